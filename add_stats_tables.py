@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import sqlite3
+
+from postings_codec import count_positions
+
+
+def add_stats(db_path: str) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.create_function("post_count", 1, count_positions, deterministic=True)
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS urns (
+            bok_id INTEGER NOT NULL PRIMARY KEY
+        ) WITHOUT ROWID
+        """
+    )
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(urns)")}
+    for column in ("n_tokens", "n_types"):
+        if column not in columns:
+            cur.execute(f"ALTER TABLE urns ADD COLUMN {column} INTEGER")
+    cur.execute(
+        """
+        INSERT INTO urns (bok_id, n_tokens, n_types)
+        SELECT bok_id, SUM(post_count(blob)), COUNT(*)
+        FROM postings
+        WHERE true
+        GROUP BY bok_id
+        ON CONFLICT (bok_id) DO UPDATE
+        SET n_tokens = excluded.n_tokens, n_types = excluded.n_types
+        """
+    )
+    cur.execute("DROP TABLE IF EXISTS vocab")
+    cur.execute(
+        """
+        CREATE TABLE vocab (
+            word TEXT NOT NULL PRIMARY KEY,
+            df INTEGER NOT NULL,
+            cf INTEGER NOT NULL,
+            total_blob_bytes INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO vocab (word, df, cf, total_blob_bytes)
+        SELECT word, COUNT(*), SUM(post_count(blob)), SUM(length(blob))
+        FROM postings
+        GROUP BY word
+        ORDER BY word
+        """
+    )
+    conn.commit()
+    conn.close()
+    print(f"Stats added: {db_path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Add vocab and urns(n_tokens, n_types) statistics to postings DBs."
+    )
+    parser.add_argument("--glob", required=True, help="Glob for postings DBs")
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(args.glob)):
+        add_stats(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Time the NumPy fallback engine against the C extension on large lists.
+
+Two random lists of `--n` positions each (gap ~ `--gap`) are encoded plain
+and packed, and every pairwise and single-list function runs through SQL on
+two in-memory connections: one with the extension loaded, one with
+`sqlite_postings.engine.register`. Results must be equal; the table gives
+the best of `--rounds` in milliseconds per call and the engine/C ratio.
+
+    python3 bench/engine_vs_c.py --ext build/linux/postings.so --n 1000000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+
+from postings_codec import encode_positions  # noqa: E402
+from sqlite_postings import engine  # noqa: E402
+
+CASES = {
+    "post_count": "post_count(?1)",
+    "post_positions": "length(post_positions(?1))",
+    "post_sample": "post_sample(?1, 12345)",
+    "post_sample_k": "post_sample_k(?1, 100, 1)",
+    "post_sample_many": "post_sample_many(?1, '[5, 500, 50000, 500000]')",
+    "post_shift": "length(post_shift(?1, 3))",
+    "post_intersect": "post_intersect(?1, ?2)",
+    "post_intersect_offset": "post_intersect_offset(?1, ?2, 1, 1)",
+    "post_intersect_offset_sym": "post_intersect_offset_sym(?1, ?2, -5, 5)",
+    "post_near_count": "post_near_count(?1, ?2, -5, 5)",
+    "post_near_positions": "length(post_near_positions(?1, ?2, -5, 5))",
+    "post_phrase_count": "post_phrase_count(?1, ?2)",
+    "post_and": "length(post_and(?1, ?2))",
+    "post_or": "length(post_or(?1, ?2))",
+    "post_andnot": "length(post_andnot(?1, ?2))",
+}
+
+
+def best_of(conn, sql: str, params, rounds: int) -> tuple[float, object]:
+    best = float("inf")
+    value = None
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        value = conn.execute(sql, params).fetchone()[0]
+        best = min(best, time.perf_counter() - t0)
+    return best, value
+
+
+def random_list(rng, n: int, gap: int) -> np.ndarray:
+    return np.cumsum(rng.integers(1, 2 * gap, n)).astype(np.uint64)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ext", default="build/linux/postings.so", help="Extension path")
+    parser.add_argument("--n", type=int, default=1_000_000, help="Positions per list")
+    parser.add_argument("--gap", type=int, default=8, help="Mean distance between positions")
+    parser.add_argument("--rounds", type=int, default=5, help="Best of this many runs")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    c_conn = sqlite3.connect(":memory:")
+    c_conn.enable_load_extension(True)
+    c_conn.load_extension(args.ext)
+    py_conn = sqlite3.connect(":memory:")
+    engine.register(py_conn)
+
+    rng = np.random.default_rng(args.seed)
+    a = random_list(rng, args.n, args.gap)
+    b = random_list(rng, args.n, args.gap)
+    print(f"n={args.n} gap={args.gap}  ms per call (best of {args.rounds})")
+    print(f"{'function':28s} {'format':7s} {'C':>9s} {'numpy':>9s} {'ratio':>7s}")
+    for fmt, packed in (("plain", False), ("packed", True)):
+        params = (encode_positions(a, packed=packed), encode_positions(b, packed=packed))
+        for name, call in CASES.items():
+            sql = f"SELECT {call}"
+            operands = params if "?2" in call else params[:1]
+            c_time, c_value = best_of(c_conn, sql, operands, args.rounds)
+            py_time, py_value = best_of(py_conn, sql, operands, args.rounds)
+            if c_value != py_value:
+                raise AssertionError(f"{name} ({fmt}): engine {py_value} != C {c_value}")
+            print(
+                f"{name:28s} {fmt:7s} {c_time * 1e3:9.2f} {py_time * 1e3:9.2f} "
+                f"{py_time / c_time:6.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
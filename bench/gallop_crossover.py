@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Find the list-length ratio where galloping beats the two-pointer merge.
+
+Builds one Zipf-distributed token stream in memory, pairs words of very
+different frequency, and times post_intersect / post_near_count with
+galloping forced off (`post_gallop_ratio(0)`) and forced on
+(`post_gallop_ratio(1)`). The blobs come from a table column, so every call
+decodes from scratch, as in a postings JOIN.
+
+    python3 bench/gallop_crossover.py --ext build/linux/postings.so
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from postings_codec import encode_positions  # noqa: E402
+
+
+def zipf_postings(n_tokens: int, vocab: int, s: float, seed: int) -> list[list[int]]:
+    rng = random.Random(seed)
+    weights = [1.0 / (rank**s) for rank in range(1, vocab + 1)]
+    cum = list(itertools.accumulate(weights))
+    words = rng.choices(range(vocab), cum_weights=cum, k=n_tokens)
+    postings = [[] for _ in range(vocab)]
+    for seq, w in enumerate(words, start=1):
+        postings[w].append(seq)
+    return postings
+
+
+def time_call(conn, sql: str, params, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchone()
+        best = min(best, time.perf_counter() - t0)
+    return best / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ext", default="build/linux/postings.so", help="Extension path")
+    parser.add_argument("--tokens", type=int, default=2_000_000, help="Tokens in the stream")
+    parser.add_argument("--vocab", type=int, default=50_000, help="Vocabulary size")
+    parser.add_argument("--zipf", type=float, default=1.0, help="Zipf exponent")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--repeat", type=int, default=20, help="Calls per measurement")
+    args = parser.parse_args()
+
+    postings = zipf_postings(args.tokens, args.vocab, args.zipf, args.seed)
+    by_len = sorted((len(p), w) for w, p in enumerate(postings) if p)
+    lengths = [n for n, _ in by_len]
+
+    conn = sqlite3.connect(":memory:")
+    conn.enable_load_extension(True)
+    conn.load_extension(args.ext)
+    conn.execute("CREATE TABLE lists (id INTEGER PRIMARY KEY, n INTEGER, blob BLOB)")
+
+    # Long operands: the most frequent words. Short operands: words whose
+    # frequency gives ratios from ~1 up to the full range.
+    long_words = [w for _, w in by_len[-3:]]
+    pairs = []
+    for long_w in long_words:
+        n_long = len(postings[long_w])
+        for ratio in (1, 2, 4, 8, 16, 32, 64, 128, 256, 1024, 4096):
+            i = bisect.bisect_left(lengths, max(1, n_long // ratio))
+            if i < len(by_len):
+                pairs.append((long_w, by_len[i][1]))
+    for w in {w for pair in pairs for w in pair}:
+        conn.execute(
+            "INSERT INTO lists VALUES (?, ?, ?)",
+            (w, len(postings[w]), encode_positions(postings[w])),
+        )
+
+    rep = f"(WITH RECURSIVE r(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM r WHERE i < {args.repeat}) SELECT i FROM r)"
+    queries = {
+        "post_intersect": f"SELECT sum(post_intersect(a.blob, b.blob)) FROM lists a, lists b, {rep} WHERE a.id = ? AND b.id = ?",
+        "post_near_count": f"SELECT sum(post_near_count(a.blob, b.blob, -5, 5)) FROM lists a, lists b, {rep} WHERE a.id = ? AND b.id = ?",
+    }
+
+    print(f"{'function':<16} {'n_short':>8} {'n_long':>8} {'ratio':>8} {'merge_us':>10} {'gallop_us':>10} {'speedup':>8}")
+    crossover = {}
+    for name, sql in queries.items():
+        rows = []
+        for long_w, short_w in pairs:
+            conn.execute("SELECT post_gallop_ratio(0)")
+            t_merge = time_call(conn, sql, (short_w, long_w), args.repeat)
+            conn.execute("SELECT post_gallop_ratio(1)")
+            t_gallop = time_call(conn, sql, (short_w, long_w), args.repeat)
+            n_s, n_l = len(postings[short_w]), len(postings[long_w])
+            rows.append((n_l / n_s, t_merge, t_gallop))
+            print(
+                f"{name:<16} {n_s:>8} {n_l:>8} {n_l / n_s:>8.1f} "
+                f"{t_merge * 1e6:>10.1f} {t_gallop * 1e6:>10.1f} {t_merge / t_gallop:>8.2f}"
+            )
+        rows.sort()
+        # Smallest ratio from which galloping wins for every larger ratio.
+        wins = [r for r, m, g in rows if g < m]
+        losses = [r for r, m, g in rows if g >= m]
+        crossover[name] = min((r for r in wins if all(l < r for l in losses)), default=None)
+
+    for name, ratio in crossover.items():
+        if ratio is None:
+            print(f"{name}: galloping never wins consistently")
+        else:
+            print(f"{name}: galloping wins from blob-length ratio ~{ratio:.0f}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Generate a synthetic Zipf-distributed postings shard.
+
+Writes `ft(urn, word, seq)` for `--books` books to `<out>.ft.db`, one
+`executemany` per book, and converts it with `convert_all_ft.convert_one`
+(streaming read order), so the shard has exactly the tables a real
+conversion produces: postings, urns, vocab, tokens and/or token_chunks, and
+optionally ng2 .. ngN. Book lengths are drawn uniformly from
+[tokens/2, 3*tokens/2]; word ranks follow a Zipf law with exponent `--zipf`
+and are named `w1` (most frequent) .. `w<vocab>`.
+
+    python3 bench/synth_shard.py --out /tmp/synth.db --books 2000 \\
+        --tokens-per-book 50000 --vocab 200000 --zipf 1.05
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from convert_all_ft import convert_one, remove_db  # noqa: E402
+
+
+def make_ft(
+    path: str,
+    books: int,
+    tokens_per_book: int,
+    vocab: int,
+    zipf: float = 1.0,
+    seed: int = 42,
+    first_urn: int = 1,
+) -> int:
+    """Write a synthetic ft table to path; returns the number of rows."""
+    rng = random.Random(seed)
+    words = [f"w{rank}" for rank in range(1, vocab + 1)]
+    cum = list(itertools.accumulate(1.0 / rank**zipf for rank in range(1, vocab + 1)))
+    remove_db(path)
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE ft (urn INTEGER, word TEXT, seq INTEGER);
+        """
+    )
+    rows = 0
+    for urn in range(first_urn, first_urn + books):
+        n = rng.randint(max(1, tokens_per_book // 2), max(1, tokens_per_book * 3 // 2))
+        text = rng.choices(words, cum_weights=cum, k=n)
+        conn.executemany(
+            "INSERT INTO ft (urn, word, seq) VALUES (?, ?, ?)",
+            zip(itertools.repeat(urn), text, range(n)),
+        )
+        rows += n
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def make_shard(
+    path: str,
+    books: int,
+    tokens_per_book: int,
+    vocab: int,
+    zipf: float = 1.0,
+    seed: int = 42,
+    tokens: str = "both",
+    max_ngram: int = 1,
+    block_size: int = 0,
+    count_header: bool = False,
+    keep_ft: bool = False,
+) -> dict:
+    """Generate ft for a synthetic shard and convert it to path."""
+    t0 = time.perf_counter()
+    ft_path = path + ".ft.db"
+    make_ft(ft_path, books, tokens_per_book, vocab, zipf, seed)
+    t_ft = time.perf_counter() - t0
+    stats = convert_one(
+        ft_path,
+        path,
+        10000,
+        block_size,
+        tokens,
+        max_ngram,
+        2,
+        count_header,
+        order="stream",
+    )
+    if not keep_ft:
+        remove_db(ft_path)
+    stats["ft_elapsed"] = t_ft
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True, help="Output shard path")
+    parser.add_argument("--books", type=int, default=200, help="Number of books")
+    parser.add_argument("--tokens-per-book", type=int, default=50_000, help="Mean book length")
+    parser.add_argument("--vocab", type=int, default=100_000, help="Vocabulary size")
+    parser.add_argument("--zipf", type=float, default=1.0, help="Zipf exponent")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument(
+        "--tokens",
+        choices=["rows", "chunks", "both"],
+        default="both",
+        help="Token layout of the shard (see convert_all_ft.py)",
+    )
+    parser.add_argument("--max-ngram", type=int, default=1, help="Build ng2 .. ngN tables")
+    parser.add_argument("--block-size", type=int, default=0, help="Skip-table block size")
+    parser.add_argument("--count-header", action="store_true", help="Counted plain blobs")
+    parser.add_argument("--keep-ft", action="store_true", help="Keep <out>.ft.db")
+    args = parser.parse_args()
+
+    stats = make_shard(
+        args.out,
+        args.books,
+        args.tokens_per_book,
+        args.vocab,
+        args.zipf,
+        args.seed,
+        args.tokens,
+        args.max_ngram,
+        args.block_size,
+        args.count_header,
+        args.keep_ft,
+    )
+    print(
+        f"{args.out}: {stats['rows']} tokens, {stats['urns']} books, "
+        f"{stats['postings']} postings; ft {stats['ft_elapsed']:.1f} s, "
+        f"conversion {stats['elapsed']:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
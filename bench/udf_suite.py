@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""Time every post_* function of the extension on one shard, as JSON.
+
+Operands come from the longest book in the shard: its most frequent word is
+the long list, and words whose lists are 1, 4, 16, ... 4096 times shorter
+are the short ones. Pairwise functions run for every ratio. Single-list
+functions run for every list length, with JSON and count/blob variants side
+by side. The concordance tables (post_kwic, post_window) and a few
+shard-wide queries over the `postings` table are timed as well. Each case
+reports the best of `--rounds` runs, in microseconds per call. With
+`--stats` each case also runs once with `post_stats` on, and its per-function
+counters (calls, bytes, positions decoded, results, ns) are stored with it.
+
+    python3 bench/synth_shard.py --out /tmp/synth.db
+    python3 bench/udf_suite.py --db /tmp/synth.db --out before.json
+    # rebuild the extension, then
+    python3 bench/udf_suite.py --db /tmp/synth.db --out after.json
+    python3 bench/udf_suite.py --compare before.json after.json
+"""
+import argparse
+import bisect
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from urllib.request import pathname2url
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from postings_codec import count_positions, decode_positions  # noqa: E402
+
+RATIOS = (1, 4, 16, 64, 256, 1024, 4096)
+
+# SQL expressions over the operand rows a (and b); summed over the repeats.
+PAIR_CASES = {
+    "post_intersect": "post_intersect(a.blob, b.blob)",
+    "post_intersect_offset": "post_intersect_offset(a.blob, b.blob, 1, 1)",
+    "post_intersect_offset_sym": "post_intersect_offset_sym(a.blob, b.blob, -5, 5)",
+    "post_near_count": "post_near_count(a.blob, b.blob, -5, 5)",
+    "post_near_positions": "length(post_near_positions(a.blob, b.blob, -5, 5))",
+    "post_near": "length(post_near(a.blob, b.blob, -5, 5))",
+    "post_and": "length(post_and(a.blob, b.blob))",
+    "post_or": "length(post_or(a.blob, b.blob))",
+    "post_andnot": "length(post_andnot(a.blob, b.blob))",
+    "post_phrase_count": "post_phrase_count(a.blob, b.blob)",
+    "post_phrase_positions": "length(post_phrase_positions(a.blob, b.blob))",
+}
+
+SINGLE_CASES = {
+    "post_count": "post_count(a.blob)",
+    "post_positions": "length(post_positions(a.blob))",
+    "post_sample": "post_sample(a.blob, a.n / 2)",
+    "post_sample_k": "length(post_sample_k(a.blob, 10, 1))",
+    "post_sample_many": "length(post_sample_many(a.blob, a.idxs))",
+    "post_shift": "length(post_shift(a.blob, 3))",
+}
+
+# Table-valued functions: rows produced per call are counted.
+PAIR_TABLES = {
+    "post_near_each": "post_near_each(a.blob, b.blob, -5, 5)",
+}
+
+SINGLE_TABLES = {
+    "post_each": "post_each(a.blob)",
+}
+
+
+def repeat_cte(n: int) -> str:
+    return (
+        f"(WITH RECURSIVE r(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM r WHERE i < {n}) "
+        f"SELECT i FROM r)"
+    )
+
+
+def best_of(conn, sql: str, params, rounds: int) -> tuple[float, object]:
+    best = float("inf")
+    value = None
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        value = conn.execute(sql, params).fetchone()[0]
+        best = min(best, time.perf_counter() - t0)
+    return best, value
+
+
+def git_rev(path: str) -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "-C", path, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def pick_operands(conn) -> tuple[int, list[tuple[str, int, bytes]]]:
+    """(bok_id, [(word, n, blob), ...]) for the long list and its short partners."""
+    try:
+        (bok_id,) = conn.execute(
+            "SELECT bok_id FROM urns ORDER BY n_tokens DESC LIMIT 1"
+        ).fetchone()
+    except sqlite3.Error:
+        (bok_id,) = conn.execute(
+            "SELECT bok_id FROM postings GROUP BY bok_id ORDER BY sum(length(blob)) DESC LIMIT 1"
+        ).fetchone()
+    rows = conn.execute("SELECT word, blob FROM postings WHERE bok_id = ?", (bok_id,))
+    lists = [(count_positions(blob), word, blob) for word, blob in rows]
+    lists.sort()
+    lengths = [n for n, _, _ in lists]
+    n_long, long_word, long_blob = lists[-1]
+    picked = [(long_word, n_long, long_blob)]
+    seen = {long_word}
+    for ratio in RATIOS:
+        target = n_long // ratio
+        if target < 1:
+            break
+        n, word, blob = lists[min(bisect.bisect_left(lengths, target), len(lists) - 2)]
+        if word not in seen:
+            seen.add(word)
+            picked.append((word, n, blob))
+    return bok_id, picked
+
+
+def stats_of(conn, sql: str, params) -> dict:
+    """Run sql once with post_stats on; per-function counters it produced."""
+    conn.execute("SELECT post_stats_reset()")
+    conn.execute("SELECT post_stats_enable(1)")
+    try:
+        conn.execute(sql, params).fetchall()
+    finally:
+        conn.execute("SELECT post_stats_enable(0)")
+    rows = conn.execute(
+        "SELECT name, calls, bytes, positions, results, ns FROM post_stats WHERE calls > 0"
+    )
+    return {
+        name: {"calls": calls, "bytes": nbytes, "positions": pos, "results": res, "ns": ns}
+        for name, calls, nbytes, pos, res, ns in rows
+    }
+
+
+def run_suite(db_path: str, ext_path: str, repeat: int, rounds: int, stats: bool = False) -> dict:
+    uri = f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    conn.enable_load_extension(True)
+    conn.load_extension(ext_path)
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute(
+        "CREATE TEMP TABLE lists (id INTEGER PRIMARY KEY, word TEXT, n INTEGER, "
+        "blob BLOB, idxs TEXT)"
+    )
+    bok_id, picked = pick_operands(conn)
+    for i, (word, n, blob) in enumerate(picked):
+        idxs = json.dumps([(k * 7919) % n for k in range(min(n, 32))])
+        conn.execute("INSERT INTO lists VALUES (?, ?, ?, ?, ?)", (i, word, n, blob, idxs))
+
+    (gallop,) = conn.execute("SELECT post_gallop_ratio()").fetchone()
+    meta = {
+        "db": os.path.abspath(db_path),
+        "ext": os.path.abspath(ext_path),
+        "ext_mtime": os.path.getmtime(ext_path),
+        "git_rev": git_rev(os.path.dirname(os.path.abspath(ext_path))),
+        "sqlite_version": sqlite3.sqlite_version,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "gallop_ratio": gallop,
+        "repeat": repeat,
+        "rounds": rounds,
+        "stats": stats,
+        "bok_id": bok_id,
+        "lists": {word: n for word, n, _ in picked},
+    }
+    results = []
+
+    def record(name: str, kind: str, sql: str, params, calls: int, **extra) -> None:
+        seconds, value = best_of(conn, sql, params, rounds)
+        label = ",".join(f"{k}={v}" for k, v in extra.items())
+        results.append(
+            {
+                "key": f"{name}[{label}]" if label else name,
+                "name": name,
+                "kind": kind,
+                **extra,
+                "us_per_call": seconds / calls * 1e6,
+                "result": value,
+            }
+        )
+        if stats:
+            results[-1]["stats"] = stats_of(conn, sql, params)
+
+    rep = repeat_cte(repeat)
+    long_id = 0
+    n_long = picked[0][1]
+    for short_id in range(1, len(picked)):
+        n_short = picked[short_id][1]
+        extra = {"n_a": n_short, "n_b": n_long, "ratio": round(n_long / n_short)}
+        params = (short_id, long_id)
+        for name, expr in PAIR_CASES.items():
+            sql = f"SELECT sum({expr}) FROM lists a, lists b, {rep} WHERE a.id = ? AND b.id = ?"
+            record(name, "pair", sql, params, repeat, **extra)
+        for name, expr in PAIR_TABLES.items():
+            sql = (
+                f"SELECT count(*) FROM lists a, lists b, {rep}, {expr} "
+                "WHERE a.id = ? AND b.id = ?"
+            )
+            record(name, "pair_table", sql, params, repeat, **extra)
+
+    for list_id, (_, n, _) in enumerate(picked):
+        for name, expr in SINGLE_CASES.items():
+            sql = f"SELECT sum({expr}) FROM lists a, {rep} WHERE a.id = ?"
+            record(name, "single", sql, (list_id,), repeat, n=n)
+        for name, expr in SINGLE_TABLES.items():
+            sql = f"SELECT count(*) FROM lists a, {rep}, {expr} WHERE a.id = ?"
+            record(name, "single_table", sql, (list_id,), repeat, n=n)
+
+    # Concordance: contexts for a mid-frequency word in the same book.
+    mid_id = len(picked) // 2
+    mid_word, mid_n, mid_blob = picked[mid_id]
+    hits = [int(x) for x in decode_positions(mid_blob)]
+    record(
+        "post_kwic",
+        "concordance",
+        "SELECT count(*) FROM lists a, post_kwic(?, a.blob, 5, 5) WHERE a.id = ?",
+        (bok_id, mid_id),
+        1,
+        n=mid_n,
+    )
+    record(
+        "post_kwic_sample",
+        "concordance",
+        "SELECT count(*) FROM lists a, post_kwic(?, a.blob, 5, 5, 10, 1) WHERE a.id = ?",
+        (bok_id, mid_id),
+        1,
+        n=mid_n,
+    )
+    record(
+        "post_window",
+        "concordance",
+        f"SELECT count(*) FROM {rep}, post_window(?, ?, 5)",
+        (bok_id, hits[len(hits) // 2]),
+        repeat,
+    )
+
+    # Shard-wide: the same word pairs over every book.
+    long_word = picked[0][0]
+    short_word = picked[min(3, len(picked) - 1)][0]
+    union_words = [w for w, _, _ in picked[1:]]
+    marks = ",".join("?" * len(union_words))
+    shard_cases = {
+        "shard_near_count": (
+            "SELECT sum(post_near_count(a.blob, b.blob, -5, 5)) FROM postings a "
+            "JOIN postings b USING (bok_id) WHERE a.word = ? AND b.word = ?",
+            (short_word, long_word),
+        ),
+        "shard_phrase_count": (
+            "SELECT sum(post_phrase_count(a.blob, b.blob)) FROM postings a "
+            "JOIN postings b USING (bok_id) WHERE a.word = ? AND b.word = ?",
+            (short_word, long_word),
+        ),
+        "shard_count": (
+            "SELECT sum(post_count(blob)) FROM postings WHERE word = ?",
+            (long_word,),
+        ),
+        "shard_union_agg": (
+            "SELECT sum(post_count(u)) FROM (SELECT post_union_agg(blob) AS u FROM postings "
+            f"WHERE word IN ({marks}) GROUP BY bok_id)",
+            union_words,
+        ),
+        "shard_kwic": (
+            "SELECT count(*) FROM postings p, post_kwic(p.bok_id, p.blob, 5, 5, 10, 1) "
+            "WHERE p.word = ?",
+            (mid_word,),
+        ),
+    }
+    for name, (sql, params) in shard_cases.items():
+        record(name, "shard", sql, params, 1)
+
+    conn.close()
+    return {"meta": meta, "results": results}
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = {r["key"]: r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'case':<60} {'old_us':>10} {'new_us':>10} {'speedup':>8}")
+    for r in new:
+        o = old.get(r["key"])
+        if o is None:
+            continue
+        speedup = o["us_per_call"] / max(r["us_per_call"], 1e-12)
+        print(f"{r['key']:<60} {o['us_per_call']:>10.2f} {r['us_per_call']:>10.2f} {speedup:>8.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="Postings shard (e.g. from bench/synth_shard.py)")
+    parser.add_argument("--ext", default="build/linux/postings.so", help="Extension path")
+    parser.add_argument("--repeat", type=int, default=20, help="Calls per measurement")
+    parser.add_argument("--rounds", type=int, default=3, help="Measurements per case (best wins)")
+    parser.add_argument("--out", help="Write the JSON here instead of stdout")
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Also run each case once with post_stats on and store the counters",
+    )
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not args.db:
+        parser.error("--db is required")
+    report = run_suite(args.db, args.ext, args.repeat, args.rounds, args.stats)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
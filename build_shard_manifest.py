@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Build the shard manifest that routes queries to the shards that can match.
+
+Run it after add_postings_index.py / add_urns_table.py (and after every
+conversion run). Shards whose size and mtime are unchanged are skipped, and
+shards that no longer match the glob are removed:
+
+    python3 build_shard_manifest.py --glob "/mnt/disk1/alto_postings/*_postings.db" \\
+        --out /mnt/disk1/alto_postings/manifest.db
+"""
+import argparse
+import glob
+import sqlite3
+import time
+
+from sqlite_postings.manifest import DEFAULT_FP_RATE, SCHEMA, add_shard, drop_missing
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build a word/book routing manifest for postings shards.")
+    parser.add_argument("--glob", required=True, help="Glob for postings DBs")
+    parser.add_argument("--out", required=True, help="Manifest DB to create or update")
+    parser.add_argument("--fp-rate", type=float, default=DEFAULT_FP_RATE, help="Bloom filter false-positive rate")
+    parser.add_argument("--exact", action="store_true", help="Store exact word -> shard lists instead of Bloom filters")
+    parser.add_argument("--rebuild", action="store_true", help="Re-read every shard (after changing --exact or --fp-rate)")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.glob))
+    if not paths:
+        parser.error(f"no shards matched {args.glob!r}")
+    conn = sqlite3.connect(args.out)
+    conn.executescript(SCHEMA)
+    if args.rebuild:
+        conn.execute("UPDATE shards SET size = -1")
+    for path in drop_missing(conn, paths):
+        print(f"Removed: {path}")
+    for path in paths:
+        t0 = time.perf_counter()
+        if add_shard(conn, path, args.fp_rate, args.exact):
+            conn.commit()
+            print(f"Added: {path} ({time.perf_counter() - t0:.1f} s)")
+        else:
+            print(f"Unchanged: {path}")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,32 +3,7 @@ import argparse
 import random
 import sqlite3
 
-
-def varint_encode(n: int) -> bytes:
-    if n < 0:
-        raise ValueError("varint only supports non-negative integers")
-    out = bytearray()
-    while True:
-        b = n & 0x7F
-        n >>= 7
-        if n:
-            out.append(b | 0x80)
-        else:
-            out.append(b)
-            break
-    return bytes(out)
-
-
-def delta_varint_encode(positions):
-    out = bytearray()
-    last = 0
-    for pos in positions:
-        delta = pos - last
-        if delta < 0:
-            raise ValueError("positions must be sorted ascending")
-        out.extend(varint_encode(delta))
-        last = pos
-    return bytes(out)
+from postings_codec import encode_positions
 
 
 def main():
@@ -102,7 +77,7 @@ def main():
         positions_by_word.setdefault(w, []).append(i)
 
     for w, positions in positions_by_word.items():
-        blob = delta_varint_encode(positions)
+        blob = encode_positions(positions)
         cur.execute(
             "INSERT INTO postings (bok_id, word, blob) VALUES (?, ?, ?)",
             (bok_id, w, blob),
@@ -0,0 +1,1016 @@
+#!/usr/bin/env python3
+"""Cross-check the compiled extension against the Python codec.
+
+Random lists (and token streams) are encoded with `postings_codec` and every
+UDF's result is compared with a brute-force answer in Python, or with the
+same call on another format of the same list. Small converted shards then
+exercise the manifest routing:
+
+    python3 check_postings.py build/linux/postings.so --rounds 300
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+
+from postings_codec import (
+    DEFAULT_BLOCK_SIZE,
+    MAGIC,
+    TOKEN_CHUNK_SIZE,
+    _encode_numpy,
+    _encode_packed,
+    _encode_scalar,
+    _encode_skip,
+    decode_positions,
+    decode_token_chunk,
+    encode_positions,
+    encode_token_chunks,
+    np,
+)
+
+
+def check_extension(ext_path: str, rounds: int = 200, seed: int = 1) -> None:
+    """Cross-check the codec against post_positions/post_sample in the C extension."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    conn.enable_load_extension(True)
+    conn.load_extension(ext_path)
+
+    pair_sql = (
+        "SELECT post_intersect(?1, ?2), post_intersect_offset(?1, ?2, ?3, ?4), "
+        "post_intersect_offset_sym(?1, ?2, ?3, ?4), post_near_count(?1, ?2, ?3, ?4), "
+        "post_near_positions(?1, ?2, ?3, ?4)"
+    )
+    prev = []
+    for i in range(rounds):
+        n = rng.choice([0, 1, 2, 5, 63, 64, 65, 1000, 20000])
+        span = rng.choice([10, 1000, 1 << 20, 1 << 40])
+        if rng.random() < 0.5:
+            span = min(span, 1 << 32)
+        positions = sorted(rng.randrange(span) for _ in range(n))
+
+        blob = encode_positions(positions)
+        reference = _encode_scalar(positions)
+        if blob != reference:
+            raise AssertionError(f"round {i}: batched encoder differs from scalar")
+        if np is not None and n:
+            if _encode_numpy(positions) != reference:
+                raise AssertionError(f"round {i}: numpy encoder differs from scalar")
+
+        decoded = [int(x) for x in decode_positions(blob)]
+        if decoded != positions:
+            raise AssertionError(f"round {i}: decode(encode(x)) != x")
+
+        (as_json,) = conn.execute("SELECT post_positions(?)", (blob,)).fetchone()
+        c_positions = [int(x) for x in as_json.strip("[]").split(",") if x]
+        if c_positions != positions:
+            raise AssertionError(f"round {i}: post_positions disagrees with codec")
+        if n:
+            idx = rng.randrange(n)
+            (c_pos,) = conn.execute("SELECT post_sample(?, ?)", (blob, idx)).fetchone()
+            if c_pos != positions[idx]:
+                raise AssertionError(f"round {i}: post_sample disagrees with codec")
+
+        if positions and positions[-1] <= 0xFFFFFFFF:
+            block_size = rng.choice([1, 4, DEFAULT_BLOCK_SIZE])
+            skip = encode_positions(positions, block_size)
+            if [int(x) for x in decode_positions(skip)] != positions:
+                raise AssertionError(f"round {i}: skip-format round trip failed")
+            for other in (prev, positions[:: rng.randrange(1, 50)]):
+                other_blob = encode_positions(other)
+                off_min = rng.randrange(-20, 5)
+                off_max = off_min + rng.randrange(0, 20)
+                for a, b in ((skip, other_blob), (other_blob, skip)):
+                    plain_a = blob if a is skip else a
+                    plain_b = blob if b is skip else b
+                    want = conn.execute(pair_sql, (plain_a, plain_b, off_min, off_max)).fetchone()
+                    got = conn.execute(pair_sql, (a, b, off_min, off_max)).fetchone()
+                    if got != want:
+                        raise AssertionError(f"round {i}: skip format changes results")
+            idx = rng.randrange(n)
+            (c_pos,) = conn.execute("SELECT post_sample(?, ?)", (skip, idx)).fetchone()
+            if c_pos != positions[idx]:
+                raise AssertionError(f"round {i}: post_sample on skip format")
+            prev = positions
+
+    _check_phrases(conn, rng, rounds)
+    _check_set_ops(conn, rng, rounds)
+    _check_counts(conn, rng, rounds)
+    _check_gallop(conn, rng, rounds)
+    _check_overflow(conn, rng)
+    _check_each(conn, rng, rounds)
+    _check_cache(conn, rng, rounds)
+    _check_stats(conn, rng, rounds)
+    _check_packed(conn, rng, rounds)
+    _check_subcorpus(conn, rng, rounds)
+    _check_engine(conn, rng, rounds)
+    _check_token_chunks(conn, ext_path, rng)
+    conn.close()
+    with tempfile.TemporaryDirectory() as tmp:
+        _check_manifest(ext_path, tmp, rng)
+        _check_update(tmp, rng)
+        _check_finalize(ext_path, tmp, rng)
+        _check_collocations(tmp, rng)
+    print(f"OK: {rounds} rounds match {ext_path}")
+
+
+def _check_phrases(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """post_phrase_count/positions must match a brute-force scan of a token stream."""
+    for i in range(rounds):
+        vocab = rng.randrange(1, 8)
+        stream = [rng.randrange(vocab) for _ in range(rng.choice([0, 10, 300, 5000]))]
+        by_word = {}
+        for seq, w in enumerate(stream):
+            by_word.setdefault(w, []).append(seq)
+        phrase = [rng.randrange(vocab + 1) for _ in range(rng.randrange(1, 6))]
+        want = [
+            s for s in range(len(stream) - len(phrase) + 1)
+            if all(stream[s + k] == w for k, w in enumerate(phrase))
+        ]
+        block_size = rng.choice([0, 0, 4, DEFAULT_BLOCK_SIZE])
+        blobs = [encode_positions(by_word.get(w, []), block_size) for w in phrase]
+        marks = ", ".join("?" * len(blobs))
+        count, as_json = conn.execute(
+            f"SELECT post_phrase_count({marks}), post_phrase_positions({marks})", blobs + blobs
+        ).fetchone()
+        got = [int(x) for x in as_json.strip("[]").split(",") if x]
+        if count != len(want) or got != want:
+            raise AssertionError(f"phrase round {i}: post_phrase disagrees with brute force")
+
+
+def _check_set_ops(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """Blob-returning post_and/or/andnot/shift/near and post_union_agg against Python sets."""
+    ops_sql = (
+        "SELECT post_and(?1, ?2), post_or(?1, ?2), post_andnot(?1, ?2), "
+        "post_shift(?1, ?3), post_near(?1, ?2, ?4, ?5)"
+    )
+    conn.execute("CREATE TEMP TABLE union_parts (grp INTEGER, blob BLOB)")
+    for i in range(rounds):
+        span = rng.choice([20, 1000, 100000])
+        a = sorted(set(rng.randrange(span) for _ in range(rng.choice([0, 1, 50, 3000]))))
+        b = sorted(set(rng.randrange(span) for _ in range(rng.choice([0, 1, 50, 3000]))))
+        off = rng.randrange(-30, 30)
+        off_min = rng.randrange(-10, 5)
+        off_max = off_min + rng.randrange(0, 10)
+        blob_a = encode_positions(a, rng.choice([0, 4]))
+        blob_b = encode_positions(b, rng.choice([0, 16]))
+        got = conn.execute(ops_sql, (blob_a, blob_b, off, off_min, off_max)).fetchone()
+        got = [[int(x) for x in decode_positions(g)] for g in got]
+        set_b = set(b)
+        want = [
+            sorted(set(a) & set_b),
+            sorted(set(a) | set_b),
+            [x for x in a if x not in set_b],
+            [x + off for x in a if x + off >= 0],
+            [x for x in a if any(x + d in set_b for d in range(off_min, off_max + 1))],
+        ]
+        if got != want:
+            raise AssertionError(f"set-op round {i}: blob set operations disagree with Python")
+
+        parts = [
+            sorted(set(rng.randrange(span) for _ in range(rng.randrange(0, 200))))
+            for _ in range(rng.randrange(0, 6))
+        ]
+        conn.execute("DELETE FROM union_parts")
+        conn.executemany(
+            "INSERT INTO union_parts VALUES (1, ?)", [(encode_positions(p),) for p in parts]
+        )
+        (merged,) = conn.execute("SELECT post_union_agg(blob) FROM union_parts").fetchone()
+        want_union = sorted(set().union(*parts))
+        if merged is None or [int(x) for x in decode_positions(merged)] != want_union:
+            raise AssertionError(f"set-op round {i}: post_union_agg disagrees with Python")
+    conn.execute("DROP TABLE union_parts")
+
+
+def _check_counts(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """post_count, post_sample_k and post_sample_many on all blob formats."""
+    for i in range(rounds):
+        n = rng.choice([0, 1, 7, 200, 5000])
+        positions = sorted(rng.sample(range(4 * n + 10), n))
+        blob = rng.choice(
+            [
+                encode_positions(positions),
+                encode_positions(positions, count_header=True),
+                encode_positions(positions, rng.choice([1, 8, DEFAULT_BLOCK_SIZE])),
+            ]
+        )
+        if [int(x) for x in decode_positions(blob)] != positions:
+            raise AssertionError(f"count round {i}: round trip failed")
+        (count,) = conn.execute("SELECT post_count(?)", (blob,)).fetchone()
+        if count != n:
+            raise AssertionError(f"count round {i}: post_count {count} != {n}")
+
+        k = rng.randrange(0, n + 3)
+        sample_sql = "SELECT post_sample_k(?1, ?2, ?3)"
+        (as_json,) = conn.execute(sample_sql, (blob, k, i)).fetchone()
+        sample = [int(x) for x in as_json.strip("[]").split(",") if x]
+        if (
+            len(sample) != min(k, n)
+            or sample != sorted(sample)
+            or len(set(sample)) != len(sample)
+            or not set(sample) <= set(positions)
+            or conn.execute(sample_sql, (blob, k, i)).fetchone()[0] != as_json
+        ):
+            raise AssertionError(f"count round {i}: post_sample_k is not a seeded k-subset")
+
+        idxs = [rng.randrange(-1, n + 2) for _ in range(rng.randrange(0, 30))]
+        want = "[" + ",".join(str(positions[j]) if 0 <= j < n else "null" for j in idxs) + "]"
+        for arg in (str(idxs), None):
+            if arg is None:
+                idxs = sorted(set(j for j in idxs if j >= 0))
+                want = "[" + ",".join(str(positions[j]) if j < n else "null" for j in idxs) + "]"
+                arg = encode_positions(idxs)
+            (got,) = conn.execute("SELECT post_sample_many(?, ?)", (blob, arg)).fetchone()
+            if got.replace(" ", "") != want:
+                raise AssertionError(f"count round {i}: post_sample_many {got} != {want}")
+
+
+def _check_gallop(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """Galloping and two-pointer merges must give the same counts.
+
+    post_gallop_ratio(0) never gallops, 1 always does (when neither operand
+    has a skip table), and the default switches on the length ratio; the
+    cache is off so the cursor paths run.
+    """
+    (old_cache,) = conn.execute("SELECT post_cache_config(0)").fetchone()
+    (old_ratio,) = conn.execute("SELECT post_gallop_ratio()").fetchone()
+    count_sql = "SELECT post_intersect(?1, ?2), post_near_count(?1, ?2, ?3, ?4), post_near_count(?2, ?1, ?3, ?4)"
+    try:
+        for i in range(rounds):
+            n_short = rng.choice([1, 3, 20, 100])
+            n_long = n_short * rng.choice([1, 2, 5, 30, 300])
+            span = rng.choice([4 * n_long + 10, 100 * n_long])
+            a = sorted(rng.randrange(span) for _ in range(n_short))
+            b = sorted(rng.randrange(span) for _ in range(n_long))
+            if rng.random() < 0.5:
+                a, b = b, a
+            blobs = [
+                rng.choice(
+                    [
+                        encode_positions(v),
+                        encode_positions(v, count_header=True),
+                        encode_positions(v, packed=v[-1] < 1 << 32),
+                    ]
+                )
+                for v in (a, b)
+            ]
+            off_min = rng.randrange(-10, 5)
+            off_max = off_min + rng.randrange(0, 12)
+            results = []
+            for ratio in (0, 1, old_ratio):
+                conn.execute("SELECT post_gallop_ratio(?)", (ratio,))
+                results.append(conn.execute(count_sql, (*blobs, off_min, off_max)).fetchone())
+            if len(set(results)) != 1:
+                raise AssertionError(f"gallop round {i}: ratio 0/1/{old_ratio} give {results}")
+            if len(set(a)) == len(a) and len(set(b)) == len(b):
+                set_a, set_b = set(a), set(b)
+                want = (
+                    len(set_a & set_b),
+                    sum(any(x + d in set_b for d in range(off_min, off_max + 1)) for x in a),
+                    sum(any(x + d in set_a for d in range(off_min, off_max + 1)) for x in b),
+                )
+                if results[0] != want:
+                    raise AssertionError(f"gallop round {i}: {results[0]} != {want}")
+    finally:
+        conn.execute("SELECT post_gallop_ratio(?)", (old_ratio,))
+        conn.execute("SELECT post_cache_config(?)", (old_cache,))
+
+
+def _check_cache(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """Cached (decoded) operands must give the same counts as the cursor paths."""
+    pool = []
+    for n in (0, 1, 9, 300, 3000, 20000):
+        positions = sorted(rng.sample(range(3 * n + 10), n))
+        pool.append(encode_positions(positions))
+        pool.append(encode_positions(positions, count_header=True))
+    pool.append(encode_positions(sorted(rng.sample(range(9000), 2000)), DEFAULT_BLOCK_SIZE))
+    calls = [
+        "post_intersect(?1, ?2)",
+        "post_near_count(?1, ?2, ?3, ?4)",
+        "post_intersect_offset(?1, ?2, ?3, ?4)",
+        "post_intersect_offset_sym(?1, ?2, ?3, ?4)",
+    ]
+    for i in range(rounds):
+        a, b = rng.choice(pool), rng.choice(pool)
+        lo = rng.randrange(-6, 4)
+        params = (a, b, lo, lo + rng.randrange(-1, 6))
+        for call in calls:
+            sql = f"SELECT {call}"
+            args = params if "?3" in call else params[:2]
+            conn.execute("SELECT post_cache_config(0)")
+            (want,) = conn.execute(sql, args).fetchone()
+            # Small enough that the largest lists evict each other.
+            conn.execute("SELECT post_cache_config(?)", (rng.choice([1 << 16, 1 << 20, 1 << 26]),))
+            for _ in range(2):
+                (got,) = conn.execute(sql, args).fetchone()
+                if got != want:
+                    raise AssertionError(f"cache round {i}: {call} {got} != {want} (params {params[2:]})")
+    stats = conn.execute("SELECT post_cache_stats()").fetchone()[0]
+    conn.execute("SELECT post_cache_config(0)")
+    if '"hits":0,' in stats:
+        raise AssertionError(f"cache: no hits recorded: {stats}")
+
+
+def _check_stats(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """post_stats must count calls and results, and must not change any result."""
+    stats_sql = "SELECT name, calls, bytes, positions, results FROM post_stats WHERE calls > 0"
+    conn.execute("SELECT post_stats_enable(0)")
+    conn.execute("SELECT post_stats_reset()")
+    calls = [
+        ("post_count", "SELECT post_count(?1)"),
+        ("post_positions", "SELECT post_positions(?1)"),
+        ("post_intersect", "SELECT post_intersect(?1, ?2)"),
+        ("post_near_count", "SELECT post_near_count(?1, ?2, -3, 3)"),
+        ("post_and", "SELECT post_and(?1, ?2)"),
+        ("post_each", "SELECT count(*) FROM post_each(?1)"),
+    ]
+    expected = {name: [0, 0, 0] for name, _ in calls}  # calls, bytes, results
+    for i in range(rounds):
+        a = sorted(rng.sample(range(2000), rng.randrange(1, 300)))
+        b = sorted(rng.sample(range(2000), rng.randrange(1, 300)))
+        blob_a, blob_b = encode_positions(a), encode_positions(b, count_header=rng.random() < 0.5)
+        for name, sql in calls:
+            args = (blob_a, blob_b) if "?2" in sql else (blob_a,)
+            conn.execute("SELECT post_stats_enable(0)")
+            off = conn.execute(sql, args).fetchone()
+            conn.execute("SELECT post_stats_enable(1)")
+            on = conn.execute(sql, args).fetchone()
+            if on != off:
+                raise AssertionError(f"stats round {i}: {name} {on} != {off}")
+            e = expected[name]
+            e[0] += 1
+            e[1] += sum(len(x) for x in args)
+            if name in ("post_count", "post_positions", "post_each"):
+                e[2] += len(a)
+            elif name == "post_and":
+                e[2] += len(set(a) & set(b))
+            else:
+                e[2] += on[0]
+    conn.execute("SELECT post_stats_enable(0)")
+    got = {name: (n, nbytes, res) for name, n, nbytes, _, res in conn.execute(stats_sql)}
+    for name, (n, nbytes, res) in expected.items():
+        if got.get(name) != (n, nbytes, res):
+            raise AssertionError(f"post_stats {name}: {got.get(name)} != {(n, nbytes, res)}")
+    if set(got) != set(expected):
+        raise AssertionError(f"post_stats: unexpected rows {sorted(set(got) - set(expected))}")
+    (reset,) = conn.execute("SELECT post_stats_reset()").fetchone()
+    if reset != sum(e[0] for e in expected.values()) or conn.execute(stats_sql).fetchall():
+        raise AssertionError("post_stats_reset did not clear the counters")
+
+
+def _check_packed(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """Packed blobs must give the same results as plain ones; post_recode matches the codec."""
+    recode_sql = (
+        "SELECT post_recode(?1, 'plain'), post_recode(?1, 'count'), "
+        "post_recode(?1, 'skip', ?2), post_recode(?1, 'packed')"
+    )
+    udf_sql = (
+        "SELECT post_positions(?1), post_count(?1), post_sample(?1, ?3), "
+        "post_sample_many(?1, '[0, 5, 127, 128, 129, 4000]'), "
+        "(SELECT count(*) FROM post_each(?1)), "
+        "post_intersect(?1, ?2), post_intersect(?2, ?1), post_near_count(?1, ?2, -3, 3), "
+        "post_near_positions(?2, ?1, -2, 5), post_phrase_count(?1, ?2), "
+        "post_and(?1, ?2), post_andnot(?2, ?1), post_intersect_offset_sym(?1, ?2, 1, 4)"
+    )
+    for i in range(rounds):
+        n = rng.choice([0, 1, 2, 127, 128, 129, 300, 5000])
+        span = rng.choice([n + 1, 2 * n + 3, 40 * n + 10, 1 << 32])
+        positions = sorted(rng.sample(range(span), n))
+        other = sorted(rng.sample(range(max(span, 6000)), rng.choice([0, 3, 200, 3000])))
+        block_size = rng.choice([1, 16, DEFAULT_BLOCK_SIZE])
+        packed = _encode_packed(positions)
+        if [int(x) for x in decode_positions(packed)] != positions:
+            raise AssertionError(f"packed round {i}: decode(encode(x)) != x")
+        want = (
+            encode_positions(positions) or None,
+            encode_positions(positions, count_header=True),
+            _encode_skip(positions, _encode_scalar(positions), block_size) if n else None,
+            packed,
+        )
+        got = conn.execute(recode_sql, (encode_positions(positions), block_size)).fetchone()
+        if n == 0:
+            got = (got[0] or None, got[1], None, got[3])
+        if got != want:
+            raise AssertionError(f"packed round {i}: post_recode disagrees with the codec")
+
+        idx = rng.randrange(n + 2)
+        plain_b = encode_positions(other)
+        for b in (plain_b, _encode_packed(other)):
+            ref = conn.execute(udf_sql, (encode_positions(positions), plain_b, idx)).fetchone()
+            res = conn.execute(udf_sql, (packed, b, idx)).fetchone()
+            if ref != res:
+                raise AssertionError(f"packed round {i}: UDFs differ on packed operands")
+
+        # A truncated packed blob must end early or fail, never read past the end.
+        if len(packed) > 4:
+            cut = packed[: rng.randrange(3, len(packed))]
+            try:
+                conn.execute("SELECT post_positions(?1), post_count(?1)", (cut,)).fetchone()
+            except sqlite3.Error:
+                pass
+
+
+def _check_subcorpus(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """subcorpus_has, subcorpus_each and post_contains must agree with a Python set."""
+    conn.execute("CREATE TABLE subcorpora (name TEXT PRIMARY KEY, bitmap BLOB NOT NULL)")
+    conn.execute("CREATE TABLE books (bok_id INTEGER PRIMARY KEY)")
+    conn.executemany("INSERT INTO books VALUES (?)", [(i,) for i in range(3000)])
+    member_sql = (
+        "SELECT group_concat(bok_id) FROM books WHERE subcorpus_has('s', bok_id) "
+        "AND post_contains(?1, bok_id)"
+    )
+    probe_sql = "SELECT b.bok_id FROM books b JOIN subcorpus_each('s') s ON s.bok_id = b.bok_id"
+    for i in range(max(rounds // 10, 5)):
+        ids = sorted(rng.sample(range(3000), rng.choice([0, 1, 50, 129, 1500])))
+        blob = encode_positions(ids, count_header=True, packed=rng.random() < 0.5)
+        conn.execute("INSERT OR REPLACE INTO subcorpora VALUES ('s', ?)", (blob,))
+        want = ",".join(map(str, ids)) or None
+        if conn.execute(member_sql, (blob,)).fetchone()[0] != want:
+            raise AssertionError(f"subcorpus round {i}: subcorpus_has/post_contains differ")
+        rows = conn.execute("SELECT bok_id, idx FROM subcorpus_each('s')").fetchall()
+        if rows != [(x, k) for k, x in enumerate(ids)]:
+            raise AssertionError(f"subcorpus round {i}: subcorpus_each differs")
+        if sorted(r[0] for r in conn.execute(probe_sql)) != ids:
+            raise AssertionError(f"subcorpus round {i}: subcorpus_each join differs")
+    try:
+        conn.execute("SELECT subcorpus_has('missing', 1)").fetchone()
+    except sqlite3.Error:
+        pass
+    else:
+        raise AssertionError("subcorpus_has accepted an unknown name")
+    conn.execute("DROP TABLE subcorpora")
+    conn.execute("DROP TABLE books")
+
+
+def _check_engine(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """The NumPy engine (sqlite_postings.engine) must return what the extension returns."""
+    if np is None:
+        return
+    from sqlite_postings import engine
+
+    py = sqlite3.connect(":memory:")
+    engine.register(py)
+    pair_sql = (
+        "SELECT post_intersect(?1, ?2), post_intersect_offset(?1, ?2, ?3, ?4), "
+        "post_intersect_offset_sym(?1, ?2, ?3, ?4), post_near_count(?1, ?2, ?3, ?4), "
+        "post_near_positions(?1, ?2, ?3, ?4), post_phrase_count(?1, ?2), "
+        "post_phrase_positions(?2, ?1, ?2), post_and(?1, ?2), post_or(?1, ?2), "
+        "post_andnot(?1, ?2), post_shift(?1, ?3), post_near(?1, ?2, ?3, ?4)"
+    )
+    single_sql = (
+        "SELECT post_count(?1), post_positions(?1), post_sample(?1, ?2), "
+        "post_sample_k(?1, ?2, ?3), post_sample_many(?1, ?4), post_contains(?1, ?2), "
+        "post_recode(?1, 'plain'), post_recode(?1, 'count'), post_recode(?1, 'skip', 7), "
+        "post_recode(?1, 'packed')"
+    )
+    for db in (conn, py):
+        db.execute("CREATE TEMP TABLE engine_parts (grp INTEGER, blob BLOB)")
+    for i in range(rounds):
+        blobs = []
+        for _ in range(2):
+            n = rng.choice([0, 1, 5, 130, 2000])
+            span = rng.choice([8, 3 * n + 10, 50 * n + 10])
+            positions = sorted(rng.randrange(span) for _ in range(n))
+            if rng.random() < 0.5:
+                positions = sorted(set(positions))
+            blobs.append(
+                rng.choice(
+                    [
+                        encode_positions(positions),
+                        encode_positions(positions, count_header=True),
+                        encode_positions(positions, rng.choice([4, DEFAULT_BLOCK_SIZE])),
+                        encode_positions(positions, packed=True),
+                    ]
+                )
+            )
+        if rng.random() < 0.1:
+            blobs[rng.randrange(2)] = None
+        off_min = rng.randrange(-12, 6)
+        params = (*blobs, off_min, off_min + rng.randrange(-2, 12))
+        want = conn.execute(pair_sql, params).fetchone()
+        got = py.execute(pair_sql, params).fetchone()
+        if got != want:
+            raise AssertionError(f"engine round {i}: pairwise functions differ {got} != {want}")
+
+        idxs = str([rng.randrange(-2, 2200) for _ in range(rng.randrange(0, 8))])
+        params = (blobs[0], rng.randrange(-1, 2100), i, idxs)
+        want = conn.execute(single_sql, params).fetchone()
+        got = py.execute(single_sql, params).fetchone()
+        if got != want:
+            raise AssertionError(f"engine round {i}: single-list functions differ {got} != {want}")
+
+        for db in (conn, py):
+            db.execute("DELETE FROM engine_parts")
+            db.executemany(
+                "INSERT INTO engine_parts VALUES (?, ?)",
+                [(k % 2, b) for k, b in enumerate(blobs + blobs[:1])],
+            )
+        union_sql = "SELECT grp, post_union_agg(blob) FROM engine_parts GROUP BY grp ORDER BY grp"
+        if conn.execute(union_sql).fetchall() != py.execute(union_sql).fetchall():
+            raise AssertionError(f"engine round {i}: post_union_agg differs")
+    conn.execute("DROP TABLE engine_parts")
+    py.close()
+
+
+def _check_token_chunks(conn: sqlite3.Connection, ext_path: str, rng: random.Random) -> None:
+    """post_window over token_chunks must agree with the tokens table."""
+    words = ["w%d" % i for i in range(50)]
+    books = {}
+    for bok_id in range(1, 6):
+        seqs = rng.sample(range(3 * TOKEN_CHUNK_SIZE + 17), rng.randrange(1, 700))
+        books[bok_id] = {seq: rng.choice(words) for seq in seqs}
+
+    chunked = sqlite3.connect(":memory:")
+    chunked.enable_load_extension(True)
+    chunked.load_extension(ext_path)
+    chunked.executescript(
+        "CREATE TABLE lexicon (word_id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE);"
+        "CREATE TABLE token_chunks (bok_id INTEGER, chunk INTEGER, ids BLOB,"
+        " PRIMARY KEY (bok_id, chunk)) WITHOUT ROWID;"
+    )
+    conn.execute("CREATE TABLE tokens (bok_id INTEGER, seq INTEGER, word TEXT, PRIMARY KEY (bok_id, seq))")
+    word_ids = {w: i + 1 for i, w in enumerate(words)}
+    chunked.executemany("INSERT INTO lexicon VALUES (?, ?)", [(i, w) for w, i in word_ids.items()])
+    for bok_id, toks in books.items():
+        conn.executemany("INSERT INTO tokens VALUES (?, ?, ?)", [(bok_id, s, w) for s, w in toks.items()])
+        rows = encode_token_chunks({s: word_ids[w] for s, w in toks.items()})
+        chunked.executemany("INSERT INTO token_chunks VALUES (?, ?, ?)", [(bok_id, c, b) for c, b in rows])
+
+    _check_kwic(conn, chunked, books, rng)
+    _check_shard_fallback(ext_path, books, word_ids, rng)
+
+    window_sql = "SELECT seq, word FROM post_window(?, ?, ?, ?)"
+    for _ in range(200):
+        args = (rng.randrange(0, 7), rng.randrange(-10, 4 * TOKEN_CHUNK_SIZE), rng.randrange(0, 300), rng.randrange(0, 300))
+        if conn.execute(window_sql, args).fetchall() != chunked.execute(window_sql, args).fetchall():
+            raise AssertionError(f"post_window{args}: token_chunks disagrees with tokens")
+    conn.execute("DROP TABLE tokens")
+    chunked.close()
+
+
+def _check_kwic(
+    conn: sqlite3.Connection, chunked: sqlite3.Connection, books: dict, rng: random.Random
+) -> None:
+    """post_kwic on tokens and on token_chunks against slices of each book's tokens."""
+
+    def span(toks: dict, lo: int, hi: int) -> str:
+        return " ".join(toks[s] for s in range(max(lo, 0), hi + 1) if s in toks)
+
+    kwic_sql = "SELECT seq, left_ctx, keyword, right_ctx FROM post_kwic(?, ?, ?, ?, ?, ?)"
+    for i in range(200):
+        bok_id = rng.randrange(0, 7)
+        toks = books.get(bok_id, {})
+        seqs = sorted(toks)
+        hits = set(rng.sample(seqs, min(len(seqs), rng.randrange(0, 40))))
+        # Hits at the ends of the book, and positions without a token.
+        hits.update(seqs[:1] + seqs[-1:])
+        hits.update(rng.randrange(0, 4 * TOKEN_CHUNK_SIZE) for _ in range(rng.randrange(0, 5)))
+        hits = sorted(hits)
+        n_left, n_right = rng.choice([0, 1, 5, 300]), rng.choice([0, 1, 5, 300])
+        blob = rng.choice(
+            [
+                encode_positions(hits),
+                encode_positions(hits, DEFAULT_BLOCK_SIZE),
+                encode_positions(hits, packed=True),
+            ]
+        )
+        want = [(h, span(toks, h - n_left, h - 1), span(toks, h, h), span(toks, h + 1, h + n_right)) for h in hits]
+        for db in (conn, chunked):
+            got = db.execute(kwic_sql, (bok_id, blob, n_left, n_right, None, None)).fetchall()
+            if got != want:
+                raise AssertionError(f"kwic round {i}: post_kwic disagrees with the token slices")
+
+        limit = rng.randrange(0, len(hits) + 2)
+        sampled = chunked.execute(kwic_sql, (bok_id, blob, n_left, n_right, limit, i)).fetchall()
+        if (
+            len(sampled) != min(limit, len(hits))
+            or not set(sampled) <= set(want)
+            or [row[0] for row in sampled] != sorted(row[0] for row in sampled)
+            or conn.execute(kwic_sql, (bok_id, blob, n_left, n_right, limit, i)).fetchall() != sampled
+        ):
+            raise AssertionError(f"kwic round {i}: sampled post_kwic rows are not a seeded subset in seq order")
+
+
+def _check_shard_fallback(ext_path: str, books: dict, word_ids: dict, rng: random.Random) -> None:
+    """Shard positions and concordances on a fallback connection against the extension."""
+    if np is None:
+        return
+    from sqlite_postings import Shard
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for layout in ("tokens", "token_chunks"):
+            path = os.path.join(tmp, f"{layout}.db")
+            db = sqlite3.connect(path)
+            db.execute("CREATE TABLE postings (bok_id INTEGER, word TEXT, blob BLOB, PRIMARY KEY (bok_id, word))")
+            if layout == "tokens":
+                db.execute("CREATE TABLE tokens (bok_id INTEGER, seq INTEGER, word TEXT, PRIMARY KEY (bok_id, seq))")
+            else:
+                db.execute("CREATE TABLE lexicon (word_id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE)")
+                db.execute("CREATE TABLE token_chunks (bok_id INTEGER, chunk INTEGER, ids BLOB, PRIMARY KEY (bok_id, chunk))")
+                db.executemany("INSERT INTO lexicon VALUES (?, ?)", [(i, w) for w, i in word_ids.items()])
+            for bok_id, toks in books.items():
+                by_word = {}
+                for seq in sorted(toks):
+                    by_word.setdefault(toks[seq], []).append(seq)
+                db.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(bok_id, w, encode_positions(v, packed=len(v) > 20)) for w, v in by_word.items()],
+                )
+                if layout == "tokens":
+                    db.executemany("INSERT INTO tokens VALUES (?, ?, ?)", [(bok_id, s, w) for s, w in toks.items()])
+                else:
+                    rows = encode_token_chunks({s: word_ids[w] for s, w in toks.items()})
+                    db.executemany("INSERT INTO token_chunks VALUES (?, ?, ?)", [(bok_id, c, b) for c, b in rows])
+            db.commit()
+            db.close()
+
+            with Shard(path, ext_path=ext_path) as native, Shard(
+                path, ext_path=os.path.join(tmp, "missing.so"), fallback=True
+            ) as fallback:
+                if not native.native or fallback.native:
+                    raise AssertionError("Shard.native does not tell the extension from the fallback")
+                words = sorted(word_ids)
+                for i in range(100):
+                    bok_id = rng.randrange(0, 7)
+                    a, b = rng.choice(words), rng.choice(words)
+                    off_min = rng.randrange(-8, 4)
+                    near = (bok_id, a, b, off_min, off_min + rng.randrange(0, 8))
+                    kwic = (rng.choice([0, 3, 40]), rng.choice([0, 3, 40]), rng.choice([None, 0, 2, 50]), i)
+                    for name, args in (
+                        ("positions", (bok_id, a)),
+                        ("near_positions", near),
+                        ("concordance", (bok_id, a, *kwic)),
+                        ("near_concordance", (*near, *kwic)),
+                    ):
+                        if getattr(fallback, name)(*args) != getattr(native, name)(*args):
+                            raise AssertionError(f"Shard.{name}{args} on {layout}: fallback differs from the extension")
+
+
+def _offset_count(a: list[int], b: list[int], off_min: int, off_max: int, sym: bool) -> int:
+    """post_intersect_offset(_sym) as a plain two-pointer walk over exact integers."""
+    i = j = count = 0
+    while i < len(a) and j < len(b):
+        diff = b[j] - a[i]
+        if diff < off_min:
+            j += 1
+        elif diff > off_max:
+            i += 1
+        else:
+            count += 1
+            j += 1
+            i += sym
+    return count
+
+
+def _check_overflow(conn: sqlite3.Connection, rng: random.Random) -> None:
+    """Window functions on positions near 2^63 and 2^64, and on corrupt blobs.
+
+    A window bound that wrapped, or a difference taken in int64, used to
+    make the merges seek to a position they were already past and spin.
+    """
+    top = (1 << 64) - 1
+    edges = [0, 3, 7, (1 << 63) - 2, (1 << 63) - 1, 1 << 63, (1 << 63) + 2, top - 3, top - 1, top]
+    signed = lambda x: x - (1 << 64) if x >= 1 << 63 else x
+    (old_cache,) = conn.execute("SELECT post_cache_config(0)").fetchone()
+    (old_ratio,) = conn.execute("SELECT post_gallop_ratio()").fetchone()
+    sql = (
+        "SELECT post_intersect_offset(?1, ?2, ?3, ?4), post_intersect_offset_sym(?1, ?2, ?3, ?4), "
+        "post_near_count(?1, ?2, ?3, ?4), post_near_positions(?1, ?2, ?3, ?4), post_near(?1, ?2, ?3, ?4), "
+        "post_phrase_count(?1, ?2), post_intersect(?1, ?2)"
+    )
+    try:
+        for i in range(400):
+            a, b = (sorted(set(rng.sample(edges, rng.randrange(1, 5)))) for _ in range(2))
+            off_min = rng.choice([-5, -3, 0, 1, -(1 << 31)])
+            off_max = off_min + rng.choice([0, 3, 6, (1 << 31) - 1])
+            off_max = min(off_max, (1 << 31) - 1)
+            near = [x for x in a if any(off_min <= y - x <= off_max for y in b)]
+            want = (
+                _offset_count(a, b, off_min, off_max, False),
+                _offset_count(a, b, off_min, off_max, True),
+                len(near),
+                "[" + ",".join(str(signed(x)) for x in near) + "]",
+                near,
+                sum(x + 1 in b for x in a),
+                len(set(a) & set(b)),
+            )
+            blobs = [encode_positions(v, count_header=rng.random() < 0.5) for v in (a, b)]
+            conn.execute("SELECT post_gallop_ratio(?)", (i % 3 if i % 3 < 2 else old_ratio,))
+            conn.execute("SELECT post_cache_config(?)", (1 << 20 if i % 2 else 0,))
+            got = list(conn.execute(sql, (*blobs, off_min, off_max)).fetchone())
+            got[4] = [int(x) for x in decode_positions(got[4])]
+            each = [row[0] for row in conn.execute("SELECT seq FROM post_near_each(?, ?, ?, ?)", (*blobs, off_min, off_max))]
+            if tuple(got) != want or each != [signed(x) for x in near]:
+                raise AssertionError(f"overflow case {a} {b} [{off_min}, {off_max}]: {got} != {want}")
+
+        # Corrupt legacy blobs decode to arbitrary, unsorted positions; the
+        # answer is meaningless but every call has to return.
+        for i in range(400):
+            blobs = [bytes(rng.randrange(256) for _ in range(rng.randrange(1, 40))) for _ in range(2)]
+            blobs = [b"\x01" + blob if blob[:2] == MAGIC else blob for blob in blobs]
+            conn.execute(sql, (*blobs, rng.randrange(-8, 1), rng.randrange(0, 8))).fetchone()
+            conn.execute("SELECT count(*) FROM post_near_each(?, ?, -3, 3)", blobs).fetchone()
+    finally:
+        conn.execute("SELECT post_gallop_ratio(?)", (old_ratio,))
+        conn.execute("SELECT post_cache_config(?)", (old_cache,))
+
+
+def _check_each(conn: sqlite3.Connection, rng: random.Random, rounds: int) -> None:
+    """post_each and post_near_each in every blob format against Python lists."""
+    for i in range(rounds):
+        lists = []
+        for _ in range(2):
+            n = rng.choice([0, 1, 5, 127, 128, 129, 2000])
+            span = rng.choice([3 * n + 5, 40 * n + 5])
+            lists.append(sorted(rng.randrange(span) for _ in range(n)))
+        blobs = [
+            rng.choice(
+                [
+                    encode_positions(v),
+                    encode_positions(v, count_header=True),
+                    encode_positions(v, rng.choice([1, 8, DEFAULT_BLOCK_SIZE])),
+                    encode_positions(v, packed=True),
+                ]
+            )
+            for v in lists
+        ]
+        a, b = lists
+        rows = conn.execute("SELECT seq, idx FROM post_each(?)", (blobs[0],)).fetchall()
+        if rows != list((seq, idx) for idx, seq in enumerate(a)):
+            raise AssertionError(f"each round {i}: post_each disagrees with the list")
+
+        off_min = rng.randrange(-12, 6)
+        off_max = off_min + rng.randrange(-2, 12)
+        set_b = set(b)
+        want = [x for x in a if any(x + d in set_b for d in range(off_min, off_max + 1))]
+        got = [row[0] for row in conn.execute("SELECT seq FROM post_near_each(?, ?, ?, ?)", (*blobs, off_min, off_max))]
+        if got != want:
+            raise AssertionError(f"each round {i}: post_near_each disagrees with Python")
+        (as_json,) = conn.execute("SELECT post_near_positions(?, ?, ?, ?)", (*blobs, off_min, off_max)).fetchone()
+        if [int(x) for x in as_json.strip("[]").split(",") if x] != want:
+            raise AssertionError(f"each round {i}: post_near_positions disagrees with post_near_each")
+
+
+def _ft_books(rng: random.Random, urns, words: list[str]) -> dict:
+    """{urn: {seq: word}} for random books drawn from `words`."""
+    return {urn: dict(enumerate(rng.choices(words, k=rng.randrange(1, 600)))) for urn in urns}
+
+
+def _write_ft(path: str, books: dict) -> None:
+    """An ft(urn, word, seq) source table with the tokens of `books`, in stored order."""
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS ft (urn INTEGER, word TEXT, seq INTEGER)")
+    db.executemany(
+        "INSERT INTO ft VALUES (?, ?, ?)", [(urn, w, seq) for urn, toks in books.items() for seq, w in toks.items()]
+    )
+    db.commit()
+    db.close()
+
+
+def _shard_rows(path: str) -> dict:
+    """Sorted rows per table of a converted shard, with token_chunks as (bok_id, seq, word)."""
+    db = sqlite3.connect(path)
+    sql = "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite%'"
+    names = {n for (n,) in db.execute(sql)}
+    out = {t: sorted(db.execute(f"SELECT * FROM {t}")) for t in names - {"token_chunks", "lexicon", "deleted_urns"}}
+    if "token_chunks" in names:
+        words = dict(db.execute("SELECT word_id, word FROM lexicon"))
+        out["token_chunks"] = sorted(
+            (bok_id, chunk * TOKEN_CHUNK_SIZE + i, words[word_id])
+            for bok_id, chunk, ids in db.execute("SELECT bok_id, chunk, ids FROM token_chunks")
+            for i, word_id in enumerate(decode_token_chunk(ids))
+            if word_id
+        )
+    db.close()
+    return out
+
+
+def _check_update(tmp: str, rng: random.Random) -> None:
+    """convert_all_ft.update_one (append, delete, replace) against a full reconversion."""
+    from convert_all_ft import convert_one, update_one
+
+    words = ["w%d" % i for i in range(200)]
+    src = os.path.join(tmp, "update.db")
+    dst = os.path.join(tmp, "update_postings.db")
+    full = os.path.join(tmp, "full_postings.db")
+    opts = {"count_header": True, "packed": True}
+    _write_ft(src, _ft_books(rng, range(1, 7), words))
+    convert_one(src, dst, 500, tokens="both", max_ngram=3, **opts)
+
+    def same_as_full(step: str, urns=None) -> None:
+        convert_one(src, full, 500, tokens="both", max_ngram=3, urns=urns, **opts)
+        got, want = _shard_rows(dst), _shard_rows(full)
+        for table in want:
+            if got.get(table) != want[table]:
+                raise AssertionError(f"update_one {step}: {table} differs from a full conversion")
+
+    _write_ft(src, _ft_books(rng, range(7, 12), words + ["ny"]))
+    update_one(src, dst, 500, **opts)
+    same_as_full("append")
+
+    update_one(src, dst, 500, delete=[3, 8], **opts)
+    same_as_full("delete", [u for u in range(1, 12) if u not in (3, 8)])
+
+    db = sqlite3.connect(src)
+    db.execute("DELETE FROM ft WHERE urn = 5")
+    db.commit()
+    db.close()
+    _write_ft(src, _ft_books(rng, [5], words))
+    _write_ft(src, _ft_books(rng, [12], words))
+    update_one(src, dst, 500, replace=[5], append=False, **opts)
+    same_as_full("replace", [u for u in range(1, 12) if u not in (3, 8)])
+
+    update_one(src, dst, 500, **opts)
+    same_as_full("append after delete", [u for u in range(1, 13) if u not in (3, 8)])
+
+    update_one(src, dst, 500, replace=[3], **opts)
+    same_as_full("replace a deleted book", [u for u in range(1, 13) if u != 8])
+
+
+def _check_finalize(ext_path: str, tmp: str, rng: random.Random) -> None:
+    """finalize_shard with and without --cluster keeps the rows and the query results."""
+    import shutil
+
+    from convert_all_ft import convert_one, update_one
+    from finalize_shard import _primary_key, finalize_shard
+    from sqlite_postings import Shard
+
+    words = ["w%d" % i for i in range(40)]
+    src = os.path.join(tmp, "final.db")
+    plain = os.path.join(tmp, "final_postings.db")
+    _write_ft(src, _ft_books(rng, range(1, 9), words))
+    convert_one(src, plain, 500, tokens="both", max_ngram=2, packed=True)
+    want = _shard_rows(plain)
+
+    for cluster in (False, True):
+        path = os.path.join(tmp, f"final_{int(cluster)}_postings.db")
+        shutil.copy(plain, path)
+        finalize_shard(path, 4096, cluster)
+        if _shard_rows(path) != want:
+            raise AssertionError(f"finalize_shard(cluster={cluster}) changed the rows")
+        db = sqlite3.connect(path)
+        page_size, free = (db.execute(f"PRAGMA {p}").fetchone()[0] for p in ("page_size", "freelist_count"))
+        keys = [_primary_key(db, t) for t in ("postings", "ng2")]
+        db.close()
+        if page_size != 4096 or free:
+            raise AssertionError(f"finalize_shard(cluster={cluster}): page size {page_size}, {free} free pages")
+        if cluster and keys != [["word", "bok_id"], ["w1", "w2", "bok_id"]]:
+            raise AssertionError(f"finalize_shard --cluster left the keys as {keys}")
+
+        with Shard(plain, ext_path=ext_path) as a, Shard(path, ext_path=ext_path) as b:
+            for i in range(50):
+                w1, w2 = rng.choice(words), rng.choice(words)
+                bok_id = rng.randrange(0, 10)
+                for name, args in (
+                    ("near_count", (w1, w2, -3, 3)),
+                    ("phrase", ([w1, w2],)),
+                    ("positions", (bok_id, w1)),
+                    ("phrase_positions", (bok_id, [w1, w2])),
+                    ("concordance", (bok_id, w1, 3, 3)),
+                ):
+                    got, expected = getattr(b, name)(*args), getattr(a, name)(*args)
+                    if name in ("near_count", "phrase"):
+                        got, expected = sorted(got), sorted(expected)
+                    if got != expected:
+                        raise AssertionError(f"Shard.{name}{args} differs after finalize_shard(cluster={cluster})")
+
+        update_one(src, path, 500, delete=[2], finalize=True, page_size=4096, cluster=cluster)
+        if _shard_rows(path)["urns"] != [row for row in want["urns"] if row[0] != 2]:
+            raise AssertionError(f"--delete on a finalized shard (cluster={cluster}) kept the book")
+
+
+def _check_collocations(tmp: str, rng: random.Random) -> None:
+    """collocations() and score() over two shards against brute-force counts."""
+    import math
+
+    from collocations import collocations, score
+    from convert_all_ft import convert_one
+
+    words = ["w%d" % i for i in range(30)]
+    all_books, paths = {}, []
+    for k, tokens in enumerate(("rows", "chunks")):
+        # Gaps in the seq numbers, as after filtering, and hits at the start of a book.
+        books = {
+            urn: {seq: rng.choice(words) for seq in sorted(rng.sample(range(900), rng.randrange(1, 600)))}
+            for urn in range(10 * k + 1, 10 * k + 6)
+        }
+        books[10 * k + 1][0] = "w0"
+        all_books.update(books)
+        src = os.path.join(tmp, f"coll_{k}.db")
+        paths.append(os.path.join(tmp, f"coll_{k}_postings.db"))
+        _write_ft(src, books)
+        convert_one(src, paths[k], 500, tokens=tokens)
+
+    for node, left, right in (("w0", 5, 5), ("w1", 0, 3), ("w2", 7, 0), ("nope", 2, 2)):
+        cooc, cf, node_cf = {}, {}, 0
+        for toks in all_books.values():
+            for seq, w in toks.items():
+                cf[w] = cf.get(w, 0) + 1
+                if w != node:
+                    continue
+                node_cf += 1
+                for s in range(seq - left, seq + right + 1):
+                    if s != seq and s in toks:
+                        cooc[toks[s]] = cooc.get(toks[s], 0) + 1
+        total = collocations(os.path.join(tmp, "coll_*_postings.db"), node, left, right, jobs=2)
+        if (total.cooc, total.node_cf, total.n_tokens) != (cooc, node_cf, sum(cf.values())):
+            raise AssertionError(f"collocations of {node!r} [-{left}, +{right}]: counts differ from brute force")
+        if total.cf != {w: cf[w] for w in cooc}:
+            raise AssertionError(f"collocations of {node!r}: corpus frequencies differ from brute force")
+
+        n, span = total.n_tokens, left + right
+        for measure in ("pmi", "ll"):
+            ranked = score(total, span, measure, min_count=2)
+            values = [row[3] for row in ranked]
+            if {row[0] for row in ranked} != {w for w in cooc if cooc[w] >= 2} or values != sorted(values, reverse=True):
+                raise AssertionError(f"score({measure}) of {node!r}: wrong candidates or order")
+            for w, o11, c1, value in ranked:
+                r1 = node_cf * span
+                if measure == "pmi":
+                    want = math.log2(o11 * n / (r1 * c1))
+                else:
+                    cells = [[o11, r1 - o11], [c1 - o11, n - r1 - c1 + o11]]
+                    rows, cols = [sum(r) for r in cells], [sum(c) for c in zip(*cells)]
+                    g2 = 2 * sum(
+                        o * math.log(o * n / (rows[i] * cols[j]))
+                        for i, r in enumerate(cells)
+                        for j, o in enumerate(r)
+                        if o > 0
+                    )
+                    want = g2 if o11 * n >= r1 * c1 else -g2
+                if (o11, c1) != (cooc[w], cf[w]) or not math.isclose(value, want, rel_tol=1e-9, abs_tol=1e-9):
+                    raise AssertionError(f"score({measure}) of {node!r}: {w} scored {value}, expected {want}")
+
+
+def _check_manifest(ext_path: str, tmp: str, rng: random.Random) -> None:
+    """Manifest routing: no Bloom false negatives, and appended words are still found."""
+    from convert_all_ft import convert_one, update_one
+    from sqlite_postings import Corpus, Manifest
+    from sqlite_postings.manifest import SCHEMA, add_shard
+
+    common = ["w%d" % i for i in range(300)]
+    srcs, paths, books = [], [], {}
+    for k in range(3):
+        own = [f"s{k}_{i}" for i in range(50)]
+        shard_books = _ft_books(rng, range(100 * k + 1, 100 * k + 9), common + own)
+        books.update(shard_books)
+        srcs.append(os.path.join(tmp, f"alto_{k}.db"))
+        paths.append(os.path.join(tmp, f"alto_{k}_postings.db"))
+        _write_ft(srcs[k], shard_books)
+        convert_one(srcs[k], paths[k], 1000)
+
+    vocabs = []
+    for path in paths:
+        db = sqlite3.connect(path)
+        vocabs.append({w for (w,) in db.execute("SELECT word FROM vocab")})
+        db.close()
+    for exact in (False, True):
+        manifest_path = os.path.join(tmp, f"manifest_{int(exact)}.db")
+        db = sqlite3.connect(manifest_path)
+        db.executescript(SCHEMA)
+        for path in paths:
+            add_shard(db, path, exact=exact)
+        db.commit()
+        db.close()
+        with Manifest(manifest_path) as manifest:
+            for k, vocab in enumerate(vocabs):
+                for word in vocab:
+                    found = set(manifest.shards_for_word(word))
+                    if os.path.abspath(paths[k]) not in found:
+                        raise AssertionError(f"manifest (exact={exact}) misses {word!r} in {paths[k]}")
+                    if exact and found != {os.path.abspath(p) for p, v in zip(paths, vocabs) if word in v}:
+                        raise AssertionError(f"exact manifest routes {word!r} to shards without it")
+            for urn in books:
+                if manifest.shard_for_book(urn) != os.path.abspath(paths[(urn - 1) // 100]):
+                    raise AssertionError(f"manifest puts book {urn} in the wrong shard")
+            if manifest.stale():
+                raise AssertionError("fresh manifest reports stale shards")
+
+    # A new word appended to shard 1 after the manifest was built.
+    new_books = {150: {0: "nyord", 1: "w1", 2: "nyord"}}
+    _write_ft(srcs[1], new_books)
+    update_one(srcs[1], paths[1], 1000)
+    for exact in (False, True):
+        manifest_path = os.path.join(tmp, f"manifest_{int(exact)}.db")
+        with Manifest(manifest_path) as manifest:
+            if manifest.stale() != [os.path.abspath(paths[1])]:
+                raise AssertionError("manifest does not report the appended shard as stale")
+            if os.path.abspath(paths[1]) not in manifest.route(map(os.path.abspath, paths), ["nyord"]):
+                raise AssertionError("manifest routes a word appended after the build away from its shard")
+        with Corpus(paths, manifest=manifest_path, ext_path=ext_path, immutable=False) as corpus:
+            if corpus.phrase(["nyord"]) != [(150, 2)]:
+                raise AssertionError("Corpus with a stale manifest misses an appended word")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cross-check the postings extension against the codec.")
+    parser.add_argument("ext", help="Compiled extension (e.g. build/linux/postings.so)")
+    parser.add_argument("--rounds", type=int, default=200, help="Random lists to check")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+    check_extension(args.ext, args.rounds, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""Corpus-wide collocations of a node word, ranked by association measure.
+
+`count_shard` reads the node word's postings in one shard. It then scans only
+the context windows around the hits, with one ordered range scan per cluster
+of nearby windows. Windows come from `token_chunks` when the shard has it,
+otherwise from `tokens`. The words found there are counted in a dict keyed by
+word id (or by word, for `tokens`). Shards run in a process pool and
+`merge_counts` adds up the per-shard counts. A second pass, `count_cf`, sums
+the candidates' frequencies in `vocab` over every shard, including shards
+where a candidate never occurs near the node. `score` then ranks the
+candidates by PMI or log-likelihood against those frequencies and the corpus
+size in `urns` (see `add_stats_tables.py` for older shards).
+
+    python3 collocations.py --glob "/mnt/disk1/alto_postings/*_postings.db" \\
+        --word demokrati --left 5 --right 5 --measure ll --top 50 --jobs 8
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from glob import glob
+from urllib.request import pathname2url
+
+from postings_codec import TOKEN_CHUNK_SIZE, count_positions, decode_positions, decode_token_chunk
+
+# Windows closer than this are read in the same range scan (as in post_kwic).
+CLUSTER_GAP = 256
+
+# Max bound parameters per IN (...) lookup.
+LOOKUP_BATCH = 500
+
+
+@dataclass
+class ShardCounts:
+    path: str
+    cooc: dict = field(default_factory=dict)  # word -> co-occurrences with the node
+    cf: dict = field(default_factory=dict)  # word -> collection frequency (filled by collocations)
+    node_cf: int = 0
+    n_tokens: int = 0
+    elapsed: float = 0.0
+    error: str | None = None
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    conn.create_function("post_count", 1, count_positions, deterministic=True)
+    return conn
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return row.fetchone() is not None
+
+
+def _clusters(hits, left: int, right: int):
+    """Yield (lo, hi, hits) for groups of windows that overlap or nearly touch."""
+    i = 0
+    while i < len(hits):
+        j = i + 1
+        hi = hits[i] + right
+        while j < len(hits) and hits[j] - left <= hi + CLUSTER_GAP:
+            hi = hits[j] + right
+            j += 1
+        yield max(hits[i] - left, 0), hi, hits[i:j]
+        i = j
+
+
+def _read_rows(conn, bok_id: int, lo: int, hi: int):
+    return conn.execute(
+        "SELECT seq, word FROM tokens WHERE bok_id = ? AND seq BETWEEN ? AND ? ORDER BY seq",
+        (bok_id, lo, hi),
+    ).fetchall()
+
+
+def _read_chunks(conn, bok_id: int, lo: int, hi: int):
+    out = []
+    rows = conn.execute(
+        "SELECT chunk, ids FROM token_chunks WHERE bok_id = ? AND chunk BETWEEN ? AND ? "
+        "ORDER BY chunk",
+        (bok_id, lo // TOKEN_CHUNK_SIZE, hi // TOKEN_CHUNK_SIZE),
+    )
+    for chunk, blob in rows:
+        base = chunk * TOKEN_CHUNK_SIZE
+        for i, word_id in enumerate(decode_token_chunk(blob)):
+            if word_id and lo <= base + i <= hi:
+                out.append((base + i, word_id))
+    return out
+
+
+def _lookup(conn, sql: str, keys) -> dict:
+    """Run `sql` (with one `{}` for the IN list) over keys in batches."""
+    keys = list(keys)
+    out = {}
+    for i in range(0, len(keys), LOOKUP_BATCH):
+        batch = keys[i : i + LOOKUP_BATCH]
+        marks = ",".join("?" * len(batch))
+        out.update(conn.execute(sql.format(marks), batch).fetchall())
+    return out
+
+
+def count_shard(path: str, word: str, left: int, right: int) -> ShardCounts:
+    """Co-occurrence counts for `word` within [-left, +right] in one shard."""
+    t0 = time.perf_counter()
+    try:
+        conn = _connect(path)
+    except sqlite3.Error as exc:
+        return ShardCounts(path, elapsed=time.perf_counter() - t0, error=str(exc))
+    try:
+        chunked = _has_table(conn, "token_chunks")
+        read = _read_chunks if chunked else _read_rows
+        counts = {}
+        node_cf = 0
+        postings = conn.execute("SELECT bok_id, blob FROM postings WHERE word = ?", (word,))
+        for bok_id, blob in postings.fetchall():
+            hits = [int(x) for x in decode_positions(blob)]
+            node_cf += len(hits)
+            for lo, hi, group in _clusters(hits, left, right):
+                toks = read(conn, bok_id, lo, hi)
+                seqs = [seq for seq, _ in toks]
+                for hit in group:
+                    a = bisect_left(seqs, hit - left)
+                    b = bisect_right(seqs, hit + right)
+                    for seq, key in toks[a:b]:
+                        if seq != hit:
+                            counts[key] = counts.get(key, 0) + 1
+
+        if chunked and counts:
+            words = _lookup(conn, "SELECT word_id, word FROM lexicon WHERE word_id IN ({})", counts)
+            counts = {words[k]: n for k, n in counts.items() if k in words}
+
+        try:
+            (n_tokens,) = conn.execute("SELECT SUM(n_tokens) FROM urns").fetchone()
+        except sqlite3.Error:
+            n_tokens = None
+        if n_tokens is None:
+            (n_tokens,) = conn.execute("SELECT SUM(post_count(blob)) FROM postings").fetchone()
+        return ShardCounts(path, counts, {}, node_cf, n_tokens or 0, time.perf_counter() - t0)
+    except sqlite3.Error as exc:
+        return ShardCounts(path, elapsed=time.perf_counter() - t0, error=str(exc))
+    finally:
+        conn.close()
+
+
+def count_cf(path: str, words) -> dict:
+    """Collection frequency in one shard of those of `words` it has."""
+    conn = _connect(path)
+    try:
+        if _has_table(conn, "vocab"):
+            return _lookup(conn, "SELECT word, cf FROM vocab WHERE word IN ({})", words)
+        return _lookup(
+            conn,
+            "SELECT word, SUM(post_count(blob)) FROM postings WHERE word IN ({}) GROUP BY word",
+            words,
+        )
+    finally:
+        conn.close()
+
+
+def merge_counts(results, on_result=None) -> ShardCounts:
+    """Add up ShardCounts from many shards (failed shards are skipped)."""
+    total = ShardCounts("*")
+    for res in results:
+        if on_result:
+            on_result(res)
+        if res.error:
+            continue
+        for w, n in res.cooc.items():
+            total.cooc[w] = total.cooc.get(w, 0) + n
+        total.node_cf += res.node_cf
+        total.n_tokens += res.n_tokens
+        total.elapsed = max(total.elapsed, res.elapsed)
+    return total
+
+
+def _ll_term(o: float, e: float) -> float:
+    return o * math.log(o / e) if o > 0 and e > 0 else 0.0
+
+
+def score(counts: ShardCounts, span: int, measure: str = "ll", min_count: int = 1) -> list:
+    """Rank collocates as (word, cooc, cf, score), best first.
+
+    `span` is the number of context slots per hit (left + right). Expected
+    co-occurrence is E = node_cf * span * cf / N. PMI is log2(O / E).
+    Log-likelihood is Dunning's G2 over the 2x2 table of window slots vs. the
+    rest of the corpus, negated when O < E.
+    """
+    n = counts.n_tokens
+    r1 = counts.node_cf * span
+    out = []
+    if n <= 0 or r1 <= 0:
+        return out
+    for word, o11 in counts.cooc.items():
+        if o11 < min_count:
+            continue
+        c1 = max(counts.cf.get(word, 0), o11)
+        e11 = r1 * c1 / n
+        if measure == "pmi":
+            value = math.log2(o11 / e11)
+        else:
+            o12, o21 = r1 - o11, c1 - o11
+            o22 = n - r1 - c1 + o11
+            e12, e21 = r1 * (n - c1) / n, (n - r1) * c1 / n
+            e22 = (n - r1) * (n - c1) / n
+            g2 = 2 * (
+                _ll_term(o11, e11) + _ll_term(o12, e12) + _ll_term(o21, e21) + _ll_term(o22, e22)
+            )
+            value = g2 if o11 >= e11 else -g2
+        out.append((word, o11, c1, value))
+    out.sort(key=lambda row: row[3], reverse=True)
+    return out
+
+
+def collocations(
+    pattern: str,
+    word: str,
+    left: int = 5,
+    right: int = 5,
+    jobs: int | None = None,
+    on_result=None,
+    min_count: int = 1,
+) -> ShardCounts:
+    """Count collocates of `word` over every shard matching `pattern`, in parallel.
+
+    The corpus frequency is looked up for the collocates seen at least
+    `min_count` times, summed over the shards that were counted. A shard
+    whose frequencies cannot be read adds none; its result gets an error and
+    is passed to `on_result` again.
+    """
+    paths = sorted(glob(pattern))
+    if not paths:
+        raise ValueError(f"No shards matched {pattern!r}")
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(count_shard, path, word, left, right) for path in paths]
+        results = [fut.result() for fut in as_completed(futures)]
+        total = merge_counts(results, on_result)
+        words = [w for w, n in total.cooc.items() if n >= min_count]
+        if words:
+            futures = {
+                pool.submit(count_cf, res.path, words): res for res in results if not res.error
+            }
+            for fut in as_completed(futures):
+                try:
+                    cf = fut.result()
+                except sqlite3.Error as exc:
+                    res = futures[fut]
+                    res.error = f"cf: {exc}"
+                    if on_result:
+                        on_result(res)
+                    continue
+                for w, n in cf.items():
+                    total.cf[w] = total.cf.get(w, 0) + n
+    return total
+
+
+def print_timing(res: ShardCounts) -> None:
+    status = res.error or f"{res.node_cf} hits, {len(res.cooc)} collocates"
+    print(f"{os.path.basename(res.path)}: {res.elapsed * 1000:.1f} ms, {status}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Collocations of a word across postings shards.")
+    parser.add_argument("--glob", default="/mnt/disk1/alto_postings/*_postings.db", help="Glob for postings DBs")
+    parser.add_argument("--word", required=True, help="Node word")
+    parser.add_argument("--left", type=int, default=5, help="Context tokens before the node")
+    parser.add_argument("--right", type=int, default=5, help="Context tokens after the node")
+    parser.add_argument("--measure", choices=["ll", "pmi"], default="ll", help="Association measure")
+    parser.add_argument("--min-count", type=int, default=3, help="Minimum co-occurrences")
+    parser.add_argument("--top", type=int, default=50, help="Collocates to print")
+    parser.add_argument("--jobs", type=int, help="Worker processes")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    counts = collocations(args.glob, args.word, args.left, args.right, args.jobs, print_timing, args.min_count)
+    ranked = score(counts, args.left + args.right, args.measure, args.min_count)
+    for word, cooc, cf, value in ranked[: args.top]:
+        print(f"{word}\t{cooc}\t{cf}\t{value:.3f}")
+    print(
+        f"{counts.node_cf} hits of {args.word!r} in {counts.n_tokens} tokens, "
+        f"{len(counts.cooc)} collocates in {time.perf_counter() - t0:.3f} s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
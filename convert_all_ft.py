@@ -3,26 +3,112 @@ import argparse
 import glob
 import os
 import sqlite3
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
 
+from finalize_shard import DEFAULT_PAGE_SIZE, finalize_shard
+from postings_codec import (
+    count_positions,
+    encode_positions,
+    encode_token_chunks,
+    ngram_postings,
+    ngram_schema,
+)
 
-def varint_encode(n: int) -> bytes:
-    if n < 0:
-        raise ValueError("varint only supports non-negative integers")
-    out = bytearray()
-    while True:
-        b = n & 0x7F
-        n >>= 7
-        if n:
-            out.append(b | 0x80)
-        else:
-            out.append(b)
-            break
-    return bytes(out)
 
+def remove_db(path: str) -> None:
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+TOKENS_SCHEMA = """
+    CREATE TABLE tokens (
+        bok_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        word TEXT NOT NULL,
+        PRIMARY KEY (bok_id, seq)
+    ) WITHOUT ROWID;
+"""
+
+TOKEN_CHUNKS_SCHEMA = """
+    CREATE TABLE lexicon (
+        word_id INTEGER PRIMARY KEY,
+        word TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE token_chunks (
+        bok_id INTEGER NOT NULL,
+        chunk INTEGER NOT NULL,
+        ids BLOB NOT NULL,
+        PRIMARY KEY (bok_id, chunk)
+    ) WITHOUT ROWID;
+"""
+
+
+def convert_one(
+    src_path: str,
+    dst_path: str,
+    batch: int,
+    *,
+    block_size: int = 0,
+    tokens: str = "rows",
+    max_ngram: int = 1,
+    ngram_min_count: int = 2,
+    count_header: bool = False,
+    urns=None,
+    lexicon=None,
+    order: str = "sorted",
+    packed: bool = False,
+    finalize: bool = False,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    cluster: bool = False,
+    word: str | None = None,
+    limit: int | None = None,
+) -> dict:
+    """Convert one shard into dst_path.
+
+    The shard is written to ``dst_path + ".tmp"`` and renamed into place only
+    when it is complete, so an existing dst_path is always a finished shard.
+
+    `tokens` selects how the token sequence is stored for context windows:
+    "rows" (the tokens table), "chunks" (lexicon + token_chunks) or "both".
+
+    With `max_ngram` >= 2, ng2 .. ng<max_ngram> postings tables are built in
+    the same pass, keeping n-grams seen at least `ngram_min_count` times in
+    a book.
+
+    With `count_header`, plain postings blobs get a header holding their
+    length so `post_count` is O(1). With `packed`, postings longer than one
+    block (PACK_BLOCK positions) are written bit-packed (format 2) instead.
+
+    `urns`, if given, limits the conversion to those books, and `lexicon`
+    (word -> word_id) seeds the word ids so new words are numbered after the
+    ones already in use (see `update_one`). `word` keeps only that word's ft
+    rows and `limit` stops after that many rows, for small test extracts
+    (convert_ft_to_postings.py).
+
+    `order` picks how ft is read. "sorted" asks SQLite for
+    ``ORDER BY urn, word, seq``, which builds a temp B-tree as large as ft
+    before the first row arrives. "stream" reads ft in stored order and
+    groups one book at a time in memory, so ft rows must be grouped by urn
+    (a book that shows up twice raises ValueError). Both write the same
+    tables.
+
+    With `finalize`, the shard is rewritten for reading before the rename
+    (see finalize_shard.py): `page_size` pages, and word-first postings
+    tables with `cluster`.
+    """
+    t0 = time.perf_counter()
+    tmp_path = dst_path + ".tmp"
+    remove_db(tmp_path)
 
-def convert_one(src_path: str, dst_path: str, batch: int) -> None:
     src = sqlite3.connect(src_path)
-    dst = sqlite3.connect(dst_path)
+    dst = sqlite3.connect(tmp_path)
 
     dst.executescript(
         """
@@ -32,14 +118,11 @@ def convert_one(src_path: str, dst_path: str, batch: int) -> None:
         PRAGMA cache_size = 200000;
 
         DROP TABLE IF EXISTS tokens;
+        DROP TABLE IF EXISTS token_chunks;
+        DROP TABLE IF EXISTS lexicon;
         DROP TABLE IF EXISTS postings;
-
-        CREATE TABLE tokens (
-            bok_id INTEGER NOT NULL,
-            seq INTEGER NOT NULL,
-            word TEXT NOT NULL,
-            PRIMARY KEY (bok_id, seq)
-        ) WITHOUT ROWID;
+        DROP TABLE IF EXISTS urns;
+        DROP TABLE IF EXISTS vocab;
 
         CREATE TABLE postings (
             bok_id INTEGER NOT NULL,
@@ -51,23 +134,68 @@ def convert_one(src_path: str, dst_path: str, batch: int) -> None:
         CREATE INDEX postings_word_bok_id ON postings(word, bok_id);
 
         CREATE TABLE urns (
-            bok_id INTEGER NOT NULL PRIMARY KEY
+            bok_id INTEGER NOT NULL PRIMARY KEY,
+            n_tokens INTEGER NOT NULL,
+            n_types INTEGER NOT NULL
+        ) WITHOUT ROWID;
+
+        CREATE TABLE vocab (
+            word TEXT NOT NULL PRIMARY KEY,
+            df INTEGER NOT NULL,
+            cf INTEGER NOT NULL,
+            total_blob_bytes INTEGER NOT NULL
         ) WITHOUT ROWID;
         """
     )
+    write_rows = tokens in ("rows", "both")
+    write_chunks = tokens in ("chunks", "both")
+    if write_rows:
+        dst.executescript(TOKENS_SCHEMA)
+    if write_chunks:
+        dst.executescript(TOKEN_CHUNKS_SCHEMA)
+    for n in range(2, max_ngram + 1):
+        dst.executescript(ngram_schema(n))
+    stream = order == "stream"
+    keep_words = write_chunks or max_ngram >= 2 or stream
 
     src_cur = src.cursor()
     dst_cur = dst.cursor()
-    src_cur.execute("SELECT urn, word, seq FROM ft ORDER BY urn, word, seq")
+    sql = "SELECT urn, word, seq FROM ft"
+    where = []
+    params = []
+    if urns is not None:
+        src.execute("CREATE TEMP TABLE only_urns (urn INTEGER PRIMARY KEY)")
+        src.executemany("INSERT INTO only_urns (urn) VALUES (?)", [(u,) for u in urns])
+        where.append("urn IN (SELECT urn FROM only_urns)")
+    if word is not None:
+        where.append("word = ?")
+        params.append(word)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if not stream:
+        sql += " ORDER BY urn, word, seq"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    src_cur.execute(sql, params)
 
     tokens_batch = []
+    postings_batch = []
     current_urn = None
     current_word = None
-    last_pos = 0
-    blob = bytearray()
+    positions = array("Q")
     postings_count = 0
     rows_count = 0
     urns_count = 0
+    ngrams_count = 0
+    lexicon = dict(lexicon or {})
+    next_word_id = max(lexicon.values(), default=0) + 1
+    book_words = {}  # seq -> word for the current book (chunks / n-grams / stream)
+    book = {}  # word -> positions for the current book (stream)
+    done_urns = set()
+    book_tokens = 0
+    book_types = 0
+    vocab = {}  # word -> [df, cf, total_blob_bytes]
 
     def flush_tokens() -> None:
         if not tokens_batch:
@@ -78,51 +206,333 @@ def convert_one(src_path: str, dst_path: str, batch: int) -> None:
         )
         tokens_batch.clear()
 
-    def flush_posting() -> None:
-        nonlocal postings_count
+    def lookup_word(word: str) -> int:
+        nonlocal next_word_id
+        wid = lexicon.get(word)
+        if wid is None:
+            wid = lexicon[word] = next_word_id
+            next_word_id += 1
+            dst_cur.execute("INSERT INTO lexicon (word_id, word) VALUES (?, ?)", (wid, word))
+        return wid
+
+    def flush_book() -> None:
+        nonlocal ngrams_count, urns_count, book_tokens, book_types
         if current_urn is None:
             return
-        dst_cur.execute(
+        dst_cur.executemany(
             "INSERT INTO postings (bok_id, word, blob) VALUES (?, ?, ?)",
-            (current_urn, current_word, bytes(blob)),
+            postings_batch,
+        )
+        postings_batch.clear()
+        dst_cur.execute(
+            "INSERT INTO urns (bok_id, n_tokens, n_types) VALUES (?, ?, ?)",
+            (current_urn, book_tokens, book_types),
         )
-        postings_count += 1
-
-    def insert_urn(urn: int) -> None:
-        nonlocal urns_count
-        dst_cur.execute("INSERT OR IGNORE INTO urns (bok_id) VALUES (?)", (urn,))
         urns_count += 1
+        book_tokens = book_types = 0
+        if not book_words:
+            return
+        if write_chunks:
+            ids = {seq: lookup_word(word) for seq, word in book_words.items()}
+            dst_cur.executemany(
+                "INSERT INTO token_chunks (bok_id, chunk, ids) VALUES (?, ?, ?)",
+                [(current_urn, chunk, blob) for chunk, blob in encode_token_chunks(ids)],
+            )
+        for n in range(2, max_ngram + 1):
+            rows = [
+                (
+                    current_urn,
+                    *words,
+                    encode_positions(positions, block_size, count_header, packed),
+                )
+                for words, positions in ngram_postings(book_words, n, ngram_min_count)
+            ]
+            cols = ", ".join(f"w{i}" for i in range(1, n + 1))
+            dst_cur.executemany(
+                f"INSERT INTO ng{n} (bok_id, {cols}, blob) VALUES (?, {', '.join('?' * (n + 1))})",
+                rows,
+            )
+            ngrams_count += len(rows)
+        book_words.clear()
 
-    for urn, word, seq in src_cur:
-        rows_count += 1
-        tokens_batch.append((urn, seq, word))
-        if len(tokens_batch) >= batch:
-            flush_tokens()
+    def flush_posting() -> None:
+        nonlocal postings_count, book_tokens, book_types
+        if current_urn is None:
+            return
+        blob = encode_positions(positions, block_size, count_header, packed)
+        postings_batch.append((current_urn, current_word, blob))
+        stats = vocab.get(current_word)
+        if stats is None:
+            stats = vocab[current_word] = [0, 0, 0]
+        stats[0] += 1
+        stats[1] += len(positions)
+        stats[2] += len(blob)
+        book_tokens += len(positions)
+        book_types += 1
+        postings_count += 1
 
-        if (urn != current_urn) or (word != current_word):
-            flush_posting()
-            current_urn = urn
+    def flush_stream_book() -> None:
+        # Postings in (bok_id, word) order and tokens in (bok_id, seq) order.
+        nonlocal current_word, positions
+        for word in sorted(book):
             current_word = word
-            last_pos = 0
-            blob = bytearray()
-            insert_urn(urn)
+            positions = array("Q", sorted(book[word]))
+            flush_posting()
+        book.clear()
+        if write_rows:
+            tokens_batch.extend((current_urn, seq, w) for seq, w in sorted(book_words.items()))
+            flush_tokens()
+        flush_book()
 
-        delta = seq - last_pos
-        if delta < 0:
-            raise ValueError("seq must be non-decreasing within a word")
-        blob.extend(varint_encode(delta))
-        last_pos = seq
+    if stream:
+        for urn, word, seq in src_cur:
+            rows_count += 1
+            if urn != current_urn:
+                flush_stream_book()
+                if urn in done_urns:
+                    raise ValueError(
+                        f"{src_path}: ft rows for urn {urn} are not contiguous; "
+                        "use order='sorted'"
+                    )
+                done_urns.add(urn)
+                current_urn = urn
+            pos = book.get(word)
+            if pos is None:
+                pos = book[word] = array("Q")
+            pos.append(seq)
+            book_words[seq] = word
+        flush_stream_book()
+    else:
+        for urn, word, seq in src_cur:
+            rows_count += 1
+            if write_rows:
+                tokens_batch.append((urn, seq, word))
+                if len(tokens_batch) >= batch:
+                    flush_tokens()
 
-    flush_tokens()
-    flush_posting()
+            if (urn != current_urn) or (word != current_word):
+                flush_posting()
+                if urn != current_urn:
+                    flush_book()
+                current_urn = urn
+                current_word = word
+                positions = array("Q")
+
+            positions.append(seq)
+            if keep_words:
+                book_words[seq] = word
+
+        flush_tokens()
+        flush_posting()
+        flush_book()
+    dst_cur.executemany(
+        "INSERT INTO vocab (word, df, cf, total_blob_bytes) VALUES (?, ?, ?, ?)",
+        [(word, *stats) for word, stats in sorted(vocab.items())],
+    )
 
     dst.commit()
+    # Fold the WAL back into the main file before the rename.
+    dst.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    dst.execute("PRAGMA journal_mode = DELETE")
     dst.close()
     src.close()
+    if finalize:
+        finalize_shard(tmp_path, page_size, cluster)
+    os.replace(tmp_path, dst_path)
+
+    return {
+        "src": src_path,
+        "dst": dst_path,
+        "rows": rows_count,
+        "postings": postings_count,
+        "urns": urns_count,
+        "ngrams": ngrams_count,
+        "src_bytes": os.path.getsize(src_path),
+        "elapsed": time.perf_counter() - t0,
+    }
+
+
+def _tables(conn: sqlite3.Connection, schema: str = "main") -> set:
+    return {
+        name
+        for (name,) in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")
+    }
+
+
+def update_one(
+    src_path: str,
+    dst_path: str,
+    batch: int,
+    *,
+    block_size: int = 0,
+    ngram_min_count: int = 2,
+    count_header: bool = False,
+    delete=(),
+    replace=(),
+    order: str = "sorted",
+    packed: bool = False,
+    finalize: bool = False,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    cluster: bool = False,
+    append: bool = True,
+) -> dict:
+    """Bring an existing shard up to date with its source, in place.
+
+    With `append`, books in the source ft table that are missing from
+    dst_path's `urns` table are converted (with the same tokens/n-gram tables
+    the shard already has) and added. Books in `delete` are removed and
+    listed in `deleted_urns`, which later appends skip; books in `replace`
+    are removed and converted again from the source. All changes to
+    dst_path, including `vocab` and `lexicon`, are made in one transaction.
+    With `finalize`, the shard is then finalized again, as in `convert_one`.
+    """
+    t0 = time.perf_counter()
+    dst = sqlite3.connect(dst_path, isolation_level=None)
+    dst.create_function("post_count", 1, count_positions, deterministic=True)
+    tables = _tables(dst)
+    urns_cols = {name for _cid, name, *_ in dst.execute("PRAGMA table_info(urns)")}
+    if not {"n_tokens", "n_types"} <= urns_cols:
+        dst.close()
+        raise ValueError(f"{dst_path}: no urns table with n_tokens/n_types; run add_stats_tables.py first")
+    existing = {bok_id for (bok_id,) in dst.execute("SELECT bok_id FROM urns")}
+    skip = set(existing)
+    if "deleted_urns" in tables:
+        skip.update(bok_id for (bok_id,) in dst.execute("SELECT bok_id FROM deleted_urns"))
+    src = sqlite3.connect(src_path)
+    src_urns = {urn for (urn,) in src.execute("SELECT DISTINCT urn FROM ft")}
+    src.close()
+
+    replace = set(replace) & src_urns
+    deleted = (set(delete) & (existing | src_urns)) - replace
+    dropped = (set(delete) | replace) & existing
+    added = sorted(((src_urns - skip) if append else set()) | replace)
+    ngram_tables = sorted(
+        (t for t in tables if t[:2] == "ng" and t[2:].isdigit()), key=lambda t: int(t[2:])
+    )
+    book_tables = ["postings", "urns"]
+    book_tables += [t for t in ("tokens", "token_chunks") if t in tables] + ngram_tables
+
+    stats = {
+        "src": src_path,
+        "dst": dst_path,
+        "rows": 0,
+        "postings": 0,
+        "urns": 0,
+        "ngrams": 0,
+        "deleted": len(dropped),
+    }
+    new_path = dst_path + ".new"
+    if added:
+        if "token_chunks" in tables:
+            tokens = "both" if "tokens" in tables else "chunks"
+            lexicon = dict(dst.execute("SELECT word, word_id FROM lexicon"))
+        else:
+            tokens, lexicon = "rows", None
+        max_ngram = int(ngram_tables[-1][2:]) if ngram_tables else 1
+        new_stats = convert_one(
+            src_path,
+            new_path,
+            batch,
+            block_size=block_size,
+            tokens=tokens,
+            max_ngram=max_ngram,
+            ngram_min_count=ngram_min_count,
+            count_header=count_header,
+            urns=added,
+            lexicon=lexicon,
+            order=order,
+            packed=packed,
+        )
+        for key in ("rows", "postings", "urns", "ngrams"):
+            stats[key] = new_stats[key]
+        dst.execute("ATTACH DATABASE ? AS new", (new_path,))
+
+    try:
+        dst.execute("BEGIN IMMEDIATE")
+        if dropped:
+            dst.execute("CREATE TEMP TABLE dropped (bok_id INTEGER PRIMARY KEY)")
+            dst.executemany("INSERT INTO dropped (bok_id) VALUES (?)", [(b,) for b in dropped])
+            if "vocab" in tables:
+                dst.execute(
+                    """
+                    UPDATE vocab
+                    SET df = vocab.df - d.df,
+                        cf = vocab.cf - d.cf,
+                        total_blob_bytes = vocab.total_blob_bytes - d.bytes
+                    FROM (
+                      SELECT word, COUNT(*) AS df, SUM(post_count(blob)) AS cf,
+                             SUM(length(blob)) AS bytes
+                      FROM postings
+                      WHERE bok_id IN (SELECT bok_id FROM dropped)
+                      GROUP BY word
+                    ) AS d
+                    WHERE vocab.word = d.word
+                    """
+                )
+                dst.execute("DELETE FROM vocab WHERE df <= 0")
+            for table in book_tables:
+                dst.execute(f"DELETE FROM {table} WHERE bok_id IN (SELECT bok_id FROM dropped)")
+            dst.execute("DROP TABLE dropped")
+        if deleted:
+            dst.execute(
+                "CREATE TABLE IF NOT EXISTS deleted_urns (bok_id INTEGER NOT NULL PRIMARY KEY) WITHOUT ROWID"
+            )
+            dst.executemany("INSERT OR IGNORE INTO deleted_urns (bok_id) VALUES (?)", [(b,) for b in deleted])
+        if replace and "deleted_urns" in tables:
+            dst.executemany("DELETE FROM deleted_urns WHERE bok_id = ?", [(b,) for b in replace])
+        if added:
+            new_tables = _tables(dst, "new")
+            for table in book_tables:
+                if table in new_tables:
+                    info = dst.execute(f"PRAGMA new.table_info({table})")
+                    cols = ", ".join(name for _, name, *_ in info)
+                    dst.execute(f"INSERT INTO main.{table} ({cols}) SELECT {cols} FROM new.{table}")
+            if "token_chunks" in tables:
+                dst.execute(
+                    "INSERT INTO main.lexicon (word_id, word) SELECT word_id, word FROM new.lexicon"
+                )
+            if "vocab" in tables:
+                dst.execute(
+                    """
+                    INSERT INTO main.vocab (word, df, cf, total_blob_bytes)
+                    SELECT word, df, cf, total_blob_bytes FROM new.vocab WHERE true
+                    ON CONFLICT (word) DO UPDATE SET
+                      df = df + excluded.df,
+                      cf = cf + excluded.cf,
+                      total_blob_bytes = total_blob_bytes + excluded.total_blob_bytes
+                    """
+                )
+        dst.execute("COMMIT")
+    except BaseException:
+        if dst.in_transaction:
+            dst.execute("ROLLBACK")
+        raise
+    finally:
+        if added:
+            dst.execute("DETACH DATABASE new")
+        dst.close()
+        remove_db(new_path)
+    if finalize and (added or dropped):
+        finalize_shard(dst_path, page_size, cluster)
 
+    stats["elapsed"] = time.perf_counter() - t0
+    return stats
+
+
+def report(stats: dict) -> None:
+    elapsed = max(stats["elapsed"], 1e-9)
+    urns = f"{stats['urns']} urns"
+    if "deleted" in stats:
+        # An update reads only some books of the source, so MB/s of it says nothing.
+        urns += f" added, {stats['deleted']} removed"
+        rate = f"{stats['urns'] / elapsed:,.1f} books/s, {stats['rows'] / elapsed:,.0f} tokens/s"
+    else:
+        rate = f"{stats['rows'] / elapsed:,.0f} rows/s, {stats['src_bytes'] / elapsed / 1e6:.1f} MB/s"
     print(
-        f"{os.path.basename(src_path)}: {rows_count} rows -> {postings_count} postings, "
-        f"{urns_count} urns"
+        f"{os.path.basename(stats['src'])}: {stats['rows']} rows -> "
+        f"{stats['postings']} postings, {stats['ngrams']} n-gram postings, {urns} "
+        f"in {stats['elapsed']:.1f} s ({rate})",
+        flush=True,
     )
 
 
@@ -141,6 +551,97 @@ def main() -> None:
         help="Output directory for converted DBs",
     )
     parser.add_argument("--batch", type=int, default=10000, help="Insert batch size")
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=0,
+        help="Write postings with a skip table every N positions (0 = plain blobs)",
+    )
+    parser.add_argument(
+        "--count-header",
+        action="store_true",
+        help="Prefix plain postings blobs with their length (O(1) post_count)",
+    )
+    parser.add_argument(
+        "--packed",
+        action="store_true",
+        help="Write postings longer than 128 positions bit-packed (format 2)",
+    )
+    parser.add_argument(
+        "--tokens",
+        choices=["rows", "chunks", "both"],
+        default="rows",
+        help="Store the token sequence as tokens rows, as lexicon + token_chunks, or both",
+    )
+    parser.add_argument(
+        "--max-ngram",
+        type=int,
+        default=1,
+        help="Also build ng2 .. ngN phrase postings tables (1 = unigrams only)",
+    )
+    parser.add_argument(
+        "--ngram-min-count",
+        type=int,
+        default=2,
+        help="Keep an n-gram in a book only if it occurs at least this many times there",
+    )
+    parser.add_argument(
+        "--order",
+        choices=["sorted", "stream"],
+        default="sorted",
+        help="Read ft with ORDER BY urn, word, seq, or stream it one book at a time "
+        "(needs ft rows grouped by urn; no temp sort)",
+    )
+    parser.add_argument(
+        "--finalize",
+        action="store_true",
+        help="Rewrite each shard for reading when done (see finalize_shard.py)",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help="Page size for --finalize",
+    )
+    parser.add_argument(
+        "--cluster",
+        action="store_true",
+        help="With --finalize, key postings and ngN tables by word first",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of shards to convert in parallel (worker processes)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Reconvert shards whose output DB already exists",
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="Add books missing from existing output DBs instead of skipping them "
+        "(except books removed with --delete)",
+    )
+    parser.add_argument(
+        "--delete",
+        type=int,
+        nargs="+",
+        default=[],
+        metavar="URN",
+        help="Remove these books from existing output DBs (kept out of later --append runs; "
+        "--force reconverts them)",
+    )
+    parser.add_argument(
+        "--replace",
+        type=int,
+        nargs="+",
+        default=[],
+        metavar="URN",
+        help="Reconvert these books in existing output DBs from their source",
+    )
     args = parser.parse_args()
 
     os.makedirs(args.out_dir, exist_ok=True)
@@ -148,10 +649,90 @@ def main() -> None:
     if not src_files:
         raise SystemExit("No source files matched.")
 
+    update = args.append or args.delete or args.replace
+    todo = []
     for src_path in src_files:
         base = os.path.basename(src_path)
         dst_path = os.path.join(args.out_dir, base.replace(".db", "_postings.db"))
-        convert_one(src_path, dst_path, args.batch)
+        if os.path.exists(dst_path) and not args.force:
+            if not update:
+                print(f"{base}: already converted, skipping")
+                continue
+            task = partial(
+                update_one,
+                src_path,
+                dst_path,
+                args.batch,
+                block_size=args.block_size,
+                ngram_min_count=args.ngram_min_count,
+                count_header=args.count_header,
+                delete=args.delete,
+                replace=args.replace,
+                order=args.order,
+                packed=args.packed,
+                finalize=args.finalize,
+                page_size=args.page_size,
+                cluster=args.cluster,
+                append=args.append,
+            )
+        else:
+            task = partial(
+                convert_one,
+                src_path,
+                dst_path,
+                args.batch,
+                block_size=args.block_size,
+                tokens=args.tokens,
+                max_ngram=args.max_ngram,
+                ngram_min_count=args.ngram_min_count,
+                count_header=args.count_header,
+                order=args.order,
+                packed=args.packed,
+                finalize=args.finalize,
+                page_size=args.page_size,
+                cluster=args.cluster,
+            )
+        todo.append(task)
+
+    t0 = time.perf_counter()
+    total_rows = 0
+    total_bytes = 0
+    failed = []
+
+    if args.jobs <= 1:
+        for task in todo:
+            src_path = task.args[0]
+            try:
+                stats = task()
+            except Exception as exc:
+                print(f"{os.path.basename(src_path)}: FAILED: {exc}", flush=True)
+                failed.append(src_path)
+                continue
+            report(stats)
+            total_rows += stats["rows"]
+            total_bytes += stats.get("src_bytes", 0)
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = {pool.submit(task): task.args[0] for task in todo}
+            for fut in as_completed(futures):
+                src_path = futures[fut]
+                try:
+                    stats = fut.result()
+                except Exception as exc:
+                    print(f"{os.path.basename(src_path)}: FAILED: {exc}", flush=True)
+                    failed.append(src_path)
+                    continue
+                report(stats)
+                total_rows += stats["rows"]
+                total_bytes += stats.get("src_bytes", 0)
+
+    elapsed = max(time.perf_counter() - t0, 1e-9)
+    rate = f"{total_rows / elapsed:,.0f} rows/s"
+    if total_bytes:
+        rate += f", {total_bytes / elapsed / 1e6:.1f} MB/s"
+    print(f"Converted {len(todo) - len(failed)}/{len(todo)} shards in {elapsed:.1f} s ({rate})")
+    if failed:
+        raise SystemExit(f"{len(failed)} shard(s) failed; rerun to retry them.")
 
 
 if __name__ == "__main__":
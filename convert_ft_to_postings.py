@@ -1,21 +1,39 @@
 #!/usr/bin/env python3
+"""Convert one ft source (or a filtered extract of it) to a postings DB.
+
+The output is written next to --dst and renamed over it when complete, so an
+existing --dst is replaced as a whole. Tables the converter does not write
+(e.g. `subcorpora` from subcorpus.py) would be lost; if --dst has any, the
+script stops unless --overwrite is given.
+"""
 import argparse
+import os
+import re
 import sqlite3
-
-
-def varint_encode(n: int) -> bytes:
-    if n < 0:
-        raise ValueError("varint only supports non-negative integers")
-    out = bytearray()
-    while True:
-        b = n & 0x7F
-        n >>= 7
-        if n:
-            out.append(b | 0x80)
-        else:
-            out.append(b)
-            break
-    return bytes(out)
+from urllib.request import pathname2url
+
+from convert_all_ft import convert_one
+from finalize_shard import DEFAULT_PAGE_SIZE
+
+# Tables convert_one writes; anything else in --dst is kept only by refusing to run.
+CONVERTED_TABLES = {"tokens", "token_chunks", "lexicon", "postings", "urns", "vocab"}
+
+
+def extra_tables(path: str) -> list:
+    """Tables in an existing postings DB that a reconversion would drop."""
+    uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    finally:
+        conn.close()
+    return sorted(
+        name
+        for (name,) in rows
+        if name not in CONVERTED_TABLES
+        and not name.startswith("sqlite_")
+        and not re.fullmatch(r"ng\d+", name)
+    )
 
 
 def main() -> None:
@@ -28,127 +46,106 @@ def main() -> None:
     parser.add_argument("--word", help="Filter by word")
     parser.add_argument("--limit", type=int, help="Limit number of rows")
     parser.add_argument("--batch", type=int, default=10000, help="Insert batch size")
-    args = parser.parse_args()
-
-    src = sqlite3.connect(args.src)
-    dst = sqlite3.connect(args.dst)
-
-    dst.executescript(
-        """
-        PRAGMA journal_mode = WAL;
-        PRAGMA synchronous = OFF;
-        PRAGMA temp_store = MEMORY;
-        PRAGMA cache_size = 200000;
-
-        DROP TABLE IF EXISTS tokens;
-        DROP TABLE IF EXISTS postings;
-
-        CREATE TABLE tokens (
-            bok_id INTEGER NOT NULL,
-            seq INTEGER NOT NULL,
-            word TEXT NOT NULL,
-            PRIMARY KEY (bok_id, seq)
-        ) WITHOUT ROWID;
-
-        CREATE TABLE postings (
-            bok_id INTEGER NOT NULL,
-            word TEXT NOT NULL,
-            blob BLOB NOT NULL,
-            PRIMARY KEY (bok_id, word)
-        ) WITHOUT ROWID;
-
-        CREATE INDEX postings_word_bok_id ON postings(word, bok_id);
-
-        CREATE TABLE urns (
-            bok_id INTEGER NOT NULL PRIMARY KEY
-        ) WITHOUT ROWID;
-        """
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=0,
+        help="Write postings with a skip table every N positions (0 = plain blobs)",
     )
+    parser.add_argument(
+        "--count-header",
+        action="store_true",
+        help="Prefix plain postings blobs with their length (O(1) post_count)",
+    )
+    parser.add_argument(
+        "--packed",
+        action="store_true",
+        help="Write postings longer than 128 positions bit-packed (format 2)",
+    )
+    parser.add_argument(
+        "--tokens",
+        choices=["rows", "chunks", "both"],
+        default="rows",
+        help="Store the token sequence as tokens rows, as lexicon + token_chunks, or both",
+    )
+    parser.add_argument(
+        "--max-ngram",
+        type=int,
+        default=1,
+        help="Also build ng2 .. ngN phrase postings tables (1 = unigrams only)",
+    )
+    parser.add_argument(
+        "--ngram-min-count",
+        type=int,
+        default=2,
+        help="Keep an n-gram in a book only if it occurs at least this many times there",
+    )
+    parser.add_argument(
+        "--order",
+        choices=["sorted", "stream"],
+        default="sorted",
+        help="Read ft with ORDER BY urn, word, seq, or stream it one book at a time "
+        "(needs ft rows grouped by urn; no temp sort)",
+    )
+    parser.add_argument(
+        "--finalize",
+        action="store_true",
+        help="Rewrite the output for reading when done (see finalize_shard.py)",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help="Page size for --finalize",
+    )
+    parser.add_argument(
+        "--cluster",
+        action="store_true",
+        help="With --finalize, key postings and ngN tables by word first",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Replace --dst even if it has tables the conversion does not write",
+    )
+    args = parser.parse_args()
 
-    where = []
-    params = []
-    if args.urn is not None:
-        where.append("urn = ?")
-        params.append(args.urn)
-    if args.word is not None:
-        where.append("word = ?")
-        params.append(args.word)
-
-    sql = "SELECT urn, word, seq FROM ft"
-    if where:
-        sql += " WHERE " + " AND ".join(where)
-    sql += " ORDER BY urn, word, seq"
-    if args.limit:
-        sql += " LIMIT ?"
-        params.append(args.limit)
-
-    src_cur = src.cursor()
-    dst_cur = dst.cursor()
-    src_cur.execute(sql, params)
-
-    tokens_batch = []
-    current_urn = None
-    current_word = None
-    last_pos = 0
-    blob = bytearray()
-    postings_count = 0
-    rows_count = 0
-    urns_count = 0
-
-    def flush_tokens() -> None:
-        if not tokens_batch:
-            return
-        dst_cur.executemany(
-            "INSERT INTO tokens (bok_id, seq, word) VALUES (?, ?, ?)",
-            tokens_batch,
-        )
-        tokens_batch.clear()
-
-    def flush_posting() -> None:
-        nonlocal postings_count
-        if current_urn is None:
-            return
-        dst_cur.execute(
-            "INSERT INTO postings (bok_id, word, blob) VALUES (?, ?, ?)",
-            (current_urn, current_word, bytes(blob)),
+    if os.path.exists(args.dst) and not args.overwrite:
+        try:
+            extra = extra_tables(args.dst)
+        except sqlite3.Error as exc:
+            raise SystemExit(f"{args.dst}: {exc} (use --overwrite to replace it)")
+        if extra:
+            raise SystemExit(
+                f"{args.dst} has tables the conversion would drop: {', '.join(extra)} "
+                "(use --overwrite to replace it)"
+            )
+
+    try:
+        stats = convert_one(
+            args.src,
+            args.dst,
+            args.batch,
+            block_size=args.block_size,
+            tokens=args.tokens,
+            max_ngram=args.max_ngram,
+            ngram_min_count=args.ngram_min_count,
+            count_header=args.count_header,
+            urns=None if args.urn is None else [args.urn],
+            order=args.order,
+            packed=args.packed,
+            finalize=args.finalize,
+            page_size=args.page_size,
+            cluster=args.cluster,
+            word=args.word,
+            limit=args.limit,
         )
-        postings_count += 1
-
-    def insert_urn(urn: int) -> None:
-        nonlocal urns_count
-        dst_cur.execute("INSERT OR IGNORE INTO urns (bok_id) VALUES (?)", (urn,))
-        urns_count += 1
-
-    for urn, word, seq in src_cur:
-        rows_count += 1
-        tokens_batch.append((urn, seq, word))
-        if len(tokens_batch) >= args.batch:
-            flush_tokens()
-
-        if (urn != current_urn) or (word != current_word):
-            flush_posting()
-            current_urn = urn
-            current_word = word
-            last_pos = 0
-            blob = bytearray()
-            insert_urn(urn)
-
-        delta = seq - last_pos
-        if delta < 0:
-            raise ValueError("seq must be non-decreasing within a word")
-        blob.extend(varint_encode(delta))
-        last_pos = seq
-
-    flush_tokens()
-    flush_posting()
-
-    dst.commit()
-    dst.close()
-    src.close()
+    except ValueError as exc:
+        raise SystemExit(str(exc))
 
     print(
-        f"Converted {rows_count} rows into tokens, {postings_count} postings, "
-        f"and {urns_count} urns."
+        f"Converted {stats['rows']} rows into tokens, {stats['postings']} postings, "
+        f"{stats['ngrams']} n-gram postings, and {stats['urns']} urns."
     )
 
 
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""Run one postings query across many shards and merge the results.
+
+`ShardPool` keeps a `sqlite_postings.ConnectionPool` per shard matching a
+glob (read-only, immutable, mmap, the postings extension loaded once per
+connection), so connections are reused across queries. `fan_out`
+runs a parameterised query on every shard in a thread pool; the UDFs run in C
+inside `sqlite3_step`, which releases the GIL, so shards are queried in
+parallel. Results stream back per shard as they finish, with timings and
+errors (including per-shard timeouts), and `merge_sum` / `merge_top_k` /
+`merge_rows` combine them. With a manifest (build_shard_manifest.py),
+queries given their words only go to the shards that can contain them all.
+
+    python3 federated.py --glob "/mnt/disk1/alto_postings/*_postings.db" \\
+        --word-a demokrati --word-b diktatur --mode top --k 20 \\
+        --manifest /mnt/disk1/alto_postings/manifest.db
+"""
+import argparse
+import heapq
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from glob import glob
+
+from sqlite_postings import ConnectionPool, Manifest
+
+NEAR_COUNT_SQL = """
+    SELECT a.bok_id, post_near_count(a.blob, b.blob, ?, ?) AS hits
+    FROM postings a
+    JOIN postings b USING (bok_id)
+    WHERE a.word = ? AND b.word = ?
+"""
+
+# Check the deadline every N SQLite VM instructions.
+PROGRESS_STEPS = 10000
+
+
+@dataclass
+class ShardResult:
+    path: str
+    rows: list = field(default_factory=list)
+    elapsed: float = 0.0
+    error: str | None = None
+
+
+class ShardPool:
+    """Read-only connections to a set of shards, reused across queries."""
+
+    def __init__(
+        self,
+        pattern: str,
+        ext_path: str | None = None,
+        max_workers: int | None = None,
+        timeout: float | None = None,
+        manifest: str | None = None,
+        pool_size: int = 4,
+    ) -> None:
+        self.paths = sorted(glob(pattern))
+        if not self.paths:
+            raise ValueError(f"No shards matched {pattern!r}")
+        self.ext_path = ext_path
+        self.timeout = timeout
+        self.manifest = Manifest(manifest) if manifest else None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 2))
+        self.pools = {path: ConnectionPool(path, pool_size, ext_path=ext_path) for path in self.paths}
+
+    def _query(self, conn: sqlite3.Connection, sql: str, params, timeout: float | None) -> list:
+        if timeout is None:
+            return conn.execute(sql, params).fetchall()
+        deadline = time.monotonic() + timeout
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    def _run(self, path: str, sql: str, params, timeout: float | None) -> ShardResult:
+        """One shard's query; any failure (opening it included) becomes its error."""
+        t0 = time.perf_counter()
+        try:
+            with self.pools[path].connection() as conn:
+                rows = self._query(conn, sql, params, timeout)
+            return ShardResult(path, rows, time.perf_counter() - t0)
+        except sqlite3.OperationalError as exc:
+            error = "timeout" if str(exc) == "interrupted" else str(exc)
+            return ShardResult(path, elapsed=time.perf_counter() - t0, error=error)
+        except Exception as exc:
+            return ShardResult(path, elapsed=time.perf_counter() - t0, error=f"{type(exc).__name__}: {exc}")
+
+    def route(self, words=None) -> list[str]:
+        """The shards that may contain every one of `words` (all without a manifest)."""
+        if self.manifest is None or not words:
+            return self.paths
+        keep = self.manifest.route(map(os.path.abspath, self.paths), words)
+        return [path for path in self.paths if os.path.abspath(path) in keep]
+
+    def fan_out(self, sql: str, params=(), timeout: float | None = None, words=None):
+        """Run sql on every shard; yield a ShardResult per shard as each finishes.
+
+        With `words` and a manifest, shards that lack one of the words are
+        skipped, so sql must not return rows for them.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        futures = [self.executor.submit(self._run, path, sql, params, timeout) for path in self.route(words)]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        for pool in self.pools.values():
+            pool.close()
+        if self.manifest is not None:
+            self.manifest.close()
+
+    def __enter__(self) -> "ShardPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def merge_sum(results, column: int = -1, on_result=None) -> int:
+    """Sum one column over all rows of all shards."""
+    total = 0
+    for res in results:
+        if on_result:
+            on_result(res)
+        for row in res.rows:
+            if row[column] is not None:
+                total += row[column]
+    return total
+
+
+def merge_top_k(results, k: int, column: int = -1, on_result=None) -> list:
+    """The k rows with the largest value in `column`, across shards."""
+    heap = []
+    seq = 0
+    for res in results:
+        if on_result:
+            on_result(res)
+        for row in res.rows:
+            item = (row[column], seq, row)
+            seq += 1
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    return [row for _, _, row in sorted(heap, reverse=True)]
+
+
+def merge_rows(results, on_result=None):
+    """Yield every row, as soon as its shard has finished."""
+    for res in results:
+        if on_result:
+            on_result(res)
+        yield from res.rows
+
+
+def print_timing(res: ShardResult) -> None:
+    status = res.error or f"{len(res.rows)} rows"
+    print(f"{os.path.basename(res.path)}: {res.elapsed * 1000:.1f} ms, {status}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Near-count of two words across many postings shards.")
+    parser.add_argument("--glob", default="/mnt/disk1/alto_postings/*_postings.db", help="Glob for postings DBs")
+    parser.add_argument("--ext", help="Path to the postings extension (default: build/)")
+    parser.add_argument("--word-a", required=True, help="Word A")
+    parser.add_argument("--word-b", required=True, help="Word B")
+    parser.add_argument("--off-min", type=int, default=-5, help="Min offset of B relative to A")
+    parser.add_argument("--off-max", type=int, default=5, help="Max offset of B relative to A")
+    parser.add_argument("--mode", choices=["sum", "top", "rows"], default="sum", help="How to merge shard results")
+    parser.add_argument("--k", type=int, default=20, help="Rows to keep for --mode top")
+    parser.add_argument("--jobs", type=int, help="Worker threads")
+    parser.add_argument("--timeout", type=float, help="Per-shard timeout in seconds")
+    parser.add_argument("--manifest", help="Shard manifest; only query shards that have both words")
+    args = parser.parse_args()
+
+    params = (args.off_min, args.off_max, args.word_a, args.word_b)
+    t0 = time.perf_counter()
+    words = (args.word_a, args.word_b)
+    with ShardPool(args.glob, args.ext, args.jobs, args.timeout, args.manifest) as pool:
+        n_shards = len(pool.route(words))
+        results = pool.fan_out(NEAR_COUNT_SQL, params, words=words)
+        if args.mode == "sum":
+            print(merge_sum(results, on_result=print_timing))
+        elif args.mode == "top":
+            for bok_id, hits in merge_top_k(results, args.k, on_result=print_timing):
+                print(f"{bok_id}\t{hits}")
+        else:
+            for bok_id, hits in merge_rows(results, on_result=print_timing):
+                if hits:
+                    print(f"{bok_id}\t{hits}")
+        print(
+            f"{n_shards} of {len(pool.paths)} shards in {time.perf_counter() - t0:.3f} s",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Finalize converted shards for read-only use.
+
+A fresh shard has the default page size, free pages and half-full B-tree
+pages from the inserts, and no planner statistics. Finalizing rewrites it
+with `VACUUM INTO` at `--page-size`, so every table and index is stored in
+key order with no free pages. It sets the rollback journal
+(`journal_mode = DELETE`), which `mode=ro&immutable=1` readers need, and
+runs `ANALYZE` and `PRAGMA optimize`. The new file replaces the shard only
+once it is complete.
+
+With `--cluster`, `postings` and the `ngN` tables are rebuilt word-first:
+PRIMARY KEY (word, bok_id) instead of (bok_id, word). A word lookup then
+reads its rows directly from the table instead of going through
+`postings_word_bok_id`. An index on bok_id takes that index's place, for
+per-book scans and `convert_all_ft.py --delete`. Lookups by
+(bok_id, word) remain primary-key lookups.
+
+Before and after, the script reports the file size and the cold-cache
+latency of word lookups for `--words` random words from `vocab`. The file
+is dropped from the OS page cache (posix_fadvise) before each query, and
+each query runs on a new connection.
+
+    python3 finalize_shard.py --glob "/mnt/disk1/alto_postings/*_postings.db" --cluster
+"""
+import argparse
+import glob
+import os
+import random
+import sqlite3
+import statistics
+import time
+from urllib.request import pathname2url
+
+DEFAULT_PAGE_SIZE = 16384
+
+LOOKUP_SQL = "SELECT bok_id, blob FROM postings WHERE word = ?"
+
+
+def remove_db(path: str) -> None:
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _word_tables(conn: sqlite3.Connection) -> list[tuple[str, list[str]]]:
+    """(table, word columns) of postings and the ngN tables."""
+    names = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    out = [("postings", ["word"])] if "postings" in names else []
+    for name in sorted((t for t in names if t[:2] == "ng" and t[2:].isdigit()), key=lambda t: int(t[2:])):
+        out.append((name, [f"w{i}" for i in range(1, int(name[2:]) + 1)]))
+    return out
+
+
+def _primary_key(conn: sqlite3.Connection, table: str) -> list[str]:
+    cols = [(pk, name) for _cid, name, _type, _nn, _dflt, pk in conn.execute(f"PRAGMA table_info({table})") if pk]
+    return [name for _pk, name in sorted(cols)]
+
+
+def cluster_by_word(conn: sqlite3.Connection) -> list[str]:
+    """Rebuild postings and ngN with the word columns first in the key.
+
+    Tables already keyed word-first are left alone. Returns the tables
+    that were rebuilt.
+    """
+    done = []
+    for table, words in _word_tables(conn):
+        key = words + ["bok_id"]
+        if _primary_key(conn, table) == key:
+            continue
+        info = list(conn.execute(f"PRAGMA table_info({table})"))
+        cols = ", ".join(name for _cid, name, *_ in info)
+        defs = ",\n                ".join(
+            f"{name} {type_}{' NOT NULL' if notnull else ''}" for _cid, name, type_, notnull, *_ in info
+        )
+        key_sql = ", ".join(key)
+        conn.executescript(
+            f"""
+            BEGIN;
+            CREATE TABLE {table}_clustered (
+                {defs},
+                PRIMARY KEY ({key_sql})
+            ) WITHOUT ROWID;
+            INSERT INTO {table}_clustered ({cols}) SELECT {cols} FROM {table} ORDER BY {key_sql};
+            DROP TABLE {table};
+            ALTER TABLE {table}_clustered RENAME TO {table};
+            CREATE INDEX {table}_bok_id ON {table}(bok_id);
+            COMMIT;
+            """
+        )
+        done.append(table)
+    return done
+
+
+def _evict(path: str) -> bool:
+    """Drop the file's pages from the OS cache; False where that isn't possible."""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def sample_words(path: str, n: int, seed: int = 1) -> list[str]:
+    """n random words of the shard (from vocab, else from postings)."""
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        try:
+            words = [w for (w,) in conn.execute("SELECT word FROM vocab ORDER BY word")]
+        except sqlite3.OperationalError:
+            words = [w for (w,) in conn.execute("SELECT DISTINCT word FROM postings ORDER BY word")]
+    finally:
+        conn.close()
+    return random.Random(seed).sample(words, min(n, len(words)))
+
+
+def measure(path: str, words) -> dict:
+    """Size, page layout and cold-cache word lookup times (ms) of a shard."""
+    uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    page_size, page_count, freelist = (
+        conn.execute(f"PRAGMA {name}").fetchone()[0] for name in ("page_size", "page_count", "freelist_count")
+    )
+    conn.close()
+    times = []
+    cold = True
+    for word in words:
+        cold = _evict(path) and cold
+        t0 = time.perf_counter()
+        conn = sqlite3.connect(uri, uri=True)
+        conn.execute(LOOKUP_SQL, (word,)).fetchall()
+        conn.close()
+        times.append((time.perf_counter() - t0) * 1000)
+    return {
+        "bytes": os.path.getsize(path),
+        "page_size": page_size,
+        "pages": page_count,
+        "free_pages": freelist,
+        "median_ms": statistics.median(times) if times else None,
+        "max_ms": max(times) if times else None,
+        "cold": cold,
+    }
+
+
+def finalize_shard(path: str, page_size: int = DEFAULT_PAGE_SIZE, cluster: bool = False) -> list[str]:
+    """Rewrite the shard at `path` in place for reading; returns the clustered tables."""
+    tmp_path = path + ".final"
+    remove_db(tmp_path)
+    src = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Fold any WAL into the file, so no stale -wal outlives the rename.
+        src.execute("PRAGMA journal_mode = DELETE")
+        src.execute(f"PRAGMA page_size = {int(page_size)}")
+        src.execute("VACUUM INTO ?", (tmp_path,))
+    finally:
+        src.close()
+    dst = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        clustered = cluster_by_word(dst) if cluster else []
+        if clustered:
+            # The rebuilt tables left free pages and the old order behind.
+            dst.execute("VACUUM")
+        dst.execute("ANALYZE")
+        dst.execute("PRAGMA optimize")
+    except BaseException:
+        dst.close()
+        remove_db(tmp_path)
+        raise
+    dst.close()
+    os.replace(tmp_path, path)
+    return clustered
+
+
+def _fmt(stats: dict) -> str:
+    line = (
+        f"{stats['bytes'] / 1e6:.1f} MB, {stats['page_size']} B pages, "
+        f"{stats['free_pages']} free"
+    )
+    if stats["median_ms"] is not None:
+        cache = "cold" if stats["cold"] else "warm"
+        line += f", lookup {stats['median_ms']:.2f} ms median / {stats['max_ms']:.2f} ms max ({cache})"
+    return line
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Finalize postings DBs for read-only use.")
+    parser.add_argument("--glob", required=True, help="Glob for postings DBs")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="Page size in bytes (512-65536)")
+    parser.add_argument("--cluster", action="store_true", help="Key postings and ngN tables by word first")
+    parser.add_argument("--words", type=int, default=20, help="Words to time before and after (0 = no timing)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for picking the words")
+    args = parser.parse_args()
+    if args.page_size < 512 or args.page_size > 65536 or args.page_size & (args.page_size - 1):
+        parser.error("--page-size must be a power of two from 512 to 65536")
+
+    for path in sorted(glob.glob(args.glob)):
+        words = sample_words(path, args.words, args.seed) if args.words else []
+        before = measure(path, words)
+        t0 = time.perf_counter()
+        clustered = finalize_shard(path, args.page_size, args.cluster)
+        elapsed = time.perf_counter() - t0
+        after = measure(path, words)
+        print(f"{path}: finalized in {elapsed:.1f} s" + (f", clustered {', '.join(clustered)}" if clustered else ""))
+        print(f"  before: {_fmt(before)}")
+        print(f"  after:  {_fmt(after)}")
+
+
+if __name__ == "__main__":
+    main()
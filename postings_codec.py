@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""Delta+varint encoding of postings lists, shared by the converters.
+
+The wire format is the one `src/postings.c` reads with `read_varint` /
+`next_seq`: each position is stored as the LEB128 varint of its distance to
+the previous position (the first one relative to 0).
+
+Blobs may optionally carry a versioned header (see the format comment in
+`src/postings.c`): ``0x80 0x00 <format> <varint count>`` followed by a
+format-specific payload. Format 1 adds a skip table of
+``(first_pos, byte_offset)`` pairs, one per block of `block_size` positions,
+in front of the ordinary delta+varint stream. Format 0 has no payload beyond
+the count, so `post_count` can answer without reading the list. Format 2
+("packed") replaces the varints with bit-packed blocks of `PACK_BLOCK`
+positions: a table of ``(first_pos, byte_offset)`` pairs, then per block one
+width byte and ``delta - 1`` for the remaining positions at that many bits
+each. The extension decodes a whole block at a time without per-byte
+branches, which is much faster than varints for long, dense lists.
+
+The optional compact token stream (`lexicon` + `token_chunks` tables) uses
+the same varints without the delta step: a book's word ids in seq order,
+`TOKEN_CHUNK_SIZE` tokens per chunk blob, with 0 for a missing seq.
+
+N-gram postings (`ng2`, `ng3`, ... tables) are ordinary postings blobs of the
+n-gram's start positions, keyed by `(bok_id, w1, ..., wN)`.
+
+`encode_positions` and `decode_positions` work on a whole list at a time.
+With NumPy installed, long lists are encoded/decoded with array operations;
+short lists (and environments without NumPy) use a tight pure-Python loop,
+which is faster than NumPy's per-call overhead for a handful of positions.
+
+`check_postings.py` compares the codec (and the extension built on the same
+format) against the compiled extension.
+"""
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    np = None
+
+# Below this many positions the scalar loop beats NumPy's call overhead.
+NUMPY_MIN_LEN = 64
+
+MAGIC = b"\x80\x00"
+FORMAT_COUNT = 0
+FORMAT_SKIP = 1
+FORMAT_PACKED = 2
+DEFAULT_BLOCK_SIZE = 128
+
+# Positions per packed block; must match POST_PACK_BLOCK in src/postings.c.
+PACK_BLOCK = 128
+
+# Varint bytes with the continuation bit; deleting them leaves one byte per value.
+_CONTINUATION = bytes(range(0x80, 0x100))
+
+# Tokens per token_chunks blob; must match POST_TOKEN_CHUNK in src/postings.c.
+TOKEN_CHUNK_SIZE = 256
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _read_varint(blob: bytes, i: int) -> tuple[int, int]:
+    x = 0
+    shift = 0
+    while i < len(blob):
+        b = blob[i]
+        i += 1
+        x |= (b & 0x7F) << shift
+        if not b & 0x80:
+            break
+        shift += 7
+    return x, i
+
+
+def _encode_scalar(positions) -> bytes:
+    out = bytearray()
+    append = out.append
+    last = 0
+    for pos in positions:
+        n = pos - last
+        if n < 0:
+            raise ValueError("positions must be sorted ascending")
+        last = pos
+        while n > 0x7F:
+            append((n & 0x7F) | 0x80)
+            n >>= 7
+        append(n)
+    return bytes(out)
+
+
+def _encode_values(values) -> bytes:
+    out = bytearray()
+    append = out.append
+    for n in values:
+        while n > 0x7F:
+            append((n & 0x7F) | 0x80)
+            n >>= 7
+        append(n)
+    return bytes(out)
+
+
+def _encode_numpy(positions) -> bytes:
+    pos = np.asarray(positions)
+    if pos.dtype.kind not in "iu":
+        raise TypeError("positions must be an integer array")
+    if pos.dtype.kind == "i" and pos.size and pos.min() < 0:
+        raise ValueError("varint only supports non-negative integers")
+    pos = pos.astype(np.uint64, copy=False)
+    if pos.size > 1 and bool((pos[1:] < pos[:-1]).any()):
+        raise ValueError("positions must be sorted ascending")
+
+    deltas = np.diff(pos, prepend=np.uint64(0))
+    width = max(1, (int(deltas.max()).bit_length() + 6) // 7)
+    if width == 1:
+        return deltas.astype(np.uint8).tobytes()
+    # One column per varint byte; bytes past a varint's length are dropped.
+    cols = np.empty((deltas.size, width), dtype=np.uint8)
+    used = np.empty((deltas.size, width), dtype=bool)
+    used[:, 0] = True
+    for k in range(width):
+        rest = deltas >> np.uint64(7 * k)
+        if k:
+            used[:, k] = rest != 0
+        more = np.where(rest > np.uint64(0x7F), np.uint64(0x80), np.uint64(0))
+        cols[:, k] = (rest & np.uint64(0x7F)) | more
+    return cols[used].tobytes()
+
+
+def _value_offsets(blob: bytes, step: int) -> list[int]:
+    """Byte offsets of every `step`-th varint in a plain delta+varint blob."""
+    if np is not None and len(blob) >= NUMPY_MIN_LEN:
+        raw = np.frombuffer(blob, dtype=np.uint8)
+        starts = np.flatnonzero((raw & 0x80) == 0)[:-1] + 1
+        return [0] + starts[step - 1 :: step].tolist()
+    offsets = []
+    i = 0
+    start = 0
+    for pos, b in enumerate(blob):
+        if i % step == 0 and start == pos:
+            offsets.append(pos)
+        if not b & 0x80:
+            i += 1
+            start = pos + 1
+    return offsets
+
+
+def _encode_skip(positions, plain: bytes, block_size: int) -> bytes:
+    n = len(positions)
+    firsts = [int(x) for x in positions[::block_size]]
+    if firsts[-1] > 0xFFFFFFFF or int(positions[-1]) > 0xFFFFFFFF:
+        raise ValueError("skip format only supports positions < 2**32")
+    offsets = _value_offsets(plain, block_size)
+    table = [v for pair in zip(firsts, offsets) for v in pair]
+    return b"".join(
+        [
+            MAGIC,
+            bytes([FORMAT_SKIP]),
+            _varint(n),
+            _varint(block_size),
+            _varint(len(firsts)),
+            struct.pack(f"<{len(table)}I", *table),
+            plain,
+        ]
+    )
+
+
+def _encode_packed(positions) -> bytes:
+    """Format-2 blob for positions (any length; see encode_positions)."""
+    positions = [int(x) for x in positions]
+    n = len(positions)
+    if n and positions[-1] > 0xFFFFFFFF:
+        raise ValueError("packed format only supports positions < 2**32")
+    table = []
+    blocks = []
+    offset = 0
+    for start in range(0, n, PACK_BLOCK):
+        block = positions[start : start + PACK_BLOCK]
+        deltas = [(b - a - 1) & 0xFFFFFFFF for a, b in zip(block, block[1:])]
+        if any(b < a for a, b in zip(block, block[1:])):
+            raise ValueError("positions must be sorted ascending")
+        width = max(deltas, default=0).bit_length()
+        bits = 0
+        for i, d in enumerate(deltas):
+            bits |= d << (i * width)
+        body = bytes([width]) + bits.to_bytes((len(deltas) * width + 7) // 8, "little")
+        table += [block[0], offset]
+        blocks.append(body)
+        offset += len(body)
+    return b"".join(
+        [
+            MAGIC,
+            bytes([FORMAT_PACKED]),
+            _varint(n),
+            _varint(len(blocks)),
+            struct.pack(f"<{len(table)}I", *table),
+            *blocks,
+        ]
+    )
+
+
+def _decode_packed(blob: bytes, start: int, count: int) -> array:
+    """Positions of a format-2 blob whose block table starts at `start`.
+
+    Like post_packed_load, a corrupt block (bad offset or width, or data
+    cut short) ends the list there.
+    """
+    n_blocks, i = _read_varint(blob, start)
+    table = struct.unpack_from(f"<{2 * n_blocks}I", blob, i)
+    data = i + 8 * n_blocks
+    out = array("Q")
+    for k in range(n_blocks):
+        first, offset = table[2 * k], table[2 * k + 1]
+        m = min(PACK_BLOCK, count - k * PACK_BLOCK)
+        if m <= 0 or data + offset >= len(blob) or blob[data + offset] > 32:
+            break
+        width = blob[data + offset]
+        nbytes = ((m - 1) * width + 7) // 8
+        if len(blob) - (data + offset + 1) < nbytes:
+            break
+        bits = int.from_bytes(blob[data + offset + 1 : data + offset + 1 + nbytes], "little")
+        mask = (1 << width) - 1
+        pos = first
+        out.append(pos)
+        for j in range(m - 1):
+            pos = (pos + ((bits >> (j * width)) & mask) + 1) & 0xFFFFFFFF
+            out.append(pos)
+    return out
+
+
+def _unpack_blocks(blob: bytes, start: int, count: int, want=None):
+    """Decode packed blocks with array operations: `(ids, rows, lengths)`.
+
+    `want` (ascending block numbers, default all) selects blocks; blocks at
+    or after a corrupt one are left out, as in `_decode_packed`. Row r holds
+    block ids[r], of which the first lengths[r] entries are positions.
+    Blocks of the same width have their values at the same bit offsets, so
+    each width is one gather over a (blocks x bytes) matrix, read as
+    unaligned little-endian uint64 words.
+    """
+    n_blocks, i = _read_varint(blob, start)
+    table = np.frombuffer(blob, dtype="<u4", count=2 * n_blocks, offset=i).reshape(-1, 2)
+    raw = np.frombuffer(blob, dtype=np.uint8, offset=i + 8 * n_blocks)
+    offsets = table[:, 1].astype(np.int64)
+    m = np.minimum(PACK_BLOCK, count - np.arange(n_blocks, dtype=np.int64) * PACK_BLOCK)
+    ok = (m > 0) & (offsets < raw.size)
+    width = np.zeros(n_blocks, dtype=np.int64)
+    width[ok] = raw[offsets[ok]]
+    ok &= (width <= 32) & (raw.size - offsets - 1 >= ((m - 1) * width + 7) // 8)
+    good = int(np.argmin(ok)) if not ok.all() else n_blocks
+    ids = np.arange(good) if want is None else np.asarray(want, dtype=np.int64)
+    ids = ids[ids < good]
+    m, offsets, width = m[ids], offsets[ids], width[ids]
+
+    out = np.zeros((ids.size, PACK_BLOCK), dtype=np.uint64)
+    out[:, 0] = table[ids, 0]
+    # Room for a full block (plus the 8-byte word) after the last one.
+    padded = np.concatenate([raw, np.zeros(4 * PACK_BLOCK + 8, dtype=np.uint8)])
+    bit = np.arange(PACK_BLOCK - 1)
+    for w in np.unique(width).tolist():
+        rows = np.flatnonzero(width == w)
+        if w == 0:
+            out[rows, 1:] = 1
+            continue
+        span = ((PACK_BLOCK - 1) * w + 7) // 8 + 8
+        mat = padded[(offsets[rows] + 1)[:, None] + np.arange(span)]
+        words = np.ndarray((rows.size, span - 7), dtype="<u8", buffer=mat, strides=(span, 1))
+        vals = words[:, (bit * w) >> 3] >> ((bit * w) & 7).astype(np.uint64)
+        vals &= np.uint64((1 << w) - 1)
+        vals += np.uint64(1)
+        out[rows, 1:] = vals
+    np.cumsum(out, axis=1, out=out)
+    out &= np.uint64(0xFFFFFFFF)
+    return ids, out, m
+
+
+def _decode_packed_numpy(blob: bytes, start: int, count: int):
+    """`_decode_packed` with array operations (see `_unpack_blocks`)."""
+    _ids, rows, m = _unpack_blocks(blob, start, count)
+    return rows.reshape(-1)[: int(m.sum())]
+
+
+def encode_positions(
+    positions, block_size: int = 0, count_header: bool = False, packed: bool = False
+) -> bytes:
+    """Encode a sorted sequence of positions as one delta+varint blob.
+
+    Accepts a NumPy integer array, an `array('Q')`, or any sequence of ints.
+    Raises ValueError if the positions are not sorted ascending.
+
+    With `block_size` > 0, lists longer than one block are written in the
+    skip-table format so the extension can jump over whole blocks; shorter
+    lists stay plain since a table would only add bytes. With `count_header`,
+    lists that would otherwise be plain get a format-0 header holding their
+    length (skip-table blobs always carry it). With `packed`, lists longer
+    than `PACK_BLOCK` are written bit-packed (format 2) instead; that takes
+    precedence over `block_size`.
+    """
+    if packed and len(positions) > PACK_BLOCK:
+        return _encode_packed(positions)
+    if np is not None and len(positions) >= NUMPY_MIN_LEN:
+        plain = _encode_numpy(positions)
+    else:
+        plain = _encode_scalar(positions)
+    if block_size > 0 and len(positions) > block_size:
+        return _encode_skip(positions, plain, block_size)
+    if count_header:
+        return MAGIC + bytes([FORMAT_COUNT]) + _varint(len(positions)) + plain
+    return plain
+
+
+def parse_header(blob: bytes) -> tuple[int | None, int | None, int]:
+    """Return `(format, count, data_offset)` for a postings blob.
+
+    Plain blobs have no header and give `(None, None, 0)`. `data_offset` is
+    where the delta+varint stream starts; for packed blobs it is where the
+    block table starts (see `_decode_packed`).
+    """
+    if len(blob) < 3 or blob[:2] != MAGIC:
+        return None, None, 0
+    fmt = blob[2]
+    count, i = _read_varint(blob, 3)
+    if fmt == FORMAT_COUNT:
+        return fmt, count, i
+    if fmt == FORMAT_SKIP:
+        _block_size, i = _read_varint(blob, i)
+        n_blocks, i = _read_varint(blob, i)
+        return fmt, count, i + 8 * n_blocks
+    if fmt == FORMAT_PACKED:
+        return fmt, count, i
+    raise ValueError(f"unsupported postings format {fmt}")
+
+
+def count_positions(blob: bytes) -> int:
+    """Number of positions in a blob, like `post_count` in the extension.
+
+    Uses the header count when there is one; otherwise counts varint
+    terminators without decoding.
+    """
+    if not blob:
+        return 0
+    _fmt, count, start = parse_header(blob)
+    if count is not None:
+        return count
+    n = len(blob.translate(None, _CONTINUATION))
+    return n + (blob[-1] >= 0x80)
+
+
+def _decode_scalar(blob: bytes) -> array:
+    out = array("Q")
+    append = out.append
+    acc = 0
+    x = 0
+    shift = 0
+    for b in blob:
+        x |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        acc = (acc + x) & 0xFFFFFFFFFFFFFFFF
+        append(acc)
+        x = 0
+        shift = 0
+    if shift:
+        # Truncated final varint: read_varint stops at the end of the blob
+        # and still yields what it has read.
+        append((acc + x) & 0xFFFFFFFFFFFFFFFF)
+    return out
+
+
+def _decode_numpy(blob: bytes):
+    raw = np.frombuffer(blob, dtype=np.uint8)
+    last = raw < 0x80
+    if last.all():
+        # Every delta fits in one byte: the positions are a plain cumsum.
+        return np.cumsum(raw, dtype=np.uint64)
+    last[-1] = True  # see _decode_scalar: a truncated varint still counts
+    # One value per varint, built from its last byte backwards: a pass per
+    # byte of the longest varint, each over all the varints at once.
+    ends = np.flatnonzero(last)
+    length = np.diff(ends, prepend=-1)
+    deltas = (raw[ends] & 0x7F).astype(np.uint64)
+    for k in range(1, int(length.max())):
+        more = (raw[ends - k] & 0x7F).astype(np.uint64)
+        deltas = np.where(length > k, (deltas << np.uint64(7)) | more, deltas)
+    return np.cumsum(deltas, out=deltas)
+
+
+def decode_positions(blob: bytes):
+    """Decode a delta+varint blob into absolute positions.
+
+    Returns a `numpy.ndarray` of uint64 when NumPy is available and the blob
+    is long enough to benefit, otherwise an `array('Q')`. Both plain and
+    versioned blobs are accepted.
+    """
+    fmt, count, start = parse_header(blob)
+    if fmt == FORMAT_PACKED:
+        if np is not None and count >= NUMPY_MIN_LEN:
+            return _decode_packed_numpy(blob, start, count)
+        return _decode_packed(blob, start, count)
+    if start:
+        blob = blob[start:]
+    if not blob:
+        return np.empty(0, dtype=np.uint64) if np is not None else array("Q")
+    if np is not None and len(blob) >= NUMPY_MIN_LEN:
+        return _decode_numpy(blob)
+    return _decode_scalar(blob)
+
+
+def encode_token_chunks(seq_ids: dict[int, int]) -> list[tuple[int, bytes]]:
+    """Encode one book's `{seq: word_id}` as `(chunk, blob)` rows for token_chunks.
+
+    Word ids must be >= 1. Chunks without any token are left out, and
+    trailing gaps inside a chunk are not stored.
+    """
+    chunks = {}
+    for seq, word_id in seq_ids.items():
+        chunks.setdefault(seq // TOKEN_CHUNK_SIZE, {})[seq % TOKEN_CHUNK_SIZE] = word_id
+    out = []
+    for chunk in sorted(chunks):
+        slots = chunks[chunk]
+        ids = [0] * (max(slots) + 1)
+        for i, word_id in slots.items():
+            ids[i] = word_id
+        out.append((chunk, _encode_values(ids)))
+    return out
+
+
+def decode_token_chunk(blob: bytes) -> list[int]:
+    """Word ids of one token_chunks blob (0 = no token at that seq)."""
+    ids = []
+    i = 0
+    while i < len(blob):
+        x, i = _read_varint(blob, i)
+        ids.append(x)
+    return ids
+
+
+def ngram_schema(n: int) -> str:
+    """DDL for the `ng<n>` postings table, laid out like `postings`."""
+    cols = [f"w{i}" for i in range(1, n + 1)]
+    words = ",\n            ".join(f"{c} TEXT NOT NULL" for c in cols)
+    return f"""
+        DROP TABLE IF EXISTS ng{n};
+
+        CREATE TABLE ng{n} (
+            bok_id INTEGER NOT NULL,
+            {words},
+            blob BLOB NOT NULL,
+            PRIMARY KEY (bok_id, {", ".join(cols)})
+        ) WITHOUT ROWID;
+
+        CREATE INDEX ng{n}_words_bok_id ON ng{n}({", ".join(cols)}, bok_id);
+    """
+
+
+def ngram_postings(seq_words: dict[int, str], n: int, min_count: int = 1) -> list:
+    """Start positions of every n-gram in one book's `{seq: word}`.
+
+    An n-gram needs all of seq .. seq+n-1 present. Returns
+    `[(words, positions), ...]` sorted by words, keeping only n-grams that
+    occur at least `min_count` times in the book.
+    """
+    grams = {}
+    get = seq_words.get
+    for seq in sorted(seq_words):
+        words = [seq_words[seq]]
+        for k in range(1, n):
+            w = get(seq + k)
+            if w is None:
+                break
+            words.append(w)
+        else:
+            grams.setdefault(tuple(words), []).append(seq)
+    return [(g, grams[g]) for g in sorted(grams) if len(grams[g]) >= min_count]
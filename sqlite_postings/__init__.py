@@ -0,0 +1,36 @@
+"""Python client for postings shards.
+
+    from sqlite_postings import Corpus
+
+    with Corpus("/mnt/disk1/alto_postings/*_postings.db") as corpus:
+        top = corpus.near_count("demokrati", "folk", -5, 5)[:20]
+        lines = corpus.concordance(top[0][0], "demokrati", 5, 5, limit=10)
+
+Shards are opened read-only (`mode=ro&immutable=1`) with `mmap_size` and
+`cache_size` set and the postings extension loaded once per connection;
+connections are pooled per shard and keep their prepared statements.
+"""
+from .connection import (
+    DEFAULT_CACHE_KIB,
+    DEFAULT_MMAP_SIZE,
+    EXT_ENV,
+    ConnectionPool,
+    connect,
+    find_extension,
+)
+from .corpus import Corpus
+from .manifest import Manifest
+from .shard import KwicRow, Shard
+
+__all__ = [
+    "DEFAULT_CACHE_KIB",
+    "DEFAULT_MMAP_SIZE",
+    "EXT_ENV",
+    "ConnectionPool",
+    "Corpus",
+    "KwicRow",
+    "Manifest",
+    "Shard",
+    "connect",
+    "find_extension",
+]
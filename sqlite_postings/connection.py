@@ -0,0 +1,140 @@
+"""Read-only shard connections with the postings extension loaded."""
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+# Environment variable that overrides where the extension is looked for.
+EXT_ENV = "SQLITE_POSTINGS_EXT"
+
+# Read-side defaults: map up to 1 GiB of the shard and keep 64 MiB of pages.
+DEFAULT_MMAP_SIZE = 1 << 30
+DEFAULT_CACHE_KIB = 64 * 1024
+
+# Prepared statements kept per connection (sqlite3's own statement cache).
+STATEMENT_CACHE = 256
+
+
+def find_extension(ext_path: str | None = None) -> str:
+    """Path of the compiled postings extension.
+
+    Uses `ext_path` if given, then $SQLITE_POSTINGS_EXT, then
+    build/<linux|macos>/postings.<so|dylib> under the working directory or
+    the source checkout this package was imported from.
+    """
+    if ext_path:
+        return ext_path
+    if os.environ.get(EXT_ENV):
+        return os.environ[EXT_ENV]
+    if sys.platform == "darwin":
+        rel = os.path.join("build", "macos", "postings.dylib")
+    else:
+        rel = os.path.join("build", "linux", "postings.so")
+    checkout = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for root in (os.getcwd(), checkout):
+        path = os.path.join(root, rel)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"postings extension not found (run make, or set ${EXT_ENV})")
+
+
+def connect(
+    path: str,
+    ext_path: str | None = None,
+    readonly: bool = True,
+    immutable: bool = True,
+    mmap_size: int = DEFAULT_MMAP_SIZE,
+    cache_kib: int = DEFAULT_CACHE_KIB,
+    fallback: bool = False,
+) -> sqlite3.Connection:
+    """Open a shard with the extension loaded and read-side pragmas set.
+
+    Read-only connections use `mode=ro`, plus `immutable=1` unless
+    `immutable` is False. An immutable shard is read without locks or change
+    checks, so it must not be written while it is open (use
+    `immutable=False` for shards that `convert_all_ft.py --append` may
+    update in place). The connection may be used from any thread, one thread
+    at a time.
+
+    With `fallback`, a connection that cannot load the extension (no build,
+    or a Python without `enable_load_extension`) gets the NumPy versions of
+    the scalar functions from `engine` instead; the table-valued functions
+    are then missing.
+    """
+    if readonly:
+        query = "mode=ro&immutable=1" if immutable else "mode=ro"
+        uri = f"file:{pathname2url(os.path.abspath(path))}?{query}"
+        conn = sqlite3.connect(
+            uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE
+        )
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE)
+    try:
+        try:
+            conn.enable_load_extension(True)
+            conn.load_extension(find_extension(ext_path))
+            conn.enable_load_extension(False)
+        except (AttributeError, FileNotFoundError, sqlite3.OperationalError):
+            if not fallback:
+                raise
+            from . import engine
+
+            engine.register(conn)
+        conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {-int(cache_kib)}")
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+class ConnectionPool:
+    """Thread-safe pool of connections to one shard, opened on demand.
+
+    At most `max_size` connections are open; `connection()` blocks while
+    all of them are in use. Each connection keeps its prepared statements,
+    so a query run again skips parsing and planning.
+    """
+
+    def __init__(self, path: str, max_size: int = 4, **connect_args) -> None:
+        self.path = path
+        self.connect_args = connect_args
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = queue.SimpleQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        conn = connect(self.path, **self.connect_args)
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block."""
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"{self.path}: pool is closed")
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
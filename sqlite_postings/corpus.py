@@ -0,0 +1,117 @@
+"""Queries across every shard of a corpus."""
+import os
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+from .manifest import Manifest
+from .shard import KwicRow, Shard
+
+
+class Corpus:
+    """A set of shards queried together.
+
+    Per-book queries (positions, concordance, sample, ...) go to the shard
+    that holds the book, found through each shard's `urns` table and
+    remembered. Corpus-wide queries (near_count, phrase) run on every shard
+    in a thread pool; the UDFs run inside `sqlite3_step`, which releases
+    the GIL, so shards are searched in parallel. Keyword arguments go to
+    each Shard (pool_size, ext_path, immutable, mmap_size, cache_kib).
+
+    With a `manifest` (build_shard_manifest.py), word queries skip the
+    shards whose Bloom filter rules a word out, unless the shard changed
+    after the manifest was built, and books are looked up in the manifest
+    before asking every shard.
+    """
+
+    def __init__(
+        self, shards, max_workers: int | None = None, manifest: str | None = None, **shard_args
+    ) -> None:
+        paths = sorted(glob(shards)) if isinstance(shards, str) else list(shards)
+        if not paths:
+            raise ValueError(f"No shards matched {shards!r}")
+        self.shards = [Shard(path, **shard_args) for path in paths]
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or min(32, (os.cpu_count() or 1) * 2)
+        )
+        self.manifest = Manifest(manifest) if manifest else None
+        self._by_path = {os.path.abspath(s.path): s for s in self.shards}
+        self._home = {}
+        self._lock = threading.Lock()
+
+    def _map(self, fn, shards=None) -> list:
+        return list(self.executor.map(fn, self.shards if shards is None else shards))
+
+    def _route(self, words) -> list[Shard]:
+        """The shards that may contain every one of `words` (or that the manifest does not cover)."""
+        if self.manifest is None:
+            return self.shards
+        keep = self.manifest.route(self._by_path, words)
+        return [s for path, s in self._by_path.items() if path in keep]
+
+    def shard_for(self, bok_id: int) -> Shard:
+        """The shard holding `bok_id`; raises KeyError if none does."""
+        with self._lock:
+            shard = self._home.get(bok_id)
+        if shard is None and self.manifest is not None:
+            shard = self._by_path.get(self.manifest.shard_for_book(bok_id))
+        if shard is None:
+            found = [s for s, ok in zip(self.shards, self._map(lambda s: s.has_book(bok_id))) if ok]
+            if not found:
+                raise KeyError(bok_id)
+            shard = found[0]
+            with self._lock:
+                self._home[bok_id] = shard
+        return shard
+
+    def near_count(
+        self,
+        word_a: str,
+        word_b: str,
+        off_min: int = -5,
+        off_max: int = 5,
+        subcorpus: str | None = None,
+    ) -> list[tuple[int, int]]:
+        """(bok_id, hits) over all shards, most hits first."""
+        parts = self._map(
+            lambda s: s.near_count(word_a, word_b, off_min, off_max, subcorpus), self._route([word_a, word_b])
+        )
+        return sorted((row for part in parts for row in part), key=lambda row: -row[1])
+
+    def phrase(self, words, subcorpus: str | None = None) -> list[tuple[int, int]]:
+        """(bok_id, matches) over all shards, most matches first."""
+        words = list(words)
+        parts = self._map(lambda s: s.phrase(words, subcorpus), self._route(words))
+        return sorted((row for part in parts for row in part), key=lambda row: -row[1])
+
+    def positions(self, bok_id: int, word: str) -> array:
+        return self.shard_for(bok_id).positions(bok_id, word)
+
+    def near_positions(self, bok_id: int, word_a: str, word_b: str, off_min: int = -5, off_max: int = 5) -> array:
+        return self.shard_for(bok_id).near_positions(bok_id, word_a, word_b, off_min, off_max)
+
+    def phrase_positions(self, bok_id: int, words) -> array:
+        return self.shard_for(bok_id).phrase_positions(bok_id, words)
+
+    def sample(self, bok_id: int, word: str, k: int, seed: int | None = None) -> array:
+        return self.shard_for(bok_id).sample(bok_id, word, k, seed)
+
+    def concordance(self, bok_id: int, word: str, *args, **kwargs) -> list[KwicRow]:
+        return self.shard_for(bok_id).concordance(bok_id, word, *args, **kwargs)
+
+    def near_concordance(self, bok_id: int, word_a: str, word_b: str, *args, **kwargs) -> list[KwicRow]:
+        return self.shard_for(bok_id).near_concordance(bok_id, word_a, word_b, *args, **kwargs)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+        if self.manifest is not None:
+            self.manifest.close()
+
+    def __enter__(self) -> "Corpus":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
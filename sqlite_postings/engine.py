@@ -0,0 +1,664 @@
+"""NumPy implementation of the postings functions, for when the extension can't load.
+
+Hosted notebooks and locked-down Python builds often can't call
+`enable_load_extension`. This module gives the same scalar and aggregate
+functions as `src/postings.c`, with the same names and results:
+
+    from sqlite_postings import engine
+
+    engine.register(conn)           # post_near_count(...) etc. now work in SQL
+    engine.post_near_count(blob_a, blob_b, -5, 5)   # or call it on fetched blobs
+
+`connect(path, fallback=True)` does the registration when loading the
+extension fails. Lists are decoded whole with array operations (see
+`postings_codec`), and the merges become `searchsorted` over the decoded
+arrays, with np.isin when neither list repeats a position. post_sample
+and post_sample_many decode only up to the largest index. Results are the extension's, also
+for duplicate positions and empty or NULL operands; post_sample_k with a
+seed draws the same sample.
+
+Not covered: the table-valued functions (post_each, post_near_each,
+subcorpus_each, post_kwic, post_window, post_stats), which need the
+virtual table API, and the tuning functions (post_cache_*, post_stats_*,
+post_gallop_ratio). `kwic(conn, ...)` gives post_kwic's rows as a plain
+function; post_each and post_near_each are `decode` and post_near_positions. A function that fails raises ValueError when called
+directly; in SQL that is sqlite3's "user-defined function raised
+exception".
+"""
+import json
+import os
+import sqlite3
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+import numpy as np
+
+from postings_codec import (
+    FORMAT_COUNT,
+    FORMAT_PACKED,
+    FORMAT_SKIP,
+    MAGIC,
+    NUMPY_MIN_LEN,
+    PACK_BLOCK,
+    TOKEN_CHUNK_SIZE,
+    _decode_numpy,
+    _encode_packed,
+    _encode_skip,
+    _read_varint,
+    _unpack_blocks,
+    _varint,
+    count_positions,
+    decode_positions,
+    decode_token_chunk,
+    encode_positions,
+    parse_header,
+)
+
+# Splitmix64 constants of post_rng_next.
+_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+_U64 = (1 << 64) - 1
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _check(blob: bytes, name: str) -> None:
+    """Reject what post_cursor_open rejects: unknown formats and bad headers."""
+    if len(blob) < 3 or blob[:2] != MAGIC:
+        return
+    fmt = blob[2]
+    count, i = _read_varint(blob, 3)
+    if fmt == FORMAT_COUNT:
+        return
+    if fmt == FORMAT_SKIP:
+        block_size, i = _read_varint(blob, i)
+        n_blocks, i = _read_varint(blob, i)
+        if 0 < block_size <= 0x7FFFFFFF and n_blocks <= 0x7FFFFFFF and len(blob) - i >= 8 * n_blocks:
+            return
+    elif fmt == FORMAT_PACKED:
+        n_blocks, i = _read_varint(blob, i)
+        if n_blocks == (count + PACK_BLOCK - 1) // PACK_BLOCK and len(blob) - i >= 8 * n_blocks:
+            return
+    raise ValueError(f"{name}: unsupported postings format")
+
+
+def _blob(value) -> bytes:
+    """A function argument as sqlite3_value_blob sees it."""
+    if value is None:
+        return b""
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, (int, float)):
+        return str(value).encode()
+    return bytes(value)
+
+
+def _int64(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, str)):
+        try:
+            return int(float(value))
+        except ValueError:
+            return 0
+    return int(value)
+
+
+def _int(value) -> int:
+    """sqlite3_value_int: the low 32 bits of the int64 value, signed."""
+    return (_int64(value) + (1 << 31)) % (1 << 32) - (1 << 31)
+
+
+def decode(blob, name: str = "decode") -> np.ndarray:
+    """Positions of a postings blob (any format) as an int64 array."""
+    blob = _blob(blob)
+    _check(blob, name)
+    if not blob:
+        return _EMPTY
+    out = decode_positions(blob)
+    if isinstance(out, np.ndarray):
+        return out.view(np.int64)
+    return np.frombuffer(out, dtype=np.int64) if len(out) else _EMPTY
+
+
+def _take(blob: bytes, idx: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Positions at indices idx of a checked blob, and which idx are in the list.
+
+    Only what the indices need is decoded: the varint data up to the largest
+    one, or the packed blocks they fall in.
+    """
+    fmt, count, start = parse_header(blob)
+    ok = idx >= 0
+    if fmt == FORMAT_PACKED:
+        block, col = np.divmod(np.where(ok, idx, 0), PACK_BLOCK)
+        ok &= block < (count + PACK_BLOCK - 1) // PACK_BLOCK
+        ids, rows, m = _unpack_blocks(blob, start, count, np.unique(block[ok]))
+        if not len(ids):
+            return np.zeros(len(idx), dtype=np.int64), ok & False
+        r = np.minimum(np.searchsorted(ids, block), len(ids) - 1)
+        ok &= (ids[r] == block) & (col < m[r])
+        return rows[r, col].view(np.int64), ok
+    raw = np.frombuffer(blob, dtype=np.uint8, offset=start)
+    ends = np.flatnonzero(raw < 0x80)
+    n = min(int(idx.max(initial=-1)) + 1, len(ends))
+    ok &= idx < n
+    if not n:
+        return np.zeros(len(idx), dtype=np.int64), ok
+    v = _decode_numpy(raw[: ends[n - 1] + 1].tobytes()).view(np.int64)
+    return v[np.where(ok, idx, 0)], ok
+
+
+@lru_cache(maxsize=64)
+def _decode_cached(blob: bytes, name: str) -> np.ndarray:
+    """decode() for operands that repeat across calls (post_contains, subcorpus_has)."""
+    return decode(blob, name)
+
+
+def _pair(a, b, name: str) -> tuple[np.ndarray, np.ndarray] | None:
+    """Both operands decoded, or None if one is NULL or has no positions."""
+    a, b = _blob(a), _blob(b)
+    if not a or not b:
+        return None
+    a, b = decode(a, name), decode(b, name)
+    return (a, b) if len(a) and len(b) else None
+
+
+def _blob_result(v: np.ndarray) -> bytes:
+    """A legacy delta+varint blob, as post_writer_result writes it."""
+    if len(v) < NUMPY_MIN_LEN:
+        return encode_positions(v.tolist())
+    return encode_positions(v.view(np.uint64))
+
+
+def _json(v) -> str:
+    return "[" + ",".join(map(str, v.tolist() if isinstance(v, np.ndarray) else v)) + "]"
+
+
+def _near_mask(a: np.ndarray, b: np.ndarray, off_min: int, off_max: int) -> np.ndarray:
+    """For each position in A: is there a B within [off_min, off_max] of it?"""
+    if not len(b):
+        return np.zeros(len(a), dtype=bool)
+    j = np.searchsorted(b, a + off_min)
+    hit = j < len(b)
+    return hit & (b[np.minimum(j, len(b) - 1)] - a <= off_max)
+
+
+def _rank(v: np.ndarray) -> np.ndarray:
+    """How many equal values come before each one (0 unless duplicates)."""
+    return np.arange(len(v)) - np.searchsorted(v, v)
+
+
+def _strict(v: np.ndarray) -> bool:
+    """No duplicate positions, so set operations can skip the multiset pairing."""
+    return bool((v[1:] > v[:-1]).all())
+
+
+def _distinct(v: np.ndarray) -> np.ndarray:
+    """A sorted array without repeats."""
+    keep = np.ones(len(v), dtype=bool)
+    keep[1:] = v[1:] != v[:-1]
+    return v[keep]
+
+
+def _in_multiset(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """A's elements matched one-to-one against equal elements of B."""
+    if _strict(a) and _strict(b):
+        return np.isin(a, b, assume_unique=True)
+    count = np.searchsorted(b, a, side="right") - np.searchsorted(b, a)
+    return count > _rank(a)
+
+
+def post_intersect(a, b) -> int:
+    """Positions found in both lists (equal positions paired off one to one)."""
+    pair = _pair(a, b, "post_intersect")
+    if pair is None:
+        return 0
+    return int(np.count_nonzero(_in_multiset(*pair)))
+
+
+def post_intersect_offset(a, b, off_min, off_max) -> int:
+    """Positions in B with an A such that B - A is in [off_min, off_max]."""
+    pair = _pair(a, b, "post_intersect_offset")
+    if pair is None:
+        return 0
+    a, b = pair
+    off_min, off_max = _int(off_min), _int(off_max)
+    i = np.searchsorted(a, b - off_max)
+    hit = i < len(a)
+    hit &= b - a[np.minimum(i, len(a) - 1)] >= off_min
+    return int(np.count_nonzero(hit))
+
+
+def post_intersect_offset_sym(a, b, off_min, off_max) -> int:
+    """Pairs (A, B) within [off_min, off_max], each position used at most once.
+
+    The extension pairs greedily: each A in turn takes the first unused B in
+    its window. With the window's B indices [lo, hi) per A, that is
+    p = max(lo, p) + (max(lo, p) < hi) over the As. As without any B in reach
+    are left out, and the recurrence restarts wherever one window ends before
+    the next begins, so only runs of overlapping windows are walked one by one.
+    """
+    pair = _pair(a, b, "post_intersect_offset_sym")
+    if pair is None:
+        return 0
+    a, b = pair
+    off_min, off_max = _int(off_min), _int(off_max)
+    lo = np.searchsorted(b, a + off_min)
+    hi = np.searchsorted(b, a + off_max, side="right")
+    some = lo < hi
+    lo, hi = lo[some], hi[some]
+    if not len(lo):
+        return 0
+    alone = np.ones(len(lo), dtype=bool)
+    alone[1:] = hi[:-1] <= lo[1:]
+    alone[:-1] &= alone[1:]
+    count = int(np.count_nonzero(alone))
+    p = 0
+    rest = ~alone
+    for lo_k, hi_k in zip(lo[rest].tolist(), hi[rest].tolist()):
+        q = max(lo_k, p)
+        if q < hi_k:
+            count += 1
+            q += 1
+        p = q
+    return count
+
+
+def post_near_count(a, b, off_min, off_max) -> int:
+    """Positions in A with a B within [off_min, off_max]."""
+    pair = _pair(a, b, "post_near_count")
+    if pair is None:
+        return 0
+    return int(np.count_nonzero(_near_mask(*pair, _int(off_min), _int(off_max))))
+
+
+def post_near_positions(a, b, off_min, off_max) -> str:
+    """post_near_count's positions as a JSON array."""
+    pair = _pair(a, b, "post_near_positions")
+    if pair is None:
+        return "[]"
+    a, b = pair
+    return _json(a[_near_mask(a, b, _int(off_min), _int(off_max))])
+
+
+def post_sample(blob, idx) -> int | None:
+    """Position number idx (0-based), or None."""
+    blob = _blob(blob)
+    idx = _int(idx)
+    if not blob or idx < 0:
+        return None
+    _check(blob, "post_sample")
+    v, ok = _take(blob, np.array([idx]))
+    return int(v[0]) if ok[0] else None
+
+
+def post_count(blob) -> int:
+    """Number of positions (from the header when there is one)."""
+    blob = _blob(blob)
+    _check(blob, "post_count")
+    return count_positions(blob)
+
+
+def post_positions(blob) -> str:
+    """All positions as a JSON array."""
+    blob = _blob(blob)
+    if not blob:
+        return "[]"
+    return _json(decode(blob, "post_positions"))
+
+
+def _splitmix(state: int, n: int) -> np.ndarray:
+    """The next n outputs of post_rng_next from `state`."""
+    z = np.arange(1, n + 1, dtype=np.uint64)
+    z *= _GAMMA
+    z += np.uint64(state)
+    z ^= z >> np.uint64(30)
+    z *= _MIX1
+    z ^= z >> np.uint64(27)
+    z *= _MIX2
+    z ^= z >> np.uint64(31)
+    return z
+
+
+def post_sample_k(blob, k, seed=None, *extra) -> str:
+    """k positions drawn without replacement, ascending, as JSON.
+
+    The same reservoir pass as the extension, with the splitmix64 draws
+    computed up front: a seed gives the extension's sample.
+    """
+    if extra:
+        raise ValueError("post_sample_k(blob, k [, seed]) expects 2-3 args")
+    blob = _blob(blob)
+    _check(blob, "post_sample_k")
+    k = min(max(_int64(k), 0), count_positions(blob))
+    v = decode(blob, "post_sample_k") if k else _EMPTY
+    k = min(k, len(v))
+    res = v[:k].copy()
+    rest = len(v) - k
+    if k and rest:
+        state = _int64(seed) & _U64 if seed is not None else int.from_bytes(os.urandom(8), "little")
+        seen = np.arange(k + 1, len(v) + 1, dtype=np.uint64)
+        j = (_splitmix(state, rest) % seen).astype(np.int64)
+        take = np.flatnonzero(j < k)
+        # The last draw into a slot is the one that stays.
+        slot, first = np.unique(j[take[::-1]], return_index=True)
+        res[slot] = v[k + take[::-1][first]]
+    res.sort()
+    return _json(res)
+
+
+def _parse_idx_json(text: str) -> list[int] | None:
+    """post_parse_idx_json: the integers in text, or None on other characters."""
+    out = []
+    x = 0
+    in_num = neg = False
+    for ch in text + "\0":
+        if "0" <= ch <= "9":
+            x = x * 10 + ord(ch) - 48
+            in_num = True
+            continue
+        if in_num:
+            out.append(-x if neg else x)
+            in_num = neg = False
+            x = 0
+        if ch == "\0":
+            return out
+        if ch == "-":
+            neg = True
+        elif ch not in "[], \t\n\r":
+            return None
+
+
+def post_sample_many(blob, idxs) -> str:
+    """The positions at indices idxs (JSON array, index blob or integer), as JSON.
+
+    In idxs order, with null for indices outside the list.
+    """
+    blob = _blob(blob)
+    _check(blob, "post_sample_many")
+    if isinstance(idxs, bytes):
+        want = decode(idxs, "post_sample_many").tolist()
+    elif isinstance(idxs, int):
+        want = [idxs]
+    elif idxs is None:
+        want = []
+    else:
+        want = _parse_idx_json(str(idxs))
+        if want is None:
+            raise ValueError("post_sample_many: idxs must be a JSON array of integers or an index blob")
+    if not blob or not want:
+        return "[" + ",".join("null" for _ in want) + "]"
+    idx = np.array([min(max(i, -1), 1 << 62) for i in want], dtype=np.int64)
+    v, ok = _take(blob, idx)
+    return "[" + ",".join(str(x) if k else "null" for x, k in zip(v.tolist(), ok.tolist())) + "]"
+
+
+def _phrase(blobs, name: str) -> np.ndarray:
+    """Start positions s with s + i in list i for every i (post_phrase_next)."""
+    if not blobs:
+        raise ValueError(f"{name}(blob, ...) expects at least 1 arg")
+    blobs = [_blob(b) for b in blobs]
+    for b in blobs:
+        _check(b, name)
+    if not all(blobs):
+        return _EMPTY
+    # The driver is the list with the fewest data bytes, as in post_phrase_open;
+    # its duplicates (if any) each count.
+    d = min(range(len(blobs)), key=lambda i: _data_len(blobs[i]))
+    s = decode(blobs[d], name)
+    s = s[s >= d] - d
+    for i, b in enumerate(blobs):
+        if i == d or not len(s):
+            continue
+        v = decode(b, name)
+        j = np.searchsorted(v, s + i)
+        s = s[(j < len(v)) & (v[np.minimum(j, len(v) - 1)] == s + i)]
+    return s
+
+
+def _data_len(blob: bytes) -> int:
+    """Bytes after the header and table (post_cursor's end - data)."""
+    if len(blob) < 3 or blob[:2] != MAGIC:
+        return len(blob)
+    _count, i = _read_varint(blob, 3)
+    if blob[2] == FORMAT_SKIP:
+        _block_size, i = _read_varint(blob, i)
+    if blob[2] in (FORMAT_SKIP, FORMAT_PACKED):
+        n_blocks, i = _read_varint(blob, i)
+        i += 8 * n_blocks
+    return len(blob) - i
+
+
+def post_phrase_count(*blobs) -> int:
+    """Number of phrase matches: positions s with s + i - 1 in blob i."""
+    return len(_phrase(blobs, "post_phrase_count"))
+
+
+def post_phrase_positions(*blobs) -> str:
+    """Phrase start positions as a JSON array."""
+    return _json(_phrase(blobs, "post_phrase_positions"))
+
+
+def _set_pair(a, b, name: str) -> tuple[np.ndarray, np.ndarray]:
+    a, b = _blob(a), _blob(b)
+    _check(a, name)
+    _check(b, name)
+    return decode(a, name), decode(b, name)
+
+
+def post_and(a, b) -> bytes:
+    """Positions in both lists, as a blob."""
+    a, b = _set_pair(a, b, "post_and")
+    return _blob_result(a[_in_multiset(a, b)])
+
+
+def post_or(a, b) -> bytes:
+    """Positions in either list, as a blob."""
+    a, b = _set_pair(a, b, "post_or")
+    if _strict(a) and _strict(b):
+        # Sorting two runs is a merge (much faster here than np.union1d).
+        return _blob_result(_distinct(np.sort(np.concatenate([a, b]), kind="stable")))
+    extra = b[~_in_multiset(b, a)]
+    if not len(extra):
+        return _blob_result(a)
+    return _blob_result(np.sort(np.concatenate([a, extra]), kind="stable"))
+
+
+def post_andnot(a, b) -> bytes:
+    """Positions in A that are not in B, as a blob."""
+    a, b = _set_pair(a, b, "post_andnot")
+    if not len(b):
+        return _blob_result(a)
+    if _strict(a) and _strict(b):
+        return _blob_result(a[np.isin(a, b, assume_unique=True, invert=True)])
+    j = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return _blob_result(a[b[j] != a])
+
+
+def post_shift(blob, off) -> bytes:
+    """Every position moved by off, dropping the ones that go negative."""
+    blob = _blob(blob)
+    _check(blob, "post_shift")
+    v = decode(blob, "post_shift") + _int64(off)
+    return _blob_result(v[v >= 0])
+
+
+def post_near(a, b, off_min, off_max) -> bytes:
+    """post_near_positions as a blob."""
+    a, b = _set_pair(a, b, "post_near")
+    return _blob_result(a[_near_mask(a, b, _int(off_min), _int(off_max))])
+
+
+def post_recode(blob, fmt, block_size=PACK_BLOCK, *extra) -> bytes:
+    """The same list in format 'plain', 'count', 'skip' (block_size) or 'packed'."""
+    if extra:
+        raise ValueError("post_recode(blob, format [, block_size]) expects 2-3 args")
+    if fmt not in ("plain", "count", "skip", "packed"):
+        raise ValueError("post_recode: format must be 'plain', 'count', 'skip' or 'packed'")
+    block_size = _int64(block_size)
+    if not 0 < block_size <= 0x7FFFFFFF:
+        raise ValueError("post_recode: block_size must be positive")
+    v = decode(blob, "post_recode")
+    if fmt in ("skip", "packed") and len(v) and v[-1] > 0xFFFFFFFF:
+        raise ValueError("post_recode: skip and packed formats need positions < 2^32")
+    if fmt == "packed":
+        return _encode_packed(v.tolist())
+    plain = _blob_result(v)
+    if fmt == "plain":
+        return plain
+    if fmt == "count":
+        return MAGIC + bytes([FORMAT_COUNT]) + _varint(len(v)) + plain
+    if not len(v):
+        return MAGIC + bytes([FORMAT_SKIP]) + _varint(0) + _varint(block_size) + _varint(0)
+    return _encode_skip(v.view(np.uint64), plain, block_size)
+
+
+def _contains(blob, x, name: str) -> int | None:
+    if x is None:
+        return None
+    blob = _blob(blob)
+    if not blob:
+        return 0
+    v = _decode_cached(blob, name)
+    x = _int64(x)
+    i = np.searchsorted(v, x)
+    return int(x >= 0 and i < len(v) and v[i] == x)
+
+
+def post_contains(blob, x) -> int | None:
+    """1 if x is one of the positions, else 0 (None if x is NULL)."""
+    return _contains(blob, x, "post_contains")
+
+
+class PostUnionAgg:
+    """post_union_agg(blob): the union of a group's lists, as a blob."""
+
+    def __init__(self) -> None:
+        self.blobs = []
+
+    def step(self, blob) -> None:
+        blob = _blob(blob)
+        if blob:
+            self.blobs.append(blob)
+
+    def finalize(self) -> bytes:
+        if not self.blobs:
+            return b""
+        parts = [decode(b, "post_union_agg") for b in self.blobs]
+        return _blob_result(_distinct(np.sort(np.concatenate(parts), kind="stable")))
+
+
+def post_union_agg(blobs) -> bytes:
+    """post_union_agg over an iterable of blobs, outside SQL."""
+    agg = PostUnionAgg()
+    for blob in blobs:
+        agg.step(blob)
+    return agg.finalize()
+
+
+SUBCORPUS_SQL = "SELECT bitmap FROM subcorpora WHERE name = ?"
+
+
+def subcorpus_has(conn: sqlite3.Connection, name, bok_id) -> int | None:
+    """1 if bok_id is in subcorpus `name` of conn's subcorpora table, else 0."""
+    if bok_id is None:
+        return None
+    row = conn.execute(SUBCORPUS_SQL, (name,)).fetchone()
+    if row is None:
+        raise ValueError(f"no subcorpus named '{name}'")
+    return _contains(row[0], bok_id, "subcorpus_has")
+
+
+# Windows closer than this are read in the same range scan, as in post_kwic.
+KWIC_GAP = 256
+
+TOKENS_SQL = "SELECT seq, word FROM tokens WHERE bok_id = ? AND seq BETWEEN ? AND ? ORDER BY seq"
+TOKEN_CHUNKS_SQL = "SELECT chunk, ids FROM token_chunks WHERE bok_id = ? AND chunk BETWEEN ? AND ? ORDER BY chunk"
+CHUNKED_SQL = "SELECT name FROM sqlite_master WHERE name IN ('token_chunks', 'lexicon')"
+LEXICON_SQL = "SELECT word_id, word FROM lexicon WHERE word_id IN (SELECT value FROM json_each(?))"
+
+
+def _tokens(conn: sqlite3.Connection, chunked: bool, bok_id: int, lo: int, hi: int) -> dict[int, str]:
+    """{seq: word} of book bok_id for seq in [lo, hi]."""
+    if not chunked:
+        return dict(conn.execute(TOKENS_SQL, (bok_id, lo, hi)))
+    ids = {}
+    for chunk, blob in conn.execute(TOKEN_CHUNKS_SQL, (bok_id, lo // TOKEN_CHUNK_SIZE, hi // TOKEN_CHUNK_SIZE)):
+        base = chunk * TOKEN_CHUNK_SIZE
+        for i, word_id in enumerate(decode_token_chunk(blob)):
+            if word_id and lo <= base + i <= hi:
+                ids[base + i] = word_id
+    words = dict(conn.execute(LEXICON_SQL, (json.dumps(sorted(set(ids.values()))),))) if ids else {}
+    return {seq: words[word_id] for seq, word_id in ids.items() if word_id in words}
+
+
+def kwic(
+    conn: sqlite3.Connection, bok_id, blob, n_left, n_right, limit=None, seed=None
+) -> list[tuple[int, str, str, str]]:
+    """post_kwic's rows (seq, left_ctx, keyword, right_ctx), with the tokens read through conn.
+
+    Like the extension it reads `token_chunks` + `lexicon` when the shard
+    has both, otherwise `tokens`, and a seeded `limit` draws the same hits.
+    """
+    blob = _blob(blob)
+    _check(blob, "post_kwic")
+    n_left, n_right = max(_int64(n_left), 0), max(_int64(n_right), 0)
+    if limit is None:
+        hits = decode(blob, "post_kwic").tolist()
+    else:
+        hits = json.loads(post_sample_k(blob, limit, seed))
+    if not hits:
+        return []
+    chunked = len(conn.execute(CHUNKED_SQL).fetchall()) == 2
+    toks = {}
+    i = 0
+    while i < len(hits):
+        lo, hi = hits[i] - n_left, hits[i] + n_right
+        i += 1
+        while i < len(hits) and hits[i] - n_left <= hi + KWIC_GAP:
+            hi = hits[i] + n_right
+            i += 1
+        toks.update(_tokens(conn, chunked, _int64(bok_id), lo, hi))
+    seqs = sorted(toks)
+
+    def span(lo: int, hi: int) -> str:
+        return " ".join(toks[seq] for seq in seqs[bisect_left(seqs, lo) : bisect_right(seqs, hi)])
+
+    return [(hit, span(hit - n_left, hit - 1), span(hit, hit), span(hit + 1, hit + n_right)) for hit in hits]
+
+
+# name -> (number of args, function); -1 is variadic, as in sqlite3_postings_init.
+FUNCTIONS = {
+    "post_intersect": (2, post_intersect),
+    "post_intersect_offset": (4, post_intersect_offset),
+    "post_intersect_offset_sym": (4, post_intersect_offset_sym),
+    "post_sample": (2, post_sample),
+    "post_count": (1, post_count),
+    "post_sample_k": (-1, post_sample_k),
+    "post_sample_many": (2, post_sample_many),
+    "post_positions": (1, post_positions),
+    "post_near_positions": (4, post_near_positions),
+    "post_near_count": (4, post_near_count),
+    "post_phrase_count": (-1, post_phrase_count),
+    "post_phrase_positions": (-1, post_phrase_positions),
+    "post_and": (2, post_and),
+    "post_or": (2, post_or),
+    "post_andnot": (2, post_andnot),
+    "post_shift": (2, post_shift),
+    "post_near": (4, post_near),
+    "post_recode": (-1, post_recode),
+    "post_contains": (2, post_contains),
+}
+
+# Registered without the deterministic flag, like in the extension.
+NONDETERMINISTIC = {"post_sample_k"}
+
+
+def register(conn: sqlite3.Connection) -> None:
+    """Create the post_* functions, subcorpus_has and post_union_agg on conn."""
+    for name, (n_args, fn) in FUNCTIONS.items():
+        conn.create_function(name, n_args, fn, deterministic=name not in NONDETERMINISTIC)
+    conn.create_function("subcorpus_has", 2, lambda name, bok_id: subcorpus_has(conn, name, bok_id))
+    conn.create_aggregate("post_union_agg", 1, PostUnionAgg)
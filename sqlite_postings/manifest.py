@@ -0,0 +1,297 @@
+"""Shard manifest: which shards can hold a word, and which one holds a book.
+
+A manifest is a small SQLite file next to the shards, built by
+build_shard_manifest.py. Per shard it stores the path, the bok_id range,
+the number of books and tokens, and the shard's words as a Bloom filter
+or, with `--exact`, as an exact word -> shard list. Every book is also
+listed with its shard. Queries can then skip the shards that cannot match
+instead of opening every file:
+
+    from sqlite_postings import Manifest
+
+    with Manifest("/mnt/disk1/alto_postings/manifest.db") as manifest:
+        paths = manifest.shards_for_words(["demokrati", "diktatur"])
+        path = manifest.shard_for_book(100004711)
+
+A Bloom filter never misses a shard that has the word. It can include
+some that don't, about `fp_rate` of them (1% by default, at about 1.2
+bytes per distinct word).
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+from postings_codec import count_positions
+
+DEFAULT_FP_RATE = 0.01
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS shards (
+        shard_id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        min_bok_id INTEGER,
+        max_bok_id INTEGER,
+        n_books INTEGER NOT NULL,
+        n_tokens INTEGER NOT NULL,
+        n_words INTEGER NOT NULL,
+        bloom BLOB,
+        bloom_k INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS books (
+        bok_id INTEGER NOT NULL PRIMARY KEY,
+        shard_id INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS words (
+        word TEXT NOT NULL,
+        shard_id INTEGER NOT NULL,
+        PRIMARY KEY (word, shard_id)
+    ) WITHOUT ROWID;
+"""
+
+
+class BloomFilter:
+    """A Bloom filter of m bits (a multiple of 8) with k hash functions.
+
+    The k bit numbers of a word come from one 128-bit BLAKE2b digest as
+    h1 + i * h2 (mod m), so a filter gives the same answers wherever it is
+    read.
+    """
+
+    def __init__(self, bits: bytes | bytearray, k: int) -> None:
+        self.bits = bytearray(bits)
+        self.m = len(self.bits) * 8
+        self.k = k
+
+    @classmethod
+    def for_count(cls, n: int, fp_rate: float = DEFAULT_FP_RATE) -> "BloomFilter":
+        """An empty filter sized for n words at false-positive rate fp_rate."""
+        if not 0 < fp_rate < 1:
+            raise ValueError("fp_rate must be between 0 and 1")
+        m = max(64, math.ceil(-max(n, 1) * math.log(fp_rate) / math.log(2) ** 2))
+        m = (m + 7) // 8 * 8
+        k = max(1, round(m / max(n, 1) * math.log(2)))
+        return cls(bytes(m // 8), k)
+
+    def _bits(self, word: str):
+        digest = hashlib.blake2b(word.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.m
+        return ((h1 + i * h2) % m for i in range(self.k))
+
+    def add(self, word: str) -> None:
+        bits = self.bits
+        for b in self._bits(word):
+            bits[b >> 3] |= 1 << (b & 7)
+
+    def __contains__(self, word: str) -> bool:
+        bits = self.bits
+        return all(bits[b >> 3] & (1 << (b & 7)) for b in self._bits(word))
+
+
+def _has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def shard_summary(path: str) -> tuple[list[int], int, list[str]]:
+    """(bok_ids, n_tokens, words) of one shard.
+
+    Uses `urns` and `vocab` when the shard has them (add_urns_table.py,
+    add_stats_tables.py), else scans `postings`.
+    """
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        if _has_column(conn, "urns", "bok_id"):
+            bok_ids = [row[0] for row in conn.execute("SELECT bok_id FROM urns ORDER BY bok_id")]
+        else:
+            bok_ids = [row[0] for row in conn.execute("SELECT DISTINCT bok_id FROM postings ORDER BY bok_id")]
+        n_tokens = None
+        if _has_column(conn, "urns", "n_tokens"):
+            n_tokens = conn.execute("SELECT SUM(n_tokens) FROM urns").fetchone()[0]
+        if n_tokens is None:
+            conn.create_function("post_count", 1, count_positions, deterministic=True)
+            n_tokens = conn.execute("SELECT SUM(post_count(blob)) FROM postings").fetchone()[0] or 0
+        if _has_column(conn, "vocab", "word"):
+            words = [row[0] for row in conn.execute("SELECT word FROM vocab")]
+        else:
+            words = [row[0] for row in conn.execute("SELECT DISTINCT word FROM postings")]
+    finally:
+        conn.close()
+    return bok_ids, n_tokens, words
+
+
+def add_shard(
+    conn: sqlite3.Connection, path: str, fp_rate: float = DEFAULT_FP_RATE, exact: bool = False
+) -> bool:
+    """Add or refresh one shard's rows in the manifest.
+
+    Returns False without reading the shard when its size and mtime match
+    the stored entry. Commit is left to the caller.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    row = conn.execute("SELECT shard_id, size, mtime_ns FROM shards WHERE path = ?", (path,)).fetchone()
+    if row is not None and row[1:] == (st.st_size, st.st_mtime_ns):
+        return False
+    bok_ids, n_tokens, words = shard_summary(path)
+    bloom = None
+    if not exact:
+        bloom = BloomFilter.for_count(len(words), fp_rate)
+        for word in words:
+            bloom.add(word)
+    values = (
+        path,
+        st.st_size,
+        st.st_mtime_ns,
+        bok_ids[0] if bok_ids else None,
+        bok_ids[-1] if bok_ids else None,
+        len(bok_ids),
+        n_tokens,
+        len(words),
+        bytes(bloom.bits) if bloom else None,
+        bloom.k if bloom else None,
+    )
+    if row is None:
+        shard_id = conn.execute(
+            """
+            INSERT INTO shards (path, size, mtime_ns, min_bok_id, max_bok_id,
+                                n_books, n_tokens, n_words, bloom, bloom_k)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            values,
+        ).lastrowid
+    else:
+        shard_id = row[0]
+        conn.execute(
+            """
+            UPDATE shards SET path = ?, size = ?, mtime_ns = ?, min_bok_id = ?, max_bok_id = ?,
+                              n_books = ?, n_tokens = ?, n_words = ?, bloom = ?, bloom_k = ?
+            WHERE shard_id = ?
+            """,
+            (*values, shard_id),
+        )
+    conn.execute("DELETE FROM books WHERE shard_id = ?", (shard_id,))
+    conn.execute("DELETE FROM words WHERE shard_id = ?", (shard_id,))
+    # A book in two shards stays with the one added first.
+    conn.executemany(
+        "INSERT OR IGNORE INTO books (bok_id, shard_id) VALUES (?, ?)",
+        ((bok_id, shard_id) for bok_id in bok_ids),
+    )
+    if exact:
+        conn.executemany(
+            "INSERT INTO words (word, shard_id) VALUES (?, ?)", ((word, shard_id) for word in words)
+        )
+    return True
+
+
+def drop_missing(conn: sqlite3.Connection, paths) -> list[str]:
+    """Remove the shards not in `paths` from the manifest; returns their paths."""
+    keep = {os.path.abspath(p) for p in paths}
+    gone = [(sid, path) for sid, path in conn.execute("SELECT shard_id, path FROM shards") if path not in keep]
+    for sid, _path in gone:
+        for table in ("books", "words", "shards"):
+            conn.execute(f"DELETE FROM {table} WHERE shard_id = ?", (sid,))
+    return [path for _sid, path in gone]
+
+
+class Manifest:
+    """Read side of a manifest built by build_shard_manifest.py.
+
+    The shard rows, Bloom filters included, are read once when it is
+    opened; books and exact word lists are looked up per call. Safe to use
+    from several threads.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.shards = {}
+        self._blooms = {}
+        rows = self.conn.execute(
+            "SELECT shard_id, path, size, mtime_ns, min_bok_id, max_bok_id, n_books, n_tokens, n_words, "
+            "bloom, bloom_k FROM shards ORDER BY path"
+        )
+        for sid, shard_path, size, mtime_ns, lo, hi, n_books, n_tokens, n_words, bloom, k in rows:
+            self.shards[sid] = {
+                "path": shard_path,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "min_bok_id": lo,
+                "max_bok_id": hi,
+                "n_books": n_books,
+                "n_tokens": n_tokens,
+                "n_words": n_words,
+            }
+            if bloom is not None:
+                self._blooms[sid] = BloomFilter(bloom, k)
+
+    @property
+    def paths(self) -> list[str]:
+        return [info["path"] for info in self.shards.values()]
+
+    def _ids_for_word(self, word: str) -> set[int]:
+        ids = {sid for sid, bloom in self._blooms.items() if word in bloom}
+        if len(self._blooms) < len(self.shards):
+            with self._lock:
+                rows = self.conn.execute("SELECT shard_id FROM words WHERE word = ?", (word,)).fetchall()
+            ids.update(sid for (sid,) in rows)
+        return ids
+
+    def shards_for_words(self, words) -> list[str]:
+        """Paths of the shards that may contain every one of `words`."""
+        ids = set(self.shards)
+        for word in words:
+            ids &= self._ids_for_word(word)
+            if not ids:
+                break
+        return [info["path"] for sid, info in self.shards.items() if sid in ids]
+
+    def shards_for_word(self, word: str) -> list[str]:
+        return self.shards_for_words([word])
+
+    def route(self, paths, words) -> set[str]:
+        """Those of `paths` (absolute) to query for `words`.
+
+        Shards missing from the manifest are kept, since nothing is known
+        about them, and so are shards changed since it was built (an
+        `--append` may have added the words).
+        """
+        known = {info["path"]: info for info in self.shards.values()}
+        keep = set(self.shards_for_words(words))
+        return {
+            path for path in paths if path in keep or path not in known or self._changed(known[path])
+        }
+
+    def shard_for_book(self, bok_id: int) -> str | None:
+        """Path of the shard that holds `bok_id`, or None if no shard does."""
+        with self._lock:
+            row = self.conn.execute("SELECT shard_id FROM books WHERE bok_id = ?", (bok_id,)).fetchone()
+        return self.shards[row[0]]["path"] if row else None
+
+    @staticmethod
+    def _changed(info: dict) -> bool:
+        try:
+            st = os.stat(info["path"])
+        except FileNotFoundError:
+            return True
+        return (st.st_size, st.st_mtime_ns) != (info["size"], info["mtime_ns"])
+
+    def stale(self) -> list[str]:
+        """Shards changed or removed since the manifest was built."""
+        return [info["path"] for info in self.shards.values() if self._changed(info)]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "Manifest":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
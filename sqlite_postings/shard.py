@@ -0,0 +1,222 @@
+"""Typed queries against one postings shard."""
+import json
+import sqlite3
+from array import array
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+
+from .connection import ConnectionPool
+
+BLOB_SQL = "SELECT blob FROM postings WHERE bok_id = ? AND word = ?"
+
+POSITIONS_SQL = """
+    SELECT e.seq FROM postings p, post_each(p.blob) e
+    WHERE p.bok_id = ? AND p.word = ?
+"""
+
+NEAR_POSITIONS_SQL = """
+    SELECT n.seq FROM postings a JOIN postings b USING (bok_id), post_near_each(a.blob, b.blob, ?, ?) n
+    WHERE a.bok_id = ? AND a.word = ? AND b.word = ?
+"""
+
+NEAR_COUNT_SQL = """
+    SELECT bok_id, hits FROM (
+        SELECT a.bok_id, post_near_count(a.blob, b.blob, ?, ?) AS hits
+        FROM postings a JOIN postings b USING (bok_id)
+        WHERE a.word = ? AND b.word = ?{filter}
+    )
+    WHERE hits > 0
+"""
+
+# Without the extension's table-valued functions (connect(fallback=True)).
+POSITIONS_JSON_SQL = "SELECT post_positions(blob) FROM postings WHERE bok_id = ? AND word = ?"
+
+NEAR_POSITIONS_JSON_SQL = """
+    SELECT post_near_positions(a.blob, b.blob, ?, ?) FROM postings a JOIN postings b USING (bok_id)
+    WHERE a.bok_id = ? AND a.word = ? AND b.word = ?
+"""
+
+NEAR_BLOB_SQL = """
+    SELECT post_near(a.blob, b.blob, ?, ?) FROM postings a JOIN postings b USING (bok_id)
+    WHERE a.bok_id = ? AND a.word = ? AND b.word = ?
+"""
+
+SAMPLE_SQL = "SELECT post_sample_k(blob, ?, ?) FROM postings WHERE bok_id = ? AND word = ?"
+
+KWIC_SQL = """
+    SELECT k.seq, k.left_ctx, k.keyword, k.right_ctx
+    FROM postings p, post_kwic(p.bok_id, p.blob, ?, ?, ?, ?) k
+    WHERE p.bok_id = ? AND p.word = ?
+"""
+
+NEAR_KWIC_SQL = """
+    SELECT k.seq, k.left_ctx, k.keyword, k.right_ctx
+    FROM postings a JOIN postings b USING (bok_id),
+         post_kwic(a.bok_id, post_near(a.blob, b.blob, ?, ?), ?, ?, ?, ?) k
+    WHERE a.bok_id = ? AND a.word = ? AND b.word = ?
+"""
+
+SUBCORPUS_FILTER = " AND subcorpus_has(?, a.bok_id)"
+
+
+@lru_cache(maxsize=None)
+def _phrase_sql(n: int, fn: str, by_book: bool, subcorpus: bool) -> str:
+    """SQL for `fn(p1.blob, ..., pn.blob)` over n joined postings rows."""
+    joins = " ".join(f"JOIN postings p{i} USING (bok_id)" for i in range(2, n + 1))
+    blobs = ", ".join(f"p{i}.blob" for i in range(1, n + 1))
+    where = " AND ".join(f"p{i}.word = ?" for i in range(1, n + 1))
+    if by_book:
+        where = f"p1.bok_id = ? AND {where}"
+    if subcorpus:
+        where += " AND subcorpus_has(?, p1.bok_id)"
+    return f"SELECT p1.bok_id, {fn}({blobs}) FROM postings p1 {joins} WHERE {where}"
+
+
+@dataclass
+class KwicRow:
+    seq: int
+    left: str
+    keyword: str
+    right: str
+
+
+class Shard:
+    """One postings shard behind a pool of read-only connections.
+
+    Results come back as Python types: positions as `array('Q')`, per-book
+    counts as lists of (bok_id, count), concordance lines as KwicRow.
+    `subcorpus` arguments name a row in the shard's `subcorpora` table (see
+    subcorpus.py). Extra keyword arguments go to `connect` (ext_path,
+    immutable, mmap_size, cache_kib, fallback). On a fallback connection
+    positions and concordances are computed with `engine` instead of the
+    table-valued functions.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4, **connect_args) -> None:
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size, **connect_args)
+
+    def query(self, sql: str, params=()) -> list:
+        """Run any SQL on a pooled connection and fetch all rows."""
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    @cached_property
+    def native(self) -> bool:
+        """True when the connections have the extension's table-valued functions."""
+        try:
+            self.query("SELECT seq FROM post_each(NULL)")
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def _kwic(self, bok_id: int, blob, n_left, n_right, limit, seed) -> list[KwicRow]:
+        from . import engine
+
+        if blob is None:
+            return []
+        with self.pool.connection() as conn:
+            return [KwicRow(*row) for row in engine.kwic(conn, bok_id, blob, n_left, n_right, limit, seed)]
+
+    def blob(self, bok_id: int, word: str) -> bytes | None:
+        rows = self.query(BLOB_SQL, (bok_id, word))
+        return rows[0][0] if rows else None
+
+    def has_book(self, bok_id: int) -> bool:
+        return bool(self.query("SELECT 1 FROM urns WHERE bok_id = ?", (bok_id,)))
+
+    def positions(self, bok_id: int, word: str) -> array:
+        """Positions of `word` in book `bok_id`."""
+        if not self.native:
+            rows = self.query(POSITIONS_JSON_SQL, (bok_id, word))
+            return array("Q", json.loads(rows[0][0]) if rows else ())
+        return array("Q", (seq for (seq,) in self.query(POSITIONS_SQL, (bok_id, word))))
+
+    def near_positions(
+        self, bok_id: int, word_a: str, word_b: str, off_min: int = -5, off_max: int = 5
+    ) -> array:
+        """Positions of `word_a` with `word_b` within [off_min, off_max] of it."""
+        params = (off_min, off_max, bok_id, word_a, word_b)
+        if not self.native:
+            rows = self.query(NEAR_POSITIONS_JSON_SQL, params)
+            return array("Q", json.loads(rows[0][0]) if rows else ())
+        rows = self.query(NEAR_POSITIONS_SQL, params)
+        return array("Q", (seq for (seq,) in rows))
+
+    def near_count(
+        self,
+        word_a: str,
+        word_b: str,
+        off_min: int = -5,
+        off_max: int = 5,
+        subcorpus: str | None = None,
+    ) -> list[tuple[int, int]]:
+        """(bok_id, hits) for every book where `word_b` occurs near `word_a`."""
+        params = [off_min, off_max, word_a, word_b]
+        if subcorpus is None:
+            sql = NEAR_COUNT_SQL.format(filter="")
+        else:
+            sql = NEAR_COUNT_SQL.format(filter=SUBCORPUS_FILTER)
+            params.append(subcorpus)
+        return self.query(sql, params)
+
+    def phrase(self, words, subcorpus: str | None = None) -> list[tuple[int, int]]:
+        """(bok_id, matches) for every book containing the phrase `words`."""
+        words = list(words)
+        params = words + ([subcorpus] if subcorpus is not None else [])
+        sql = _phrase_sql(len(words), "post_phrase_count", False, subcorpus is not None)
+        return [row for row in self.query(sql, params) if row[1]]
+
+    def phrase_positions(self, bok_id: int, words) -> array:
+        """Start positions of the phrase `words` in book `bok_id`."""
+        words = list(words)
+        rows = self.query(_phrase_sql(len(words), "post_phrase_positions", True, False), [bok_id] + words)
+        return array("Q", json.loads(rows[0][1]) if rows else ())
+
+    def sample(self, bok_id: int, word: str, k: int, seed: int | None = None) -> array:
+        """Up to `k` positions of `word` in `bok_id`, drawn uniformly, in order."""
+        rows = self.query(SAMPLE_SQL, (k, seed, bok_id, word))
+        return array("Q", json.loads(rows[0][0]) if rows and rows[0][0] else ())
+
+    def concordance(
+        self,
+        bok_id: int,
+        word: str,
+        n_left: int = 5,
+        n_right: int = 5,
+        limit: int | None = None,
+        seed: int | None = None,
+    ) -> list[KwicRow]:
+        """KWIC lines for `word` in `bok_id` (a sample of `limit` hits if given)."""
+        if not self.native:
+            return self._kwic(bok_id, self.blob(bok_id, word), n_left, n_right, limit, seed)
+        rows = self.query(KWIC_SQL, (n_left, n_right, limit, seed, bok_id, word))
+        return [KwicRow(*row) for row in rows]
+
+    def near_concordance(
+        self,
+        bok_id: int,
+        word_a: str,
+        word_b: str,
+        off_min: int = -5,
+        off_max: int = 5,
+        n_left: int = 5,
+        n_right: int = 5,
+        limit: int | None = None,
+        seed: int | None = None,
+    ) -> list[KwicRow]:
+        """KWIC lines for the hits of `word_a` that have `word_b` nearby."""
+        if not self.native:
+            rows = self.query(NEAR_BLOB_SQL, (off_min, off_max, bok_id, word_a, word_b))
+            return self._kwic(bok_id, rows[0][0] if rows else None, n_left, n_right, limit, seed)
+        params = (off_min, off_max, n_left, n_right, limit, seed, bok_id, word_a, word_b)
+        return [KwicRow(*row) for row in self.query(NEAR_KWIC_SQL, params)]
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def __enter__(self) -> "Shard":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -23,13 +23,53 @@
 #define sqlite3_value_int         sqlite3_api->value_int
 #define sqlite3_realloc           sqlite3_api->realloc
 #define sqlite3_free              sqlite3_api->free
+#define sqlite3_create_function_v2 sqlite3_api->create_function_v2
+#define sqlite3_malloc            sqlite3_api->malloc
+#define sqlite3_malloc64          sqlite3_api->malloc64
+#define sqlite3_realloc64         sqlite3_api->realloc64
+#define sqlite3_user_data         sqlite3_api->user_data
+#define sqlite3_get_auxdata       sqlite3_api->get_auxdata
+#define sqlite3_set_auxdata       sqlite3_api->set_auxdata
+#define sqlite3_result_error_nomem sqlite3_api->result_error_nomem
+#define sqlite3_value_type        sqlite3_api->value_type
+#define sqlite3_create_module     sqlite3_api->create_module
+#define sqlite3_declare_vtab      sqlite3_api->declare_vtab
+#define sqlite3_vtab_config       sqlite3_api->vtab_config
+#define sqlite3_mprintf           sqlite3_api->mprintf
+#define sqlite3_value_int64       sqlite3_api->value_int64
+#define sqlite3_randomness        sqlite3_api->randomness
+#define sqlite3_prepare_v2        sqlite3_api->prepare_v2
+#define sqlite3_bind_int64        sqlite3_api->bind_int64
+#define sqlite3_step              sqlite3_api->step
+#define sqlite3_reset             sqlite3_api->reset
+#define sqlite3_finalize          sqlite3_api->finalize
+#define sqlite3_column_int64      sqlite3_api->column_int64
+#define sqlite3_column_text       sqlite3_api->column_text
+#define sqlite3_column_bytes      sqlite3_api->column_bytes
+#define sqlite3_errmsg            sqlite3_api->errmsg
+#define sqlite3_column_blob       sqlite3_api->column_blob
+#define sqlite3_result_blob64     sqlite3_api->result_blob64
+#define sqlite3_result_zeroblob   sqlite3_api->result_zeroblob
+#define sqlite3_aggregate_context sqlite3_api->aggregate_context
+#define sqlite3_value_text        sqlite3_api->value_text
+#define sqlite3_bind_value        sqlite3_api->bind_value
+#define sqlite3_context_db_handle sqlite3_api->context_db_handle
 #endif
 
 SQLITE_EXTENSION_INIT1
 
 #include <stdint.h>
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
+#include <time.h>
+#include <stddef.h>
+
+#if defined(__SSE2__)
+#include <emmintrin.h>
+#elif defined(__ARM_NEON)
+#include <arm_neon.h>
+#endif
 
 
 // Enkle varint/delta helpers – fyll ut senere
@@ -53,6 +93,909 @@ static int next_seq(const uint8_t **p, const uint8_t *end, uint64_t *acc) {
     return 1;
 }
 
+/*
+ * Blob-formater
+ *
+ *  - Legacy: ren delta+varint-strøm (ingen header).
+ *  - Versjonert: 0x80 0x00 <format> <varint count> <format-spesifikk payload>.
+ *    0x80 0x00 er en ikke-kanonisk varint for 0 og skrives aldri av legacy-
+ *    encoderen, så de to kan skilles på de to første bytene.
+ *
+ *  POST_FMT_COUNT (0):
+ *    ingen payload utover count: data er delta+varint-strømmen rett etter.
+ *    Gir post_count i O(1) for lister uten skip-tabell.
+ *
+ *  POST_FMT_SKIP (1):
+ *    <varint block_size> <varint n_blocks>
+ *    skip-tabell: n_blocks x (uint32 LE first_pos, uint32 LE byte_offset)
+ *    data: samme delta+varint-strøm som legacy. byte_offset peker på varinten
+ *    for første posisjon i blokka (relativt til starten av data), first_pos
+ *    er den absolutte posisjonen den varinten gir.
+ *
+ *  POST_FMT_PACKED (2):
+ *    <varint n_blocks>
+ *    blokk-tabell: n_blocks x (uint32 LE first_pos, uint32 LE byte_offset),
+ *    som skip-tabellen, men byte_offset peker på blokka i data.
+ *    data: blokker à POST_PACK_BLOCK posisjoner (siste kan være kortere):
+ *    <u8 bredde w> og så (delta - 1) for element 1 .. n-1 i blokka, w bits
+ *    hver, little-endian bitrekkefølge. Element 0 er first_pos.
+ *    Dekodes en blokk om gangen uten dataavhengige greiner (se
+ *    post_packed_load), og cursoren leser fra den dekodede blokka.
+ *    Posisjonene må være < 2^32.
+ */
+#define POST_MAGIC0 0x80
+#define POST_MAGIC1 0x00
+#define POST_FMT_COUNT 0
+#define POST_FMT_SKIP 1
+#define POST_FMT_PACKED 2
+#define POST_SKIP_ENTRY 8
+#define POST_PACK_BLOCK 128
+
+typedef struct post_cursor {
+    const uint8_t *head;    // starten på blobben
+    const uint8_t *p;       // neste varint i data
+    const uint8_t *end;
+    const uint8_t *data;    // start på delta+varint-strømmen
+    const uint8_t *skip;    // skip-tabell, NULL for legacy
+    int n_blocks;
+    int block_size;
+    sqlite3_int64 count;    // antall posisjoner, -1 hvis ukjent (legacy)
+    sqlite3_int64 idx;      // indeks til acc, -1 før første next
+    uint64_t acc;
+    sqlite3_int64 n_next;   // dekodede posisjoner (for post_stats)
+    int packed;             // POST_FMT_PACKED: skip er blokk-tabellen
+    int blk_k;              // dekodet blokk, -1 før første
+    int blk_i, blk_n;       // neste element / antall i blk
+    uint32_t blk[POST_PACK_BLOCK + 1];  // må stå sist, se post_cursor_open
+} post_cursor;
+
+static uint32_t read_u32le(const uint8_t *p) {
+    return (uint32_t)p[0] | ((uint32_t)p[1] << 8) |
+           ((uint32_t)p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+static int blob_is_versioned(const uint8_t *b, int len) {
+    return len >= 3 && b[0] == POST_MAGIC0 && b[1] == POST_MAGIC1;
+}
+
+static uint64_t read_u64le(const uint8_t *p) {
+    uint64_t x;
+    memcpy(&x, p, 8);
+#if defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+    x = __builtin_bswap64(x);
+#endif
+    return x;
+}
+
+// n verdier à w bits (w <= 32) fra in. Leser 8 bytes per verdi, så in må ha
+// minst 7 bytes etter siste hele byte; se post_packed_load.
+static void post_unpack(const uint8_t *in, int w, int n, uint32_t *out) {
+    if (w == 0) {
+        memset(out, 0, (size_t)n * sizeof(*out));
+        return;
+    }
+    uint64_t mask = ((uint64_t)1 << w) - 1;
+    for (int i = 0; i < n; i++) {
+        uint32_t bit = (uint32_t)i * (uint32_t)w;
+        out[i] = (uint32_t)((read_u64le(in + (bit >> 3)) >> (bit & 7)) & mask);
+    }
+}
+
+// Hele blokker med fast w: åtte verdier fyller nøyaktig w bytes, så alle
+// forskyvninger innenfor en gruppe er konstanter. Pakker ut POST_PACK_BLOCK
+// verdier (én mer enn blokka har; den siste er søppel og out har plass).
+#define POST_UNPACK_GET(J, W) \
+    (uint32_t)((read_u64le(in + ((J) * (W) >> 3)) >> ((J) * (W) & 7)) & (((uint64_t)1 << (W)) - 1))
+#define POST_UNPACK_FULL(W)                                                     \
+    static void post_unpack_full_##W(const uint8_t *in, uint32_t *out) {       \
+        for (int g = 0; g < POST_PACK_BLOCK / 8; g++, in += W, out += 8) {      \
+            out[0] = POST_UNPACK_GET(0, W);                                     \
+            out[1] = POST_UNPACK_GET(1, W);                                     \
+            out[2] = POST_UNPACK_GET(2, W);                                     \
+            out[3] = POST_UNPACK_GET(3, W);                                     \
+            out[4] = POST_UNPACK_GET(4, W);                                     \
+            out[5] = POST_UNPACK_GET(5, W);                                     \
+            out[6] = POST_UNPACK_GET(6, W);                                     \
+            out[7] = POST_UNPACK_GET(7, W);                                     \
+        }                                                                       \
+    }
+POST_UNPACK_FULL(1)  POST_UNPACK_FULL(2)  POST_UNPACK_FULL(3)  POST_UNPACK_FULL(4)
+POST_UNPACK_FULL(5)  POST_UNPACK_FULL(6)  POST_UNPACK_FULL(7)  POST_UNPACK_FULL(8)
+POST_UNPACK_FULL(9)  POST_UNPACK_FULL(10) POST_UNPACK_FULL(11) POST_UNPACK_FULL(12)
+POST_UNPACK_FULL(13) POST_UNPACK_FULL(14) POST_UNPACK_FULL(15) POST_UNPACK_FULL(16)
+POST_UNPACK_FULL(17) POST_UNPACK_FULL(18) POST_UNPACK_FULL(19) POST_UNPACK_FULL(20)
+POST_UNPACK_FULL(21) POST_UNPACK_FULL(22) POST_UNPACK_FULL(23) POST_UNPACK_FULL(24)
+POST_UNPACK_FULL(25) POST_UNPACK_FULL(26) POST_UNPACK_FULL(27) POST_UNPACK_FULL(28)
+POST_UNPACK_FULL(29) POST_UNPACK_FULL(30) POST_UNPACK_FULL(31) POST_UNPACK_FULL(32)
+
+static void (*const post_unpack_full[33])(const uint8_t *, uint32_t *) = {
+    NULL,
+    post_unpack_full_1,  post_unpack_full_2,  post_unpack_full_3,  post_unpack_full_4,
+    post_unpack_full_5,  post_unpack_full_6,  post_unpack_full_7,  post_unpack_full_8,
+    post_unpack_full_9,  post_unpack_full_10, post_unpack_full_11, post_unpack_full_12,
+    post_unpack_full_13, post_unpack_full_14, post_unpack_full_15, post_unpack_full_16,
+    post_unpack_full_17, post_unpack_full_18, post_unpack_full_19, post_unpack_full_20,
+    post_unpack_full_21, post_unpack_full_22, post_unpack_full_23, post_unpack_full_24,
+    post_unpack_full_25, post_unpack_full_26, post_unpack_full_27, post_unpack_full_28,
+    post_unpack_full_29, post_unpack_full_30, post_unpack_full_31, post_unpack_full_32,
+};
+
+// v[i] = base + sum(v[0..i] + 1), fire og fire med SSE2/NEON der det finnes.
+static void post_prefix_sum1(uint32_t *v, int n, uint32_t base) {
+    int i = 0;
+#if defined(__SSE2__)
+    __m128i one = _mm_set1_epi32(1);
+    __m128i carry = _mm_set1_epi32((int)base);
+    for (; i + 4 <= n; i += 4) {
+        __m128i x = _mm_add_epi32(_mm_loadu_si128((const __m128i *)(v + i)), one);
+        x = _mm_add_epi32(x, _mm_slli_si128(x, 4));
+        x = _mm_add_epi32(x, _mm_slli_si128(x, 8));
+        x = _mm_add_epi32(x, carry);
+        _mm_storeu_si128((__m128i *)(v + i), x);
+        carry = _mm_shuffle_epi32(x, 0xFF);
+    }
+    base = (uint32_t)_mm_cvtsi128_si32(carry);
+#elif defined(__ARM_NEON)
+    uint32x4_t zero = vdupq_n_u32(0);
+    uint32x4_t one = vdupq_n_u32(1);
+    uint32x4_t carry = vdupq_n_u32(base);
+    for (; i + 4 <= n; i += 4) {
+        uint32x4_t x = vaddq_u32(vld1q_u32(v + i), one);
+        x = vaddq_u32(x, vextq_u32(zero, x, 3));
+        x = vaddq_u32(x, vextq_u32(zero, x, 2));
+        x = vaddq_u32(x, carry);
+        vst1q_u32(v + i, x);
+        carry = vdupq_n_u32(vgetq_lane_u32(x, 3));
+    }
+    base = vgetq_lane_u32(carry, 0);
+#endif
+    for (; i < n; i++) {
+        base += v[i] + 1;
+        v[i] = base;
+    }
+}
+
+// Dekod blokk k til c->blk. Returnerer antall posisjoner, 0 hvis blokka
+// er korrupt (lista slutter da der).
+static int post_packed_load(post_cursor *c, int k) {
+    const uint8_t *e = c->skip + (size_t)k * POST_SKIP_ENTRY;
+    sqlite3_int64 left = c->count - (sqlite3_int64)k * POST_PACK_BLOCK;
+    int n = left < POST_PACK_BLOCK ? (int)left : POST_PACK_BLOCK;
+    uint32_t off = read_u32le(e + 4);
+    c->blk_k = k;
+    c->blk_i = c->blk_n = 0;
+    if (n <= 0 || off >= c->end - c->data || c->data[off] > 32) return 0;
+    const uint8_t *p = c->data + off;
+    int w = *p++;
+    sqlite3_int64 nbytes = ((sqlite3_int64)(n - 1) * w + 7) / 8;
+    if (c->end - p < nbytes) return 0;
+    // Element 0 er first_pos: -1 + 1 = 0 i prefikssummen.
+    c->blk[0] = UINT32_MAX;
+    if (c->end - p >= nbytes + 8) {
+        if (n == POST_PACK_BLOCK && w > 0) post_unpack_full[w](p, c->blk + 1);
+        else post_unpack(p, w, n - 1, c->blk + 1);
+    } else {
+        uint8_t tmp[POST_PACK_BLOCK * 4 + 8] = {0};
+        memcpy(tmp, p, (size_t)nbytes);
+        post_unpack(tmp, w, n - 1, c->blk + 1);
+    }
+    post_prefix_sum1(c->blk, n, read_u32le(e));
+    c->blk_n = n;
+    return n;
+}
+
+// Parse header og posisjoner cursoren før første element.
+// Returnerer 0 ved ukjent format eller korrupt header.
+static int post_cursor_open(post_cursor *c, const uint8_t *b, int len) {
+    // blk står sist og trenger ingen nullstilling
+    memset(c, 0, offsetof(post_cursor, blk));
+    c->head = b;
+    c->count = -1;
+    c->idx = -1;
+    if (!b || len <= 0) {
+        c->p = c->end = c->data = b;
+        return 1;
+    }
+    const uint8_t *end = b + len;
+    if (!blob_is_versioned(b, len)) {
+        c->p = c->data = b;
+        c->end = end;
+        return 1;
+    }
+
+    const uint8_t *p = b + 3;
+    int fmt = b[2];
+    c->count = (sqlite3_int64)read_varint(&p, end);
+    if (fmt == POST_FMT_COUNT) {
+        c->p = c->data = p;
+        c->end = end;
+        return 1;
+    }
+    if (fmt == POST_FMT_SKIP) {
+        uint64_t block_size = read_varint(&p, end);
+        uint64_t n_blocks = read_varint(&p, end);
+        if (block_size == 0 || block_size > 0x7fffffff || n_blocks > 0x7fffffff) return 0;
+        if ((uint64_t)(end - p) < n_blocks * POST_SKIP_ENTRY) return 0;
+        c->block_size = (int)block_size;
+        c->n_blocks = (int)n_blocks;
+        c->skip = n_blocks ? p : NULL;
+        p += n_blocks * POST_SKIP_ENTRY;
+        c->p = c->data = p;
+        c->end = end;
+        return 1;
+    }
+    if (fmt == POST_FMT_PACKED) {
+        uint64_t n_blocks = read_varint(&p, end);
+        uint64_t count = (uint64_t)c->count;
+        if (n_blocks != (count + POST_PACK_BLOCK - 1) / POST_PACK_BLOCK) return 0;
+        if ((uint64_t)(end - p) < n_blocks * POST_SKIP_ENTRY) return 0;
+        c->packed = 1;
+        c->blk_k = -1;
+        c->block_size = POST_PACK_BLOCK;
+        c->n_blocks = (int)n_blocks;
+        c->skip = n_blocks ? p : NULL;
+        p += n_blocks * POST_SKIP_ENTRY;
+        c->p = c->data = p;
+        c->end = end;
+        return 1;
+    }
+    return 0;
+}
+
+static int post_cursor_next(post_cursor *c) {
+    // blk_n er alltid 0 utenom packed, så legacy går rett til next_seq.
+    if (c->blk_i < c->blk_n) {
+        c->acc = c->blk[c->blk_i++];
+    } else if (c->packed) {
+        if (c->blk_k + 1 >= c->n_blocks || !post_packed_load(c, c->blk_k + 1)) return 0;
+        c->acc = c->blk[c->blk_i++];
+    } else if (!next_seq(&c->p, c->end, &c->acc)) {
+        return 0;
+    }
+    c->idx++;
+    c->n_next++;
+    return 1;
+}
+
+// Hopp til starten av blokk k: neste post_cursor_next gir first_pos[k].
+static void post_cursor_jump(post_cursor *c, int k) {
+    if (c->packed) {
+        if (post_packed_load(c, k)) {
+            c->acc = c->blk[0];
+            c->blk_i = 1;
+        }
+        c->idx = (sqlite3_int64)k * c->block_size;
+        return;
+    }
+    const uint8_t *e = c->skip + (size_t)k * POST_SKIP_ENTRY;
+    uint32_t first = read_u32le(e);
+    uint32_t off = read_u32le(e + 4);
+    const uint8_t *p = c->data + off;
+    if (p > c->end) p = c->end;
+    // Varinten på p er delta fra forrige blokk; first_pos gir oss svaret direkte.
+    const uint8_t *q = p;
+    read_varint(&q, c->end);
+    c->acc = first;
+    c->p = q;
+    c->idx = (sqlite3_int64)k * c->block_size;
+}
+
+// Flytt cursoren fram til første posisjon >= target.
+// Forutsetter at cursoren står på et element (siste next returnerte 1).
+// Returnerer 0 hvis lista tar slutt før target.
+static int post_cursor_seek(post_cursor *c, uint64_t target) {
+    if (c->acc >= target) return 1;
+    if (c->skip) {
+        int cur = (int)(c->idx / c->block_size);
+        // Galopper over skip-tabellen etter siste blokk med first_pos < target
+        // (strengt mindre: like posisjoner kan fortsette fra blokka før).
+        int lo = cur, step = 1, hi = cur + 1;
+        while (hi < c->n_blocks &&
+               read_u32le(c->skip + (size_t)hi * POST_SKIP_ENTRY) < target) {
+            lo = hi;
+            step <<= 1;
+            hi = cur + step;
+        }
+        if (hi > c->n_blocks) hi = c->n_blocks;
+        // first_pos[lo] < target, first_pos[hi] >= target (eller hi == n_blocks)
+        while (hi - lo > 1) {
+            int mid = lo + (hi - lo) / 2;
+            if (read_u32le(c->skip + (size_t)mid * POST_SKIP_ENTRY) < target) lo = mid;
+            else hi = mid;
+        }
+        if (lo > cur) post_cursor_jump(c, lo);
+        if (c->acc >= target) return 1;
+    }
+    while (post_cursor_next(c)) {
+        if (c->acc >= target) return 1;
+    }
+    return 0;
+}
+
+// Les første element og søk fram til første posisjon >= target.
+static int post_cursor_seek_first(post_cursor *c, uint64_t target) {
+    return post_cursor_next(c) && post_cursor_seek(c, target);
+}
+
+// base + off, mettet til [0, UINT64_MAX].
+static uint64_t seek_target(uint64_t base, sqlite3_int64 off) {
+    if (off < 0) return (uint64_t)(-off) > base ? 0 : base - (uint64_t)(-off);
+    return base > UINT64_MAX - (uint64_t)off ? UINT64_MAX : base + (uint64_t)off;
+}
+
+// b - a < off og b - a > off, regnet eksakt (ingen int64-differanse som
+// kan flyte over for posisjoner >= 2^63).
+static int post_diff_lt(uint64_t b, uint64_t a, sqlite3_int64 off) {
+    if (off >= 0) return b < a || b - a < (uint64_t)off;
+    return a > b && a - b > (uint64_t)(-off);
+}
+
+static int post_diff_gt(uint64_t b, uint64_t a, sqlite3_int64 off) {
+    if (off >= 0) return b > a && b - a > (uint64_t)off;
+    return b >= a || a - b < (uint64_t)(-off);
+}
+
+// Som post_cursor_seek, men flytter alltid minst ett steg: et mettet
+// target <= acc gir next, så vindusløkkene alltid kommer videre.
+static int post_cursor_advance(post_cursor *c, uint64_t target) {
+    if (target <= c->acc) return post_cursor_next(c);
+    return post_cursor_seek(c, target);
+}
+
+/*
+ * Per-connection state
+ *
+ * Opprettes i sqlite3_postings_init og sendes som user data til UDF-ene.
+ * scratch er en gjenbrukt buffer for dekodede lister, så galloping ikke
+ * trenger malloc/free per kall. cache er en LRU av dekodede lister (se
+ * post_cache_get), av til post_cache_config setter en grense.
+ */
+#ifndef POST_GALLOP_RATIO
+#define POST_GALLOP_RATIO 4
+#endif
+
+#ifndef POST_CACHE_BYTES
+#define POST_CACHE_BYTES 0
+#endif
+
+#ifndef POST_STATS
+#define POST_STATS 0
+#endif
+
+typedef struct post_array {
+    uint64_t *v;
+    sqlite3_int64 n;
+} post_array;
+
+typedef struct post_cache_entry {
+    struct post_cache_entry *prev, *next;   // LRU-liste, head = sist brukt
+    struct post_cache_entry *chain;         // neste i samme hash-bøtte
+    uint64_t hash;
+    int len;                                // bytes i blob
+    int pins;                               // > 0 mens en UDF bruker arr
+    sqlite3_int64 bytes;                    // hele allokeringen
+    const uint8_t *blob;                    // kopi av nøkkelen
+    post_array arr;
+} post_cache_entry;
+
+typedef struct post_cache {
+    post_cache_entry **buckets;
+    sqlite3_int64 n_buckets;                // 0 eller potens av 2
+    post_cache_entry *head, *tail;
+    sqlite3_int64 max_bytes, bytes, entries;
+    sqlite3_int64 hits, misses, evictions;
+} post_cache;
+
+/*
+ * Tellere per funksjon for post_stats (se post_stats_run). Bare i bruk når
+ * post_stats_enable(1) er satt; ellers koster de én test per kall.
+ */
+enum {
+    POST_FN_INTERSECT,
+    POST_FN_INTERSECT_OFFSET,
+    POST_FN_INTERSECT_OFFSET_SYM,
+    POST_FN_SAMPLE,
+    POST_FN_POSITIONS,
+    POST_FN_NEAR_POSITIONS,
+    POST_FN_NEAR_COUNT,
+    POST_FN_PHRASE_COUNT,
+    POST_FN_PHRASE_POSITIONS,
+    POST_FN_AND,
+    POST_FN_OR,
+    POST_FN_ANDNOT,
+    POST_FN_SHIFT,
+    POST_FN_NEAR,
+    POST_FN_UNION_AGG,
+    POST_FN_COUNT,
+    POST_FN_SAMPLE_K,
+    POST_FN_SAMPLE_MANY,
+    POST_FN_EACH,
+    POST_FN_NEAR_EACH,
+    POST_FN_KWIC,
+    POST_FN_WINDOW,
+    POST_FN_RECODE,
+    POST_FN_CONTAINS,
+    POST_FN_SUBCORPUS_HAS,
+    POST_FN_SUBCORPUS_EACH,
+    POST_FN_N
+};
+
+static const char *const post_fn_names[POST_FN_N] = {
+    "post_intersect",
+    "post_intersect_offset",
+    "post_intersect_offset_sym",
+    "post_sample",
+    "post_positions",
+    "post_near_positions",
+    "post_near_count",
+    "post_phrase_count",
+    "post_phrase_positions",
+    "post_and",
+    "post_or",
+    "post_andnot",
+    "post_shift",
+    "post_near",
+    "post_union_agg",
+    "post_count",
+    "post_sample_k",
+    "post_sample_many",
+    "post_each",
+    "post_near_each",
+    "post_kwic",
+    "post_window",
+    "post_recode",
+    "post_contains",
+    "subcorpus_has",
+    "subcorpus_each",
+};
+
+typedef struct post_fn_stats {
+    sqlite3_int64 calls;        // kall (grupper for post_union_agg, filter for tabeller)
+    sqlite3_int64 bytes;        // blob-bytes inn
+    sqlite3_int64 positions;    // dekodede posisjoner
+    sqlite3_int64 results;      // treff / posisjoner / rader ut
+    sqlite3_int64 ns;           // tid i funksjonen
+} post_fn_stats;
+
+typedef struct post_conn {
+    uint64_t *scratch;
+    sqlite3_int64 scratch_cap;  // antall uint64_t
+    int gallop_ratio;           // 0 = aldri gallop
+    post_cache cache;
+    int stats_on;
+    post_fn_stats stats[POST_FN_N];
+    sqlite3_int64 tally_positions;  // for kallet som pågår, se post_tally
+    sqlite3_int64 tally_results;
+} post_conn;
+
+static void post_cache_clear(post_cache *c);
+
+static void post_conn_free(void *p) {
+    post_conn *st = (post_conn *)p;
+    if (!st) return;
+    post_cache_clear(&st->cache);
+    sqlite3_free(st->scratch);
+    sqlite3_free(st);
+}
+
+static uint64_t *post_conn_scratch(post_conn *st, sqlite3_int64 n) {
+    if (n > st->scratch_cap) {
+        sqlite3_int64 cap = st->scratch_cap ? st->scratch_cap : 1024;
+        while (cap < n) cap *= 2;
+        uint64_t *buf = sqlite3_realloc64(st->scratch, (sqlite3_uint64)cap * sizeof(uint64_t));
+        if (!buf) return NULL;
+        st->scratch = buf;
+        st->scratch_cap = cap;
+    }
+    return st->scratch;
+}
+
+// Legg til dekodede posisjoner og resultater for kallet som pågår.
+static void post_tally(post_conn *st, sqlite3_int64 positions, sqlite3_int64 results) {
+    if (st && st->stats_on) {
+        st->tally_positions += positions;
+        st->tally_results += results;
+    }
+}
+
+static sqlite3_int64 post_now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (sqlite3_int64)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
+typedef void (*post_scalar_fn)(sqlite3_context *, int, sqlite3_value **);
+
+// Kjør fn og før kall, blob-bytes inn, tid og tallies på stats[id].
+static void post_stats_run(post_conn *st, int id, post_scalar_fn fn, int count_call,
+                           sqlite3_context *ctx, int argc, sqlite3_value **argv) {
+    post_fn_stats *s = &st->stats[id];
+    for (int i = 0; i < argc; i++) {
+        if (sqlite3_value_type(argv[i]) == SQLITE_BLOB) s->bytes += sqlite3_value_bytes(argv[i]);
+    }
+    st->tally_positions = st->tally_results = 0;
+    sqlite3_int64 t0 = post_now_ns();
+    fn(ctx, argc, argv);
+    s->ns += post_now_ns() - t0;
+    s->calls += count_call;
+    s->positions += st->tally_positions;
+    s->results += st->tally_results;
+}
+
+// Registreres i stedet for fn_sqlite; user data må være post_conn.
+#define POST_TIMED(fn, id)                                                      \
+    static void fn##_timed(sqlite3_context *ctx, int argc, sqlite3_value **argv) { \
+        post_conn *st = sqlite3_user_data(ctx);                                 \
+        if (st->stats_on) post_stats_run(st, id, fn, 1, ctx, argc, argv);      \
+        else fn(ctx, argc, argv);                                               \
+    }
+
+// Før tid og tellere for et xFilter- eller xNext-kall på en tabellverdi-funksjon.
+// argv er NULL for xNext (teller ikke som et kall).
+static void post_stats_table(post_conn *st, int id, sqlite3_int64 t0, int argc,
+                             sqlite3_value **argv, sqlite3_int64 positions,
+                             sqlite3_int64 results) {
+    post_fn_stats *s = &st->stats[id];
+    if (argv) {
+        s->calls++;
+        for (int i = 0; i < argc; i++) {
+            if (sqlite3_value_type(argv[i]) == SQLITE_BLOB) s->bytes += sqlite3_value_bytes(argv[i]);
+        }
+    }
+    s->ns += post_now_ns() - t0;
+    s->positions += positions;
+    s->results += results;
+}
+
+// Dekod en legacy-blob til absolutte posisjoner. out må ha plass til len
+// elementer (hver varint er minst én byte).
+static sqlite3_int64 decode_all(const uint8_t *b, int len, uint64_t *out) {
+    const uint8_t *p = b, *end = b + len;
+    uint64_t acc = 0;
+    sqlite3_int64 n = 0;
+    while (next_seq(&p, end, &acc)) out[n++] = acc;
+    return n;
+}
+
+// Bytes som identifiserer lista (nøkkel for cache og auxdata): delta+varint-
+// strømmen, eller hele blobben for packed (blokkene trenger tabellen og count).
+static void post_cursor_key(const post_cursor *c, const uint8_t **b, int *len) {
+    *b = c->packed ? c->head : c->data;
+    *len = (int)(c->end - *b);
+}
+
+static int blob_is_packed(const uint8_t *b, int len) {
+    return blob_is_versioned(b, len) && b[2] == POST_FMT_PACKED;
+}
+
+// Øvre grense for antall posisjoner i en nøkkel fra post_cursor_key.
+static sqlite3_int64 decode_bound(const uint8_t *b, int len) {
+    post_cursor c;
+    if (blob_is_packed(b, len) && post_cursor_open(&c, b, len)) return c.count;
+    return len;
+}
+
+// Som decode_all, men for en nøkkel fra post_cursor_key. out må ha plass til
+// decode_bound elementer.
+static sqlite3_int64 decode_key(const uint8_t *b, int len, uint64_t *out) {
+    post_cursor c;
+    if (!blob_is_packed(b, len)) return decode_all(b, len, out);
+    if (!post_cursor_open(&c, b, len)) return 0;
+    sqlite3_int64 n = 0;
+    for (int k = 0; k < c.n_blocks; k++) {
+        int m = post_packed_load(&c, k);
+        for (int i = 0; i < m; i++) out[n + i] = c.blk[i];
+        n += m;
+        if (m < POST_PACK_BLOCK) break;
+    }
+    return n;
+}
+
+/*
+ * Cache av dekodede lister
+ *
+ * Nøkkelen er bytes i delta+varint-strømmen (cursor.data .. cursor.end), så
+ * samme liste treffer uansett hvilken rad eller kolonne den kommer fra. Et
+ * treff sjekkes med memcmp mot en kopi av blobben, så en hash-kollisjon gir
+ * aldri feil svar. Innslag som er pinnet (i bruk i et kall) kastes ikke ut.
+ * Blobs med skip-tabell caches ikke; der gjør post_cursor_seek jobben.
+ */
+static uint64_t post_hash(const uint8_t *p, int len) {
+    uint64_t h = 0x9E3779B97F4A7C15ULL ^ (uint64_t)len;
+    int i = 0;
+    for (; i + 8 <= len; i += 8) {
+        uint64_t w;
+        memcpy(&w, p + i, 8);
+        h = (h ^ w) * 0xFF51AFD7ED558CCDULL;
+        h ^= h >> 32;
+    }
+    uint64_t tail = 0;
+    for (int k = 0; i < len; i++, k += 8) tail |= (uint64_t)p[i] << k;
+    h = (h ^ tail) * 0xC4CEB9FE1A85EC53ULL;
+    return h ^ (h >> 29);
+}
+
+static void post_cache_unlink(post_cache *c, post_cache_entry *e) {
+    if (e->prev) e->prev->next = e->next;
+    else c->head = e->next;
+    if (e->next) e->next->prev = e->prev;
+    else c->tail = e->prev;
+    e->prev = e->next = NULL;
+}
+
+static void post_cache_push_front(post_cache *c, post_cache_entry *e) {
+    e->prev = NULL;
+    e->next = c->head;
+    if (c->head) c->head->prev = e;
+    c->head = e;
+    if (!c->tail) c->tail = e;
+}
+
+static void post_cache_remove(post_cache *c, post_cache_entry *e) {
+    post_cache_entry **pp = &c->buckets[e->hash & (uint64_t)(c->n_buckets - 1)];
+    while (*pp != e) pp = &(*pp)->chain;
+    *pp = e->chain;
+    post_cache_unlink(c, e);
+    c->bytes -= e->bytes;
+    c->entries--;
+    sqlite3_free(e);
+}
+
+// Kast ut minst nylig brukte (upinnede) innslag til bytes + need <= max_bytes.
+static void post_cache_evict(post_cache *c, sqlite3_int64 need) {
+    post_cache_entry *e = c->tail;
+    while (e && c->bytes + need > c->max_bytes) {
+        post_cache_entry *prev = e->prev;
+        if (e->pins == 0) {
+            post_cache_remove(c, e);
+            c->evictions++;
+        }
+        e = prev;
+    }
+}
+
+static void post_cache_clear(post_cache *c) {
+    post_cache_entry *e = c->head;
+    while (e) {
+        post_cache_entry *next = e->next;
+        sqlite3_free(e);
+        e = next;
+    }
+    sqlite3_free(c->buckets);
+    c->buckets = NULL;
+    c->n_buckets = 0;
+    c->head = c->tail = NULL;
+    c->bytes = c->entries = 0;
+}
+
+static int post_cache_grow(post_cache *c) {
+    sqlite3_int64 n = c->n_buckets ? c->n_buckets * 2 : 256;
+    post_cache_entry **b = sqlite3_malloc64((sqlite3_uint64)n * sizeof(*b));
+    if (!b) return 0;
+    memset(b, 0, (size_t)n * sizeof(*b));
+    for (post_cache_entry *e = c->head; e; e = e->next) {
+        post_cache_entry **slot = &b[e->hash & (uint64_t)(n - 1)];
+        e->chain = *slot;
+        *slot = e;
+    }
+    sqlite3_free(c->buckets);
+    c->buckets = b;
+    c->n_buckets = n;
+    return 1;
+}
+
+/*
+ * Dekodet liste for strømmen b[0..len), pinnet til post_cache_release.
+ * NULL når cachen er av, lista ikke får plass, eller ved OOM; da dekoder
+ * kalleren selv som før.
+ */
+static post_cache_entry *post_cache_get(post_conn *st, const uint8_t *b, int len) {
+    post_cache *c = &st->cache;
+    if (c->max_bytes <= 0 || !b || len <= 0) return NULL;
+    uint64_t h = post_hash(b, len);
+    if (c->n_buckets) {
+        post_cache_entry *e = c->buckets[h & (uint64_t)(c->n_buckets - 1)];
+        for (; e; e = e->chain) {
+            if (e->hash == h && e->len == len && memcmp(e->blob, b, (size_t)len) == 0) {
+                c->hits++;
+                e->pins++;
+                if (c->head != e) {
+                    post_cache_unlink(c, e);
+                    post_cache_push_front(c, e);
+                }
+                return e;
+            }
+        }
+    }
+    c->misses++;
+    if ((sqlite3_int64)sizeof(post_cache_entry) + len > c->max_bytes) return NULL;
+
+    uint64_t *buf = post_conn_scratch(st, decode_bound(b, len));
+    if (!buf) return NULL;
+    sqlite3_int64 n = decode_key(b, len, buf);
+    post_tally(st, n, 0);
+    sqlite3_int64 bytes = (sqlite3_int64)sizeof(post_cache_entry)
+        + n * (sqlite3_int64)sizeof(uint64_t) + len;
+    if (bytes > c->max_bytes) return NULL;
+    if (c->entries >= c->n_buckets && !post_cache_grow(c)) return NULL;
+    post_cache_evict(c, bytes);
+
+    post_cache_entry *e = sqlite3_malloc64((sqlite3_uint64)bytes);
+    if (!e) return NULL;
+    memset(e, 0, sizeof(*e));
+    e->hash = h;
+    e->len = len;
+    e->pins = 1;
+    e->bytes = bytes;
+    e->arr.v = (uint64_t *)(e + 1);
+    e->arr.n = n;
+    memcpy(e->arr.v, buf, (size_t)n * sizeof(uint64_t));
+    e->blob = (const uint8_t *)(e->arr.v + n);
+    memcpy((uint8_t *)e->blob, b, (size_t)len);
+
+    post_cache_entry **slot = &c->buckets[h & (uint64_t)(c->n_buckets - 1)];
+    e->chain = *slot;
+    *slot = e;
+    post_cache_push_front(c, e);
+    c->bytes += bytes;
+    c->entries++;
+    return e;
+}
+
+// Dekodet liste utenom cachen (pins < 0), frigjøres av post_cache_release.
+static post_cache_entry *post_array_temp(post_conn *st, const uint8_t *b, int len) {
+    sqlite3_int64 bound = decode_bound(b, len);
+    post_cache_entry *e = sqlite3_malloc64(sizeof(*e) + (sqlite3_uint64)bound * sizeof(uint64_t));
+    if (!e) return NULL;
+    memset(e, 0, sizeof(*e));
+    e->pins = -1;
+    e->arr.v = (uint64_t *)(e + 1);
+    e->arr.n = decode_key(b, len, e->arr.v);
+    post_tally(st, e->arr.n, 0);
+    return e;
+}
+
+static void post_cache_release(post_cache_entry *e) {
+    if (!e) return;
+    if (e->pins < 0) sqlite3_free(e);
+    else e->pins--;
+}
+
+// Skip-tabell (POST_FMT_SKIP); packed bruker også c->skip som blokk-tabell.
+static int post_has_skip(const post_cursor *c) {
+    return c->skip && !c->packed;
+}
+
+static post_cache_entry *post_array_get(post_conn *st, const post_cursor *c, int temp) {
+    const uint8_t *b;
+    int len;
+    post_cursor_key(c, &b, &len);
+    post_cache_entry *e = post_cache_get(st, b, len);
+    return e || !temp ? e : post_array_temp(st, b, len);
+}
+
+// Begge operandene som dekodede lister, eller 0 (uten noe pinnet) hvis
+// ingen av dem kan brukes som array. Fra cachen når den er på; packed-lister
+// dekodes ellers uansett, siden blokkdekoderen er raskere enn cursoren.
+static int post_cache_pair(post_conn *st, const post_cursor *ca, const post_cursor *cb,
+                           post_cache_entry **ea, post_cache_entry **eb) {
+    *ea = *eb = NULL;
+    if (!st || post_has_skip(ca) || post_has_skip(cb)) return 0;
+    int temp = ca->packed || cb->packed;
+    if (st->cache.max_bytes <= 0 && !temp) return 0;
+    *ea = post_array_get(st, ca, temp);
+    if (!*ea) return 0;
+    *eb = post_array_get(st, cb, temp);
+    if (!*eb) {
+        post_cache_release(*ea);
+        *ea = NULL;
+        return 0;
+    }
+    return 1;
+}
+
+/*
+ * Dekodet operand for galloping.
+ *
+ * Konstante argumenter (f.eks. en bundet ?-blob) dekodes bare én gang per
+ * statement: første kall legger en sentinel i auxdata, og hvis den fortsatt
+ * er der ved neste kall er argumentet konstant, så vi dekoder til eget minne
+ * som SQLite holder på til statementet er ferdig. Ellers hentes lista fra
+ * cachen (når den er på) eller dekodes til scratch.
+ */
+static char aux_sentinel;
+
+typedef struct post_operand {
+    post_array arr;
+    post_array *owned;   // publiseres som auxdata i post_operand_done
+    post_cache_entry *entry;  // pinnet cache-innslag, slippes i post_operand_done
+    int mark;            // sett sentinel i post_operand_done
+} post_operand;
+
+static int post_operand_load(
+    sqlite3_context *ctx, post_conn *st, int arg,
+    const uint8_t *b, int len, post_operand *op
+) {
+    memset(op, 0, sizeof(*op));
+    void *aux = sqlite3_get_auxdata(ctx, arg);
+    if (aux && aux != &aux_sentinel) {
+        op->arr = *(post_array *)aux;
+        return 1;
+    }
+    if (aux == &aux_sentinel) {
+        sqlite3_uint64 bound = (sqlite3_uint64)decode_bound(b, len);
+        post_array *pa = sqlite3_malloc64(sizeof(*pa) + bound * sizeof(uint64_t));
+        if (!pa) return 0;
+        pa->v = (uint64_t *)(pa + 1);
+        pa->n = decode_key(b, len, pa->v);
+        post_tally(st, pa->n, 0);
+        op->arr = *pa;
+        op->owned = pa;
+        return 1;
+    }
+    op->mark = 1;
+    op->entry = post_cache_get(st, b, len);
+    if (op->entry) {
+        op->arr = op->entry->arr;
+        return 1;
+    }
+    uint64_t *buf = post_conn_scratch(st, decode_bound(b, len));
+    if (!buf) return 0;
+    op->arr.v = buf;
+    op->arr.n = decode_key(b, len, buf);
+    post_tally(st, op->arr.n, 0);
+    return 1;
+}
+
+// Må kalles til slutt i UDF-en: SQLite kan frigjøre auxdata med en gang.
+static void post_operand_done(sqlite3_context *ctx, int arg, post_operand *op) {
+    post_cache_release(op->entry);
+    if (op->owned) {
+        sqlite3_set_auxdata(ctx, arg, op->owned, sqlite3_free);
+    } else if (op->mark) {
+        sqlite3_set_auxdata(ctx, arg, &aux_sentinel, NULL);
+    }
+}
+
+// Første indeks i >= from med v[i] >= target, eller n.
+static sqlite3_int64 gallop_geq(const uint64_t *v, sqlite3_int64 n,
+                                sqlite3_int64 from, uint64_t target) {
+    if (from >= n || v[from] >= target) return from;
+    sqlite3_int64 lo = from, hi = from + 1, step = 1;
+    while (hi < n && v[hi] < target) {
+        lo = hi;
+        step <<= 1;
+        hi = from + step;
+    }
+    if (hi > n) hi = n;
+    // v[lo] < target, v[hi] >= target (eller hi == n)
+    while (hi - lo > 1) {
+        sqlite3_int64 mid = lo + (hi - lo) / 2;
+        if (v[mid] < target) lo = mid;
+        else hi = mid;
+    }
+    return hi;
+}
+
+// gallop_geq som flytter minst ett steg (se post_cursor_advance).
+static sqlite3_int64 gallop_advance(const uint64_t *v, sqlite3_int64 n,
+                                    sqlite3_int64 from, uint64_t target) {
+    sqlite3_int64 i = gallop_geq(v, n, from, target);
+    return i > from ? i : from + 1;
+}
+
+// Galloping lønner seg når den ene lista er mye lengre enn den andre og
+// ingen av dem har skip-tabell (da gjør post_cursor_seek jobben).
+static int use_gallop(post_conn *st, const post_cursor *ca, const post_cursor *cb) {
+    if (!st || st->gallop_ratio <= 0 || post_has_skip(ca) || post_has_skip(cb)) return 0;
+    int a_len = (int)(ca->end - ca->data);
+    int b_len = (int)(cb->end - cb->data);
+    if (a_len <= 0 || b_len <= 0) return 0;
+    int short_len = a_len < b_len ? a_len : b_len;
+    int long_len = a_len < b_len ? b_len : a_len;
+    return (sqlite3_int64)long_len >= (sqlite3_int64)st->gallop_ratio * short_len;
+}
+
 // Minimal JSON builder for integer arrays
 static int json_append_char(char **buf, int *len, int *cap, char c) {
     if (*len + 1 >= *cap) {
@@ -77,9 +1020,108 @@ static int json_append_int64(char **buf, int *len, int *cap, sqlite3_int64 v) {
     return 1;
 }
 
+/*
+ * Galloping-kjerner: den korte lista leses med cursor, den lange er dekodet
+ * og søkes i med gallop_geq. Samme resultat som to-pointer-løkkene.
+ */
+static int intersect_gallop(post_cursor *cs, const post_array *l) {
+    sqlite3_int64 i = 0;
+    int count = 0;
+    while (post_cursor_next(cs)) {
+        i = gallop_geq(l->v, l->n, i, cs->acc);
+        if (i >= l->n) break;
+        if (l->v[i] == cs->acc) {
+            count++;
+            i++;
+        }
+    }
+    return count;
+}
+
+// A kort, B lang: for hver a, finnes b i [a + off_min, a + off_max]?
+static int near_count_gallop_b(post_cursor *ca, const post_array *b,
+                               int off_min, int off_max) {
+    sqlite3_int64 j = 0;
+    int count = 0;
+    while (post_cursor_next(ca)) {
+        j = gallop_geq(b->v, b->n, j, seek_target(ca->acc, off_min));
+        if (j >= b->n) break;
+        if (!post_diff_lt(b->v[j], ca->acc, off_min) && !post_diff_gt(b->v[j], ca->acc, off_max)) count++;
+    }
+    return count;
+}
+
+// A lang, B kort: tell a i [b - off_max, b - off_min] for hver b, uten
+// å telle samme a to ganger.
+static int near_count_gallop_a(const post_array *a, post_cursor *cb,
+                               int off_min, int off_max) {
+    sqlite3_int64 i = 0;
+    int count = 0;
+    while (i < a->n && post_cursor_next(cb)) {
+        i = gallop_geq(a->v, a->n, i, seek_target(cb->acc, -(sqlite3_int64)off_max));
+        while (i < a->n && !post_diff_lt(cb->acc, a->v[i], off_min)) {
+            if (!post_diff_gt(cb->acc, a->v[i], off_max)) count++;
+            i++;
+        }
+    }
+    return count;
+}
+
+/*
+ * Kjerner for to dekodede lister (begge fra cachen). Samme semantikk som
+ * to-pointer-løkkene i UDF-ene; seek er gallop_geq.
+ */
+static int intersect_arrays(const post_array *a, const post_array *b) {
+    const post_array *s = a->n <= b->n ? a : b;
+    const post_array *l = a->n <= b->n ? b : a;
+    sqlite3_int64 j = 0;
+    int count = 0;
+    for (sqlite3_int64 i = 0; i < s->n; i++) {
+        j = gallop_geq(l->v, l->n, j, s->v[i]);
+        if (j >= l->n) break;
+        if (l->v[j] == s->v[i]) {
+            count++;
+            j++;
+        }
+    }
+    return count;
+}
+
+static int near_count_arrays(const post_array *a, const post_array *b,
+                             int off_min, int off_max) {
+    sqlite3_int64 j = 0;
+    int count = 0;
+    for (sqlite3_int64 i = 0; i < a->n; i++) {
+        j = gallop_geq(b->v, b->n, j, seek_target(a->v[i], off_min));
+        if (j >= b->n) break;
+        if (!post_diff_lt(b->v[j], a->v[i], off_min) && !post_diff_gt(b->v[j], a->v[i], off_max)) count++;
+    }
+    return count;
+}
+
+// sym = 0: post_intersect_offset (bare B flyttes ved treff), 1: begge.
+static int intersect_offset_arrays(const post_array *a, const post_array *b,
+                                   int off_min, int off_max, int sym) {
+    sqlite3_int64 i = 0, j = 0;
+    int count = 0;
+    while (i < a->n && j < b->n) {
+        if (post_diff_lt(b->v[j], a->v[i], off_min)) {
+            j = gallop_advance(b->v, b->n, j, seek_target(a->v[i], off_min));
+        } else if (post_diff_gt(b->v[j], a->v[i], off_max)) {
+            i = gallop_advance(a->v, a->n, i, seek_target(b->v[j], -(sqlite3_int64)off_max));
+        } else {
+            count++;
+            j++;
+            if (sym) i++;
+        }
+    }
+    return count;
+}
+
 /*
  * post_intersect(blobA, blobB)
  *  - returnerer antall posisjoner som finnes i begge lister (eksakt match)
+ *  - galloper over den lengste lista når lengdeforholdet er stort nok
  */
 static void post_intersect_sqlite(
     sqlite3_context *ctx,
@@ -101,25 +1143,59 @@ static void post_intersect_sqlite(
         return;
     }
 
-    const uint8_t *pa = a, *pb = b;
-    const uint8_t *ea = a + a_len, *eb = b + b_len;
-    uint64_t acc_a = 0, acc_b = 0;
-    int has_a = next_seq(&pa, ea, &acc_a);
-    int has_b = next_seq(&pb, eb, &acc_b);
+    post_cursor ca, cb;
+    if (!post_cursor_open(&ca, a, a_len) || !post_cursor_open(&cb, b, b_len)) {
+        sqlite3_result_error(ctx, "post_intersect: unsupported postings format", -1);
+        return;
+    }
+
+    post_conn *st = sqlite3_user_data(ctx);
+    post_cache_entry *ea, *eb;
+    if (post_cache_pair(st, &ca, &cb, &ea, &eb)) {
+        int count = intersect_arrays(&ea->arr, &eb->arr);
+        post_tally(st, 0, count);
+        sqlite3_result_int(ctx, count);
+        post_cache_release(ea);
+        post_cache_release(eb);
+        return;
+    }
+    if (use_gallop(st, &ca, &cb)) {
+        int a_long = (ca.end - ca.data) >= (cb.end - cb.data);
+        int arg = a_long ? 0 : 1;
+        post_cursor *lc = a_long ? &ca : &cb;
+        post_operand op;
+        const uint8_t *lb;
+        int ll;
+        post_cursor_key(lc, &lb, &ll);
+        if (!post_operand_load(ctx, st, arg, lb, ll, &op)) {
+            sqlite3_result_error_nomem(ctx);
+            return;
+        }
+        post_cursor *sc = a_long ? &cb : &ca;
+        int count = intersect_gallop(sc, &op.arr);
+        post_tally(st, sc->n_next, count);
+        sqlite3_result_int(ctx, count);
+        post_operand_done(ctx, arg, &op);
+        return;
+    }
+
+    int has_a = post_cursor_next(&ca);
+    int has_b = post_cursor_next(&cb);
     int count = 0;
 
     while (has_a && has_b) {
-        if (acc_a == acc_b) {
+        if (ca.acc == cb.acc) {
             count++;
-            has_a = next_seq(&pa, ea, &acc_a);
-            has_b = next_seq(&pb, eb, &acc_b);
-        } else if (acc_a < acc_b) {
-            has_a = next_seq(&pa, ea, &acc_a);
+            has_a = post_cursor_next(&ca);
+            has_b = post_cursor_next(&cb);
+        } else if (ca.acc < cb.acc) {
+            has_a = post_cursor_seek(&ca, cb.acc);
         } else {
-            has_b = next_seq(&pb, eb, &acc_b);
+            has_b = post_cursor_seek(&cb, ca.acc);
         }
     }
 
+    post_tally(st, ca.n_next + cb.n_next, count);
     sqlite3_result_int(ctx, count);
 }
 
@@ -150,32 +1226,45 @@ static void post_intersect_offset_sqlite(
         return;
     }
 
-    const uint8_t *pa = a, *pb = b;
-    const uint8_t *ea = a + a_len, *eb = b + b_len;
-    uint64_t acc_a = 0, acc_b = 0;
+    post_cursor ca, cb;
+    if (!post_cursor_open(&ca, a, a_len) || !post_cursor_open(&cb, b, b_len)) {
+        sqlite3_result_error(ctx, "post_intersect_offset: unsupported postings format", -1);
+        return;
+    }
+
+    post_conn *st = sqlite3_user_data(ctx);
+    post_cache_entry *ea, *eb;
+    if (post_cache_pair(st, &ca, &cb, &ea, &eb)) {
+        int count = intersect_offset_arrays(&ea->arr, &eb->arr, off_min, off_max, 0);
+        post_tally(st, 0, count);
+        sqlite3_result_int(ctx, count);
+        post_cache_release(ea);
+        post_cache_release(eb);
+        return;
+    }
 
-    // For enkelhet: naïv to-pointer med “window”
+    // To-pointer med “window”; seek hopper over hele blokker når
+    // blobene har skip-tabell.
     int count = 0;
-    int has_a = next_seq(&pa, ea, &acc_a);
-    int has_b = next_seq(&pb, eb, &acc_b);
+    int has_a = post_cursor_next(&ca);
+    int has_b = post_cursor_next(&cb);
 
-    // Vi kan gjøre dette smartere senere (galloping/skip), men start enkelt.
     while (has_a && has_b) {
-        int64_t diff = (int64_t)acc_b - (int64_t)acc_a;
-        if (diff < off_min) {
-            // B ligger for langt bak → flytt B fram
-            has_b = next_seq(&pb, eb, &acc_b);
-        } else if (diff > off_max) {
-            // B ligger for langt foran → flytt A fram
-            has_a = next_seq(&pa, ea, &acc_a);
+        if (post_diff_lt(cb.acc, ca.acc, off_min)) {
+            // B ligger for langt bak → flytt B fram til A + off_min
+            has_b = post_cursor_advance(&cb, seek_target(ca.acc, off_min));
+        } else if (post_diff_gt(cb.acc, ca.acc, off_max)) {
+            // B ligger for langt foran → flytt A fram til B - off_max
+            has_a = post_cursor_advance(&ca, seek_target(cb.acc, -(sqlite3_int64)off_max));
         } else {
             // innenfor vindu
             count++;
             // flytt begge videre (eller bare B, avh. av semantikk)
-            has_b = next_seq(&pb, eb, &acc_b);
+            has_b = post_cursor_next(&cb);
         }
     }
 
+    post_tally(st, ca.n_next + cb.n_next, count);
     sqlite3_result_int(ctx, count);
 }
 
@@ -206,28 +1295,41 @@ static void post_intersect_offset_sym_sqlite(
         return;
     }
 
-    const uint8_t *pa = a, *pb = b;
-    const uint8_t *ea = a + a_len, *eb = b + b_len;
-    uint64_t acc_a = 0, acc_b = 0;
+    post_cursor ca, cb;
+    if (!post_cursor_open(&ca, a, a_len) || !post_cursor_open(&cb, b, b_len)) {
+        sqlite3_result_error(ctx, "post_intersect_offset_sym: unsupported postings format", -1);
+        return;
+    }
+
+    post_conn *st = sqlite3_user_data(ctx);
+    post_cache_entry *ea, *eb;
+    if (post_cache_pair(st, &ca, &cb, &ea, &eb)) {
+        int count = intersect_offset_arrays(&ea->arr, &eb->arr, off_min, off_max, 1);
+        post_tally(st, 0, count);
+        sqlite3_result_int(ctx, count);
+        post_cache_release(ea);
+        post_cache_release(eb);
+        return;
+    }
 
     int count = 0;
-    int has_a = next_seq(&pa, ea, &acc_a);
-    int has_b = next_seq(&pb, eb, &acc_b);
+    int has_a = post_cursor_next(&ca);
+    int has_b = post_cursor_next(&cb);
 
     while (has_a && has_b) {
-        int64_t diff = (int64_t)acc_b - (int64_t)acc_a;
-        if (diff < off_min) {
-            has_b = next_seq(&pb, eb, &acc_b);
-        } else if (diff > off_max) {
-            has_a = next_seq(&pa, ea, &acc_a);
+        if (post_diff_lt(cb.acc, ca.acc, off_min)) {
+            has_b = post_cursor_advance(&cb, seek_target(ca.acc, off_min));
+        } else if (post_diff_gt(cb.acc, ca.acc, off_max)) {
+            has_a = post_cursor_advance(&ca, seek_target(cb.acc, -(sqlite3_int64)off_max));
         } else {
             count++;
             // Symmetrisk: flytt begge videre
-            has_a = next_seq(&pa, ea, &acc_a);
-            has_b = next_seq(&pb, eb, &acc_b);
+            has_a = post_cursor_next(&ca);
+            has_b = post_cursor_next(&cb);
         }
     }
 
+    post_tally(st, ca.n_next + cb.n_next, count);
     sqlite3_result_int(ctx, count);
 }
 
@@ -253,22 +1355,36 @@ static void post_sample_sqlite(
         return;
     }
 
-    const uint8_t *p = a;
-    const uint8_t *end = a + a_len;
-    uint64_t acc = 0;
-    int i = 0;
+    post_cursor c;
+    if (!post_cursor_open(&c, a, a_len)) {
+        sqlite3_result_error(ctx, "post_sample: unsupported postings format", -1);
+        return;
+    }
+    post_conn *st = sqlite3_user_data(ctx);
+    if (c.count >= 0 && idx >= c.count) {
+        sqlite3_result_null(ctx);
+        return;
+    }
+    if (c.skip && idx / c.block_size < c.n_blocks) {
+        // Start i blokka som inneholder idx
+        post_cursor_jump(&c, idx / c.block_size);
+        if (c.idx == idx) {
+            post_tally(st, 1, 1);
+            sqlite3_result_int64(ctx, (sqlite3_int64)c.acc);
+            return;
+        }
+    }
 
-    while (p < end) {
-        uint64_t delta = read_varint(&p, end);
-        acc += delta;
-        if (i == idx) {
-            sqlite3_result_int64(ctx, (sqlite3_int64)acc);
+    while (post_cursor_next(&c)) {
+        if (c.idx == idx) {
+            post_tally(st, c.n_next, 1);
+            sqlite3_result_int64(ctx, (sqlite3_int64)c.acc);
             return;
         }
-        i++;
     }
 
     // idx utenfor rekkevidde
+    post_tally(st, c.n_next, 0);
     sqlite3_result_null(ctx);
 }
 
@@ -293,9 +1409,11 @@ static void post_positions_sqlite(
         return;
     }
 
-    const uint8_t *p = a;
-    const uint8_t *end = a + a_len;
-    uint64_t acc = 0;
+    post_cursor c;
+    if (!post_cursor_open(&c, a, a_len)) {
+        sqlite3_result_error(ctx, "post_positions: unsupported postings format", -1);
+        return;
+    }
 
     char *buf = NULL;
     int len = 0;
@@ -307,9 +1425,7 @@ static void post_positions_sqlite(
     }
 
     int first = 1;
-    while (p < end) {
-        uint64_t delta = read_varint(&p, end);
-        acc += delta;
+    while (post_cursor_next(&c)) {
         if (!first) {
             if (!json_append_char(&buf, &len, &cap, ',')) {
                 sqlite3_free(buf);
@@ -318,7 +1434,7 @@ static void post_positions_sqlite(
             }
         }
         first = 0;
-        if (!json_append_int64(&buf, &len, &cap, (sqlite3_int64)acc)) {
+        if (!json_append_int64(&buf, &len, &cap, (sqlite3_int64)c.acc)) {
             sqlite3_free(buf);
             sqlite3_result_error(ctx, "post_positions: OOM", -1);
             return;
@@ -331,6 +1447,7 @@ static void post_positions_sqlite(
         return;
     }
 
+    post_tally(sqlite3_user_data(ctx), c.n_next, c.n_next);
     sqlite3_result_text(ctx, buf, len, sqlite3_free);
 }
 
@@ -360,11 +1477,13 @@ static void post_near_positions_sqlite(
         return;
     }
 
-    const uint8_t *pa = a, *pb = b;
-    const uint8_t *ea = a + a_len, *eb = b + b_len;
-    uint64_t acc_a = 0, acc_b = 0;
-    int has_a = next_seq(&pa, ea, &acc_a);
-    int has_b = next_seq(&pb, eb, &acc_b);
+    post_cursor ca, cb;
+    if (!post_cursor_open(&ca, a, a_len) || !post_cursor_open(&cb, b, b_len)) {
+        sqlite3_result_error(ctx, "post_near_positions: unsupported postings format", -1);
+        return;
+    }
+    int has_a = post_cursor_next(&ca);
+    int has_b = post_cursor_next(&cb);
 
     char *buf = NULL;
     int len = 0;
@@ -376,12 +1495,12 @@ static void post_near_positions_sqlite(
     }
 
     int first = 1;
+    sqlite3_int64 hits = 0;
     while (has_a && has_b) {
-        int64_t diff = (int64_t)acc_b - (int64_t)acc_a;
-        if (diff < off_min) {
-            has_b = next_seq(&pb, eb, &acc_b);
-        } else if (diff > off_max) {
-            has_a = next_seq(&pa, ea, &acc_a);
+        if (post_diff_lt(cb.acc, ca.acc, off_min)) {
+            has_b = post_cursor_advance(&cb, seek_target(ca.acc, off_min));
+        } else if (post_diff_gt(cb.acc, ca.acc, off_max)) {
+            has_a = post_cursor_advance(&ca, seek_target(cb.acc, -(sqlite3_int64)off_max));
         } else {
             if (!first) {
                 if (!json_append_char(&buf, &len, &cap, ',')) {
@@ -391,12 +1510,13 @@ static void post_near_positions_sqlite(
                 }
             }
             first = 0;
-            if (!json_append_int64(&buf, &len, &cap, (sqlite3_int64)acc_a)) {
+            hits++;
+            if (!json_append_int64(&buf, &len, &cap, (sqlite3_int64)ca.acc)) {
                 sqlite3_free(buf);
                 sqlite3_result_error(ctx, "post_near_positions: OOM", -1);
                 return;
             }
-            has_a = next_seq(&pa, ea, &acc_a);
+            has_a = post_cursor_next(&ca);
         }
     }
 
@@ -406,6 +1526,7 @@ static void post_near_positions_sqlite(
         return;
     }
 
+    post_tally(sqlite3_user_data(ctx), ca.n_next + cb.n_next, hits);
     sqlite3_result_text(ctx, buf, len, sqlite3_free);
 }
 
@@ -435,28 +1556,2626 @@ static void post_near_count_sqlite(
         return;
     }
 
-    const uint8_t *pa = a, *pb = b;
-    const uint8_t *ea = a + a_len, *eb = b + b_len;
-    uint64_t acc_a = 0, acc_b = 0;
-    int has_a = next_seq(&pa, ea, &acc_a);
-    int has_b = next_seq(&pb, eb, &acc_b);
-    int count = 0;
+    post_cursor ca, cb;
+    if (!post_cursor_open(&ca, a, a_len) || !post_cursor_open(&cb, b, b_len)) {
+        sqlite3_result_error(ctx, "post_near_count: unsupported postings format", -1);
+        return;
+    }
+
+    post_conn *st = sqlite3_user_data(ctx);
+    post_cache_entry *ea, *eb;
+    if (post_cache_pair(st, &ca, &cb, &ea, &eb)) {
+        int count = near_count_arrays(&ea->arr, &eb->arr, off_min, off_max);
+        post_tally(st, 0, count);
+        sqlite3_result_int(ctx, count);
+        post_cache_release(ea);
+        post_cache_release(eb);
+        return;
+    }
+    if (use_gallop(st, &ca, &cb)) {
+        int a_long = (ca.end - ca.data) >= (cb.end - cb.data);
+        int arg = a_long ? 0 : 1;
+        post_cursor *lc = a_long ? &ca : &cb;
+        post_operand op;
+        const uint8_t *lb;
+        int ll;
+        post_cursor_key(lc, &lb, &ll);
+        if (!post_operand_load(ctx, st, arg, lb, ll, &op)) {
+            sqlite3_result_error_nomem(ctx);
+            return;
+        }
+        int count = a_long
+            ? near_count_gallop_a(&op.arr, &cb, off_min, off_max)
+            : near_count_gallop_b(&ca, &op.arr, off_min, off_max);
+        post_tally(st, (a_long ? &cb : &ca)->n_next, count);
+        sqlite3_result_int(ctx, count);
+        post_operand_done(ctx, arg, &op);
+        return;
+    }
+    int has_a = post_cursor_next(&ca);
+    int has_b = post_cursor_next(&cb);
+    int count = 0;
+
+    while (has_a && has_b) {
+        if (post_diff_lt(cb.acc, ca.acc, off_min)) {
+            has_b = post_cursor_advance(&cb, seek_target(ca.acc, off_min));
+        } else if (post_diff_gt(cb.acc, ca.acc, off_max)) {
+            has_a = post_cursor_advance(&ca, seek_target(cb.acc, -(sqlite3_int64)off_max));
+        } else {
+            count++;
+            has_a = post_cursor_next(&ca);
+        }
+    }
+
+    post_tally(st, ca.n_next + cb.n_next, count);
+    sqlite3_result_int(ctx, count);
+}
+
+/*
+ * Frase-søk over N lister: term i må stå på start + i.
+ *
+ * Én leapfrog-merge drevet av den korteste lista (minst data): for hver
+ * kandidat fra driveren søkes de andre listene fram med post_cursor_seek,
+ * korteste først. En bom gir ny kandidat, og driveren hopper dit.
+ */
+typedef struct post_phrase {
+    post_cursor *c;
+    int *order;             // de andre listene, kortest først
+    int n;
+    int d;                  // driver
+    int live;               // 0 når en liste er tom eller tatt slutt
+} post_phrase;
+
+// Returnerer 0 (og setter feil) ved ukjent format eller OOM.
+static int post_phrase_open(sqlite3_context *ctx, int argc, sqlite3_value **argv,
+                            const char *name, post_phrase *ph) {
+    memset(ph, 0, sizeof(*ph));
+    ph->c = sqlite3_malloc64((sqlite3_uint64)argc * (sizeof(post_cursor) + sizeof(int)));
+    if (!ph->c) {
+        sqlite3_result_error_nomem(ctx);
+        return 0;
+    }
+    ph->order = (int *)(ph->c + argc);
+    ph->n = argc;
+    ph->live = 1;
+    for (int i = 0; i < argc; i++) {
+        const unsigned char *b = sqlite3_value_blob(argv[i]);
+        int len = sqlite3_value_bytes(argv[i]);
+        if (!post_cursor_open(&ph->c[i], b, len)) {
+            char *msg = sqlite3_mprintf("%s: unsupported postings format", name);
+            sqlite3_result_error(ctx, msg ? msg : name, -1);
+            sqlite3_free(msg);
+            sqlite3_free(ph->c);
+            ph->c = NULL;
+            return 0;
+        }
+        if (!b || len <= 0) ph->live = 0;
+    }
+    for (int i = 1; i < argc; i++) {
+        if (ph->c[i].end - ph->c[i].data < ph->c[ph->d].end - ph->c[ph->d].data) ph->d = i;
+    }
+    int k = 0;
+    for (int i = 0; i < argc; i++) {
+        if (i != ph->d) ph->order[k++] = i;
+    }
+    // innsettingssortering på lengde; N er liten
+    for (int i = 1; i < k; i++) {
+        int x = ph->order[i];
+        sqlite3_int64 xl = ph->c[x].end - ph->c[x].data;
+        int j = i - 1;
+        while (j >= 0 && ph->c[ph->order[j]].end - ph->c[ph->order[j]].data > xl) {
+            ph->order[j + 1] = ph->order[j];
+            j--;
+        }
+        ph->order[j + 1] = x;
+    }
+    for (int i = 0; i < argc && ph->live; i++) {
+        if (!post_cursor_next(&ph->c[i])) ph->live = 0;
+    }
+    return 1;
+}
+
+static void post_phrase_close(post_phrase *ph) {
+    sqlite3_free(ph->c);
+    ph->c = NULL;
+}
+
+// Neste frasestart, eller 0 når en av listene er oppbrukt.
+static int post_phrase_next(post_phrase *ph, uint64_t *start) {
+    post_cursor *dc = &ph->c[ph->d];
+    uint64_t d = (uint64_t)ph->d;
+    while (ph->live) {
+        if (dc->acc < d && !post_cursor_seek(dc, d)) break;
+        uint64_t s = dc->acc - d;
+        int hit = 1;
+        for (int k = 0; k < ph->n - 1; k++) {
+            int j = ph->order[k];
+            uint64_t want = s + (uint64_t)j;
+            // want < s: frasen går forbi 2^64 - 1 og får ikke plass.
+            if (want < s || !post_cursor_seek(&ph->c[j], want)) {
+                ph->live = 0;
+                return 0;
+            }
+            if (ph->c[j].acc != want) {
+                // Tidligste mulige start er nå acc - j; driveren hopper dit.
+                uint64_t next_s = ph->c[j].acc - (uint64_t)j;
+                if (next_s > UINT64_MAX - d || !post_cursor_advance(dc, next_s + d)) ph->live = 0;
+                hit = 0;
+                break;
+            }
+        }
+        if (hit) {
+            *start = s;
+            if (!post_cursor_next(dc)) ph->live = 0;
+            return 1;
+        }
+    }
+    ph->live = 0;
+    return 0;
+}
+
+static sqlite3_int64 post_phrase_decoded(const post_phrase *ph) {
+    sqlite3_int64 n = 0;
+    for (int i = 0; i < ph->n; i++) n += ph->c[i].n_next;
+    return n;
+}
+
+/*
+ * post_phrase_count(blob1, ..., blobN)
+ *  - antall posisjoner s der blob_i inneholder s + i - 1 for alle i
+ */
+static void post_phrase_count_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc < 1) {
+        sqlite3_result_error(ctx, "post_phrase_count(blob, ...) expects at least 1 arg", -1);
+        return;
+    }
+    post_phrase ph;
+    if (!post_phrase_open(ctx, argc, argv, "post_phrase_count", &ph)) return;
+    sqlite3_int64 count = 0;
+    uint64_t s;
+    while (post_phrase_next(&ph, &s)) count++;
+    post_tally(sqlite3_user_data(ctx), post_phrase_decoded(&ph), count);
+    post_phrase_close(&ph);
+    sqlite3_result_int64(ctx, count);
+}
+
+/*
+ * post_phrase_positions(blob1, ..., blobN)
+ *  - startposisjonene for frasen som JSON-array
+ */
+static void post_phrase_positions_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc < 1) {
+        sqlite3_result_error(ctx, "post_phrase_positions(blob, ...) expects at least 1 arg", -1);
+        return;
+    }
+    post_phrase ph;
+    if (!post_phrase_open(ctx, argc, argv, "post_phrase_positions", &ph)) return;
+
+    char *buf = NULL;
+    int len = 0;
+    int cap = 0;
+    int ok = json_append_char(&buf, &len, &cap, '[');
+    uint64_t s;
+    int first = 1;
+    sqlite3_int64 hits = 0;
+    while (ok && post_phrase_next(&ph, &s)) {
+        if (!first) ok = json_append_char(&buf, &len, &cap, ',');
+        first = 0;
+        hits++;
+        if (ok) ok = json_append_int64(&buf, &len, &cap, (sqlite3_int64)s);
+    }
+    if (ok) ok = json_append_char(&buf, &len, &cap, ']');
+    post_tally(sqlite3_user_data(ctx), post_phrase_decoded(&ph), hits);
+    post_phrase_close(&ph);
+    if (!ok) {
+        sqlite3_free(buf);
+        sqlite3_result_error(ctx, "post_phrase_positions: OOM", -1);
+        return;
+    }
+    sqlite3_result_text(ctx, buf, len, sqlite3_free);
+}
+
+/*
+ * Mengdeoperasjoner som returnerer postings-blober
+ *
+ * post_and, post_or, post_andnot, post_shift og post_near gir en ny
+ * delta+varint-blob (legacy-format, uten header), så resultatet kan gis
+ * rett videre til de andre funksjonene. Tom liste er en tom blob.
+ * post_union_agg slår sammen mange blober i én k-veis merge.
+ */
+typedef struct post_writer {
+    uint8_t *buf;
+    sqlite3_int64 len, cap;
+    uint64_t last;
+    sqlite3_int64 n;            // posisjoner skrevet
+    int oom;
+} post_writer;
+
+// Plass til n bytes til; 0 (og oom) hvis allokeringen feiler.
+static int post_writer_reserve(post_writer *w, sqlite3_int64 n) {
+    if (w->oom) return 0;
+    if (w->len + n > w->cap) {
+        sqlite3_int64 cap = w->cap ? w->cap * 2 : 256;
+        while (cap < w->len + n) cap *= 2;
+        uint8_t *buf = sqlite3_realloc64(w->buf, (sqlite3_uint64)cap);
+        if (!buf) {
+            w->oom = 1;
+            return 0;
+        }
+        w->buf = buf;
+        w->cap = cap;
+    }
+    return 1;
+}
+
+static void post_writer_varint(post_writer *w, uint64_t n) {
+    if (!post_writer_reserve(w, 10)) return;
+    while (n > 0x7f) {
+        w->buf[w->len++] = (uint8_t)((n & 0x7f) | 0x80);
+        n >>= 7;
+    }
+    w->buf[w->len++] = (uint8_t)n;
+}
+
+static void post_writer_bytes(post_writer *w, const void *p, sqlite3_int64 n) {
+    if (n <= 0 || !post_writer_reserve(w, n)) return;
+    memcpy(w->buf + w->len, p, (size_t)n);
+    w->len += n;
+}
+
+// Posisjoner må komme stigende og uten duplikater.
+static void post_writer_put(post_writer *w, uint64_t pos) {
+    uint64_t n = pos - w->last;
+    w->last = pos;
+    w->n++;
+    post_writer_varint(w, n);
+}
+
+static void post_writer_result(sqlite3_context *ctx, post_writer *w) {
+    if (w->oom) {
+        sqlite3_free(w->buf);
+        sqlite3_result_error_nomem(ctx);
+    } else if (w->len == 0) {
+        sqlite3_free(w->buf);
+        sqlite3_result_zeroblob(ctx, 0);
+    } else {
+        sqlite3_result_blob64(ctx, w->buf, (sqlite3_uint64)w->len, sqlite3_free);
+    }
+}
+
+// Åpner argv[0] og argv[1]; NULL og tomme blober er tomme lister.
+static int post_open_pair(sqlite3_context *ctx, sqlite3_value **argv, const char *err,
+                          post_cursor *ca, post_cursor *cb) {
+    if (!post_cursor_open(ca, sqlite3_value_blob(argv[0]), sqlite3_value_bytes(argv[0])) ||
+        !post_cursor_open(cb, sqlite3_value_blob(argv[1]), sqlite3_value_bytes(argv[1]))) {
+        sqlite3_result_error(ctx, err, -1);
+        return 0;
+    }
+    return 1;
+}
+
+/*
+ * post_and(blobA, blobB) -> blob
+ *  - posisjoner som finnes i begge lister
+ */
+static void post_and_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2) {
+        sqlite3_result_error(ctx, "post_and(blob, blob) expects 2 args", -1);
+        return;
+    }
+    post_cursor ca, cb;
+    if (!post_open_pair(ctx, argv, "post_and: unsupported postings format", &ca, &cb)) return;
+
+    post_writer w = {0};
+    int has_a = post_cursor_next(&ca);
+    int has_b = post_cursor_next(&cb);
+    while (has_a && has_b) {
+        if (ca.acc == cb.acc) {
+            post_writer_put(&w, ca.acc);
+            has_a = post_cursor_next(&ca);
+            has_b = post_cursor_next(&cb);
+        } else if (ca.acc < cb.acc) {
+            has_a = post_cursor_seek(&ca, cb.acc);
+        } else {
+            has_b = post_cursor_seek(&cb, ca.acc);
+        }
+    }
+    post_tally(sqlite3_user_data(ctx), ca.n_next + cb.n_next, w.n);
+    post_writer_result(ctx, &w);
+}
+
+/*
+ * post_or(blobA, blobB) -> blob
+ *  - posisjoner som finnes i minst én av listene
+ */
+static void post_or_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2) {
+        sqlite3_result_error(ctx, "post_or(blob, blob) expects 2 args", -1);
+        return;
+    }
+    post_cursor ca, cb;
+    if (!post_open_pair(ctx, argv, "post_or: unsupported postings format", &ca, &cb)) return;
+
+    post_writer w = {0};
+    int has_a = post_cursor_next(&ca);
+    int has_b = post_cursor_next(&cb);
+    while (has_a && has_b) {
+        if (ca.acc == cb.acc) {
+            post_writer_put(&w, ca.acc);
+            has_a = post_cursor_next(&ca);
+            has_b = post_cursor_next(&cb);
+        } else if (ca.acc < cb.acc) {
+            post_writer_put(&w, ca.acc);
+            has_a = post_cursor_next(&ca);
+        } else {
+            post_writer_put(&w, cb.acc);
+            has_b = post_cursor_next(&cb);
+        }
+    }
+    for (; has_a; has_a = post_cursor_next(&ca)) post_writer_put(&w, ca.acc);
+    for (; has_b; has_b = post_cursor_next(&cb)) post_writer_put(&w, cb.acc);
+    post_tally(sqlite3_user_data(ctx), ca.n_next + cb.n_next, w.n);
+    post_writer_result(ctx, &w);
+}
+
+/*
+ * post_andnot(blobA, blobB) -> blob
+ *  - posisjoner i A som ikke finnes i B
+ */
+static void post_andnot_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2) {
+        sqlite3_result_error(ctx, "post_andnot(blob, blob) expects 2 args", -1);
+        return;
+    }
+    post_cursor ca, cb;
+    if (!post_open_pair(ctx, argv, "post_andnot: unsupported postings format", &ca, &cb)) return;
+
+    post_writer w = {0};
+    int has_b = post_cursor_next(&cb);
+    while (post_cursor_next(&ca)) {
+        if (has_b) has_b = post_cursor_seek(&cb, ca.acc);
+        if (!has_b || cb.acc != ca.acc) post_writer_put(&w, ca.acc);
+    }
+    post_tally(sqlite3_user_data(ctx), ca.n_next + cb.n_next, w.n);
+    post_writer_result(ctx, &w);
+}
+
+/*
+ * post_shift(blob, off) -> blob
+ *  - alle posisjoner flyttet med off; posisjoner som blir negative faller bort
+ *  - post_and(a, post_shift(b, -1)) er bigrammet "a b" (startposisjoner)
+ */
+static void post_shift_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2) {
+        sqlite3_result_error(ctx, "post_shift(blob, off) expects 2 args", -1);
+        return;
+    }
+    post_cursor c;
+    if (!post_cursor_open(&c, sqlite3_value_blob(argv[0]), sqlite3_value_bytes(argv[0]))) {
+        sqlite3_result_error(ctx, "post_shift: unsupported postings format", -1);
+        return;
+    }
+    sqlite3_int64 off = sqlite3_value_int64(argv[1]);
+
+    post_writer w = {0};
+    if (off < 0 && !post_cursor_seek_first(&c, (uint64_t)(-off))) {
+        post_writer_result(ctx, &w);
+        return;
+    }
+    do {
+        if (c.idx >= 0) post_writer_put(&w, c.acc + (uint64_t)off);
+    } while (post_cursor_next(&c));
+    post_tally(sqlite3_user_data(ctx), c.n_next, w.n);
+    post_writer_result(ctx, &w);
+}
+
+/*
+ * post_near(blobA, blobB, off_min, off_max) -> blob
+ *  - posisjonene i A der det finnes en B innenfor [off_min, off_max]
+ *    (samme som post_near_positions, men som blob)
+ */
+static void post_near_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 4) {
+        sqlite3_result_error(ctx, "post_near(blob, blob, off_min, off_max) expects 4 args", -1);
+        return;
+    }
+    post_cursor ca, cb;
+    if (!post_open_pair(ctx, argv, "post_near: unsupported postings format", &ca, &cb)) return;
+    int off_min = sqlite3_value_int(argv[2]);
+    int off_max = sqlite3_value_int(argv[3]);
+
+    post_writer w = {0};
+    int has_a = post_cursor_next(&ca);
+    int has_b = post_cursor_next(&cb);
+    while (has_a && has_b) {
+        if (post_diff_lt(cb.acc, ca.acc, off_min)) {
+            has_b = post_cursor_advance(&cb, seek_target(ca.acc, off_min));
+        } else if (post_diff_gt(cb.acc, ca.acc, off_max)) {
+            has_a = post_cursor_advance(&ca, seek_target(cb.acc, -(sqlite3_int64)off_max));
+        } else {
+            post_writer_put(&w, ca.acc);
+            has_a = post_cursor_next(&ca);
+        }
+    }
+    post_tally(sqlite3_user_data(ctx), ca.n_next + cb.n_next, w.n);
+    post_writer_result(ctx, &w);
+}
+
+// Antall varinter i en legacy-strøm. En avkortet siste varint teller med,
+// slik read_varint gjør.
+static sqlite3_int64 count_varints(const uint8_t *p, const uint8_t *end) {
+    sqlite3_int64 n = 0;
+    for (const uint8_t *q = p; q < end; q++) n += (*q & 0x80) == 0;
+    if (end > p && (end[-1] & 0x80)) n++;
+    return n;
+}
+
+/*
+ * post_recode(blob, format [, block_size]) -> blob
+ *  - samme liste i et annet format: 'plain' (legacy), 'count', 'skip'
+ *    (blokker à block_size, standard POST_PACK_BLOCK) eller 'packed'
+ *  - skriver formatet uansett lengde; konverteringsskriptene bruker skip og
+ *    packed bare for lister lengre enn én blokk
+ *  - for å migrere en shard på stedet:
+ *      UPDATE postings SET blob = post_recode(blob, 'packed')
+ *      WHERE post_count(blob) > 128;
+ */
+static void post_writer_header(post_writer *w, int fmt, sqlite3_int64 count) {
+    uint8_t head[3] = {POST_MAGIC0, POST_MAGIC1, (uint8_t)fmt};
+    post_writer_bytes(w, head, 3);
+    post_writer_varint(w, (uint64_t)count);
+}
+
+static void put_u32le(uint8_t *p, uint32_t x) {
+    p[0] = (uint8_t)x;
+    p[1] = (uint8_t)(x >> 8);
+    p[2] = (uint8_t)(x >> 16);
+    p[3] = (uint8_t)(x >> 24);
+}
+
+// Skriv v[0..n) som skip-tabell + delta+varint.
+static void post_encode_skip(post_writer *out, const uint64_t *v, sqlite3_int64 n, int block_size) {
+    sqlite3_int64 n_blocks = (n + block_size - 1) / block_size;
+    post_writer_header(out, POST_FMT_SKIP, n);
+    post_writer_varint(out, (uint64_t)block_size);
+    post_writer_varint(out, (uint64_t)n_blocks);
+    sqlite3_int64 table = out->len;
+    if (!post_writer_reserve(out, n_blocks * POST_SKIP_ENTRY)) return;
+    out->len += n_blocks * POST_SKIP_ENTRY;
+    sqlite3_int64 data = out->len;
+    for (sqlite3_int64 i = 0; i < n; i++) {
+        if (i % block_size == 0) {
+            uint8_t *e = out->buf + table + (i / block_size) * POST_SKIP_ENTRY;
+            put_u32le(e, (uint32_t)v[i]);
+            put_u32le(e + 4, (uint32_t)(out->len - data));
+        }
+        post_writer_put(out, v[i]);
+        if (out->oom) return;
+    }
+}
+
+// Skriv v[0..n) som bit-pakkede blokker (POST_FMT_PACKED).
+static void post_encode_packed(post_writer *out, const uint64_t *v, sqlite3_int64 n) {
+    sqlite3_int64 n_blocks = (n + POST_PACK_BLOCK - 1) / POST_PACK_BLOCK;
+    post_writer_header(out, POST_FMT_PACKED, n);
+    post_writer_varint(out, (uint64_t)n_blocks);
+    sqlite3_int64 table = out->len;
+    if (!post_writer_reserve(out, n_blocks * POST_SKIP_ENTRY)) return;
+    out->len += n_blocks * POST_SKIP_ENTRY;
+    sqlite3_int64 data = out->len;
+    for (sqlite3_int64 i = 0; i < n; i += POST_PACK_BLOCK) {
+        sqlite3_int64 m = n - i < POST_PACK_BLOCK ? n - i : POST_PACK_BLOCK;
+        uint32_t max = 0;
+        for (sqlite3_int64 j = 1; j < m; j++) {
+            uint32_t d = (uint32_t)(v[i + j] - v[i + j - 1] - 1);
+            if (d > max) max = d;
+        }
+        int w = 0;
+        while (w < 32 && (max >> w) != 0) w++;
+        uint8_t *e = out->buf + table + (i / POST_PACK_BLOCK) * POST_SKIP_ENTRY;
+        put_u32le(e, (uint32_t)v[i]);
+        put_u32le(e + 4, (uint32_t)(out->len - data));
+        if (!post_writer_reserve(out, 1 + ((m - 1) * w + 7) / 8)) return;
+        out->buf[out->len++] = (uint8_t)w;
+        uint64_t bits = 0;
+        int nbits = 0;
+        for (sqlite3_int64 j = 1; j < m; j++) {
+            bits |= (uint64_t)(uint32_t)(v[i + j] - v[i + j - 1] - 1) << nbits;
+            nbits += w;
+            while (nbits >= 8) {
+                out->buf[out->len++] = (uint8_t)bits;
+                bits >>= 8;
+                nbits -= 8;
+            }
+        }
+        if (nbits > 0) out->buf[out->len++] = (uint8_t)bits;
+    }
+}
+
+static void post_recode_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2 && argc != 3) {
+        sqlite3_result_error(ctx, "post_recode(blob, format [, block_size]) expects 2-3 args", -1);
+        return;
+    }
+    const char *fmt = (const char *)sqlite3_value_text(argv[1]);
+    int target = -1;
+    if (fmt && strcmp(fmt, "plain") == 0) target = -2;
+    else if (fmt && strcmp(fmt, "count") == 0) target = POST_FMT_COUNT;
+    else if (fmt && strcmp(fmt, "skip") == 0) target = POST_FMT_SKIP;
+    else if (fmt && strcmp(fmt, "packed") == 0) target = POST_FMT_PACKED;
+    if (target == -1) {
+        sqlite3_result_error(ctx,
+            "post_recode: format must be 'plain', 'count', 'skip' or 'packed'", -1);
+        return;
+    }
+    sqlite3_int64 block_size = argc == 3 ? sqlite3_value_int64(argv[2]) : POST_PACK_BLOCK;
+    if (block_size <= 0 || block_size > 0x7fffffff) {
+        sqlite3_result_error(ctx, "post_recode: block_size must be positive", -1);
+        return;
+    }
+    post_cursor c;
+    if (!post_cursor_open(&c, sqlite3_value_blob(argv[0]), sqlite3_value_bytes(argv[0]))) {
+        sqlite3_result_error(ctx, "post_recode: unsupported postings format", -1);
+        return;
+    }
+
+    post_conn *st = sqlite3_user_data(ctx);
+    sqlite3_int64 cap = c.count >= 0 ? c.count : count_varints(c.data, c.end);
+    uint64_t *v = post_conn_scratch(st, cap ? cap : 1);
+    if (!v) {
+        sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    sqlite3_int64 n = 0;
+    while (n < cap && post_cursor_next(&c)) v[n++] = c.acc;
+    post_tally(st, c.n_next, n);
+    if ((target == POST_FMT_SKIP || target == POST_FMT_PACKED) && n && v[n - 1] > 0xFFFFFFFFu) {
+        sqlite3_result_error(ctx, "post_recode: skip and packed formats need positions < 2^32", -1);
+        return;
+    }
+
+    post_writer w = {0};
+    if (target == POST_FMT_SKIP) {
+        post_encode_skip(&w, v, n, (int)block_size);
+    } else if (target == POST_FMT_PACKED) {
+        post_encode_packed(&w, v, n);
+    } else {
+        if (target == POST_FMT_COUNT) post_writer_header(&w, POST_FMT_COUNT, n);
+        for (sqlite3_int64 i = 0; i < n; i++) post_writer_put(&w, v[i]);
+    }
+    post_writer_result(ctx, &w);
+}
+
+/*
+ * post_union_agg(blob) (aggregat)
+ *  - unionen av alle blobene i gruppa, f.eks. alle bøyningsformer av et lemma:
+ *      SELECT bok_id, post_union_agg(blob) FROM postings
+ *      WHERE word IN ('hus', 'huset', 'husene') GROUP BY bok_id;
+ *  - xStep kopierer blobene; xFinal gjør én k-veis merge med en min-heap.
+ */
+typedef struct post_union_acc {
+    uint8_t **blobs;
+    int *lens;
+    int n, cap;
+} post_union_acc;
+
+static void post_union_agg_step(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    const uint8_t *b = sqlite3_value_blob(argv[0]);
+    int len = sqlite3_value_bytes(argv[0]);
+    post_union_acc *acc = sqlite3_aggregate_context(ctx, sizeof(*acc));
+    if (!acc) {
+        sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    if (!b || len <= 0) return;
+    if (acc->n == acc->cap) {
+        int cap = acc->cap ? acc->cap * 2 : 16;
+        uint8_t **blobs = sqlite3_realloc64(acc->blobs, (sqlite3_uint64)cap * sizeof(*blobs));
+        if (!blobs) {
+            sqlite3_result_error_nomem(ctx);
+            return;
+        }
+        acc->blobs = blobs;
+        int *lens = sqlite3_realloc64(acc->lens, (sqlite3_uint64)cap * sizeof(*lens));
+        if (!lens) {
+            sqlite3_result_error_nomem(ctx);
+            return;
+        }
+        acc->lens = lens;
+        acc->cap = cap;
+    }
+    uint8_t *copy = sqlite3_malloc(len);
+    if (!copy) {
+        sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    memcpy(copy, b, len);
+    acc->blobs[acc->n] = copy;
+    acc->lens[acc->n] = len;
+    acc->n++;
+}
+
+static void post_heap_down(int *heap, int n, const post_cursor *c, int i) {
+    for (;;) {
+        int l = 2 * i + 1, m = i;
+        if (l < n && c[heap[l]].acc < c[heap[m]].acc) m = l;
+        if (l + 1 < n && c[heap[l + 1]].acc < c[heap[m]].acc) m = l + 1;
+        if (m == i) return;
+        int t = heap[i];
+        heap[i] = heap[m];
+        heap[m] = t;
+        i = m;
+    }
+}
+
+static void post_union_agg_final(sqlite3_context *ctx) {
+    post_union_acc *acc = sqlite3_aggregate_context(ctx, 0);
+    post_writer w = {0};
+    if (!acc || acc->n == 0) {
+        if (acc) {
+            sqlite3_free(acc->blobs);
+            sqlite3_free(acc->lens);
+        }
+        post_writer_result(ctx, &w);
+        return;
+    }
+
+    int k = acc->n;
+    post_cursor *c = sqlite3_malloc64((sqlite3_uint64)k * (sizeof(post_cursor) + sizeof(int)));
+    int *heap = c ? (int *)(c + k) : NULL;
+    int n = 0;
+    int bad = 0;
+    for (int i = 0; c && i < k; i++) {
+        if (!post_cursor_open(&c[i], acc->blobs[i], acc->lens[i])) bad = 1;
+        else if (post_cursor_next(&c[i])) heap[n++] = i;
+    }
+    if (c && !bad) {
+        for (int i = n / 2 - 1; i >= 0; i--) post_heap_down(heap, n, c, i);
+        int first = 1;
+        while (n > 0) {
+            post_cursor *top = &c[heap[0]];
+            if (first || top->acc != w.last) post_writer_put(&w, top->acc);
+            first = 0;
+            if (!post_cursor_next(top)) heap[0] = heap[--n];
+            post_heap_down(heap, n, c, 0);
+        }
+        sqlite3_int64 decoded = 0;
+        for (int i = 0; i < k; i++) decoded += c[i].n_next;
+        post_tally(sqlite3_user_data(ctx), decoded, w.n);
+    }
+
+    for (int i = 0; i < k; i++) sqlite3_free(acc->blobs[i]);
+    sqlite3_free(acc->blobs);
+    sqlite3_free(acc->lens);
+    sqlite3_free(c);
+    if (!c) {
+        sqlite3_free(w.buf);
+        sqlite3_result_error_nomem(ctx);
+    } else if (bad) {
+        sqlite3_free(w.buf);
+        sqlite3_result_error(ctx, "post_union_agg: unsupported postings format", -1);
+    } else {
+        post_writer_result(ctx, &w);
+    }
+}
+
+/*
+ * Delkorpus
+ *
+ *   CREATE TABLE subcorpora (name TEXT PRIMARY KEY, bitmap BLOB NOT NULL);
+ *
+ * Et delkorpus er en sortert liste av bok_id lagret som en vanlig postings-
+ * blob (hvilket som helst format), så den kan lagres, gjenbrukes og bindes
+ * som én parameter i stedet for en IN-liste med tusenvis av plassholdere.
+ * Tabellen slås opp uten skjemanavn, så den kan ligge i temp eller i en
+ * ATTACH-et database ved siden av en skrivebeskyttet shard.
+ *
+ *   post_contains(blob, x)       -> 1 hvis x er i lista
+ *   subcorpus_has(name, bok_id)  -> 1 hvis bok_id er i delkorpuset name
+ *   subcorpus_each(name)         -> én rad per bok_id (se post_each)
+ *
+ * Med konstant blob/navn dekodes lista én gang per statement (auxdata), og
+ * hvert oppslag er et binærsøk.
+ */
+#define POST_SUBCORPUS_SQL "SELECT bitmap FROM subcorpora WHERE name = ?1"
+
+// Kjør oppslaget i stmt for navnet i name. Gir SQLITE_ROW med blobben som
+// kolonne 0, eller SQLITE_DONE hvis navnet ikke finnes.
+static int post_subcorpus_step(sqlite3 *db, sqlite3_stmt **stmt, sqlite3_value *name) {
+    if (!*stmt) {
+        int rc = sqlite3_prepare_v2(db, POST_SUBCORPUS_SQL, -1, stmt, NULL);
+        if (rc != SQLITE_OK) return rc;
+    }
+    sqlite3_reset(*stmt);
+    sqlite3_bind_value(*stmt, 1, name);
+    return sqlite3_step(*stmt);
+}
+
+static char *post_subcorpus_error(sqlite3 *db, int rc, sqlite3_value *name) {
+    if (rc == SQLITE_DONE) {
+        return sqlite3_mprintf("no subcorpus named '%s'", sqlite3_value_text(name));
+    }
+    return sqlite3_mprintf("subcorpora: %s", sqlite3_errmsg(db));
+}
+
+// Dekod hele lista i b til ett sqlite3_malloc-et post_array (for auxdata).
+static post_array *post_array_decode(post_conn *st, const uint8_t *b, int len, int *bad) {
+    post_cursor c;
+    const uint8_t *key;
+    int key_len;
+    *bad = 0;
+    if (!post_cursor_open(&c, b, len)) {
+        *bad = 1;
+        return NULL;
+    }
+    post_cursor_key(&c, &key, &key_len);
+    sqlite3_uint64 bound = (sqlite3_uint64)decode_bound(key, key_len);
+    post_array *pa = sqlite3_malloc64(sizeof(*pa) + bound * sizeof(uint64_t));
+    if (!pa) return NULL;
+    pa->v = (uint64_t *)(pa + 1);
+    pa->n = decode_key(key, key_len, pa->v);
+    post_tally(st, pa->n, 0);
+    return pa;
+}
+
+static int post_array_has(const post_array *arr, sqlite3_int64 x) {
+    if (x < 0) return 0;
+    sqlite3_int64 i = gallop_geq(arr->v, arr->n, 0, (uint64_t)x);
+    return i < arr->n && arr->v[i] == (uint64_t)x;
+}
+
+/*
+ * post_contains(blob, x)
+ *  - 1 hvis x er en av posisjonene i blob, ellers 0 (NULL hvis x er NULL)
+ *  - konstant blob (f.eks. en bundet ?) dekodes bare én gang per statement
+ */
+static void post_contains_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2) {
+        sqlite3_result_error(ctx, "post_contains(blob, x) expects 2 args", -1);
+        return;
+    }
+    if (sqlite3_value_type(argv[1]) == SQLITE_NULL) {
+        sqlite3_result_null(ctx);
+        return;
+    }
+    const unsigned char *a = sqlite3_value_blob(argv[0]);
+    int a_len = sqlite3_value_bytes(argv[0]);
+    if (!a || a_len <= 0) {
+        sqlite3_result_int(ctx, 0);
+        return;
+    }
+
+    post_cursor c;
+    if (!post_cursor_open(&c, a, a_len)) {
+        sqlite3_result_error(ctx, "post_contains: unsupported postings format", -1);
+        return;
+    }
+    post_conn *st = sqlite3_user_data(ctx);
+    post_operand op;
+    const uint8_t *key;
+    int key_len;
+    post_cursor_key(&c, &key, &key_len);
+    if (!post_operand_load(ctx, st, 0, key, key_len, &op)) {
+        sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    int found = post_array_has(&op.arr, sqlite3_value_int64(argv[1]));
+    post_tally(st, 0, found);
+    sqlite3_result_int(ctx, found);
+    post_operand_done(ctx, 0, &op);
+}
+
+/*
+ * subcorpus_has(name, bok_id)
+ *  - 1 hvis bok_id er med i delkorpuset name i tabellen subcorpora, ellers 0
+ *  - feiler hvis navnet ikke finnes
+ */
+static void subcorpus_has_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2) {
+        sqlite3_result_error(ctx, "subcorpus_has(name, bok_id) expects 2 args", -1);
+        return;
+    }
+    if (sqlite3_value_type(argv[1]) == SQLITE_NULL) {
+        sqlite3_result_null(ctx);
+        return;
+    }
+
+    post_conn *st = sqlite3_user_data(ctx);
+    post_array *pa = sqlite3_get_auxdata(ctx, 0);
+    int loaded = 0;
+    if (!pa) {
+        sqlite3 *db = sqlite3_context_db_handle(ctx);
+        sqlite3_stmt *stmt = NULL;
+        int rc = post_subcorpus_step(db, &stmt, argv[0]);
+        int bad = 0;
+        if (rc == SQLITE_ROW) {
+            const uint8_t *b = sqlite3_column_blob(stmt, 0);
+            int len = sqlite3_column_bytes(stmt, 0);
+            pa = post_array_decode(st, b, len, &bad);
+        }
+        if (!pa) {
+            char *msg = NULL;
+            if (rc != SQLITE_ROW) msg = post_subcorpus_error(db, rc, argv[0]);
+            else if (bad) msg = sqlite3_mprintf("subcorpus_has: unsupported postings format");
+            sqlite3_finalize(stmt);
+            if (msg) {
+                sqlite3_result_error(ctx, msg, -1);
+                sqlite3_free(msg);
+            } else {
+                sqlite3_result_error_nomem(ctx);
+            }
+            return;
+        }
+        sqlite3_finalize(stmt);
+        loaded = 1;
+    }
+    int found = post_array_has(pa, sqlite3_value_int64(argv[1]));
+    post_tally(st, 0, found);
+    sqlite3_result_int(ctx, found);
+    // Må stå sist: SQLite kan frigjøre auxdata med en gang.
+    if (loaded) sqlite3_set_auxdata(ctx, 0, pa, sqlite3_free);
+}
+
+/*
+ * Tabellverdi-funksjoner (eponymous virtual tables)
+ *
+ *   SELECT seq, idx FROM post_each(blob)
+ *   SELECT seq FROM post_near_each(blobA, blobB, off_min, off_max)
+ *   SELECT bok_id, idx FROM subcorpus_each(name)
+ *
+ * Gir én INTEGER-rad per posisjon rett fra dekoderen, uten JSON-omveien via
+ * post_positions/json_each. post_near_each gir de samme posisjonene som
+ * post_near_positions. subcorpus_each er post_each på blobben til name i
+ * subcorpora. Radene kommer i stigende seq-rekkefølge, så ORDER BY seq er
+ * gratis.
+ */
+#define POST_EACH_SEQ 0
+#define POST_EACH_IDX 1
+#define POST_EACH_BLOB 2
+#define POST_EACH_PROBE 1      // idxNum: subcorpus_each med bok_id = ?
+
+#define POST_NEAR_SEQ 0
+#define POST_NEAR_A 1
+#define POST_NEAR_B 2
+#define POST_NEAR_MIN 3
+#define POST_NEAR_MAX 4
+
+typedef struct post_each_vtab {
+    sqlite3_vtab base;
+    int near;              // 0 = post_each, 1 = post_near_each
+    int sub;               // subcorpus_each: blobben slås opp i subcorpora
+    sqlite3 *db;
+    post_conn *st;
+} post_each_vtab;
+
+// Blob-argumentet kopieres: verdien fra xFilter lever ikke lenger enn kallet.
+// Bufferen gjenbrukes mellom xFilter-kall på samme cursor (f.eks. i en join).
+typedef struct post_blob_buf {
+    uint8_t *p;
+    int cap;
+} post_blob_buf;
+
+typedef struct post_each_cursor {
+    sqlite3_vtab_cursor base;
+    int near;
+    post_blob_buf buf_a, buf_b;
+    post_cursor ca, cb;
+    int has_a, has_b;
+    int off_min, off_max;
+    sqlite3_int64 rowid;
+    sqlite3_int64 seen;    // dekodede posisjoner som er ført i post_stats
+    sqlite3_stmt *lookup;  // subcorpus_each: oppslaget i subcorpora
+    post_array *members;   // subcorpus_each med bok_id = ?: dekodet liste
+    char *members_name;    // ... for dette navnet
+    int eof;
+} post_each_cursor;
+
+static int post_blob_set(post_blob_buf *buf, const uint8_t *b, int n,
+                         const uint8_t **out, int *len) {
+    if (!b || n <= 0) {
+        *out = NULL;
+        *len = 0;
+        return SQLITE_OK;
+    }
+    if (n > buf->cap) {
+        uint8_t *p = sqlite3_realloc(buf->p, n);
+        if (!p) return SQLITE_NOMEM;
+        buf->p = p;
+        buf->cap = n;
+    }
+    memcpy(buf->p, b, n);
+    *out = buf->p;
+    *len = n;
+    return SQLITE_OK;
+}
+
+static int post_blob_copy(post_blob_buf *buf, sqlite3_value *v, const uint8_t **out, int *len) {
+    return post_blob_set(buf, sqlite3_value_blob(v), sqlite3_value_bytes(v), out, len);
+}
+
+static int post_each_connect_impl(sqlite3 *db, post_conn *st, sqlite3_vtab **ppVtab,
+                                  int near, int sub) {
+    int rc = sqlite3_declare_vtab(db, near
+        ? "CREATE TABLE x(seq INTEGER, blob_a HIDDEN, blob_b HIDDEN, off_min HIDDEN, off_max HIDDEN)"
+        : sub ? "CREATE TABLE x(bok_id INTEGER, idx INTEGER, name HIDDEN)"
+        : "CREATE TABLE x(seq INTEGER, idx INTEGER, blob HIDDEN)");
+    if (rc != SQLITE_OK) return rc;
+    post_each_vtab *vt = sqlite3_malloc(sizeof(*vt));
+    if (!vt) return SQLITE_NOMEM;
+    memset(vt, 0, sizeof(*vt));
+    vt->near = near;
+    vt->sub = sub;
+    vt->db = db;
+    vt->st = st;
+    // subcorpus_each leser en tabell, så den er ikke "innocuous".
+    if (!sub) sqlite3_vtab_config(db, SQLITE_VTAB_INNOCUOUS);
+    *ppVtab = &vt->base;
+    return SQLITE_OK;
+}
+
+static int post_each_connect(sqlite3 *db, void *pAux, int argc, const char *const *argv,
+                             sqlite3_vtab **ppVtab, char **pzErr) {
+    return post_each_connect_impl(db, pAux, ppVtab, 0, 0);
+}
+
+static int post_near_each_connect(sqlite3 *db, void *pAux, int argc, const char *const *argv,
+                                  sqlite3_vtab **ppVtab, char **pzErr) {
+    return post_each_connect_impl(db, pAux, ppVtab, 1, 0);
+}
+
+static int subcorpus_each_connect(sqlite3 *db, void *pAux, int argc, const char *const *argv,
+                                  sqlite3_vtab **ppVtab, char **pzErr) {
+    return post_each_connect_impl(db, pAux, ppVtab, 0, 1);
+}
+
+static int post_each_disconnect(sqlite3_vtab *pVtab) {
+    sqlite3_free(pVtab);
+    return SQLITE_OK;
+}
+
+static int post_each_open(sqlite3_vtab *pVtab, sqlite3_vtab_cursor **ppCursor) {
+    post_each_cursor *cur = sqlite3_malloc(sizeof(*cur));
+    if (!cur) return SQLITE_NOMEM;
+    memset(cur, 0, sizeof(*cur));
+    cur->near = ((post_each_vtab *)pVtab)->near;
+    cur->eof = 1;
+    *ppCursor = &cur->base;
+    return SQLITE_OK;
+}
+
+static int post_each_close(sqlite3_vtab_cursor *pCur) {
+    post_each_cursor *cur = (post_each_cursor *)pCur;
+    sqlite3_finalize(cur->lookup);
+    sqlite3_free(cur->members);
+    sqlite3_free(cur->members_name);
+    sqlite3_free(cur->buf_a.p);
+    sqlite3_free(cur->buf_b.p);
+    sqlite3_free(cur);
+    return SQLITE_OK;
+}
+
+// Samme løkke som post_near_positions, men stopper ved hvert treff.
+static void post_near_each_step(post_each_cursor *cur) {
+    while (cur->has_a && cur->has_b) {
+        if (post_diff_lt(cur->cb.acc, cur->ca.acc, cur->off_min)) {
+            cur->has_b = post_cursor_advance(&cur->cb, seek_target(cur->ca.acc, cur->off_min));
+        } else if (post_diff_gt(cur->cb.acc, cur->ca.acc, cur->off_max)) {
+            cur->has_a = post_cursor_advance(&cur->ca, seek_target(cur->cb.acc, -(sqlite3_int64)cur->off_max));
+        } else {
+            return;
+        }
+    }
+    cur->eof = 1;
+}
+
+static int post_each_next_impl(post_each_cursor *cur) {
+    cur->rowid++;
+    if (cur->near) {
+        cur->has_a = post_cursor_next(&cur->ca);
+        post_near_each_step(cur);
+    } else if (!post_cursor_next(&cur->ca)) {
+        cur->eof = 1;
+    }
+    return SQLITE_OK;
+}
+
+/*
+ * subcorpus_each(name) med bok_id = x (typisk som indre løkke i en join):
+ * lista dekodes én gang per cursor og navn, og hver xFilter er et binærsøk
+ * som gir null eller én rad.
+ */
+static int post_subcorpus_probe(post_each_cursor *cur, sqlite3_value *name, sqlite3_value *x) {
+    post_each_vtab *vt = (post_each_vtab *)cur->base.pVtab;
+    const char *zname = (const char *)sqlite3_value_text(name);
+    sqlite3_int64 decoded = 0;
+    if (!cur->members || !zname || strcmp(zname, cur->members_name) != 0) {
+        sqlite3_free(cur->members);
+        sqlite3_free(cur->members_name);
+        cur->members = NULL;
+        cur->members_name = NULL;
+        int rc = post_subcorpus_step(vt->db, &cur->lookup, name);
+        if (rc != SQLITE_ROW) {
+            sqlite3_free(vt->base.zErrMsg);
+            vt->base.zErrMsg = post_subcorpus_error(vt->db, rc, name);
+            return SQLITE_ERROR;
+        }
+        int bad = 0;
+        cur->members = post_array_decode(vt->st, sqlite3_column_blob(cur->lookup, 0),
+                                         sqlite3_column_bytes(cur->lookup, 0), &bad);
+        sqlite3_reset(cur->lookup);
+        if (bad) {
+            sqlite3_free(vt->base.zErrMsg);
+            vt->base.zErrMsg = sqlite3_mprintf("unsupported postings format");
+            return SQLITE_ERROR;
+        }
+        cur->members_name = sqlite3_mprintf("%s", zname ? zname : "");
+        if (!cur->members || !cur->members_name) return SQLITE_NOMEM;
+        decoded = cur->members->n;
+    }
+
+    // Tom cursor: post_cursor_next gir 0, så neste xNext gir eof.
+    memset(&cur->ca, 0, offsetof(post_cursor, blk));
+    cur->ca.n_next = decoded;
+    if (sqlite3_value_type(x) == SQLITE_NULL) return SQLITE_OK;
+    sqlite3_int64 v = sqlite3_value_int64(x);
+    const post_array *arr = cur->members;
+    if (v < 0) return SQLITE_OK;
+    sqlite3_int64 i = gallop_geq(arr->v, arr->n, 0, (uint64_t)v);
+    if (i < arr->n && arr->v[i] == (uint64_t)v) {
+        cur->ca.acc = (uint64_t)v;
+        cur->ca.idx = i;
+        cur->eof = 0;
+    }
+    return SQLITE_OK;
+}
+
+static int post_each_filter_impl(sqlite3_vtab_cursor *pCur, int idxNum,
+                                 int argc, sqlite3_value **argv) {
+    post_each_cursor *cur = (post_each_cursor *)pCur;
+    const uint8_t *a = NULL, *b = NULL;
+    int a_len = 0, b_len = 0;
+    int rc;
+
+    cur->eof = 1;
+    cur->rowid = 0;
+    if (argc < (cur->near ? 4 : 1)) return SQLITE_OK;
+    if (idxNum == POST_EACH_PROBE && argc == 2) return post_subcorpus_probe(cur, argv[0], argv[1]);
+
+    post_each_vtab *vt = (post_each_vtab *)pCur->pVtab;
+    if (vt->sub) {
+        rc = post_subcorpus_step(vt->db, &cur->lookup, argv[0]);
+        if (rc != SQLITE_ROW) {
+            sqlite3_free(pCur->pVtab->zErrMsg);
+            pCur->pVtab->zErrMsg = post_subcorpus_error(vt->db, rc, argv[0]);
+            return SQLITE_ERROR;
+        }
+        rc = post_blob_set(&cur->buf_a, sqlite3_column_blob(cur->lookup, 0),
+                           sqlite3_column_bytes(cur->lookup, 0), &a, &a_len);
+        sqlite3_reset(cur->lookup);
+    } else {
+        rc = post_blob_copy(&cur->buf_a, argv[0], &a, &a_len);
+    }
+    if (rc != SQLITE_OK) return rc;
+    if (!post_cursor_open(&cur->ca, a, a_len)) {
+        sqlite3_free(pCur->pVtab->zErrMsg);
+        pCur->pVtab->zErrMsg = sqlite3_mprintf("unsupported postings format");
+        return SQLITE_ERROR;
+    }
+
+    if (!cur->near) {
+        cur->eof = !post_cursor_next(&cur->ca);
+        return SQLITE_OK;
+    }
+
+    rc = post_blob_copy(&cur->buf_b, argv[1], &b, &b_len);
+    if (rc != SQLITE_OK) return rc;
+    if (!post_cursor_open(&cur->cb, b, b_len)) {
+        sqlite3_free(pCur->pVtab->zErrMsg);
+        pCur->pVtab->zErrMsg = sqlite3_mprintf("unsupported postings format");
+        return SQLITE_ERROR;
+    }
+    cur->off_min = sqlite3_value_int(argv[2]);
+    cur->off_max = sqlite3_value_int(argv[3]);
+    cur->eof = 0;
+    cur->has_a = post_cursor_next(&cur->ca);
+    cur->has_b = post_cursor_next(&cur->cb);
+    post_near_each_step(cur);
+    return SQLITE_OK;
+}
+
+// Posisjoner dekodet siden forrige gang; for post_stats.
+static sqlite3_int64 post_each_decoded(post_each_cursor *cur) {
+    sqlite3_int64 seen = cur->ca.n_next + (cur->near ? cur->cb.n_next : 0);
+    sqlite3_int64 n = seen - cur->seen;
+    cur->seen = seen;
+    return n;
+}
+
+static int post_each_fn(const post_each_vtab *vt) {
+    return vt->near ? POST_FN_NEAR_EACH : vt->sub ? POST_FN_SUBCORPUS_EACH : POST_FN_EACH;
+}
+
+static int post_each_filter(sqlite3_vtab_cursor *pCur, int idxNum, const char *idxStr,
+                            int argc, sqlite3_value **argv) {
+    post_each_cursor *cur = (post_each_cursor *)pCur;
+    post_conn *st = ((post_each_vtab *)pCur->pVtab)->st;
+    if (!st->stats_on) return post_each_filter_impl(pCur, idxNum, argc, argv);
+    sqlite3_int64 t0 = post_now_ns();
+    memset(&cur->ca, 0, sizeof(cur->ca));
+    memset(&cur->cb, 0, sizeof(cur->cb));
+    cur->seen = 0;
+    int rc = post_each_filter_impl(pCur, idxNum, argc, argv);
+    post_stats_table(st, post_each_fn((post_each_vtab *)pCur->pVtab), t0, argc, argv,
+                     post_each_decoded(cur), !cur->eof);
+    return rc;
+}
+
+static int post_each_next(sqlite3_vtab_cursor *pCur) {
+    post_each_cursor *cur = (post_each_cursor *)pCur;
+    post_conn *st = ((post_each_vtab *)pCur->pVtab)->st;
+    if (!st->stats_on) return post_each_next_impl(cur);
+    sqlite3_int64 t0 = post_now_ns();
+    int rc = post_each_next_impl(cur);
+    post_stats_table(st, post_each_fn((post_each_vtab *)pCur->pVtab), t0, 0, NULL,
+                     post_each_decoded(cur), !cur->eof);
+    return rc;
+}
+
+static int post_each_eof(sqlite3_vtab_cursor *pCur) {
+    return ((post_each_cursor *)pCur)->eof;
+}
+
+static int post_each_column(sqlite3_vtab_cursor *pCur, sqlite3_context *ctx, int i) {
+    post_each_cursor *cur = (post_each_cursor *)pCur;
+    if (i == POST_EACH_SEQ) {
+        sqlite3_result_int64(ctx, (sqlite3_int64)cur->ca.acc);
+    } else if (!cur->near && i == POST_EACH_IDX) {
+        sqlite3_result_int64(ctx, cur->ca.idx);
+    } else {
+        sqlite3_result_null(ctx);  // skjulte argumentkolonner
+    }
+    return SQLITE_OK;
+}
+
+static int post_each_rowid(sqlite3_vtab_cursor *pCur, sqlite_int64 *pRowid) {
+    *pRowid = ((post_each_cursor *)pCur)->rowid;
+    return SQLITE_OK;
+}
+
+// Alle skjulte kolonner må være gitt med '=' (dvs. som funksjonsargumenter).
+static int post_each_best_index(sqlite3_vtab *pVtab, sqlite3_index_info *info) {
+    int near = ((post_each_vtab *)pVtab)->near;
+    int sub = ((post_each_vtab *)pVtab)->sub;
+    int first = near ? POST_NEAR_A : POST_EACH_BLOB;
+    int n_args = near ? 4 : 1;
+    int seen = 0;
+    int probe = -1;
+
+    for (int i = 0; i < info->nConstraint; i++) {
+        const struct sqlite3_index_constraint *c = &info->aConstraint[i];
+        if (sub && c->iColumn == POST_EACH_SEQ && c->usable &&
+            c->op == SQLITE_INDEX_CONSTRAINT_EQ) {
+            probe = i;
+            continue;
+        }
+        int arg = c->iColumn - first;
+        if (arg < 0 || arg >= n_args) continue;
+        if (!c->usable || c->op != SQLITE_INDEX_CONSTRAINT_EQ) return SQLITE_CONSTRAINT;
+        info->aConstraintUsage[i].argvIndex = arg + 1;
+        info->aConstraintUsage[i].omit = 1;
+        seen |= 1 << arg;
+    }
+    if (seen != (1 << n_args) - 1) {
+        sqlite3_free(pVtab->zErrMsg);
+        pVtab->zErrMsg = sqlite3_mprintf(near
+            ? "post_near_each(blobA, blobB, off_min, off_max) expects 4 args"
+            : sub ? "subcorpus_each(name) expects 1 arg"
+            : "post_each(blob) expects 1 arg");
+        return SQLITE_ERROR;
+    }
+    if (probe >= 0) {
+        info->aConstraintUsage[probe].argvIndex = n_args + 1;
+        info->aConstraintUsage[probe].omit = 1;
+        info->idxNum = POST_EACH_PROBE;
+        info->idxFlags |= SQLITE_INDEX_SCAN_UNIQUE;
+        info->estimatedCost = 10.0;
+        info->estimatedRows = 1;
+        return SQLITE_OK;
+    }
+    if (info->nOrderBy == 1 && info->aOrderBy[0].iColumn == POST_EACH_SEQ &&
+        !info->aOrderBy[0].desc) {
+        info->orderByConsumed = 1;
+    }
+    info->estimatedCost = 1000.0;
+    info->estimatedRows = 1000;
+    return SQLITE_OK;
+}
+
+static sqlite3_module post_each_module = {
+    0,                          // iVersion
+    0,                          // xCreate (eponymous only)
+    post_each_connect,          // xConnect
+    post_each_best_index,       // xBestIndex
+    post_each_disconnect,       // xDisconnect
+    0,                          // xDestroy
+    post_each_open,             // xOpen
+    post_each_close,            // xClose
+    post_each_filter,           // xFilter
+    post_each_next,             // xNext
+    post_each_eof,              // xEof
+    post_each_column,           // xColumn
+    post_each_rowid,            // xRowid
+    // resten (xUpdate, transaksjoner, ...) er 0
+};
+
+static sqlite3_module post_near_each_module = {
+    0,                          // iVersion
+    0,                          // xCreate (eponymous only)
+    post_near_each_connect,     // xConnect
+    post_each_best_index,       // xBestIndex
+    post_each_disconnect,       // xDisconnect
+    0,                          // xDestroy
+    post_each_open,             // xOpen
+    post_each_close,            // xClose
+    post_each_filter,           // xFilter
+    post_each_next,             // xNext
+    post_each_eof,              // xEof
+    post_each_column,           // xColumn
+    post_each_rowid,            // xRowid
+    // resten (xUpdate, transaksjoner, ...) er 0
+};
+
+static sqlite3_module subcorpus_each_module = {
+    0,                          // iVersion
+    0,                          // xCreate (eponymous only)
+    subcorpus_each_connect,     // xConnect
+    post_each_best_index,       // xBestIndex
+    post_each_disconnect,       // xDisconnect
+    0,                          // xDestroy
+    post_each_open,             // xOpen
+    post_each_close,            // xClose
+    post_each_filter,           // xFilter
+    post_each_next,             // xNext
+    post_each_eof,              // xEof
+    post_each_column,           // xColumn
+    post_each_rowid,            // xRowid
+    // resten (xUpdate, transaksjoner, ...) er 0
+};
+
+/*
+ * Enkel seedbar PRNG (splitmix64) for sampling.
+ */
+typedef struct post_rng {
+    uint64_t state;
+} post_rng;
+
+static uint64_t post_rng_next(post_rng *r) {
+    uint64_t z = (r->state += 0x9e3779b97f4a7c15ULL);
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    return z ^ (z >> 31);
+}
+
+// Uniformt tall i [0, n)
+static uint64_t post_rng_below(post_rng *r, uint64_t n) {
+    return n ? post_rng_next(r) % n : 0;
+}
+
+static void post_rng_seed(post_rng *r, sqlite3_value *seed) {
+    if (seed && sqlite3_value_type(seed) != SQLITE_NULL) {
+        r->state = (uint64_t)sqlite3_value_int64(seed);
+    } else {
+        sqlite3_randomness(sizeof(r->state), &r->state);
+    }
+}
+
+static int cmp_u64(const void *x, const void *y) {
+    uint64_t a = *(const uint64_t *)x, b = *(const uint64_t *)y;
+    return (a > b) - (a < b);
+}
+
+/*
+ * Antall og sampling
+ *
+ * post_count leser count fra headeren når blobben har en (format 0 og 1),
+ * ellers teller den varint-avslutninger uten å dekode. post_sample_k og
+ * post_sample_many leser lista én gang uansett hvor mange posisjoner som
+ * trekkes.
+ */
+
+/*
+ * post_count(blob)
+ *  - antall posisjoner; O(1) når blobben har count i headeren
+ */
+static void post_count_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 1) {
+        sqlite3_result_error(ctx, "post_count(blob) expects 1 arg", -1);
+        return;
+    }
+    post_cursor c;
+    if (!post_cursor_open(&c, sqlite3_value_blob(argv[0]), sqlite3_value_bytes(argv[0]))) {
+        sqlite3_result_error(ctx, "post_count: unsupported postings format", -1);
+        return;
+    }
+    sqlite3_int64 n = c.count >= 0 ? c.count : count_varints(c.data, c.end);
+    post_tally(sqlite3_user_data(ctx), 0, n);
+    sqlite3_result_int64(ctx, n);
+}
+
+// Flytt cursoren til indeks idx (>= c->idx); hopper via skip-tabellen.
+// Returnerer 0 hvis lista er kortere.
+static int post_cursor_goto(post_cursor *c, sqlite3_int64 idx) {
+    if (c->count >= 0 && idx >= c->count) return 0;
+    if (c->skip) {
+        sqlite3_int64 k = idx / c->block_size;
+        if (k < c->n_blocks && (c->idx < 0 || k > c->idx / c->block_size)) {
+            post_cursor_jump(c, (int)k);
+        }
+    }
+    while (c->idx < idx) {
+        if (!post_cursor_next(c)) return 0;
+    }
+    return 1;
+}
+
+static void post_result_json_u64(sqlite3_context *ctx, const char *name,
+                                 const uint64_t *v, sqlite3_int64 n) {
+    char *buf = NULL;
+    int len = 0;
+    int cap = 0;
+    int ok = json_append_char(&buf, &len, &cap, '[');
+    for (sqlite3_int64 i = 0; ok && i < n; i++) {
+        if (i) ok = json_append_char(&buf, &len, &cap, ',');
+        if (ok) ok = json_append_int64(&buf, &len, &cap, (sqlite3_int64)v[i]);
+    }
+    if (ok) ok = json_append_char(&buf, &len, &cap, ']');
+    if (!ok) {
+        sqlite3_free(buf);
+        char *msg = sqlite3_mprintf("%s: OOM", name);
+        sqlite3_result_error(ctx, msg ? msg : name, -1);
+        sqlite3_free(msg);
+        return;
+    }
+    sqlite3_result_text(ctx, buf, len, sqlite3_free);
+}
+
+/*
+ * post_sample_k(blob, k [, seed])
+ *  - k uniformt trukne posisjoner (uten tilbakelegging) som JSON-array i
+ *    stigende rekkefølge; alle hvis lista har færre enn k
+ *  - én reservoir-pass over lista; seed gjør trekket reproduserbart
+ */
+static void post_sample_k_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2 && argc != 3) {
+        sqlite3_result_error(ctx, "post_sample_k(blob, k [, seed]) expects 2-3 args", -1);
+        return;
+    }
+    post_cursor c;
+    if (!post_cursor_open(&c, sqlite3_value_blob(argv[0]), sqlite3_value_bytes(argv[0]))) {
+        sqlite3_result_error(ctx, "post_sample_k: unsupported postings format", -1);
+        return;
+    }
+    sqlite3_int64 k = sqlite3_value_int64(argv[1]);
+    if (k < 0) k = 0;
+    sqlite3_int64 n = c.count >= 0 ? c.count : count_varints(c.data, c.end);
+    if (k > n) k = n;
+
+    uint64_t *res = sqlite3_malloc64((sqlite3_uint64)(k ? k : 1) * sizeof(uint64_t));
+    if (!res) {
+        sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    post_rng rng;
+    post_rng_seed(&rng, argc == 3 ? argv[2] : NULL);
+    sqlite3_int64 seen = 0;
+    while (k > 0 && post_cursor_next(&c)) {
+        if (seen < k) {
+            res[seen] = c.acc;
+        } else {
+            uint64_t j = post_rng_below(&rng, (uint64_t)seen + 1);
+            if ((sqlite3_int64)j < k) res[j] = c.acc;
+        }
+        seen++;
+    }
+    if (seen < k) k = seen;
+    post_tally(sqlite3_user_data(ctx), c.n_next, k);
+    qsort(res, (size_t)k, sizeof(uint64_t), cmp_u64);
+    post_result_json_u64(ctx, "post_sample_k", res, k);
+    sqlite3_free(res);
+}
+
+typedef struct post_idx_slot {
+    sqlite3_int64 idx;
+    sqlite3_int64 slot;     // plass i resultatet
+} post_idx_slot;
+
+static int cmp_idx_slot(const void *x, const void *y) {
+    const post_idx_slot *a = x, *b = y;
+    if (a->idx != b->idx) return (a->idx > b->idx) - (a->idx < b->idx);
+    return (a->slot > b->slot) - (a->slot < b->slot);
+}
+
+static int post_idx_push(post_idx_slot **v, sqlite3_int64 *n, sqlite3_int64 *cap,
+                         sqlite3_int64 idx) {
+    if (*n == *cap) {
+        sqlite3_int64 c = *cap ? *cap * 2 : 64;
+        post_idx_slot *t = sqlite3_realloc64(*v, (sqlite3_uint64)c * sizeof(*t));
+        if (!t) return 0;
+        *v = t;
+        *cap = c;
+    }
+    (*v)[*n].idx = idx;
+    (*v)[*n].slot = *n;
+    (*n)++;
+    return 1;
+}
+
+// Les indekser fra en JSON-array av heltall. Returnerer 0 ved syntaksfeil.
+static int post_parse_idx_json(const char *s, post_idx_slot **v, sqlite3_int64 *n,
+                               sqlite3_int64 *cap, int *oom) {
+    int in_num = 0, neg = 0;
+    sqlite3_int64 x = 0;
+    for (;; s++) {
+        char ch = *s;
+        if (ch >= '0' && ch <= '9') {
+            x = x * 10 + (ch - '0');
+            in_num = 1;
+            continue;
+        }
+        if (in_num) {
+            if (!post_idx_push(v, n, cap, neg ? -x : x)) {
+                *oom = 1;
+                return 0;
+            }
+            in_num = neg = 0;
+            x = 0;
+        }
+        if (ch == '\0') return 1;
+        if (ch == '-') neg = 1;
+        else if (ch != '[' && ch != ']' && ch != ',' && ch != ' ' &&
+                 ch != '\t' && ch != '\n' && ch != '\r') return 0;
+    }
+}
+
+/*
+ * post_sample_many(blob, idxs)
+ *  - posisjonene på indeksene i idxs (0-basert) som JSON-array, i samme
+ *    rekkefølge som idxs; null for indekser utenfor lista
+ *  - idxs er en JSON-array av heltall eller en postings-blob med indekser
+ *  - indeksene sorteres og lista leses én gang (med skip-tabell hvis den
+ *    finnes), i stedet for ett post_sample-kall per indeks
+ */
+static void post_sample_many_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc != 2) {
+        sqlite3_result_error(ctx, "post_sample_many(blob, idxs) expects 2 args", -1);
+        return;
+    }
+    post_cursor c;
+    if (!post_cursor_open(&c, sqlite3_value_blob(argv[0]), sqlite3_value_bytes(argv[0]))) {
+        sqlite3_result_error(ctx, "post_sample_many: unsupported postings format", -1);
+        return;
+    }
+
+    post_idx_slot *want = NULL;
+    sqlite3_int64 n = 0, cap = 0;
+    int oom = 0;
+    int type = sqlite3_value_type(argv[1]);
+    if (type == SQLITE_BLOB) {
+        post_cursor ci;
+        if (!post_cursor_open(&ci, sqlite3_value_blob(argv[1]), sqlite3_value_bytes(argv[1]))) {
+            sqlite3_result_error(ctx, "post_sample_many: unsupported index blob format", -1);
+            return;
+        }
+        while (post_cursor_next(&ci)) {
+            if (!post_idx_push(&want, &n, &cap, (sqlite3_int64)ci.acc)) {
+                oom = 1;
+                break;
+            }
+        }
+    } else if (type == SQLITE_INTEGER) {
+        oom = !post_idx_push(&want, &n, &cap, sqlite3_value_int64(argv[1]));
+    } else if (type != SQLITE_NULL) {
+        const char *txt = (const char *)sqlite3_value_text(argv[1]);
+        if (txt && !post_parse_idx_json(txt, &want, &n, &cap, &oom) && !oom) {
+            sqlite3_free(want);
+            sqlite3_result_error(ctx,
+                "post_sample_many: idxs must be a JSON array of integers or an index blob", -1);
+            return;
+        }
+    }
+
+    sqlite3_int64 *pos = oom ? NULL : sqlite3_malloc64((sqlite3_uint64)(n ? n : 1) * sizeof(*pos));
+    if (!pos) {
+        sqlite3_free(want);
+        sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    if (n > 0) qsort(want, (size_t)n, sizeof(*want), cmp_idx_slot);
+    int live = 1;
+    for (sqlite3_int64 i = 0; i < n; i++) {
+        sqlite3_int64 idx = want[i].idx;
+        if (idx < 0 || !live) {
+            pos[want[i].slot] = -1;
+            continue;
+        }
+        live = post_cursor_goto(&c, idx);
+        pos[want[i].slot] = live ? (sqlite3_int64)c.acc : -1;
+    }
+    sqlite3_free(want);
+    post_tally(sqlite3_user_data(ctx), c.n_next, n);
+
+    char *buf = NULL;
+    int len = 0;
+    int jcap = 0;
+    int ok = json_append_char(&buf, &len, &jcap, '[');
+    for (sqlite3_int64 i = 0; ok && i < n; i++) {
+        if (i) ok = json_append_char(&buf, &len, &jcap, ',');
+        if (!ok) break;
+        if (pos[i] < 0) {
+            ok = json_append_char(&buf, &len, &jcap, 'n') &&
+                 json_append_char(&buf, &len, &jcap, 'u') &&
+                 json_append_char(&buf, &len, &jcap, 'l') &&
+                 json_append_char(&buf, &len, &jcap, 'l');
+        } else {
+            ok = json_append_int64(&buf, &len, &jcap, pos[i]);
+        }
+    }
+    if (ok) ok = json_append_char(&buf, &len, &jcap, ']');
+    sqlite3_free(pos);
+    if (!ok) {
+        sqlite3_free(buf);
+        sqlite3_result_error(ctx, "post_sample_many: OOM", -1);
+        return;
+    }
+    sqlite3_result_text(ctx, buf, len, sqlite3_free);
+}
+
+/*
+ * Token-kilde for kontekstvinduer
+ *
+ * Konteksten kan ligge på to måter i en shard:
+ *
+ *  - tokens(bok_id, seq, word): én rad per token.
+ *  - token_chunks(bok_id, chunk, ids) + lexicon(word_id, word): bokas
+ *    token-sekvens som varint-kodede word_id-er, POST_TOKEN_CHUNK tokens
+ *    per blob. Chunk k dekker seq k*POST_TOKEN_CHUNK .. (k+1)*POST_TOKEN_CHUNK-1;
+ *    word_id 0 betyr at seq mangler.
+ *
+ * token_chunks brukes hvis tabellen finnes, ellers tokens. Ordene fra
+ * lexicon caches per cursor, så hvert distinkte ord slås opp én gang.
+ */
+#define POST_TOKEN_CHUNK 256
+
+typedef struct post_token_buf {
+    sqlite3_int64 *seq;
+    int *off, *len;             // ordet ligger i text[off .. off+len)
+    sqlite3_int64 n, cap;
+    char *text;
+    sqlite3_int64 text_len, text_cap;
+} post_token_buf;
+
+typedef struct post_tokens {
+    sqlite3 *db;
+    int mode;                   // 0 = ikke åpnet, 1 = token_chunks, 2 = tokens
+    sqlite3_stmt *range;        // range-scan i valgt tabell
+    sqlite3_stmt *lex;          // SELECT word FROM lexicon WHERE word_id = ?
+    // lexicon-cache: åpen adressering, word_id -> ord i lex_words
+    sqlite3_int64 *lex_keys;
+    int *lex_off, *lex_len;
+    sqlite3_int64 lex_n, lex_cap;
+    char *lex_text;
+    sqlite3_int64 lex_text_len, lex_text_cap;
+} post_tokens;
+
+static void post_token_buf_free(post_token_buf *b) {
+    sqlite3_free(b->seq);
+    sqlite3_free(b->off);
+    sqlite3_free(b->len);
+    sqlite3_free(b->text);
+    memset(b, 0, sizeof(*b));
+}
+
+static int post_text_append(char **text, sqlite3_int64 *len, sqlite3_int64 *cap,
+                            const char *s, int n) {
+    if (*len + n > *cap) {
+        sqlite3_int64 c = *cap ? *cap : 4096;
+        while (c < *len + n) c *= 2;
+        char *t = sqlite3_realloc64(*text, (sqlite3_uint64)c);
+        if (!t) return SQLITE_NOMEM;
+        *text = t;
+        *cap = c;
+    }
+    if (n > 0) memcpy(*text + *len, s, n);
+    *len += n;
+    return SQLITE_OK;
+}
+
+static int post_token_push(post_token_buf *b, sqlite3_int64 seq, const char *word, int len) {
+    if (b->n == b->cap) {
+        sqlite3_int64 cap = b->cap ? b->cap * 2 : 256;
+        sqlite3_int64 *s = sqlite3_realloc64(b->seq, (sqlite3_uint64)cap * sizeof(*s));
+        if (!s) return SQLITE_NOMEM;
+        b->seq = s;
+        int *o = sqlite3_realloc64(b->off, (sqlite3_uint64)cap * sizeof(*o));
+        if (!o) return SQLITE_NOMEM;
+        b->off = o;
+        int *l = sqlite3_realloc64(b->len, (sqlite3_uint64)cap * sizeof(*l));
+        if (!l) return SQLITE_NOMEM;
+        b->len = l;
+        b->cap = cap;
+    }
+    sqlite3_int64 off = b->text_len;
+    int rc = post_text_append(&b->text, &b->text_len, &b->text_cap, word, len);
+    if (rc != SQLITE_OK) return rc;
+    b->seq[b->n] = seq;
+    b->off[b->n] = (int)off;
+    b->len[b->n] = len;
+    b->n++;
+    return SQLITE_OK;
+}
+
+// Første indeks med seq >= target
+static sqlite3_int64 post_token_lower(const post_token_buf *b, sqlite3_int64 target) {
+    sqlite3_int64 lo = 0, hi = b->n;
+    while (lo < hi) {
+        sqlite3_int64 mid = lo + (hi - lo) / 2;
+        if (b->seq[mid] < target) lo = mid + 1;
+        else hi = mid;
+    }
+    return lo;
+}
+
+static void post_tokens_free(post_tokens *src) {
+    sqlite3_finalize(src->range);
+    sqlite3_finalize(src->lex);
+    sqlite3_free(src->lex_keys);
+    sqlite3_free(src->lex_off);
+    sqlite3_free(src->lex_len);
+    sqlite3_free(src->lex_text);
+    memset(src, 0, sizeof(*src));
+}
+
+static int post_tokens_open(post_tokens *src, sqlite3 *db) {
+    if (src->mode) return SQLITE_OK;
+    src->db = db;
+    if (sqlite3_prepare_v2(db,
+            "SELECT chunk, ids FROM token_chunks "
+            "WHERE bok_id = ?1 AND chunk BETWEEN ?2 AND ?3 ORDER BY chunk",
+            -1, &src->range, NULL) == SQLITE_OK &&
+        sqlite3_prepare_v2(db,
+            "SELECT word FROM lexicon WHERE word_id = ?1",
+            -1, &src->lex, NULL) == SQLITE_OK) {
+        src->mode = 1;
+        return SQLITE_OK;
+    }
+    sqlite3_finalize(src->range);
+    sqlite3_finalize(src->lex);
+    src->range = src->lex = NULL;
+    int rc = sqlite3_prepare_v2(db,
+        "SELECT seq, word FROM tokens WHERE bok_id = ?1 AND seq BETWEEN ?2 AND ?3 ORDER BY seq",
+        -1, &src->range, NULL);
+    if (rc != SQLITE_OK) return rc;
+    src->mode = 2;
+    return SQLITE_OK;
+}
+
+static sqlite3_int64 post_lex_slot(const post_tokens *src, sqlite3_int64 id) {
+    sqlite3_int64 mask = src->lex_cap - 1;
+    sqlite3_int64 h = (sqlite3_int64)(((uint64_t)id * 0x9e3779b97f4a7c15ULL) >> 1) & mask;
+    while (src->lex_keys[h] != 0 && src->lex_keys[h] != id) h = (h + 1) & mask;
+    return h;
+}
+
+static int post_lex_grow(post_tokens *src) {
+    sqlite3_int64 old_cap = src->lex_cap;
+    sqlite3_int64 *old_keys = src->lex_keys;
+    int *old_off = src->lex_off, *old_len = src->lex_len;
+    sqlite3_int64 cap = old_cap ? old_cap * 2 : 1024;
+    src->lex_keys = sqlite3_malloc64((sqlite3_uint64)cap * sizeof(sqlite3_int64));
+    src->lex_off = sqlite3_malloc64((sqlite3_uint64)cap * sizeof(int));
+    src->lex_len = sqlite3_malloc64((sqlite3_uint64)cap * sizeof(int));
+    if (!src->lex_keys || !src->lex_off || !src->lex_len) {
+        sqlite3_free(src->lex_keys);
+        sqlite3_free(src->lex_off);
+        sqlite3_free(src->lex_len);
+        src->lex_keys = old_keys;
+        src->lex_off = old_off;
+        src->lex_len = old_len;
+        return SQLITE_NOMEM;
+    }
+    memset(src->lex_keys, 0, (size_t)cap * sizeof(sqlite3_int64));
+    src->lex_cap = cap;
+    for (sqlite3_int64 i = 0; i < old_cap; i++) {
+        if (!old_keys[i]) continue;
+        sqlite3_int64 h = post_lex_slot(src, old_keys[i]);
+        src->lex_keys[h] = old_keys[i];
+        src->lex_off[h] = old_off[i];
+        src->lex_len[h] = old_len[i];
+    }
+    sqlite3_free(old_keys);
+    sqlite3_free(old_off);
+    sqlite3_free(old_len);
+    return SQLITE_OK;
+}
+
+// Slå opp ordet for word_id (via cache). *word peker inn i lex_text.
+static int post_lex_word(post_tokens *src, sqlite3_int64 id, const char **word, int *len) {
+    if (src->lex_n * 2 >= src->lex_cap) {
+        int rc = post_lex_grow(src);
+        if (rc != SQLITE_OK) return rc;
+    }
+    sqlite3_int64 h = post_lex_slot(src, id);
+    if (src->lex_keys[h] != id) {
+        sqlite3_bind_int64(src->lex, 1, id);
+        const char *w = NULL;
+        int n = 0;
+        int rc = sqlite3_step(src->lex);
+        if (rc == SQLITE_ROW) {
+            w = (const char *)sqlite3_column_text(src->lex, 0);
+            n = w ? sqlite3_column_bytes(src->lex, 0) : 0;
+        } else if (rc != SQLITE_DONE) {
+            sqlite3_reset(src->lex);
+            return rc;
+        }
+        sqlite3_int64 off = src->lex_text_len;
+        rc = post_text_append(&src->lex_text, &src->lex_text_len, &src->lex_text_cap, w, n);
+        sqlite3_reset(src->lex);
+        if (rc != SQLITE_OK) return rc;
+        src->lex_keys[h] = id;
+        src->lex_off[h] = (int)off;
+        src->lex_len[h] = n;
+        src->lex_n++;
+    }
+    *word = src->lex_text + src->lex_off[h];
+    *len = src->lex_len[h];
+    return SQLITE_OK;
+}
+
+static int post_tokens_load_chunks(post_tokens *src, post_token_buf *buf,
+                                   sqlite3_int64 bok_id, sqlite3_int64 lo, sqlite3_int64 hi) {
+    int rc;
+    sqlite3_bind_int64(src->range, 1, bok_id);
+    sqlite3_bind_int64(src->range, 2, lo / POST_TOKEN_CHUNK);
+    sqlite3_bind_int64(src->range, 3, hi / POST_TOKEN_CHUNK);
+    while ((rc = sqlite3_step(src->range)) == SQLITE_ROW) {
+        sqlite3_int64 seq = sqlite3_column_int64(src->range, 0) * POST_TOKEN_CHUNK;
+        const uint8_t *p = sqlite3_column_blob(src->range, 1);
+        const uint8_t *end = p + sqlite3_column_bytes(src->range, 1);
+        for (; p && p < end && seq <= hi; seq++) {
+            sqlite3_int64 id = (sqlite3_int64)read_varint(&p, end);
+            if (id == 0 || seq < lo) continue;
+            const char *w = NULL;
+            int n = 0;
+            rc = post_lex_word(src, id, &w, &n);
+            if (rc == SQLITE_OK) rc = post_token_push(buf, seq, w, n);
+            if (rc != SQLITE_OK) {
+                sqlite3_reset(src->range);
+                return rc;
+            }
+        }
+    }
+    sqlite3_reset(src->range);
+    return rc == SQLITE_DONE ? SQLITE_OK : rc;
+}
+
+// Legg til alle tokens med seq i [lo, hi] i buf, i seq-rekkefølge.
+static int post_tokens_load(post_tokens *src, post_token_buf *buf,
+                            sqlite3_int64 bok_id, sqlite3_int64 lo, sqlite3_int64 hi) {
+    if (lo < 0) lo = 0;
+    if (hi < lo) return SQLITE_OK;
+    if (src->mode == 1) return post_tokens_load_chunks(src, buf, bok_id, lo, hi);
+
+    int rc;
+    sqlite3_bind_int64(src->range, 1, bok_id);
+    sqlite3_bind_int64(src->range, 2, lo);
+    sqlite3_bind_int64(src->range, 3, hi);
+    while ((rc = sqlite3_step(src->range)) == SQLITE_ROW) {
+        const char *w = (const char *)sqlite3_column_text(src->range, 1);
+        int n = w ? sqlite3_column_bytes(src->range, 1) : 0;
+        rc = post_token_push(buf, sqlite3_column_int64(src->range, 0), w, n);
+        if (rc != SQLITE_OK) {
+            sqlite3_reset(src->range);
+            return rc;
+        }
+    }
+    sqlite3_reset(src->range);
+    return rc == SQLITE_DONE ? SQLITE_OK : rc;
+}
+
+/*
+ * post_kwic(bok_id, blob, n_left, n_right [, limit, seed]) (tabellverdi)
+ *
+ *   SELECT seq, left_ctx, keyword, right_ctx
+ *   FROM post_kwic(:bok_id, :blob, 5, 5, 20, 42);
+ *
+ * Én rad per treff i blob, med venstre/høyre kontekst ferdig satt sammen
+ * (ord skilt med mellomrom). Med limit trekkes limit treff uniformt
+ * (reservoir, seedbar); radene kommer alltid i stigende seq-rekkefølge.
+ *
+ * Konteksten leses med én ordnet range-scan per sammenhengende område av
+ * vinduer (fra token_chunks eller tokens), ikke én spørring per treff.
+ */
+#define POST_KWIC_SEQ 0
+#define POST_KWIC_LEFT 1
+#define POST_KWIC_KEYWORD 2
+#define POST_KWIC_RIGHT 3
+#define POST_KWIC_BOK 4     // første skjulte kolonne
+#define POST_KWIC_NARGS 6
+#define POST_KWIC_REQUIRED 4
+
+// Vinduer med mindre avstand enn dette leses i samme range-scan.
+#define POST_KWIC_GAP 256
+
+// Felles for post_kwic og post_window.
+typedef struct post_ctx_vtab {
+    sqlite3_vtab base;
+    sqlite3 *db;
+    post_conn *st;
+} post_ctx_vtab;
+
+typedef struct post_kwic_cursor {
+    sqlite3_vtab_cursor base;
+    post_tokens src;
+    post_token_buf toks;
+    uint64_t *hits;
+    sqlite3_int64 n_hits, cap_hits;
+    sqlite3_int64 n_left, n_right;
+    sqlite3_int64 row;
+    sqlite3_int64 decoded;  // posisjoner lest i siste xFilter (for post_stats)
+} post_kwic_cursor;
+
+static int post_ctx_connect(sqlite3 *db, post_conn *st, const char *schema, sqlite3_vtab **ppVtab) {
+    int rc = sqlite3_declare_vtab(db, schema);
+    if (rc != SQLITE_OK) return rc;
+    post_ctx_vtab *vt = sqlite3_malloc(sizeof(*vt));
+    if (!vt) return SQLITE_NOMEM;
+    memset(vt, 0, sizeof(*vt));
+    vt->db = db;
+    vt->st = st;
+    *ppVtab = &vt->base;
+    return SQLITE_OK;
+}
+
+static int post_kwic_connect(sqlite3 *db, void *pAux, int argc, const char *const *argv,
+                             sqlite3_vtab **ppVtab, char **pzErr) {
+    return post_ctx_connect(db, pAux,
+        "CREATE TABLE x(seq INTEGER, left_ctx TEXT, keyword TEXT, right_ctx TEXT, "
+        "bok_id HIDDEN, blob HIDDEN, n_left HIDDEN, n_right HIDDEN, lim HIDDEN, seed HIDDEN)",
+        ppVtab);
+}
+
+static int post_ctx_disconnect(sqlite3_vtab *pVtab) {
+    sqlite3_free(pVtab);
+    return SQLITE_OK;
+}
+
+static int post_kwic_open(sqlite3_vtab *pVtab, sqlite3_vtab_cursor **ppCursor) {
+    post_kwic_cursor *cur = sqlite3_malloc(sizeof(*cur));
+    if (!cur) return SQLITE_NOMEM;
+    memset(cur, 0, sizeof(*cur));
+    *ppCursor = &cur->base;
+    return SQLITE_OK;
+}
+
+static int post_kwic_close(sqlite3_vtab_cursor *pCur) {
+    post_kwic_cursor *cur = (post_kwic_cursor *)pCur;
+    post_tokens_free(&cur->src);
+    post_token_buf_free(&cur->toks);
+    sqlite3_free(cur->hits);
+    sqlite3_free(cur);
+    return SQLITE_OK;
+}
+
+static int post_kwic_push_hit(post_kwic_cursor *cur, uint64_t seq) {
+    if (cur->n_hits == cur->cap_hits) {
+        sqlite3_int64 cap = cur->cap_hits ? cur->cap_hits * 2 : 64;
+        uint64_t *h = sqlite3_realloc64(cur->hits, (sqlite3_uint64)cap * sizeof(*h));
+        if (!h) return SQLITE_NOMEM;
+        cur->hits = h;
+        cur->cap_hits = cap;
+    }
+    cur->hits[cur->n_hits++] = seq;
+    return SQLITE_OK;
+}
+
+// Les tokens for alle vinduer: én range-scan per område der vinduene
+// overlapper eller ligger nærmere enn POST_KWIC_GAP.
+static int post_kwic_load_tokens(post_kwic_cursor *cur, sqlite3 *db, sqlite3_int64 bok_id) {
+    int rc = post_tokens_open(&cur->src, db);
+    if (rc != SQLITE_OK) return rc;
+    sqlite3_int64 i = 0;
+    while (i < cur->n_hits) {
+        sqlite3_int64 lo = (sqlite3_int64)cur->hits[i] - cur->n_left;
+        sqlite3_int64 hi = (sqlite3_int64)cur->hits[i] + cur->n_right;
+        for (i++; i < cur->n_hits; i++) {
+            sqlite3_int64 next_lo = (sqlite3_int64)cur->hits[i] - cur->n_left;
+            if (next_lo > hi + POST_KWIC_GAP) break;
+            hi = (sqlite3_int64)cur->hits[i] + cur->n_right;
+        }
+        rc = post_tokens_load(&cur->src, &cur->toks, bok_id, lo, hi);
+        if (rc != SQLITE_OK) return rc;
+    }
+    return SQLITE_OK;
+}
+
+static int post_kwic_filter_impl(sqlite3_vtab_cursor *pCur, int idxNum,
+                                 int argc, sqlite3_value **argv) {
+    post_kwic_cursor *cur = (post_kwic_cursor *)pCur;
+    post_ctx_vtab *vt = (post_ctx_vtab *)pCur->pVtab;
+    sqlite3_value *args[POST_KWIC_NARGS] = {0};
+    int j = 0;
+    for (int i = 0; i < POST_KWIC_NARGS; i++) {
+        if (idxNum & (1 << i)) args[i] = argv[j++];
+    }
+
+    cur->n_hits = cur->toks.n = cur->toks.text_len = 0;
+    cur->row = cur->decoded = 0;
+    sqlite3_int64 bok_id = sqlite3_value_int64(args[0]);
+    cur->n_left = sqlite3_value_int64(args[2]);
+    cur->n_right = sqlite3_value_int64(args[3]);
+    if (cur->n_left < 0) cur->n_left = 0;
+    if (cur->n_right < 0) cur->n_right = 0;
+    sqlite3_int64 limit = -1;
+    if (args[4] && sqlite3_value_type(args[4]) != SQLITE_NULL) {
+        limit = sqlite3_value_int64(args[4]);
+        if (limit < 0) limit = 0;
+    }
+
+    post_cursor c;
+    if (!post_cursor_open(&c, sqlite3_value_blob(args[1]), sqlite3_value_bytes(args[1]))) {
+        sqlite3_free(pCur->pVtab->zErrMsg);
+        pCur->pVtab->zErrMsg = sqlite3_mprintf("unsupported postings format");
+        return SQLITE_ERROR;
+    }
+
+    int rc = SQLITE_OK;
+    if (limit < 0) {
+        while (rc == SQLITE_OK && post_cursor_next(&c)) rc = post_kwic_push_hit(cur, c.acc);
+    } else {
+        // Reservoir sampling (Algorithm R), så sortering tilbake til seq-orden
+        post_rng rng;
+        post_rng_seed(&rng, args[5]);
+        sqlite3_int64 seen = 0;
+        while (rc == SQLITE_OK && post_cursor_next(&c)) {
+            if (cur->n_hits < limit) {
+                rc = post_kwic_push_hit(cur, c.acc);
+            } else {
+                uint64_t k = post_rng_below(&rng, (uint64_t)seen + 1);
+                if ((sqlite3_int64)k < limit) cur->hits[k] = c.acc;
+            }
+            seen++;
+        }
+        if (cur->n_hits > 0) qsort(cur->hits, (size_t)cur->n_hits, sizeof(uint64_t), cmp_u64);
+    }
+    cur->decoded = c.n_next;
+    if (rc != SQLITE_OK) return rc;
+
+    rc = post_kwic_load_tokens(cur, vt->db, bok_id);
+    if (rc != SQLITE_OK) {
+        sqlite3_free(pCur->pVtab->zErrMsg);
+        pCur->pVtab->zErrMsg = sqlite3_mprintf("post_kwic: %s", sqlite3_errmsg(vt->db));
+    }
+    return rc;
+}
+
+static int post_kwic_filter(sqlite3_vtab_cursor *pCur, int idxNum, const char *idxStr,
+                            int argc, sqlite3_value **argv) {
+    post_kwic_cursor *cur = (post_kwic_cursor *)pCur;
+    post_conn *st = ((post_ctx_vtab *)pCur->pVtab)->st;
+    if (!st->stats_on) return post_kwic_filter_impl(pCur, idxNum, argc, argv);
+    sqlite3_int64 t0 = post_now_ns();
+    int rc = post_kwic_filter_impl(pCur, idxNum, argc, argv);
+    post_stats_table(st, POST_FN_KWIC, t0, argc, argv, cur->decoded, cur->n_hits);
+    return rc;
+}
+
+static int post_kwic_next(sqlite3_vtab_cursor *pCur) {
+    ((post_kwic_cursor *)pCur)->row++;
+    return SQLITE_OK;
+}
+
+static int post_kwic_eof(sqlite3_vtab_cursor *pCur) {
+    post_kwic_cursor *cur = (post_kwic_cursor *)pCur;
+    return cur->row >= cur->n_hits;
+}
+
+// Sett sammen ordene med seq i [from, to] skilt med mellomrom.
+static void post_kwic_result_span(sqlite3_context *ctx, const post_token_buf *b,
+                                  sqlite3_int64 from, sqlite3_int64 to) {
+    sqlite3_int64 i0 = post_token_lower(b, from);
+    sqlite3_int64 i1 = post_token_lower(b, to + 1);
+    if (i1 <= i0) {
+        sqlite3_result_text(ctx, "", 0, SQLITE_STATIC);
+        return;
+    }
+    sqlite3_int64 n = 0;
+    for (sqlite3_int64 i = i0; i < i1; i++) n += b->len[i] + 1;
+    char *out = sqlite3_malloc64((sqlite3_uint64)n);
+    if (!out) {
+        sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    char *p = out;
+    for (sqlite3_int64 i = i0; i < i1; i++) {
+        if (i > i0) *p++ = ' ';
+        memcpy(p, b->text + b->off[i], b->len[i]);
+        p += b->len[i];
+    }
+    sqlite3_result_text(ctx, out, (int)(p - out), sqlite3_free);
+}
 
-    while (has_a && has_b) {
-        int64_t diff = (int64_t)acc_b - (int64_t)acc_a;
-        if (diff < off_min) {
-            has_b = next_seq(&pb, eb, &acc_b);
-        } else if (diff > off_max) {
-            has_a = next_seq(&pa, ea, &acc_a);
-        } else {
-            count++;
-            has_a = next_seq(&pa, ea, &acc_a);
-        }
+static int post_kwic_column(sqlite3_vtab_cursor *pCur, sqlite3_context *ctx, int i) {
+    post_kwic_cursor *cur = (post_kwic_cursor *)pCur;
+    sqlite3_int64 hit = (sqlite3_int64)cur->hits[cur->row];
+    switch (i) {
+        case POST_KWIC_SEQ:
+            sqlite3_result_int64(ctx, hit);
+            break;
+        case POST_KWIC_LEFT:
+            post_kwic_result_span(ctx, &cur->toks, hit - cur->n_left, hit - 1);
+            break;
+        case POST_KWIC_KEYWORD:
+            post_kwic_result_span(ctx, &cur->toks, hit, hit);
+            break;
+        case POST_KWIC_RIGHT:
+            post_kwic_result_span(ctx, &cur->toks, hit + 1, hit + cur->n_right);
+            break;
+        default:
+            sqlite3_result_null(ctx);
     }
+    return SQLITE_OK;
+}
 
-    sqlite3_result_int(ctx, count);
+static int post_kwic_rowid(sqlite3_vtab_cursor *pCur, sqlite_int64 *pRowid) {
+    *pRowid = ((post_kwic_cursor *)pCur)->row;
+    return SQLITE_OK;
+}
+
+// Skjulte kolonner fra first og utover er argumenter; de første required
+// må være med. idxNum er en bitmaske over hvilke argumenter som er gitt.
+static int post_args_best_index(sqlite3_vtab *pVtab, sqlite3_index_info *info,
+                                int first, int n_args, int required, const char *usage) {
+    int slot[8];
+    int mask = 0;
+    for (int i = 0; i < n_args; i++) slot[i] = -1;
+
+    for (int i = 0; i < info->nConstraint; i++) {
+        const struct sqlite3_index_constraint *c = &info->aConstraint[i];
+        int arg = c->iColumn - first;
+        if (arg < 0 || arg >= n_args) continue;
+        if (!c->usable || c->op != SQLITE_INDEX_CONSTRAINT_EQ) return SQLITE_CONSTRAINT;
+        slot[arg] = i;
+        mask |= 1 << arg;
+    }
+    if ((mask & ((1 << required) - 1)) != (1 << required) - 1) {
+        sqlite3_free(pVtab->zErrMsg);
+        pVtab->zErrMsg = sqlite3_mprintf("%s", usage);
+        return SQLITE_ERROR;
+    }
+    int argv_index = 1;
+    for (int i = 0; i < n_args; i++) {
+        if (slot[i] < 0) continue;
+        info->aConstraintUsage[slot[i]].argvIndex = argv_index++;
+        info->aConstraintUsage[slot[i]].omit = 1;
+    }
+    info->idxNum = mask;
+    if (info->nOrderBy == 1 && info->aOrderBy[0].iColumn == 0 && !info->aOrderBy[0].desc) {
+        info->orderByConsumed = 1;
+    }
+    info->estimatedCost = 10000.0;
+    info->estimatedRows = 100;
+    return SQLITE_OK;
+}
+
+static int post_kwic_best_index(sqlite3_vtab *pVtab, sqlite3_index_info *info) {
+    return post_args_best_index(pVtab, info, POST_KWIC_BOK, POST_KWIC_NARGS, POST_KWIC_REQUIRED,
+        "post_kwic(bok_id, blob, n_left, n_right [, limit, seed]) expects 4-6 args");
+}
+
+static sqlite3_module post_kwic_module = {
+    0,                          // iVersion
+    0,                          // xCreate (eponymous only)
+    post_kwic_connect,          // xConnect
+    post_kwic_best_index,       // xBestIndex
+    post_ctx_disconnect,        // xDisconnect
+    0,                          // xDestroy
+    post_kwic_open,             // xOpen
+    post_kwic_close,            // xClose
+    post_kwic_filter,           // xFilter
+    post_kwic_next,             // xNext
+    post_kwic_eof,              // xEof
+    post_kwic_column,           // xColumn
+    post_kwic_rowid,            // xRowid
+    // resten (xUpdate, transaksjoner, ...) er 0
+};
+
+/*
+ * post_window(bok_id, seq, n_left [, n_right]) (tabellverdi)
+ *
+ *   SELECT seq, word FROM post_window(:bok_id, :seq, 5);
+ *
+ * Tokens i [seq - n_left, seq + n_right] (n_right = n_left hvis utelatt).
+ * Med token_chunks dekodes bare chunkene vinduet berører.
+ */
+#define POST_WINDOW_SEQ 0
+#define POST_WINDOW_WORD 1
+#define POST_WINDOW_BOK 2
+#define POST_WINDOW_NARGS 4
+#define POST_WINDOW_REQUIRED 3
+
+typedef struct post_window_cursor {
+    sqlite3_vtab_cursor base;
+    post_tokens src;
+    post_token_buf toks;
+    sqlite3_int64 row;
+} post_window_cursor;
+
+static int post_window_connect(sqlite3 *db, void *pAux, int argc, const char *const *argv,
+                               sqlite3_vtab **ppVtab, char **pzErr) {
+    return post_ctx_connect(db, pAux,
+        "CREATE TABLE x(seq INTEGER, word TEXT, "
+        "bok_id HIDDEN, center HIDDEN, n_left HIDDEN, n_right HIDDEN)",
+        ppVtab);
+}
+
+static int post_window_open(sqlite3_vtab *pVtab, sqlite3_vtab_cursor **ppCursor) {
+    post_window_cursor *cur = sqlite3_malloc(sizeof(*cur));
+    if (!cur) return SQLITE_NOMEM;
+    memset(cur, 0, sizeof(*cur));
+    *ppCursor = &cur->base;
+    return SQLITE_OK;
+}
+
+static int post_window_close(sqlite3_vtab_cursor *pCur) {
+    post_window_cursor *cur = (post_window_cursor *)pCur;
+    post_tokens_free(&cur->src);
+    post_token_buf_free(&cur->toks);
+    sqlite3_free(cur);
+    return SQLITE_OK;
+}
+
+static int post_window_filter_impl(sqlite3_vtab_cursor *pCur, int idxNum,
+                                   int argc, sqlite3_value **argv) {
+    post_window_cursor *cur = (post_window_cursor *)pCur;
+    post_ctx_vtab *vt = (post_ctx_vtab *)pCur->pVtab;
+    sqlite3_value *args[POST_WINDOW_NARGS] = {0};
+    int j = 0;
+    for (int i = 0; i < POST_WINDOW_NARGS; i++) {
+        if (idxNum & (1 << i)) args[i] = argv[j++];
+    }
+
+    cur->toks.n = cur->toks.text_len = 0;
+    cur->row = 0;
+    sqlite3_int64 seq = sqlite3_value_int64(args[1]);
+    sqlite3_int64 n_left = sqlite3_value_int64(args[2]);
+    sqlite3_int64 n_right = args[3] ? sqlite3_value_int64(args[3]) : n_left;
+    if (n_left < 0) n_left = 0;
+    if (n_right < 0) n_right = 0;
+
+    int rc = post_tokens_open(&cur->src, vt->db);
+    if (rc == SQLITE_OK) {
+        rc = post_tokens_load(&cur->src, &cur->toks, sqlite3_value_int64(args[0]),
+                              seq - n_left, seq + n_right);
+    }
+    if (rc != SQLITE_OK) {
+        sqlite3_free(pCur->pVtab->zErrMsg);
+        pCur->pVtab->zErrMsg = sqlite3_mprintf("post_window: %s", sqlite3_errmsg(vt->db));
+    }
+    return rc;
+}
+
+static int post_window_filter(sqlite3_vtab_cursor *pCur, int idxNum, const char *idxStr,
+                              int argc, sqlite3_value **argv) {
+    post_window_cursor *cur = (post_window_cursor *)pCur;
+    post_conn *st = ((post_ctx_vtab *)pCur->pVtab)->st;
+    if (!st->stats_on) return post_window_filter_impl(pCur, idxNum, argc, argv);
+    sqlite3_int64 t0 = post_now_ns();
+    int rc = post_window_filter_impl(pCur, idxNum, argc, argv);
+    post_stats_table(st, POST_FN_WINDOW, t0, argc, argv, 0, cur->toks.n);
+    return rc;
+}
+
+static int post_window_next(sqlite3_vtab_cursor *pCur) {
+    ((post_window_cursor *)pCur)->row++;
+    return SQLITE_OK;
+}
+
+static int post_window_eof(sqlite3_vtab_cursor *pCur) {
+    post_window_cursor *cur = (post_window_cursor *)pCur;
+    return cur->row >= cur->toks.n;
+}
+
+static int post_window_column(sqlite3_vtab_cursor *pCur, sqlite3_context *ctx, int i) {
+    post_window_cursor *cur = (post_window_cursor *)pCur;
+    const post_token_buf *b = &cur->toks;
+    if (i == POST_WINDOW_SEQ) {
+        sqlite3_result_int64(ctx, b->seq[cur->row]);
+    } else if (i == POST_WINDOW_WORD) {
+        sqlite3_result_text(ctx, b->text + b->off[cur->row], b->len[cur->row], SQLITE_TRANSIENT);
+    } else {
+        sqlite3_result_null(ctx);
+    }
+    return SQLITE_OK;
+}
+
+static int post_window_rowid(sqlite3_vtab_cursor *pCur, sqlite_int64 *pRowid) {
+    *pRowid = ((post_window_cursor *)pCur)->row;
+    return SQLITE_OK;
+}
+
+static int post_window_best_index(sqlite3_vtab *pVtab, sqlite3_index_info *info) {
+    return post_args_best_index(pVtab, info, POST_WINDOW_BOK, POST_WINDOW_NARGS,
+        POST_WINDOW_REQUIRED, "post_window(bok_id, seq, n_left [, n_right]) expects 3-4 args");
+}
+
+static sqlite3_module post_window_module = {
+    0,                          // iVersion
+    0,                          // xCreate (eponymous only)
+    post_window_connect,        // xConnect
+    post_window_best_index,     // xBestIndex
+    post_ctx_disconnect,        // xDisconnect
+    0,                          // xDestroy
+    post_window_open,           // xOpen
+    post_window_close,          // xClose
+    post_window_filter,         // xFilter
+    post_window_next,           // xNext
+    post_window_eof,            // xEof
+    post_window_column,         // xColumn
+    post_window_rowid,          // xRowid
+    // resten (xUpdate, transaksjoner, ...) er 0
+};
+
+/*
+ * post_gallop_ratio([ratio])
+ *  - leser/setter lengdeforholdet (lang/kort blob) der post_intersect og
+ *    post_near_count bytter til galloping. 0 slår galloping av.
+ *  - returnerer forrige verdi
+ */
+static void post_gallop_ratio_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc > 1) {
+        sqlite3_result_error(ctx, "post_gallop_ratio([ratio]) expects 0 or 1 args", -1);
+        return;
+    }
+    post_conn *st = sqlite3_user_data(ctx);
+    int prev = st->gallop_ratio;
+    if (argc == 1) {
+        int ratio = sqlite3_value_int(argv[0]);
+        st->gallop_ratio = ratio < 0 ? 0 : ratio;
+    }
+    sqlite3_result_int(ctx, prev);
+}
+
+/*
+ * post_cache_config([max_bytes])
+ *  - leser eller setter (per tilkobling) hvor mye minne cachen av dekodede
+ *    lister kan bruke; 0 slår den av og tømmer den
+ *  - returnerer forrige verdi
+ */
+static void post_cache_config_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc > 1) {
+        sqlite3_result_error(ctx, "post_cache_config([max_bytes]) expects 0 or 1 args", -1);
+        return;
+    }
+    post_conn *st = sqlite3_user_data(ctx);
+    post_cache *c = &st->cache;
+    sqlite3_int64 prev = c->max_bytes;
+    if (argc == 1) {
+        sqlite3_int64 max_bytes = sqlite3_value_int64(argv[0]);
+        c->max_bytes = max_bytes < 0 ? 0 : max_bytes;
+        if (c->max_bytes == 0) post_cache_clear(c);
+        else post_cache_evict(c, 0);
+    }
+    sqlite3_result_int64(ctx, prev);
+}
+
+/*
+ * post_cache_stats()
+ *  - JSON-objekt med grense, bruk og tellere for cachen
+ */
+static void post_cache_stats_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    (void)argc;
+    (void)argv;
+    post_conn *st = sqlite3_user_data(ctx);
+    post_cache *c = &st->cache;
+    char *json = sqlite3_mprintf(
+        "{\"max_bytes\":%lld,\"bytes\":%lld,\"entries\":%lld,"
+        "\"hits\":%lld,\"misses\":%lld,\"evictions\":%lld}",
+        (long long)c->max_bytes, (long long)c->bytes, (long long)c->entries,
+        (long long)c->hits, (long long)c->misses, (long long)c->evictions
+    );
+    if (!json) {
+        sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    sqlite3_result_text(ctx, json, -1, sqlite3_free);
+}
+
+/*
+ * Instrumentering
+ *
+ *   SELECT post_stats_enable(1);
+ *   ... spørringer ...
+ *   SELECT * FROM post_stats WHERE calls > 0;
+ *   SELECT post_stats_reset();
+ *
+ * Per tilkobling og per funksjon: kall, blob-bytes inn, dekodede posisjoner,
+ * resultater (treff, posisjoner eller rader ut) og nanosekunder brukt. Av som
+ * standard (POST_STATS); når det er av koster det én test per kall.
+ */
+POST_TIMED(post_intersect_sqlite, POST_FN_INTERSECT)
+POST_TIMED(post_intersect_offset_sqlite, POST_FN_INTERSECT_OFFSET)
+POST_TIMED(post_intersect_offset_sym_sqlite, POST_FN_INTERSECT_OFFSET_SYM)
+POST_TIMED(post_sample_sqlite, POST_FN_SAMPLE)
+POST_TIMED(post_positions_sqlite, POST_FN_POSITIONS)
+POST_TIMED(post_near_positions_sqlite, POST_FN_NEAR_POSITIONS)
+POST_TIMED(post_near_count_sqlite, POST_FN_NEAR_COUNT)
+POST_TIMED(post_phrase_count_sqlite, POST_FN_PHRASE_COUNT)
+POST_TIMED(post_phrase_positions_sqlite, POST_FN_PHRASE_POSITIONS)
+POST_TIMED(post_and_sqlite, POST_FN_AND)
+POST_TIMED(post_or_sqlite, POST_FN_OR)
+POST_TIMED(post_andnot_sqlite, POST_FN_ANDNOT)
+POST_TIMED(post_shift_sqlite, POST_FN_SHIFT)
+POST_TIMED(post_near_sqlite, POST_FN_NEAR)
+POST_TIMED(post_count_sqlite, POST_FN_COUNT)
+POST_TIMED(post_sample_k_sqlite, POST_FN_SAMPLE_K)
+POST_TIMED(post_sample_many_sqlite, POST_FN_SAMPLE_MANY)
+POST_TIMED(post_recode_sqlite, POST_FN_RECODE)
+POST_TIMED(post_contains_sqlite, POST_FN_CONTAINS)
+POST_TIMED(subcorpus_has_sqlite, POST_FN_SUBCORPUS_HAS)
+
+static void post_union_agg_step_timed(sqlite3_context *ctx, int argc, sqlite3_value **argv) {
+    post_conn *st = sqlite3_user_data(ctx);
+    if (st->stats_on) post_stats_run(st, POST_FN_UNION_AGG, post_union_agg_step, 0, ctx, argc, argv);
+    else post_union_agg_step(ctx, argc, argv);
+}
+
+// Et kall per gruppe; tiden i xStep (kopiering) er med i ns.
+static void post_union_agg_final_timed(sqlite3_context *ctx) {
+    post_conn *st = sqlite3_user_data(ctx);
+    if (!st->stats_on) {
+        post_union_agg_final(ctx);
+        return;
+    }
+    post_fn_stats *s = &st->stats[POST_FN_UNION_AGG];
+    st->tally_positions = st->tally_results = 0;
+    sqlite3_int64 t0 = post_now_ns();
+    post_union_agg_final(ctx);
+    s->ns += post_now_ns() - t0;
+    s->calls++;
+    s->positions += st->tally_positions;
+    s->results += st->tally_results;
+}
+
+/*
+ * post_stats_enable([on])
+ *  - leser eller slår av/på tellerne for denne tilkoblingen
+ *  - returnerer forrige verdi
+ */
+static void post_stats_enable_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    if (argc > 1) {
+        sqlite3_result_error(ctx, "post_stats_enable([on]) expects 0 or 1 args", -1);
+        return;
+    }
+    post_conn *st = sqlite3_user_data(ctx);
+    int prev = st->stats_on;
+    if (argc == 1) st->stats_on = sqlite3_value_int(argv[0]) != 0;
+    sqlite3_result_int(ctx, prev);
+}
+
+/*
+ * post_stats_reset()
+ *  - nullstiller tellerne; returnerer antall kall som ble nullstilt
+ */
+static void post_stats_reset_sqlite(
+    sqlite3_context *ctx,
+    int argc,
+    sqlite3_value **argv
+) {
+    (void)argc;
+    (void)argv;
+    post_conn *st = sqlite3_user_data(ctx);
+    sqlite3_int64 calls = 0;
+    for (int i = 0; i < POST_FN_N; i++) calls += st->stats[i].calls;
+    memset(st->stats, 0, sizeof(st->stats));
+    sqlite3_result_int64(ctx, calls);
+}
+
+/*
+ * post_stats (tabell)
+ *
+ *   SELECT name, calls, bytes, positions, results, ns FROM post_stats;
+ *
+ * Én rad per funksjon i post_fn_names, i den rekkefølgen.
+ */
+#define POST_STATS_NAME 0
+#define POST_STATS_CALLS 1
+#define POST_STATS_BYTES 2
+#define POST_STATS_POSITIONS 3
+#define POST_STATS_RESULTS 4
+#define POST_STATS_NS 5
+
+typedef struct post_stats_vtab {
+    sqlite3_vtab base;
+    post_conn *st;
+} post_stats_vtab;
+
+typedef struct post_stats_cursor {
+    sqlite3_vtab_cursor base;
+    int row;
+} post_stats_cursor;
+
+static int post_stats_connect(sqlite3 *db, void *pAux, int argc, const char *const *argv,
+                              sqlite3_vtab **ppVtab, char **pzErr) {
+    int rc = sqlite3_declare_vtab(db,
+        "CREATE TABLE x(name TEXT, calls INTEGER, bytes INTEGER, positions INTEGER, "
+        "results INTEGER, ns INTEGER)");
+    if (rc != SQLITE_OK) return rc;
+    post_stats_vtab *vt = sqlite3_malloc(sizeof(*vt));
+    if (!vt) return SQLITE_NOMEM;
+    memset(vt, 0, sizeof(*vt));
+    vt->st = pAux;
+    *ppVtab = &vt->base;
+    return SQLITE_OK;
 }
 
+static int post_stats_disconnect(sqlite3_vtab *pVtab) {
+    sqlite3_free(pVtab);
+    return SQLITE_OK;
+}
+
+static int post_stats_open(sqlite3_vtab *pVtab, sqlite3_vtab_cursor **ppCursor) {
+    post_stats_cursor *cur = sqlite3_malloc(sizeof(*cur));
+    if (!cur) return SQLITE_NOMEM;
+    memset(cur, 0, sizeof(*cur));
+    *ppCursor = &cur->base;
+    return SQLITE_OK;
+}
+
+static int post_stats_close(sqlite3_vtab_cursor *pCur) {
+    sqlite3_free(pCur);
+    return SQLITE_OK;
+}
+
+static int post_stats_filter(sqlite3_vtab_cursor *pCur, int idxNum, const char *idxStr,
+                             int argc, sqlite3_value **argv) {
+    ((post_stats_cursor *)pCur)->row = 0;
+    return SQLITE_OK;
+}
+
+static int post_stats_next(sqlite3_vtab_cursor *pCur) {
+    ((post_stats_cursor *)pCur)->row++;
+    return SQLITE_OK;
+}
+
+static int post_stats_eof(sqlite3_vtab_cursor *pCur) {
+    return ((post_stats_cursor *)pCur)->row >= POST_FN_N;
+}
+
+static int post_stats_column(sqlite3_vtab_cursor *pCur, sqlite3_context *ctx, int i) {
+    int row = ((post_stats_cursor *)pCur)->row;
+    const post_fn_stats *s = &((post_stats_vtab *)pCur->pVtab)->st->stats[row];
+    switch (i) {
+        case POST_STATS_NAME:
+            sqlite3_result_text(ctx, post_fn_names[row], -1, SQLITE_STATIC);
+            break;
+        case POST_STATS_CALLS:
+            sqlite3_result_int64(ctx, s->calls);
+            break;
+        case POST_STATS_BYTES:
+            sqlite3_result_int64(ctx, s->bytes);
+            break;
+        case POST_STATS_POSITIONS:
+            sqlite3_result_int64(ctx, s->positions);
+            break;
+        case POST_STATS_RESULTS:
+            sqlite3_result_int64(ctx, s->results);
+            break;
+        default:
+            sqlite3_result_int64(ctx, s->ns);
+    }
+    return SQLITE_OK;
+}
+
+static int post_stats_rowid(sqlite3_vtab_cursor *pCur, sqlite_int64 *pRowid) {
+    *pRowid = ((post_stats_cursor *)pCur)->row;
+    return SQLITE_OK;
+}
+
+static int post_stats_best_index(sqlite3_vtab *pVtab, sqlite3_index_info *info) {
+    info->estimatedCost = 10.0;
+    info->estimatedRows = POST_FN_N;
+    return SQLITE_OK;
+}
+
+static sqlite3_module post_stats_module = {
+    0,                          // iVersion
+    0,                          // xCreate (eponymous only)
+    post_stats_connect,         // xConnect
+    post_stats_best_index,      // xBestIndex
+    post_stats_disconnect,      // xDisconnect
+    0,                          // xDestroy
+    post_stats_open,            // xOpen
+    post_stats_close,           // xClose
+    post_stats_filter,          // xFilter
+    post_stats_next,            // xNext
+    post_stats_eof,             // xEof
+    post_stats_column,          // xColumn
+    post_stats_rowid,           // xRowid
+    // resten (xUpdate, transaksjoner, ...) er 0
+};
+
 // Entry point for sqlite3_load_extension
 int sqlite3_postings_init(
     sqlite3 *db,
@@ -466,54 +4185,215 @@ int sqlite3_postings_init(
     SQLITE_EXTENSION_INIT2(pApi);
     int rc = SQLITE_OK;
 
+    post_conn *st = sqlite3_malloc(sizeof(post_conn));
+    if (!st) return SQLITE_NOMEM;
+    memset(st, 0, sizeof(*st));
+    st->gallop_ratio = POST_GALLOP_RATIO;
+    st->cache.max_bytes = POST_CACHE_BYTES;
+    st->stats_on = POST_STATS;
+
+    // Eier st: frigjøres når tilkoblingen lukkes (eller her, hvis kallet feiler).
+    rc = sqlite3_create_function_v2(
+        db, "post_gallop_ratio", -1,
+        SQLITE_UTF8,
+        st, post_gallop_ratio_sqlite, NULL, NULL, post_conn_free
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_cache_config", -1,
+        SQLITE_UTF8,
+        st, post_cache_config_sqlite, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_cache_stats", 0,
+        SQLITE_UTF8,
+        st, post_cache_stats_sqlite, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_stats_enable", -1,
+        SQLITE_UTF8,
+        st, post_stats_enable_sqlite, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_stats_reset", 0,
+        SQLITE_UTF8,
+        st, post_stats_reset_sqlite, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
     rc = sqlite3_create_function(
         db, "post_intersect", 2,
         SQLITE_UTF8 | SQLITE_DETERMINISTIC,
-        NULL, post_intersect_sqlite, NULL, NULL
+        st, post_intersect_sqlite_timed, NULL, NULL
     );
     if (rc != SQLITE_OK) return rc;
 
     rc = sqlite3_create_function(
         db, "post_intersect_offset", 4,
         SQLITE_UTF8 | SQLITE_DETERMINISTIC,
-        NULL, post_intersect_offset_sqlite, NULL, NULL
+        st, post_intersect_offset_sqlite_timed, NULL, NULL
     );
     if (rc != SQLITE_OK) return rc;
 
     rc = sqlite3_create_function(
         db, "post_intersect_offset_sym", 4,
         SQLITE_UTF8 | SQLITE_DETERMINISTIC,
-        NULL, post_intersect_offset_sym_sqlite, NULL, NULL
+        st, post_intersect_offset_sym_sqlite_timed, NULL, NULL
     );
     if (rc != SQLITE_OK) return rc;
 
     rc = sqlite3_create_function(
         db, "post_sample", 2,
         SQLITE_UTF8 | SQLITE_DETERMINISTIC,
-        NULL, post_sample_sqlite, NULL, NULL
+        st, post_sample_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_count", 1,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_count_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    // Ikke DETERMINISTIC: uten seed gir hvert kall et nytt trekk.
+    rc = sqlite3_create_function(
+        db, "post_sample_k", -1,
+        SQLITE_UTF8,
+        st, post_sample_k_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_sample_many", 2,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_sample_many_sqlite_timed, NULL, NULL
     );
     if (rc != SQLITE_OK) return rc;
 
     rc = sqlite3_create_function(
         db, "post_positions", 1,
         SQLITE_UTF8 | SQLITE_DETERMINISTIC,
-        NULL, post_positions_sqlite, NULL, NULL
+        st, post_positions_sqlite_timed, NULL, NULL
     );
     if (rc != SQLITE_OK) return rc;
 
     rc = sqlite3_create_function(
         db, "post_near_positions", 4,
         SQLITE_UTF8 | SQLITE_DETERMINISTIC,
-        NULL, post_near_positions_sqlite, NULL, NULL
+        st, post_near_positions_sqlite_timed, NULL, NULL
     );
     if (rc != SQLITE_OK) return rc;
 
     rc = sqlite3_create_function(
         db, "post_near_count", 4,
         SQLITE_UTF8 | SQLITE_DETERMINISTIC,
-        NULL, post_near_count_sqlite, NULL, NULL
+        st, post_near_count_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_phrase_count", -1,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_phrase_count_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_phrase_positions", -1,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_phrase_positions_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_and", 2,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_and_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_or", 2,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_or_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_andnot", 2,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_andnot_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_shift", 2,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_shift_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_near", 4,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_near_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_recode", -1,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_recode_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_contains", 2,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, post_contains_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    // Ikke DETERMINISTIC: svaret avhenger av innholdet i subcorpora.
+    rc = sqlite3_create_function(
+        db, "subcorpus_has", 2,
+        SQLITE_UTF8,
+        st, subcorpus_has_sqlite_timed, NULL, NULL
+    );
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_function(
+        db, "post_union_agg", 1,
+        SQLITE_UTF8 | SQLITE_DETERMINISTIC,
+        st, NULL, post_union_agg_step_timed, post_union_agg_final_timed
     );
     if (rc != SQLITE_OK) return rc;
 
+    rc = sqlite3_create_module(db, "post_each", &post_each_module, st);
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_module(db, "post_near_each", &post_near_each_module, st);
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_module(db, "subcorpus_each", &subcorpus_each_module, st);
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_module(db, "post_kwic", &post_kwic_module, st);
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_module(db, "post_window", &post_window_module, st);
+    if (rc != SQLITE_OK) return rc;
+
+    rc = sqlite3_create_module(db, "post_stats", &post_stats_module, st);
+    if (rc != SQLITE_OK) return rc;
+
     return SQLITE_OK;
 }
@@ -1,33 +1,86 @@
 #!/usr/bin/env python3
-import json
 import sqlite3
 import time
+from contextlib import contextmanager
 
 import streamlit as st
 
+from postings_codec import count_positions, encode_positions
+from sqlite_postings import ConnectionPool
+from subcorpus import encode_subcorpus, random_bok_ids
+
+TEMP_SUBCORPORA = """
+    CREATE TEMP TABLE IF NOT EXISTS subcorpora (
+        name TEXT NOT NULL PRIMARY KEY,
+        bitmap BLOB NOT NULL
+    )
+"""
+
+
+# Én pool per DB for hele appen, så utvidelsen lastes og pragmaene settes én
+# gang per tilkobling i stedet for ved hvert klikk. Ikke immutable: skarden
+# kan oppdateres (convert_all_ft.py --append) mens appen kjører. Appen selv
+# skriver aldri til skarden.
+@st.cache_resource
+def postings_pool(db_path: str) -> ConnectionPool:
+    return ConnectionPool(db_path, immutable=False)
 
-def open_postings_db(db_path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
-    conn.enable_load_extension(True)
-    conn.load_extension("build/linux/postings.so")
-    return conn
 
+def pooled_connection(db_path: str):
+    return postings_pool(db_path).connection()
 
-def ensure_random_bok_ids(db_path: str, count: int) -> list[int]:
-    if st.session_state.get("bok_ids"):
-        return st.session_state["bok_ids"]
-    conn = open_postings_db(db_path)
-    cur = conn.cursor()
+
+def show_post_stats(conn: sqlite3.Connection) -> None:
+    rows = conn.execute(
+        """
+        SELECT name, calls, bytes, positions, results, ns / 1e6 AS ms
+        FROM post_stats WHERE calls > 0
+        """
+    ).fetchall()
+    if rows:
+        st.caption("post_stats (kall, bytes, dekodede posisjoner, resultater, ms)")
+        st.dataframe(rows, use_container_width=True)
+
+
+def shard_subcorpus(conn: sqlite3.Connection, name: str) -> bytes | None:
     try:
-        cur.execute("SELECT bok_id FROM urns ORDER BY random() LIMIT ?", (count,))
-    except sqlite3.Error:
-        cur.execute(
-            "SELECT DISTINCT bok_id FROM tokens ORDER BY random() LIMIT ?",
-            (count,),
+        row = conn.execute("SELECT bitmap FROM main.subcorpora WHERE name = ?", (name,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+# Delkorpus ligger i session_state, ikke i skarden: en skrivende app ville
+# endret mtime (utdatert manifest) og kan ikke kjøre ved siden av immutable
+# lesere. Et delkorpus lagret i skarden med subcorpus.py brukes om det finnes.
+def ensure_subcorpus(db_path: str, name: str, count: int, fresh: bool = False) -> int:
+    saved = st.session_state["subcorpora"]
+    key = (db_path, name)
+    if fresh or key not in saved:
+        with pooled_connection(db_path) as conn:
+            blob = None if fresh else shard_subcorpus(conn, name)
+            if blob is None:
+                blob = encode_subcorpus(random_bok_ids(conn, count))
+        saved[key] = blob
+    return count_positions(saved[key])
+
+
+def subcorpus_bitmap(db_path: str, name: str) -> bytes:
+    return st.session_state["subcorpora"][(db_path, name)]
+
+
+# subcorpus_has slår opp subcorpora uten skjemanavn, og temp søkes før main,
+# så delkorpuset fra økten legges i temp.subcorpora på den lånte tilkoblingen.
+@contextmanager
+def subcorpus_connection(db_path: str, name: str):
+    with pooled_connection(db_path) as conn:
+        conn.execute(TEMP_SUBCORPORA)
+        conn.execute(
+            "INSERT OR REPLACE INTO temp.subcorpora (name, bitmap) VALUES (?, ?)",
+            (name, subcorpus_bitmap(db_path, name)),
         )
-    st.session_state["bok_ids"] = [row[0] for row in cur.fetchall()]
-    conn.close()
-    return st.session_state["bok_ids"]
+        conn.commit()
+        yield conn
 
 
 st.set_page_config(page_title="SQLite Postings Demo", layout="wide")
@@ -59,37 +112,39 @@ off_min = st.sidebar.number_input("off_min", value=-5)
 off_max = st.sidebar.number_input("off_max", value=5)
 sample_n = 10
 window = 20
+subcorpus = st.sidebar.text_input("Delkorpus (navn)", value=f"random_{corpus_size}")
+show_stats = st.sidebar.checkbox("Vis post_stats per funksjon", value=False)
 
-if "bok_ids" not in st.session_state:
-    st.session_state["bok_ids"] = []
-if "bok_ids_size" not in st.session_state:
-    st.session_state["bok_ids_size"] = None
+if "subcorpora" not in st.session_state:
+    st.session_state["subcorpora"] = {}
+if "subcorpus_size" not in st.session_state:
+    st.session_state["subcorpus_size"] = None
 if "near_positions" not in st.session_state:
     st.session_state["near_positions"] = []
 if "near_bok_id" not in st.session_state:
     st.session_state["near_bok_id"] = None
 
-if st.session_state.get("bok_ids_size") != corpus_size:
-    st.session_state["bok_ids"] = []
-    st.session_state["bok_ids_size"] = corpus_size
-
 if st.sidebar.button("Lag korpus (tilfeldig bok_id‑liste)"):
     try:
-        st.session_state["bok_ids"] = []
-        ids = ensure_random_bok_ids(postings_db, corpus_size)
-        st.sidebar.caption(f"Aktivt utvalg: {len(ids)} bok_id")
+        n = ensure_subcorpus(postings_db, subcorpus, corpus_size, fresh=True)
+        st.session_state["subcorpus_size"] = (subcorpus, n)
     except Exception as exc:
         st.sidebar.error(f"Feil: {exc}")
-elif st.session_state["bok_ids"]:
-    st.sidebar.caption(f"Aktivt utvalg: {len(st.session_state['bok_ids'])} bok_id")
+size = st.session_state["subcorpus_size"]
+if size and size[0] == subcorpus:
+    st.sidebar.caption(f"Aktivt utvalg: {subcorpus} ({size[1]} bok_id)")
 else:
-    st.sidebar.caption("Aktivt utvalg: 0 bok_id")
+    st.sidebar.caption(f"Aktivt utvalg: {subcorpus} (lages ved første søk om det mangler)")
 
 run_compare = st.button("Kjør sammenligning")
-bok_ids = st.session_state["bok_ids"]
-if run_compare and not bok_ids:
-    bok_ids = ensure_random_bok_ids(postings_db, corpus_size)
-    st.session_state["bok_ids"] = bok_ids
+n_books = 0
+if run_compare:
+    try:
+        n_books = ensure_subcorpus(postings_db, subcorpus, corpus_size)
+        st.session_state["subcorpus_size"] = (subcorpus, n_books)
+    except Exception as exc:
+        st.error(f"Feil: {exc}")
+        run_compare = False
 
 left, middle, right = st.columns(3)
 
@@ -97,66 +152,75 @@ with left:
     st.subheader("Postings: near_count")
     if run_compare:
         try:
-            conn = open_postings_db(postings_db)
-            cur = conn.cursor()
-            bok_ids = st.session_state["bok_ids"] or None
-            if not bok_ids:
-                bok_ids = ensure_random_bok_ids(postings_db, corpus_size)
-
-            placeholders = ",".join("?" for _ in bok_ids)
-            t0 = time.perf_counter()
-            sql_hits = f"""
-                SELECT bok_id, hits
-                FROM (
-                  SELECT a.bok_id,
-                         post_near_count(a.blob, b.blob, ?, ?) AS hits
-                  FROM postings a
-                  JOIN postings b USING (bok_id)
-                  WHERE a.word = ? AND b.word = ?
-                    AND a.bok_id IN ({placeholders})
-                )
-                WHERE hits > 0
-                ORDER BY hits DESC
-            """
-            params = [off_min, off_max, word_a, word_b] + bok_ids
-            sql_len = f"""
-                SELECT
-                  AVG(length(a.blob)) AS avg_a,
-                  AVG(length(b.blob)) AS avg_b
-                FROM postings a
-                JOIN postings b USING (bok_id)
-                WHERE a.word = ? AND b.word = ?
-                  AND a.bok_id IN ({placeholders})
-            """
-            cur.execute(sql_len, [word_a, word_b] + bok_ids)
-            row_len = cur.fetchone()
-            cur.execute(sql_hits, params)
-            hits_rows = cur.fetchall()
-            elapsed = time.perf_counter() - t0
-            if row_len and row_len[0] is not None and row_len[1] is not None:
-                st.write(f"Snitt blob‑lengde: a={row_len[0]:.1f}, b={row_len[1]:.1f}")
-            st.write(f"Bøker i korpus: {len(bok_ids)}")
-            st.write(f"Treff (bøker): {len(hits_rows)}")
-            st.write(f"Tid (total): {elapsed:.3f} s")
-            if hits_rows:
-                st.dataframe(hits_rows, use_container_width=True)
-                top_bok = hits_rows[0][0]
-                cur.execute(
+            with subcorpus_connection(postings_db, subcorpus) as conn:
+                conn.execute("SELECT post_stats_enable(?)", (int(show_stats),))
+                conn.execute("SELECT post_stats_reset()")
+                cur = conn.cursor()
+                t0 = time.perf_counter()
+                sql_hits = """
+                    SELECT bok_id, hits
+                    FROM (
+                      SELECT a.bok_id,
+                             post_near_count(a.blob, b.blob, ?, ?) AS hits
+                      FROM postings a
+                      JOIN postings b USING (bok_id)
+                      WHERE a.word = ? AND b.word = ?
+                        AND subcorpus_has(?, a.bok_id)
+                    )
+                    WHERE hits > 0
+                    ORDER BY hits DESC
+                """
+                params = [off_min, off_max, word_a, word_b, subcorpus]
+                try:
+                    # Shard-statistikk fra konverteringen: ett oppslag per ord.
+                    cur.execute(
+                        """
+                        SELECT
+                          (SELECT 1.0 * total_blob_bytes / df FROM vocab WHERE word = ?),
+                          (SELECT 1.0 * total_blob_bytes / df FROM vocab WHERE word = ?)
+                        """,
+                        (word_a, word_b),
+                    )
+                except sqlite3.Error:
+                    sql_len = """
+                        SELECT
+                          AVG(length(a.blob)) AS avg_a,
+                          AVG(length(b.blob)) AS avg_b
+                        FROM postings a
+                        JOIN postings b USING (bok_id)
+                        WHERE a.word = ? AND b.word = ?
+                          AND subcorpus_has(?, a.bok_id)
                     """
-                    SELECT je.value
-                    FROM postings a
-                    JOIN postings b USING (bok_id),
-                         json_each(post_near_positions(a.blob, b.blob, ?, ?)) AS je
-                    WHERE a.word = ? AND b.word = ? AND a.bok_id = ?
-                    LIMIT 10
-                    """,
-                    (off_min, off_max, word_a, word_b, top_bok),
-                )
-                st.session_state["near_positions"] = [r[0] for r in cur.fetchall()]
-                st.session_state["near_bok_id"] = top_bok
-            else:
-                st.write("Ingen treff.")
-            conn.close()
+                    cur.execute(sql_len, [word_a, word_b, subcorpus])
+                row_len = cur.fetchone()
+                cur.execute(sql_hits, params)
+                hits_rows = cur.fetchall()
+                elapsed = time.perf_counter() - t0
+                if row_len and row_len[0] is not None and row_len[1] is not None:
+                    st.write(f"Snitt blob‑lengde: a={row_len[0]:.1f}, b={row_len[1]:.1f}")
+                st.write(f"Bøker i korpus: {n_books}")
+                st.write(f"Treff (bøker): {len(hits_rows)}")
+                st.write(f"Tid (total): {elapsed:.3f} s")
+                if hits_rows:
+                    st.dataframe(hits_rows, use_container_width=True)
+                    top_bok = hits_rows[0][0]
+                    cur.execute(
+                        """
+                        SELECT n.seq
+                        FROM postings a
+                        JOIN postings b USING (bok_id),
+                             post_near_each(a.blob, b.blob, ?, ?) AS n
+                        WHERE a.word = ? AND b.word = ? AND a.bok_id = ?
+                        LIMIT 10
+                        """,
+                        (off_min, off_max, word_a, word_b, top_bok),
+                    )
+                    st.session_state["near_positions"] = [r[0] for r in cur.fetchall()]
+                    st.session_state["near_bok_id"] = top_bok
+                else:
+                    st.write("Ingen treff.")
+                if show_stats:
+                    show_post_stats(conn)
         except Exception as exc:
             st.error(f"Feil: {exc}")
 
@@ -164,109 +228,99 @@ with middle:
     st.subheader("Postings: offset_sym")
     if run_compare:
         try:
-            conn = open_postings_db(postings_db)
-            cur = conn.cursor()
-            bok_ids = st.session_state["bok_ids"] or None
-            if not bok_ids:
-                bok_ids = ensure_random_bok_ids(postings_db, corpus_size)
-
-            placeholders = ",".join("?" for _ in bok_ids)
-            t0 = time.perf_counter()
-            sql_hits = f"""
-                SELECT bok_id, hits
-                FROM (
-                  SELECT a.bok_id,
-                         post_intersect_offset_sym(a.blob, b.blob, ?, ?) AS hits
-                  FROM postings a
-                  JOIN postings b USING (bok_id)
-                  WHERE a.word = ? AND b.word = ?
-                    AND a.bok_id IN ({placeholders})
-                )
-                WHERE hits > 0
-                ORDER BY hits DESC
-            """
-            params = [off_min, off_max, word_a, word_b] + bok_ids
-            cur.execute(sql_hits, params)
-            hits_rows = cur.fetchall()
-            elapsed = time.perf_counter() - t0
-            st.write(f"Bøker i korpus: {len(bok_ids)}")
-            st.write(f"Treff (bøker): {len(hits_rows)}")
-            st.write(f"Tid (total): {elapsed:.3f} s")
-            if hits_rows:
-                st.dataframe(hits_rows, use_container_width=True)
-            else:
-                st.write("Ingen treff.")
-            conn.close()
-        except Exception as exc:
-            st.error(f"Feil: {exc}")
-
-with right:
-    st.subheader("FTS5: NEAR‑søk")
-    if run_compare:
-        if not fts_db:
-            st.warning("Oppgi en FTS5‑DB.")
-        else:
-            try:
-                conn = sqlite3.connect(fts_db)
+            with subcorpus_connection(postings_db, subcorpus) as conn:
+                conn.execute("SELECT post_stats_enable(?)", (int(show_stats),))
+                conn.execute("SELECT post_stats_reset()")
                 cur = conn.cursor()
-                distance = abs(off_max)
-                query = f'NEAR("{word_a}" "{word_b}", {distance})'
-                placeholders = ",".join("?" for _ in bok_ids)
                 t0 = time.perf_counter()
-                sql_hits = (
-                    f"SELECT urn, COUNT(*) AS hits FROM ft_para "
-                    f"WHERE ft_para MATCH ? AND urn IN ({placeholders}) "
-                    f"GROUP BY urn ORDER BY hits DESC"
-                )
-                params = [query] + bok_ids
+                sql_hits = """
+                    SELECT bok_id, hits
+                    FROM (
+                      SELECT a.bok_id,
+                             post_intersect_offset_sym(a.blob, b.blob, ?, ?) AS hits
+                      FROM postings a
+                      JOIN postings b USING (bok_id)
+                      WHERE a.word = ? AND b.word = ?
+                        AND subcorpus_has(?, a.bok_id)
+                    )
+                    WHERE hits > 0
+                    ORDER BY hits DESC
+                """
+                params = [off_min, off_max, word_a, word_b, subcorpus]
                 cur.execute(sql_hits, params)
                 hits_rows = cur.fetchall()
                 elapsed = time.perf_counter() - t0
-                st.write(f"Bøker i korpus: {len(bok_ids)}")
+                st.write(f"Bøker i korpus: {n_books}")
                 st.write(f"Treff (bøker): {len(hits_rows)}")
                 st.write(f"Tid (total): {elapsed:.3f} s")
                 if hits_rows:
                     st.dataframe(hits_rows, use_container_width=True)
                 else:
                     st.write("Ingen treff.")
-                conn.close()
+                if show_stats:
+                    show_post_stats(conn)
+        except Exception as exc:
+            st.error(f"Feil: {exc}")
+
+with right:
+    st.subheader("FTS5: NEAR‑søk")
+    if run_compare:
+        if not fts_db:
+            st.warning("Oppgi en FTS5‑DB.")
+        else:
+            try:
+                # FTS-siden får delkorpuset som én bundet blob og filtrerer
+                # med post_contains.
+                bitmap = subcorpus_bitmap(postings_db, subcorpus)
+                with pooled_connection(fts_db) as conn:
+                    cur = conn.cursor()
+                    distance = abs(off_max)
+                    query = f'NEAR("{word_a}" "{word_b}", {distance})'
+                    t0 = time.perf_counter()
+                    sql_hits = (
+                        "SELECT urn, COUNT(*) AS hits FROM ft_para "
+                        "WHERE ft_para MATCH ? AND post_contains(?, urn) "
+                        "GROUP BY urn ORDER BY hits DESC"
+                    )
+                    params = [query, bitmap]
+                    cur.execute(sql_hits, params)
+                    hits_rows = cur.fetchall()
+                    elapsed = time.perf_counter() - t0
+                    st.write(f"Bøker i korpus: {n_books}")
+                    st.write(f"Treff (bøker): {len(hits_rows)}")
+                    st.write(f"Tid (total): {elapsed:.3f} s")
+                    if hits_rows:
+                        st.dataframe(hits_rows, use_container_width=True)
+                    else:
+                        st.write("Ingen treff.")
             except Exception as exc:
                 st.error(f"Feil: {exc}")
 
 st.subheader("Postings: konkordans")
 if st.button("Kjør konkordans"):
     try:
-        conn = open_postings_db(postings_db)
-        cur = conn.cursor()
-        target_bok = st.session_state.get("near_bok_id")
-        positions = st.session_state.get("near_positions", [])
-        if target_bok is None or not positions:
-            st.write("Kjør først nærhetssøk for å hente 10 treff.")
-            conn.close()
-            target_bok = None
-        if target_bok is not None:
-            if positions and st.session_state.get("near_bok_id") == target_bok:
-                positions_json = json.dumps(positions)
-                cur.execute(
-                    f"""
-                    SELECT s.seq AS hit_seq, t.seq, t.word
-                    FROM (
-                      SELECT value AS seq
-                      FROM json_each(?)
-                      LIMIT {int(sample_n)}
-                    ) AS s
-                    JOIN tokens t
-                      ON t.bok_id = ?
-                     AND t.seq BETWEEN s.seq - ? AND s.seq + ?
-                    ORDER BY s.seq, t.seq
-                    """,
-                    (positions_json, target_bok, window, window),
-                )
-            rows = cur.fetchall()
-            if rows:
-                st.dataframe(rows, use_container_width=True)
-            else:
-                st.write("Ingen rader.")
-        conn.close()
+        with pooled_connection(postings_db) as conn:
+            cur = conn.cursor()
+            target_bok = st.session_state.get("near_bok_id")
+            positions = st.session_state.get("near_positions", [])
+            if target_bok is None or not positions:
+                st.write("Kjør først nærhetssøk for å hente 10 treff.")
+                target_bok = None
+            if target_bok is not None:
+                if positions and st.session_state.get("near_bok_id") == target_bok:
+                    positions_blob = encode_positions(sorted(positions))
+                    cur.execute(
+                        f"""
+                        SELECT seq AS hit_seq, left_ctx, keyword, right_ctx
+                        FROM post_kwic(?, ?, ?, ?)
+                        LIMIT {int(sample_n)}
+                        """,
+                        (target_bok, positions_blob, window, window),
+                    )
+                rows = cur.fetchall()
+                if rows:
+                    st.dataframe(rows, use_container_width=True)
+                else:
+                    st.write("Ingen rader.")
     except Exception as exc:
         st.error(f"Feil: {exc}")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Named subcorpora: saved bok_id lists for filtering postings queries.
+
+A subcorpus is a sorted list of bok_ids stored as one postings blob in
+`subcorpora(name, bitmap)`, next to the shard's own tables or in a database
+attached beside it. Queries then filter on it by name instead of sending a
+`bok_id IN (?, ?, ...)` list with one placeholder per book:
+
+    SELECT a.bok_id, post_near_count(a.blob, b.blob, -5, 5)
+    FROM postings a JOIN postings b USING (bok_id)
+    WHERE a.word = ? AND b.word = ? AND subcorpus_has('demo', a.bok_id);
+
+`subcorpus_each(name)` lists the members as rows, for joins that should be
+driven by the subcorpus (see USAGE.md).
+
+    python3 subcorpus.py --db shard_postings.db --name demo --random 1000
+    python3 subcorpus.py --db shard_postings.db --name mine --file bok_ids.txt
+    python3 subcorpus.py --db shard_postings.db --list
+"""
+import argparse
+import sqlite3
+
+from postings_codec import PACK_BLOCK, count_positions, decode_positions, encode_positions
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS subcorpora (
+        name TEXT NOT NULL PRIMARY KEY,
+        bitmap BLOB NOT NULL
+    )
+"""
+
+
+def encode_subcorpus(bok_ids) -> bytes:
+    """Postings blob for a set of bok_ids (bit-packed when long enough)."""
+    ids = sorted({int(x) for x in bok_ids})
+    if ids and ids[0] < 0:
+        raise ValueError("bok_ids must be >= 0")
+    packed = len(ids) > PACK_BLOCK and ids[-1] < 1 << 32
+    return encode_positions(ids, count_header=True, packed=packed)
+
+
+def save_subcorpus(conn: sqlite3.Connection, name: str, bok_ids) -> int:
+    """Store (or replace) subcorpus `name`; returns the number of books."""
+    blob = encode_subcorpus(bok_ids)
+    conn.execute(SCHEMA)
+    conn.execute("INSERT OR REPLACE INTO subcorpora (name, bitmap) VALUES (?, ?)", (name, blob))
+    conn.commit()
+    return count_positions(blob)
+
+
+def load_subcorpus(conn: sqlite3.Connection, name: str) -> list[int]:
+    """The bok_ids of subcorpus `name`; raises KeyError if it does not exist."""
+    row = conn.execute("SELECT bitmap FROM subcorpora WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        raise KeyError(name)
+    return [int(x) for x in decode_positions(row[0])]
+
+
+def list_subcorpora(conn: sqlite3.Connection) -> list[tuple[str, int]]:
+    """(name, number of books) for every saved subcorpus."""
+    try:
+        rows = conn.execute("SELECT name, bitmap FROM subcorpora ORDER BY name").fetchall()
+    except sqlite3.OperationalError:
+        return []
+    return [(name, count_positions(blob)) for name, blob in rows]
+
+
+def drop_subcorpus(conn: sqlite3.Connection, name: str) -> bool:
+    cur = conn.execute("DELETE FROM subcorpora WHERE name = ?", (name,))
+    conn.commit()
+    return cur.rowcount > 0
+
+
+def random_bok_ids(conn: sqlite3.Connection, count: int) -> list[int]:
+    """`count` bok_ids drawn at random from the shard (urns, else postings)."""
+    try:
+        rows = conn.execute("SELECT bok_id FROM urns ORDER BY random() LIMIT ?", (count,))
+        return [row[0] for row in rows]
+    except sqlite3.Error:
+        rows = conn.execute(
+            "SELECT bok_id FROM (SELECT DISTINCT bok_id FROM postings) ORDER BY random() LIMIT ?",
+            (count,),
+        )
+        return [row[0] for row in rows]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Save, list and drop named subcorpora.")
+    parser.add_argument("--db", required=True, help="Postings DB (or a separate DB to attach)")
+    parser.add_argument("--name", help="Subcorpus name")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--random", type=int, metavar="N", help="N random books from the shard")
+    source.add_argument("--file", help="Text file with one bok_id per line")
+    source.add_argument("--sql", help="Query whose first column is bok_id")
+    source.add_argument("--drop", action="store_true", help="Remove the subcorpus")
+    parser.add_argument("--shard", help="Read --random/--sql from this DB instead of --db")
+    parser.add_argument("--list", action="store_true", help="List saved subcorpora")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    src = sqlite3.connect(args.shard) if args.shard else conn
+    if args.random is not None or args.file or args.sql or args.drop:
+        if not args.name:
+            parser.error("--name is required")
+        if args.drop:
+            found = drop_subcorpus(conn, args.name)
+            print(f"{args.name}: {'dropped' if found else 'not found'}")
+        else:
+            if args.random is not None:
+                ids = random_bok_ids(src, args.random)
+            elif args.file:
+                with open(args.file, encoding="utf-8") as fh:
+                    ids = [int(line) for line in fh if line.strip()]
+            else:
+                ids = [row[0] for row in src.execute(args.sql)]
+            n = save_subcorpus(conn, args.name, ids)
+            print(f"{args.name}: {n} books saved to {args.db}")
+    if args.list or not (args.random is not None or args.file or args.sql or args.drop):
+        for name, n in list_subcorpora(conn):
+            print(f"{name}\t{n}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
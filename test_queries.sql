@@ -1,7 +1,7 @@
 -- Load extension (adjust path if needed)
 -- .load ./build/macos/postings.dylib
 
--- Check JSON1 availability
+-- Check JSON1 availability (only needed for the json_each variants)
 SELECT json_array(1, 2, 3);
 
 -- All positions for a word
@@ -15,11 +15,23 @@ FROM postings a
 JOIN postings b USING (bok_id)
 WHERE a.bok_id = 1 AND a.word = 'demokrati' AND b.word = 'diktatur';
 
+-- Same positions as rows, without JSON
+SELECT e.seq
+FROM postings p, post_each(p.blob) AS e
+WHERE p.bok_id = 1 AND p.word = 'demokrati'
+LIMIT 10;
+
+SELECT n.seq
+FROM postings a
+JOIN postings b USING (bok_id),
+     post_near_each(a.blob, b.blob, -5, 5) AS n
+WHERE a.bok_id = 1 AND a.word = 'demokrati' AND b.word = 'diktatur';
+
 -- Example concordance: tokens around each occurrence of "demokrati" (+/- 3)
 WITH pos AS (
-  SELECT je.value AS seq
+  SELECT e.seq
   FROM postings p,
-       json_each(post_positions(p.blob)) AS je
+       post_each(p.blob) AS e
   WHERE p.bok_id = 1 AND p.word = 'demokrati'
 )
 SELECT t.seq, t.word
@@ -31,9 +43,9 @@ ORDER BY t.seq;
 
 -- Sampled concordance: pick 5 random occurrences of a word (+/- 3)
 WITH sampled AS (
-  SELECT je.value AS seq
+  SELECT e.seq
   FROM postings p,
-       json_each(post_positions(p.blob)) AS je
+       post_each(p.blob) AS e
   WHERE p.bok_id = 1 AND p.word = 'demokrati'
   ORDER BY random()
   LIMIT 5
@@ -44,3 +56,21 @@ JOIN tokens t
   ON t.bok_id = 1
  AND t.seq BETWEEN s.seq - 3 AND s.seq + 3
 ORDER BY s.seq, t.seq;
+
+-- Sampled KWIC concordance: one row per hit with assembled context (+/- 3)
+SELECT k.seq, k.left_ctx, k.keyword, k.right_ctx
+FROM postings p, post_kwic(p.bok_id, p.blob, 3, 3, 5, 42) AS k
+WHERE p.bok_id = 1 AND p.word = 'demokrati';
+
+-- Context window (+/- 5) around one position; reads token_chunks or tokens
+SELECT w.seq, w.word
+FROM post_window(1, 10, 5) AS w;
+
+-- Exact phrase "A B C": count and start positions per book
+SELECT a.bok_id,
+       post_phrase_count(a.blob, b.blob, c.blob) AS hits,
+       post_phrase_positions(a.blob, b.blob, c.blob) AS starts
+FROM postings a
+JOIN postings b USING (bok_id)
+JOIN postings c USING (bok_id)
+WHERE a.word = 'A' AND b.word = 'B' AND c.word = 'C';